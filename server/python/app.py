@@ -1,37 +1,91 @@
 import os
-from typing import Dict, List, Optional, Any
-
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import sys
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, UploadFile, File, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from openai import OpenAI
-import smtplib
 from email.message import EmailMessage
 from datetime import datetime, timedelta
 import json
 import re
-import glob
+import hmac
+
+from readiness import ReadinessTracker
+from training_jobs import get_training_queue
+from lead_store import get_lead_store
+from knowledge_base import KB_CACHE_DIR, KB_INGEST_WORKERS, simple_tokenize
+from kb_shared import KB_INDEX_BACKEND, create_kb_index
+from dense_index import KB_RETRIEVAL
+from result_cache import ResultCache
+from latency_stats import LatencyTracker
+from session_store import get_session_store
+from mail_queue import SMTP_FROM, MailQueueFull, get_mail_dispatcher, smtp_configured
+from rate_limiter import (RATE_LIMIT_ENABLED, ExpiringDict, client_ip, get_rate_limiter, load_route_quotas,
+                          quota_buckets, retry_after_header)
 
-# Import ML model
-from ml_chatbot_model import get_ml_model
+load_dotenv()
 
-# Lightweight local retrieval
-try:  # pragma: no cover
-    from rank_bm25 import BM25Okapi  # type: ignore
-except Exception:  # pragma: no cover
-    BM25Okapi = None  # type: ignore
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-try:  # pragma: no cover
-    from pypdf import PdfReader  # type: ignore
-except Exception:  # pragma: no cover
-    PdfReader = None  # type: ignore
+# Heavy dependencies (sklearn, NLTK, OpenAI SDK, PDF parsing) are imported
+# on first use; KB indexing and model loading run in a background warm-up
+# started from the ASGI lifespan. Set WARMUP_BLOCKING=true to finish warm-up
+# before accepting traffic.
+WARMUP_BLOCKING = os.getenv("WARMUP_BLOCKING", "false").lower() == "true"
+READINESS = ReadinessTracker(["nltk_data", "knowledge_base", "ml_model"])
 
-load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+def get_ml_model():
+    """Import the ML stack on first use and return the global model."""
+    return READINESS.timed_import("ml_chatbot_model").get_ml_model()
+
+
+# Routes on the request path are async. CPU-bound ML inference and KB scoring
+# run in a small dedicated pool, blocking file, index and SMTP I/O in another,
+# so chats waiting on the LLM hold no thread at all.
+ML_INFERENCE_WORKERS = int(os.getenv("ML_INFERENCE_WORKERS", "2"))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+INFERENCE_EXECUTOR = ThreadPoolExecutor(max_workers=ML_INFERENCE_WORKERS, thread_name_prefix="inference")
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
 
-app = FastAPI(title="Matex AI Chatbot", version="1.1.0")
+async def run_inference(fn: Callable[..., Any], *args: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(INFERENCE_EXECUTOR, functools.partial(fn, *args))
+
+
+async def run_io(fn: Callable[..., Any], *args: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(IO_EXECUTOR, functools.partial(fn, *args))
+
+
+_warmup_thread: Optional[threading.Thread] = None
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global _warmup_thread
+    _warmup_thread = threading.Thread(target=_warm_up, name="warm-up", daemon=True)
+    _warmup_thread.start()
+    if WARMUP_BLOCKING:
+        await asyncio.to_thread(_warmup_thread.join)
+    yield
+    KB_INDEX.close()
+    await asyncio.to_thread(MAIL_DISPATCHER.stop)  # sends what is still queued
+    SESSION_STORE.close()
+    RATE_LIMITER.close()
+    if "openai_client" in sys.modules:
+        await sys.modules["openai_client"].aclose_async_openai_client()
+
+
+app = FastAPI(title="Matex AI Chatbot", version="1.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +95,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# Token buckets per client IP, email and session, with per-route quotas (RATE_LIMITS)
+RATE_LIMITER = get_rate_limiter()
+ROUTE_QUOTAS = load_route_quotas()
+
+
+async def _json_body(request) -> Optional[Dict[str, Any]]:
+    try:
+        body = json.loads(await request.body() or b"null")
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+@app.middleware("http")
+async def rate_limit(request, call_next):
+    """Answer 429 with Retry-After once a client has spent its quota for the route."""
+    route = f"{request.method} {request.url.path}"
+    quotas = ROUTE_QUOTAS.get(route) if RATE_LIMIT_ENABLED else None
+    if not quotas:
+        return await call_next(request)
+    body = await _json_body(request) if ("email" in quotas or "session" in quotas) else None
+    ip = client_ip(request.headers, request.client.host if request.client else None)
+    buckets = quota_buckets(route, quotas, ip, body)
+    if RATE_LIMITER.blocking:
+        decision = await run_io(RATE_LIMITER.acquire, buckets)
+    else:
+        decision = RATE_LIMITER.acquire(buckets)
+    RATE_LIMITER.record(route, decision)
+    if not decision.allowed:
+        return JSONResponse(status_code=429, content={"detail": "Too many requests. Try again shortly."},
+                            headers={"Retry-After": retry_after_header(decision.retry_after_s)})
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def limit_kb_upload_size(request, call_next):
+    """Reject oversized KB uploads from Content-Length before the body is read."""
+    if request.url.path == "/api/kb/upload":
+        try:
+            length = int(request.headers.get("content-length") or 0)
+        except ValueError:
+            length = 0
+        if length > KB_UPLOAD_MAX_BYTES:
+            return JSONResponse(status_code=413, content={"detail": f"Upload exceeds {KB_UPLOAD_MAX_BYTES} bytes"})
+    return await call_next(request)
+
+
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
@@ -64,135 +166,80 @@ class FeedbackRequest(BaseModel):
 
 class TrainingRequest(BaseModel):
     force_retrain: Optional[bool] = False
+    include_feedback: Optional[bool] = True
+
+
+class BatchPredictRequest(BaseModel):
+    messages: List[str]
 
 
-# In-memory session store (for demo). Replace with Redis in production.
-SESSION_MEMORY: Dict[str, List[Dict[str, str]]] = {}
-OTP_STORE: Dict[str, Dict[str, object]] = {}
-TOTP_STORE: Dict[str, Dict[str, str]] = {}
+class RollbackRequest(BaseModel):
+    version: Optional[str] = None
+
+
+# Chat history per session: memory, SQLite or Redis (SESSION_BACKEND), bounded by TTL and size
+SESSION_STORE = get_session_store()
+# Pending OTP codes and unconfirmed 2FA setups expire (timing wheel, see rate_limiter.py)
+OTP_STORE = ExpiringDict("otp")
+TOTP_STORE = ExpiringDict("totp")
 
 # Load response categories for ML training
 RESPONSE_CATEGORIES = None
 
 
 # -------------------------------------------------
-# Local RAG knowledge base (BM25 over text chunks)
+# Local RAG knowledge base (BM25 + LSA dense retrieval over text chunks)
 # -------------------------------------------------
 KNOWLEDGE_DIR = os.path.join("server", "data", "knowledge")
-KB_INDEX = None  # type: ignore
-KB_TOKENS: List[List[str]] = []
-KB_CHUNKS: List[Dict[str, str]] = []  # {id, doc, text}
-KB_META: Dict[str, Any] = {
-    "doc_count": 0,
-    "chunk_count": 0,
-    "last_indexed_at": None,
-}
+# Extraction runs in KB_INGEST_WORKERS processes with a per-file timeout
+# (KB_INGEST_TIMEOUT_S) and PDF page limit (KB_PDF_MAX_PAGES). With
+# KB_INDEX_BACKEND=mmap the index is built once and mapped by every worker.
+KB_INDEX = create_kb_index(KNOWLEDGE_DIR, cache_dir=KB_CACHE_DIR, ingest_workers=KB_INGEST_WORKERS)
+# Uploads are streamed to disk in KB_UPLOAD_BLOCK_BYTES blocks and rejected
+# with 413 past KB_UPLOAD_MAX_BYTES
+KB_UPLOAD_MAX_BYTES = int(os.getenv("KB_UPLOAD_MAX_BYTES", str(256 * 1024 * 1024)))
+KB_UPLOAD_BLOCK_BYTES = 1024 * 1024
+KB_META: Dict[str, Any] = KB_INDEX.meta()
+# Retrieval results keyed by query tokens, stamped with the index generation
+KB_QUERY_CACHE = ResultCache("kb_query")
+RAG_ANSWER_CACHE = ResultCache("rag_answer")
 
 
 def _ensure_knowledge_dir() -> None:
     os.makedirs(KNOWLEDGE_DIR, exist_ok=True)
 
 
-def _simple_tokenize(text: str) -> List[str]:
-    return re.findall(r"[\w']+", (text or "").lower())
-
- 
-def _chunk_text(text: str, max_chars: int = 800, overlap: int = 150) -> List[str]:
-    text = (text or "").strip()
-    if not text:
-        return []
-    chunks: List[str] = []
-    start = 0
-    while start < len(text):
-        end = min(len(text), start + max_chars)
-        chunks.append(text[start:end])
-        if end == len(text):
-            break
-        start = max(0, end - overlap)
-    return chunks
-
-
-def _read_text_file(path: str) -> str:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
-    except Exception:
-        return ""
-
-
-def _read_pdf_file(path: str) -> str:
-    if PdfReader is None:
-        return ""
-    try:
-        reader = PdfReader(path)
-        pages_text = [p.extract_text() or "" for p in reader.pages]
-        return "\n".join(pages_text)
-    except Exception:
-        return ""
-
-
 def build_kb_index() -> Dict[str, Any]:
-    """Rebuild the BM25 index from files in KNOWLEDGE_DIR."""
-    global KB_INDEX, KB_TOKENS, KB_CHUNKS, KB_META
+    """Sync the BM25 index with KNOWLEDGE_DIR, re-indexing only changed files."""
+    global KB_META
     _ensure_knowledge_dir()
+    KB_META = KB_INDEX.sync()
+    return KB_META
 
-    KB_CHUNKS = []
-    KB_TOKENS = []
 
-    files = (
-        glob.glob(os.path.join(KNOWLEDGE_DIR, "**", "*.txt"), recursive=True)
-        + glob.glob(os.path.join(KNOWLEDGE_DIR, "**", "*.md"), recursive=True)
-        + glob.glob(os.path.join(KNOWLEDGE_DIR, "**", "*.pdf"), recursive=True)
-    )
+def _index_kb_file(path: str) -> Dict[str, Any]:
+    """Index one saved KB file without rescanning the directory; returns its per-file report."""
+    global KB_META
+    report = KB_INDEX.index_file(path)
+    KB_META = KB_INDEX.meta()
+    if "error" in report:
+        raise HTTPException(status_code=422, detail=f"Could not index {report['doc']}: {report['error']}")
+    return report
 
-    doc_count = 0
-    for fp in files:
-        ext = os.path.splitext(fp)[1].lower()
-        if ext in (".txt", ".md"):
-            raw = _read_text_file(fp)
-        elif ext == ".pdf":
-            raw = _read_pdf_file(fp)
-        else:
-            raw = ""
-        if not raw:
-            continue
-        doc_name = os.path.basename(fp)
-        for idx, chunk in enumerate(_chunk_text(raw)):
-            KB_CHUNKS.append({
-                "id": f"{doc_name}:{idx}",
-                "doc": doc_name,
-                "text": chunk.strip(),
-            })
-            KB_TOKENS.append(_simple_tokenize(chunk))
-        doc_count += 1
-
-    if KB_TOKENS and BM25Okapi is not None:
-        KB_INDEX = BM25Okapi(KB_TOKENS)  # type: ignore
-    else:
-        KB_INDEX = None  # type: ignore
 
-    KB_META = {
-        "doc_count": doc_count,
-        "chunk_count": len(KB_CHUNKS),
-        "last_indexed_at": datetime.utcnow().isoformat(),
-    }
-    return KB_META
+def current_kb_meta() -> Dict[str, Any]:
+    """KB metadata; with a shared index another worker may have published a newer generation."""
+    return KB_INDEX.meta() if KB_INDEX_BACKEND == "mmap" else KB_META
 
 
 def kb_query(query: str, top_n: int = 5) -> List[Dict[str, Any]]:
-    if not query or KB_INDEX is None:
+    if not query:
         return []
-    tokens = _simple_tokenize(query)
-    if not tokens:
-        return []
-    scores = KB_INDEX.get_scores(tokens)  # type: ignore
-    ranked = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)[:top_n]
-    results: List[Dict[str, Any]] = []
-    for i, score in ranked:
-        if i < len(KB_CHUNKS):
-            ch = KB_CHUNKS[i]
-            results.append({"score": float(score), **ch})
-    return results
+    # search() only sees the query's tokens, so equal token lists share results;
+    # KB_RETRIEVAL picks BM25, dense (LSA) or hybrid ranking
+    key = (" ".join(simple_tokenize(query)), top_n)
+    return KB_QUERY_CACHE.get_or_compute(key, KB_INDEX.generation,
+                                         lambda: KB_INDEX.search(query, top_n, KB_RETRIEVAL))
 
 
 def _rule_based_fallback(user_text: str) -> str:
@@ -208,6 +255,11 @@ def _rule_based_fallback(user_text: str) -> str:
 
 def rag_answer(user_text: str, max_words: int = 140) -> str:
     """Generate a concise answer using top KB chunks when OpenAI is unavailable."""
+    key = (" ".join(simple_tokenize(user_text)), max_words)
+    return RAG_ANSWER_CACHE.get_or_compute(key, KB_INDEX.generation, lambda: _rag_answer(user_text, max_words))
+
+
+def _rag_answer(user_text: str, max_words: int) -> str:
     results = kb_query(user_text, top_n=4)
     if not results:
         return _rule_based_fallback(user_text)
@@ -218,12 +270,20 @@ def rag_answer(user_text: str, max_words: int = 140) -> str:
     return f"Based on our knowledge base: {summary}".strip()
 
 
-def get_or_create_session(session_id: Optional[str]) -> str:
-    if session_id and session_id in SESSION_MEMORY:
-        return session_id
+async def session_io(fn: Callable[..., Any], *args: Any) -> Any:
+    """Call a SESSION_STORE method, on the I/O pool if the backend does disk or network I/O."""
+    return await run_io(fn, *args) if SESSION_STORE.blocking else fn(*args)
+
+
+async def get_or_create_session(session_id: Optional[str]) -> Tuple[str, List[Dict[str, str]]]:
+    """Session id and its history; unknown or expired ids start an empty session."""
+    if session_id:
+        history = await session_io(SESSION_STORE.get, session_id)
+        if history is not None:
+            return session_id, history
     new_id = session_id or os.urandom(8).hex()
-    SESSION_MEMORY.setdefault(new_id, [])
-    return new_id
+    await session_io(SESSION_STORE.put, new_id, [])
+    return new_id, []
 
 
 COMPANY_KNOWLEDGE = """
@@ -300,24 +360,19 @@ def load_response_categories():
     return RESPONSE_CATEGORIES
 
 
-def call_openai(messages: List[Dict[str, str]]) -> str:
+async def call_openai(messages: List[Dict[str, str]]) -> str:
     if not OPENAI_API_KEY:
         # Use local RAG fallback when API key is missing
         last = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
-        return rag_answer(last)
-
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        temperature=0.2,
-        max_tokens=300,
-    )
-    return response.choices[0].message.content or ""
+        return await run_inference(rag_answer, last)
+
+    # One pooled async client per worker (keep-alive, timeouts, retries with jitter)
+    client = READINESS.timed_import("openai_client").get_async_openai_client()
+    return await client.chat_completion(messages, temperature=0.2, max_tokens=300)
 
 
 def get_ml_response(message: str) -> Dict[str, Any]:
-    """Get ML-powered response."""
+    """Get ML-powered response (CPU-bound: call through run_inference)."""
     ml_model = get_ml_model()
     
     # Load response categories if not loaded
@@ -325,35 +380,35 @@ def get_ml_response(message: str) -> Dict[str, Any]:
         load_response_categories()
     
     # Generate ML response
-    ml_result = ml_model.generate_response(message, RESPONSE_CATEGORIES or {})
-    
-    # Fallback to OpenAI if confidence is very low
-    if ml_result['confidence_level'] in ['very_low'] and OPENAI_API_KEY:
-        try:
-            openai_response = call_openai([
-                {"role": "system", "content": build_system_prompt()},
-                {"role": "user", "content": message}
-            ])
-            ml_result['response'] = openai_response
-            ml_result['fallback_used'] = 'openai'
-        except:
-            pass
-    
-    return ml_result
+    return ml_model.generate_response(message, RESPONSE_CATEGORIES or {})
+
+
+def _openai_messages(history: List[Dict[str, str]], message: str) -> List[Dict[str, str]]:
+    return [{"role": "system", "content": build_system_prompt()}] + history + [
+        {"role": "user", "content": message}
+    ]
 
 
 @app.post("/api/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     if not req.message or not req.message.strip():
         raise HTTPException(status_code=400, detail="Message is required")
 
-    sid = get_or_create_session(req.session_id)
-    history = SESSION_MEMORY[sid]
+    message = req.message.strip()
+    sid, history = await get_or_create_session(req.session_id)
+    predicted_category = confidence = confidence_level = None
 
     # Use ML model if requested and available
     if req.use_ml:
         try:
-            ml_result = get_ml_response(req.message.strip())
+            ml_result = await run_inference(get_ml_response, message)
+            # Fallback to OpenAI if confidence is very low
+            if ml_result['confidence_level'] in ['very_low'] and OPENAI_API_KEY:
+                try:
+                    ml_result['response'] = await call_openai(_openai_messages([], message))
+                    ml_result['fallback_used'] = 'openai'
+                except Exception:
+                    pass
             answer = ml_result['response']
             predicted_category = ml_result['predicted_category']
             confidence = ml_result['confidence']
@@ -366,35 +421,21 @@ def chat(req: ChatRequest):
         except Exception as e:
             print(f"ML model error: {e}")
             # Fallback to OpenAI
-            system_prompt = build_system_prompt()
-            openai_messages: List[Dict[str, str]] = [{"role": "system", "content": system_prompt}] + history + [
-                {"role": "user", "content": req.message.strip()}
-            ]
             try:
-                answer = call_openai(openai_messages)
-                predicted_category = None
-                confidence = None
-                confidence_level = None
+                answer = await call_openai(_openai_messages(history, message))
             except Exception as e2:
                 raise HTTPException(status_code=500, detail=f"AI error: {e2}")
     else:
         # Use OpenAI directly
-        system_prompt = build_system_prompt()
-        openai_messages: List[Dict[str, str]] = [{"role": "system", "content": system_prompt}] + history + [
-            {"role": "user", "content": req.message.strip()}
-        ]
         try:
-            answer = call_openai(openai_messages)
-            predicted_category = None
-            confidence = None
-            confidence_level = None
+            answer = await call_openai(_openai_messages(history, message))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"AI error: {e}")
 
     # Update memory
-    history.append({"role": "user", "content": req.message.strip()})
+    history.append({"role": "user", "content": message})
     history.append({"role": "assistant", "content": answer})
-    SESSION_MEMORY[sid] = history[-20:]  # keep last 20 turns
+    await session_io(SESSION_STORE.put, sid, history)  # trimmed to the store's caps
 
     return ChatResponse(
         response=answer, 
@@ -405,9 +446,130 @@ def chat(req: ChatRequest):
     )
 
 
+def result_cache_stats() -> Dict[str, Any]:
+    """Result cache hit rates and memory use; ML caches only once the model is loaded."""
+    stats = {"kb_query": KB_QUERY_CACHE.get_stats(), "rag_answer": RAG_ANSWER_CACHE.get_stats()}
+    # getattr: the warm-up thread may still be importing the module
+    ml_model = getattr(sys.modules.get("ml_chatbot_model"), "ml_model", None)
+    if ml_model is not None:
+        stats.update(ml_model.get_cache_stats())
+    return stats
+
+
+def openai_client_stats() -> Optional[Dict[str, Any]]:
+    """Retry counts, connection reuse and pool saturation of the shared OpenAI client, once created."""
+    get_client_stats = getattr(sys.modules.get("openai_client"), "get_client_stats", None)
+    return get_client_stats() if get_client_stats is not None else None
+
+
+# Time to first event vs total time of /api/chat/stream, per answer source
+CHAT_STREAM_LATENCY = LatencyTracker()
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_openai(messages: List[Dict[str, str]]):
+    """Answer text pieces as the LLM produces them (one RAG answer without an API key)."""
+    if not OPENAI_API_KEY:
+        last = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        yield await run_inference(rag_answer, last)
+        return
+    client = READINESS.timed_import("openai_client").get_async_openai_client()
+    async for piece in client.stream_chat_completion(messages, temperature=0.2, max_tokens=300):
+        yield piece
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    Server-sent events version of /api/chat.
+
+    LLM answers arrive as `token` events while they are generated; ML and RAG
+    answers are sent at once as a single `answer` event. A final `done` event
+    carries the prediction and timings. Session history is only updated once
+    the answer is complete.
+    """
+    if not req.message or not req.message.strip():
+        raise HTTPException(status_code=400, detail="Message is required")
+    start = time.perf_counter()
+    message = req.message.strip()
+    sid, history = await get_or_create_session(req.session_id)
+
+    async def events():
+        yield _sse("session", {"session_id": sid})
+        result: Dict[str, Any] = {"predicted_category": None, "confidence": None, "confidence_level": None}
+        openai_messages: Optional[List[Dict[str, str]]] = _openai_messages(history, message)
+        answer, source = "", "ml"
+        if req.use_ml:
+            try:
+                ml_result = await run_inference(get_ml_response, message)
+                result = {key: ml_result[key] for key in result}
+                if ml_result["confidence_level"] == "very_low" and OPENAI_API_KEY:
+                    openai_messages = _openai_messages([], message)
+                else:
+                    openai_messages = None
+                    answer = ml_result["response"]
+                    if ml_result.get("follow_up"):
+                        answer += "\n\n" + ml_result["follow_up"]
+            except Exception as e:
+                print(f"ML model error: {e}")
+                result = {key: None for key in result}
+
+        ttfb_ms = None
+        if openai_messages is None:
+            ttfb_ms = (time.perf_counter() - start) * 1000.0
+            yield _sse("answer", {"text": answer})
+        else:
+            source = "openai" if OPENAI_API_KEY else "rag"
+            pieces: List[str] = []
+            try:
+                async for piece in stream_openai(openai_messages):
+                    if ttfb_ms is None:
+                        ttfb_ms = (time.perf_counter() - start) * 1000.0
+                    pieces.append(piece)
+                    yield _sse("token" if source == "openai" else "answer", {"text": piece})
+            except Exception as e:
+                print(f"AI stream error: {e}")
+                yield _sse("error", {"detail": f"AI error: {e}"})
+                return
+            answer = "".join(pieces)
+            if ttfb_ms is None:
+                ttfb_ms = (time.perf_counter() - start) * 1000.0
+
+        history.append({"role": "user", "content": message})
+        history.append({"role": "assistant", "content": answer})
+        await session_io(SESSION_STORE.put, sid, history)
+        total_ms = (time.perf_counter() - start) * 1000.0
+        CHAT_STREAM_LATENCY.record(source, ttfb_ms, total_ms)
+        yield _sse("done", {"session_id": sid, "source": source, **result,
+                            "ttfb_ms": round(ttfb_ms, 3), "total_ms": round(total_ms, 3)})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/api/health")
 def health():
-    return {"status": "ok", "kb": KB_META}
+    return {
+        "status": "ok",
+        "kb": current_kb_meta(),
+        "result_cache": result_cache_stats(),
+        "openai": openai_client_stats(),
+        "chat_stream": CHAT_STREAM_LATENCY.snapshot(),
+        "sessions": SESSION_STORE.get_stats(),
+        "mail": MAIL_DISPATCHER.get_stats(),
+        "rate_limit": {**RATE_LIMITER.get_stats(),
+                       "state": {"otp": OTP_STORE.get_stats(), "totp": TOTP_STORE.get_stats()}},
+    }
+
+
+@app.get("/api/ready")
+def ready():
+    """Readiness probe: per-component warm-up state and import/warm-up timings."""
+    snapshot = READINESS.snapshot()
+    return JSONResponse(status_code=200 if snapshot["ready"] else 503, content=snapshot)
 
 
 # ----------------------
@@ -420,41 +582,86 @@ class KBText(BaseModel):
 
 
 @app.get("/api/kb/status")
-def kb_status():
+async def kb_status():
     return {
         "ok": True,
-        "has_index": KB_INDEX is not None,
-        "meta": KB_META,
+        "has_index": KB_INDEX.chunk_count > 0,
+        "meta": current_kb_meta(),
     }
 
 
 @app.post("/api/kb/reload")
-def kb_reload():
-    meta = build_kb_index()
+async def kb_reload():
+    meta = await run_io(build_kb_index)
     return {"ok": True, "meta": meta}
 
 
+def _save_text(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _remove_if_exists(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
 @app.post("/api/kb/text")
-def kb_add_text(payload: KBText):
-    _ensure_knowledge_dir()
+async def kb_add_text(payload: KBText):
     name = payload.name or f"snippet_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.txt"
     safe_name = re.sub(r"[^\w\.-]", "_", name)
     path = os.path.join(KNOWLEDGE_DIR, safe_name)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(payload.text or "")
-    meta = build_kb_index()
-    return {"ok": True, "saved_as": safe_name, "meta": meta}
+    await run_io(_ensure_knowledge_dir)
+    await run_io(_save_text, path, payload.text or "")
+    report = await run_io(_index_kb_file, path)
+    return {"ok": True, "saved_as": safe_name, "file": report, "meta": KB_META}
 
 
 @app.post("/api/kb/upload")
-def kb_upload(file: UploadFile = File(...)):
-    _ensure_knowledge_dir()
+async def kb_upload(file: UploadFile = File(...)):
+    await run_io(_ensure_knowledge_dir)
     filename = re.sub(r"[^\w\.-]", "_", file.filename or "uploaded")
     path = os.path.join(KNOWLEDGE_DIR, filename)
-    with open(path, "wb") as out:
-        out.write(file.file.read())
-    meta = build_kb_index()
-    return {"ok": True, "saved_as": filename, "meta": meta}
+    # Stream to a temp file so a partial or oversized upload never replaces a document
+    tmp_path = f"{path}.{os.getpid()}.{os.urandom(4).hex()}.part"
+    written = 0
+    try:
+        out = await run_io(open, tmp_path, "wb")
+        try:
+            while True:
+                block = await file.read(KB_UPLOAD_BLOCK_BYTES)
+                if not block:
+                    break
+                written += len(block)
+                if written > KB_UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {KB_UPLOAD_MAX_BYTES} bytes")
+                await run_io(out.write, block)
+        finally:
+            await run_io(out.close)
+        await run_io(os.replace, tmp_path, path)
+    finally:
+        await run_io(_remove_if_exists, tmp_path)
+    report = await run_io(_index_kb_file, path)
+    return {"ok": True, "saved_as": filename, "file": report, "meta": KB_META}
+
+
+def _delete_kb_doc(key: str) -> bool:
+    global KB_META
+    deleted = KB_INDEX.delete_document(key)
+    KB_META = KB_INDEX.meta()
+    return deleted
+
+
+@app.delete("/api/kb/doc/{name:path}")
+async def kb_delete_doc(name: str):
+    """Delete a KB document; its chunks are tombstoned and compacted by a background merge."""
+    try:
+        key = KB_INDEX.resolve_key(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not await run_io(_delete_kb_doc, key):
+        raise HTTPException(status_code=404, detail=f"Document not found: {key}")
+    return {"ok": True, "deleted": key, "meta": KB_META}
 
 
 # ----------------------
@@ -470,12 +677,20 @@ class OtpVerify(BaseModel):
     code: str
 
 
-SMTP_HOST = os.getenv("SMTP_HOST")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
-SMTP_USER = os.getenv("SMTP_USER")
-SMTP_PASS = os.getenv("SMTP_PASS")
-SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER or "no-reply@matex.local")
+# Outbound mail is queued and sent in the background over reused SMTP connections (SMTP_*, MAIL_*)
+MAIL_DISPATCHER = get_mail_dispatcher()
 DEV_RETURN_CODE = os.getenv("DEV_RETURN_OTP_IN_RESPONSE", "false").lower() == "true"
+OTP_TTL = timedelta(minutes=10)
+# Per-email resend interval, enforced even when the rate limiter is disabled
+OTP_RESEND_INTERVAL = timedelta(seconds=45)
+# Expired codes are kept this much longer so verify can still answer "Code expired"
+OTP_STATE_GRACE_S = 300.0
+# Unconfirmed 2FA setups are forgotten after this long
+TOTP_SETUP_TTL_S = float(os.getenv("TOTP_SETUP_TTL_S", "3600"))
+
+
+def _otp_state_ttl(record: Dict[str, Any], now: datetime) -> float:
+    return max(0.0, (record["expires"] - now).total_seconds()) + OTP_STATE_GRACE_S
 
 
 def is_valid_email(value: str) -> bool:
@@ -483,7 +698,8 @@ def is_valid_email(value: str) -> bool:
 
 
 def send_otp_email(recipient: str, code: str) -> None:
-    if not (SMTP_HOST and SMTP_USER and SMTP_PASS):
+    """Queue the OTP email; raises MailQueueFull if the outbound queue is full."""
+    if not smtp_configured():
         # Fallback: log only
         print(f"[OTP] Code for {recipient}: {code}")
         return
@@ -496,35 +712,30 @@ def send_otp_email(recipient: str, code: str) -> None:
         f"Your verification code is: {code}\nThis code expires in 10 minutes.\n\nIf you did not request this, please ignore this email."
     )
 
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASS)
-        server.send_message(msg)
+    MAIL_DISPATCHER.submit(msg)
 
 
 @app.post("/api/otp/request")
-def request_otp(payload: OtpRequest):
+async def request_otp(payload: OtpRequest):
     email = (payload.email or "").strip().lower()
     if not is_valid_email(email):
         raise HTTPException(status_code=400, detail="Invalid email")
 
+    # Resends are throttled per email by the rate limiter ("email" quota of this
+    # route); the stored next_allowed time still applies with RATE_LIMIT_ENABLED=false
     now = datetime.utcnow()
     record = OTP_STORE.get(email)
     if record and record.get("next_allowed") and now < record["next_allowed"]:  # type: ignore
         raise HTTPException(status_code=429, detail="Too many requests. Try again shortly.")
 
     code = f"{int.from_bytes(os.urandom(3), 'big') % 1000000:06d}"
-    OTP_STORE[email] = {
-        "code": code,
-        "expires": now + timedelta(minutes=10),
-        "attempts": 0,
-        "next_allowed": now + timedelta(seconds=45),
-    }
+    record = {"code": code, "expires": now + OTP_TTL, "attempts": 0, "next_allowed": now + OTP_RESEND_INTERVAL}
+    OTP_STORE.set(email, record, ttl_s=_otp_state_ttl(record, now))
 
     try:
         send_otp_email(email, code)
-    except Exception as e:
-        print(f"[OTP] Email send failed: {e}")
+    except MailQueueFull as e:
+        print(f"[OTP] Email not queued: {e}")
         # Still keep the code stored; client can retrieve if dev flag is on
 
     response: Dict[str, object] = {"ok": True}
@@ -534,7 +745,7 @@ def request_otp(payload: OtpRequest):
 
 
 @app.post("/api/otp/verify")
-def verify_otp(payload: OtpVerify):
+async def verify_otp(payload: OtpVerify):
     email = (payload.email or "").strip().lower()
     code = (payload.code or "").strip()
     if not is_valid_email(email) or not code:
@@ -553,12 +764,12 @@ def verify_otp(payload: OtpVerify):
 
     if code != record["code"]:  # type: ignore
         record["attempts"] = int(record.get("attempts", 0)) + 1
-        OTP_STORE[email] = record
+        OTP_STORE.set(email, record, ttl_s=_otp_state_ttl(record, now))
         raise HTTPException(status_code=400, detail="Invalid code")
 
     # Success: create a lightweight session token
     token = os.urandom(16).hex()
-    SESSION_MEMORY[token] = [{"role": "system", "content": f"otp_login:{email}"}]
+    await session_io(SESSION_STORE.put, token, [{"role": "system", "content": f"otp_login:{email}"}])
     # Optionally clear OTP after success
     OTP_STORE.pop(email, None)
     return {"ok": True, "token": token, "email": email}
@@ -593,7 +804,8 @@ def setup_2fa(payload: TotpSetupRequest):
 
     record = TOTP_STORE.get(email)
     secret = record["secret"] if record else pyotp.random_base32()  # type: ignore
-    TOTP_STORE[email] = {"secret": secret}
+    if not (record and record.get("confirmed")):
+        TOTP_STORE.set(email, {"secret": secret, "confirmed": False}, ttl_s=TOTP_SETUP_TTL_S)
 
     issuer = "Matex"
     uri = pyotp.totp.TOTP(secret).provisioning_uri(name=email, issuer_name=issuer)  # type: ignore
@@ -616,6 +828,9 @@ def verify_2fa(payload: TotpVerifyRequest):
     totp = pyotp.TOTP(record["secret"])  # type: ignore
     if not totp.verify(code, valid_window=1):  # type: ignore
         raise HTTPException(status_code=400, detail="Invalid 2FA code")
+    if not record.get("confirmed"):
+        # First successful code confirms the setup; confirmed secrets never expire
+        TOTP_STORE.set(email, {"secret": record["secret"], "confirmed": True}, ttl_s=None)
 
     return {"ok": True}
 
@@ -633,73 +848,150 @@ class Lead(BaseModel):
     language: Optional[str] = None
 
 
+# Token required to list/export leads; listing is disabled when unset
+LEADS_ADMIN_TOKEN = os.getenv("LEADS_ADMIN_TOKEN")
+LEADS_PAGE_MAX = int(os.getenv("LEADS_PAGE_MAX", "1000"))
+
+
 @app.post("/api/leads")
 def create_lead(lead: Lead):
     payload = lead.model_dump() | {"created_at": datetime.utcnow().isoformat()}
     try:
-        path = os.path.join(os.getcwd(), "server", "data", "leads.json")
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        existing: list[dict] = []
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                try:
-                    existing = json.load(f)
-                except Exception:
-                    existing = []
-        existing.append(payload)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(existing, f, ensure_ascii=False, indent=2)
+        lead_id = get_lead_store().add(payload)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    return {"ok": True}
+    return {"ok": True, "id": lead_id}
+
+
+@app.get("/api/leads")
+def list_leads(
+    limit: int = 100,
+    cursor: int = 0,
+    email: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    format: str = "json",
+    x_admin_token: Optional[str] = Header(default=None),
+):
+    """Page through leads (keyset cursor), or stream all matches as NDJSON with format=ndjson."""
+    if not LEADS_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Lead listing is disabled (LEADS_ADMIN_TOKEN not set)")
+    if not hmac.compare_digest(x_admin_token or "", LEADS_ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+    store = get_lead_store()
+    if format == "ndjson":
+        rows = store.iter_leads(email=email, since=since, until=until)
+        return StreamingResponse(
+            (json.dumps(row, ensure_ascii=False) + "\n" for row in rows),
+            media_type="application/x-ndjson"
+        )
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    limit = max(1, min(limit, LEADS_PAGE_MAX))
+    return store.page(limit=limit, cursor=max(0, cursor), email=email, since=since, until=until)
 
 # ----------------------
 # ML Model Endpoints
 # ----------------------
 
+def _run_training(include_feedback: bool, progress) -> Dict[str, Any]:
+    """Training job body: full rebuild from categories (plus stored feedback)."""
+    ml_model = get_ml_model()
+    categories = load_response_categories()
+    additional = ml_model.get_feedback_examples() if include_feedback else None
+    return ml_model.train_model(categories, additional, progress=progress)
+
+
+def _queue_training(include_feedback: bool, trigger: str, force: bool = False):
+    return get_training_queue().submit(
+        lambda progress: _run_training(include_feedback, progress),
+        params={"include_feedback": include_feedback, "trigger": trigger},
+        force=force
+    )
+
+
 @app.post("/api/ml/train")
 def train_ml_model(req: TrainingRequest = TrainingRequest()):
-    """Train the ML model with current response categories."""
+    """
+    Queue a background training job; the new model is hot-swapped when done.
+    force_retrain queues a new job even while one is running (it starts after it).
+    """
     try:
-        ml_model = get_ml_model()
-        
-        # Load response categories
-        categories = load_response_categories()
-        
-        # Train the model
-        result = ml_model.train_model(categories)
+        job, deduplicated = _queue_training(bool(req.include_feedback), "api", force=bool(req.force_retrain))
         
         return {
             "ok": True,
-            "training_result": result,
-            "message": "ML model trained successfully"
+            "job": job.to_dict(),
+            "deduplicated": deduplicated,
+            "message": "Training already in progress" if deduplicated else "Training job queued"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Training error: {e}")
 
 
+@app.get("/api/ml/jobs")
+def list_training_jobs():
+    """List recent training jobs."""
+    return {"ok": True, "jobs": get_training_queue().list_jobs()}
+
+
+@app.get("/api/ml/jobs/{job_id}")
+def get_training_job(job_id: str):
+    """Progress, accuracy and duration of a training job."""
+    job = get_training_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"ok": True, "job": job.to_dict()}
+
+
+@app.get("/api/ml/versions")
+def list_model_versions():
+    """List model versions with manifest summary and per-version load time."""
+    try:
+        return {"ok": True, **get_ml_model().list_versions()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Versions error: {e}")
+
+
+@app.post("/api/ml/rollback")
+def rollback_model(req: RollbackRequest = RollbackRequest()):
+    """Activate an earlier model version (default: the previous one)."""
+    try:
+        result = get_ml_model().rollback(req.version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Rollback error: {e}")
+    return {"ok": True, **result, "message": f"Rolled back to model version {result['version']}"}
+
+
 @app.post("/api/ml/feedback")
 def submit_feedback(req: FeedbackRequest):
     """Submit feedback for ML model improvement."""
     try:
         ml_model = get_ml_model()
         
-        # Add feedback to training data
-        if req.correct_category:
+        low_satisfaction = bool(req.user_satisfaction and req.user_satisfaction < 0.5)
+        
+        # Add feedback to training data (retrain_with_feedback records it itself)
+        if req.correct_category and not low_satisfaction:
             ml_model.add_training_example(req.message, req.correct_category, req.feedback_text)
         
         # Retrain with feedback if satisfaction is low
-        if req.user_satisfaction and req.user_satisfaction < 0.5:
+        if low_satisfaction:
             result = ml_model.retrain_with_feedback(
                 req.message, 
                 req.correct_category or 'unknown', 
                 req.user_satisfaction
             )
+            if result.get("retrain_due"):
+                job, _ = _queue_training(True, "feedback")
+                result["job"] = job.to_dict()
             return {
                 "ok": True,
                 "feedback_recorded": True,
                 "retraining_result": result,
-                "message": "Feedback recorded and model retrained"
+                "message": "Feedback recorded and retraining queued" if result.get("job") else "Feedback recorded"
             }
         
         return {
@@ -745,24 +1037,65 @@ def predict_category(message: str):
         raise HTTPException(status_code=500, detail=f"Prediction error: {e}")
 
 
-# Initialize knowledge base and ML model
-_ensure_knowledge_dir()
-try:
-    build_kb_index()
-except Exception as _:
-    pass
+ML_BATCH_MAX = int(os.getenv("ML_BATCH_MAX", "5000"))
 
-# Initialize ML model and load response categories
-try:
+
+@app.post("/api/ml/predict/batch")
+def predict_category_batch(req: BatchPredictRequest):
+    """Predict categories for a batch of messages in one model pass."""
+    if not req.messages:
+        raise HTTPException(status_code=400, detail="messages must not be empty")
+    if len(req.messages) > ML_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {ML_BATCH_MAX} messages)")
+    try:
+        ml_model = get_ml_model()
+        predictions = ml_model.predict_batch(req.messages)
+
+        return {
+            "ok": True,
+            "predictions": predictions,
+            "count": len(predictions),
+            "message": "Batch prediction completed successfully"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch prediction error: {e}")
+
+
+def _warm_up_nltk() -> Dict[str, bool]:
+    status = READINESS.timed_import("ml_chatbot_model").ensure_nltk_data()
+    missing = [name for name, ok in status.items() if not ok]
+    if missing:
+        print(f"NLTK data unavailable: {', '.join(missing)} (preprocessing falls back to plain text)")
+    return status
+
+
+def _warm_up_ml_model() -> None:
     ml_model = get_ml_model()
+    ml_model.start_reload_watcher()
     load_response_categories()
     
-    # Auto-train the model if not already trained
+    # Auto-train the model in the background if not already trained
     if RESPONSE_CATEGORIES and not ml_model.get_model_status()['is_trained']:
         print("Auto-training ML model with response categories...")
-        ml_model.train_model(RESPONSE_CATEGORIES)
-except Exception as e:
-    print(f"ML model initialization error: {e}")
+        _queue_training(True, "startup")
+    
+    # Touch the prediction path once so the first request pays no lazy setup
+    ml_model.predict_category("hello")
+
+
+def _warm_up() -> None:
+    """Background warm-up: NLTK data, knowledge base index, ML model, OpenAI client."""
+    READINESS.run("nltk_data", _warm_up_nltk)
+    READINESS.run("knowledge_base", build_kb_index)
+    READINESS.run("ml_model", _warm_up_ml_model)
+    if OPENAI_API_KEY:
+        # Import the SDK before the first chat needs it (the async client itself is
+        # created on the event loop by the first call)
+        READINESS.run("openai_client", lambda: [READINESS.timed_import(name) for name in ("openai_client", "openai")])
+    print(f"Warm-up finished: ready={READINESS.is_ready()}")
+
+
+_ensure_knowledge_dir()
 
 # Payments removed by request
 
@@ -0,0 +1,567 @@
+import math
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# BM25Okapi defaults (rank_bm25), kept so scores match the previous engine
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+# Chunk positions per block for block-max upper bounds
+BLOCK_SIZE = 64
+# Terms with at most this many base postings are scored exhaustively (no block stats)
+SHORT_POSTINGS = 256
+
+
+class GrowableArray:
+    """Append-only NumPy buffer; existing views stay valid when it grows."""
+
+    __slots__ = ("data", "size")
+
+    def __init__(self, dtype: Any, capacity: int = 1024):
+        self.data = np.zeros(max(16, capacity), dtype=dtype)
+        self.size = 0
+
+    @classmethod
+    def from_array(cls, values: Any) -> "GrowableArray":
+        grown = cls(values.dtype, len(values))
+        grown.data[:len(values)] = values
+        grown.size = len(values)
+        return grown
+
+    @classmethod
+    def wrap(cls, values: Any) -> "GrowableArray":
+        """Use `values` as the buffer without copying (read-only arrays stay read-only)."""
+        wrapped = cls.__new__(cls)
+        wrapped.data = values
+        wrapped.size = len(values)
+        return wrapped
+
+    def append(self, value: Any) -> None:
+        if self.size == len(self.data):
+            data = np.zeros(2 * len(self.data), dtype=self.data.dtype)
+            data[:self.size] = self.data
+            self.data = data
+        self.data[self.size] = value
+        self.size += 1
+
+    def view(self) -> Any:
+        return self.data[:self.size]
+
+
+def _gather_ranges(starts: Any, ends: Any) -> Any:
+    """Indexes of the concatenated ranges [starts[i], ends[i]) without a Python loop."""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return offsets + np.arange(total)
+
+
+def _impacts(tfs: Any, doc_len: Any, avgdl: float) -> Any:
+    """BM25 tf/length factor of postings."""
+    tf = tfs.astype(np.float64)
+    return tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avgdl))
+
+
+def _round_up_f32(values: Any) -> Any:
+    """float32 copy that never rounds below the float64 input (for upper bounds)."""
+    rounded = values.astype(np.float32)
+    low = rounded < values
+    rounded[low] = np.nextafter(rounded[low], np.float32(np.inf))
+    return rounded
+
+
+class FrozenPostings:
+    """
+    Immutable postings of the merged base segment in CSR layout.
+
+    Term t's postings are positions[term_offsets[t]:term_offsets[t + 1]]
+    (ascending chunk positions) with matching tfs. Terms with more than
+    SHORT_POSTINGS postings also get one entry per BLOCK_SIZE-wide range of
+    chunk positions they occur in: the first posting offset and the largest
+    BM25 impact (the tf/length part of the score) in the block at the
+    segment's average chunk length. Impacts grow at most linearly with the
+    average length, so scaling by max(1, avgdl / build avgdl) keeps the block
+    maximum an upper bound as chunks are added or removed later.
+    """
+
+    def __init__(self, term_offsets: Any, positions: Any, tfs: Any, blk_offsets: Any, blk_ids: Any,
+                 blk_start: Any, blk_max_impact: Any, avgdl: float, chunk_count: int):
+        self.term_offsets = term_offsets
+        self.positions = positions
+        self.tfs = tfs
+        self.blk_offsets = blk_offsets
+        self.blk_ids = blk_ids
+        self.blk_start = blk_start
+        self.blk_max_impact = blk_max_impact
+        self.avgdl = avgdl
+        self.chunk_count = chunk_count
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.term_offsets) - 1
+
+    @classmethod
+    def empty(cls) -> "FrozenPostings":
+        zeros = np.zeros(1, dtype=np.int64)
+        return cls(zeros, np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint16), zeros,
+                   np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32),
+                   np.zeros(0, dtype=np.float32), 1.0, 0)
+
+    @classmethod
+    def build(cls, terms: Any, positions: Any, tfs: Any, doc_len: Any, n_terms: int) -> "FrozenPostings":
+        """From postings sorted by (term, position); positions already compacted."""
+        avgdl = float(doc_len.sum()) / len(doc_len) if len(doc_len) else 1.0
+        counts = np.bincount(terms, minlength=n_terms)
+        term_offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(counts, out=term_offsets[1:])
+
+        long_terms = counts > SHORT_POSTINGS
+        blocked = np.flatnonzero(long_terms[terms]) if len(terms) else np.zeros(0, dtype=np.int64)
+        if len(blocked):
+            b_terms, b_pos = terms[blocked], positions[blocked]
+            blk = b_pos // BLOCK_SIZE
+            new_block = np.ones(len(blocked), dtype=bool)
+            new_block[1:] = (b_terms[1:] != b_terms[:-1]) | (blk[1:] != blk[:-1])
+            first = np.flatnonzero(new_block)
+            blk_ids = blk[first].astype(np.uint32)
+            blk_start = blocked[first].astype(np.uint32)
+            blk_max_impact = _round_up_f32(np.maximum.reduceat(_impacts(tfs[blocked], doc_len[b_pos], avgdl), first))
+            blk_counts = np.bincount(b_terms[first], minlength=n_terms)
+        else:
+            blk_ids = np.zeros(0, dtype=np.uint32)
+            blk_start = np.zeros(0, dtype=np.uint32)
+            blk_max_impact = np.zeros(0, dtype=np.float32)
+            blk_counts = np.zeros(n_terms, dtype=np.int64)
+        blk_offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(blk_counts, out=blk_offsets[1:])
+        return cls(term_offsets, positions.astype(np.uint32), tfs.astype(np.uint16), blk_offsets,
+                   blk_ids, blk_start, blk_max_impact, avgdl, len(doc_len))
+
+    def term_range(self, tid: int) -> Tuple[int, int]:
+        if tid >= self.n_terms:
+            return 0, 0
+        return int(self.term_offsets[tid]), int(self.term_offsets[tid + 1])
+
+    def block_range(self, tid: int) -> Tuple[int, int]:
+        if tid >= self.n_terms:
+            return 0, 0
+        return int(self.blk_offsets[tid]), int(self.blk_offsets[tid + 1])
+
+
+class BM25Index:
+    """
+    Inverted-index BM25 with integer term ids, scored like rank_bm25.BM25Okapi.
+
+    Postings live in an immutable base segment (FrozenPostings) plus a small
+    mutable tail of chunks added since the last merge. Document frequencies
+    are maintained incrementally, with a histogram of them for BM25Okapi's
+    average-idf term, so adding or removing a chunk costs time proportional to
+    that chunk. Removed chunks are tombstoned until the next merge.
+
+    A query only touches the postings of its terms. Tail postings and short
+    base lists are scored directly; long base lists are visited block by
+    block in decreasing upper-bound order (block-max pruning) until no
+    remaining block can beat the k-th best score. Candidates are scored by
+    binary search in each term's postings, accumulating in query-term order
+    with BM25Okapi's arithmetic, so scores match it exactly apart from
+    rounding in the average idf used to floor very common terms.
+    """
+
+    def __init__(self):
+        self.term_ids: Dict[str, int] = {}
+        self.base = FrozenPostings.empty()
+        self.tail: Dict[int, Tuple[array, array]] = {}  # term id -> (positions, tfs)
+        self.tail_postings = 0
+        self.chunk_terms: List[Optional[array]] = []  # unique term ids per chunk, None = tombstone
+        self.doc_len = GrowableArray(np.uint32)
+        self.alive = GrowableArray(np.bool_)
+        self.df = array("I")  # term id -> live document frequency
+        self.df_hist: Counter = Counter()  # document frequency -> number of terms
+        self.vocab_size = 0  # terms with a live document frequency
+        self.live_chunks = 0
+        self.total_len = 0
+        self.tombstones = 0
+        self.version = 0
+        self._avg_idf: Tuple[int, float] = (-1, 0.0)
+        self._norm: Tuple[int, Any] = (-1, None)
+
+    @classmethod
+    def read_only(cls, base: FrozenPostings, term_ids: Any, df: Any, doc_len: Any, norm: Any,
+                  total_len: int, avg_idf: float) -> "BM25Index":
+        """
+        Searchable index over a base segment alone, without tail or tombstones,
+        e.g. arrays mapped from a shared file. `term_ids` needs only get();
+        length norms and the average idf are precomputed, so nothing per chunk
+        is copied. Updates are not supported.
+        """
+        index = cls()
+        index.term_ids = term_ids
+        index.base = base
+        index.df = df
+        index.doc_len = GrowableArray.wrap(doc_len)
+        index.alive = GrowableArray.wrap(np.ones(0, dtype=np.bool_) if not len(doc_len)
+                                         else np.broadcast_to(np.True_, len(doc_len)))
+        index.vocab_size = int(np.count_nonzero(df))
+        index.live_chunks = len(doc_len)
+        index.total_len = total_len
+        index._avg_idf = (index.version, avg_idf)
+        index._norm = (index.version, norm)
+        return index
+
+    @property
+    def chunk_count(self) -> int:
+        """Positions in use, including tombstones."""
+        return self.doc_len.size
+
+    @property
+    def tail_chunks(self) -> int:
+        return self.doc_len.size - self.base.chunk_count
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def _term_id(self, term: str) -> int:
+        tid = self.term_ids.get(term)
+        if tid is None:
+            tid = len(self.df)
+            self.term_ids[term] = tid
+            self.df.append(0)
+        return tid
+
+    def _inc_df(self, tid: int) -> None:
+        old = self.df[tid]
+        if old:
+            self.df_hist[old] -= 1
+            if not self.df_hist[old]:
+                del self.df_hist[old]
+        else:
+            self.vocab_size += 1
+        self.df[tid] = old + 1
+        self.df_hist[old + 1] += 1
+
+    def _dec_df(self, tid: int) -> None:
+        old = self.df[tid]
+        self.df_hist[old] -= 1
+        if not self.df_hist[old]:
+            del self.df_hist[old]
+        self.df[tid] = old - 1
+        if old == 1:
+            self.vocab_size -= 1
+        else:
+            self.df_hist[old - 1] += 1
+
+    def add_chunk(self, tokens: List[str]) -> int:
+        """Index a chunk's tokens; returns its position."""
+        pos = self.doc_len.size
+        ids = array("I")
+        for term, tf in Counter(tokens).items():
+            tid = self._term_id(term)
+            entry = self.tail.get(tid)
+            if entry is None:
+                entry = self.tail[tid] = (array("I"), array("H"))
+            entry[0].append(pos)
+            entry[1].append(min(tf, 0xFFFF))
+            self._inc_df(tid)
+            ids.append(tid)
+        self.tail_postings += len(ids)
+        self.chunk_terms.append(ids)
+        self.doc_len.append(len(tokens))
+        self.alive.append(True)
+        self.live_chunks += 1
+        self.total_len += len(tokens)
+        self.version += 1
+        return pos
+
+    def remove_chunk(self, pos: int) -> None:
+        ids = self.chunk_terms[pos]
+        if ids is None:
+            return
+        for tid in ids:
+            self._dec_df(tid)
+        self.chunk_terms[pos] = None
+        self.alive.data[pos] = False
+        self.live_chunks -= 1
+        self.total_len -= int(self.doc_len.data[pos])
+        self.tombstones += 1
+        self.version += 1
+
+    # ------------------------------------------------------------------
+    # Merge: fold the tail into a new base segment and drop tombstones
+    # ------------------------------------------------------------------
+
+    def merge_snapshot(self) -> Dict[str, Any]:
+        """State needed to build a new base segment without holding the caller's lock."""
+        return {
+            "base": self.base,
+            "tail": {tid: (np.frombuffer(p, dtype=np.uint32).astype(np.int64),
+                           np.frombuffer(t, dtype=np.uint16).copy())
+                     for tid, (p, t) in self.tail.items()},
+            "alive": self.alive.view().copy(),
+            "doc_len": self.doc_len.view().copy(),
+            "n_terms": len(self.df),
+            "size": self.doc_len.size,
+        }
+
+    @staticmethod
+    def build_base(snapshot: Dict[str, Any]) -> Tuple[FrozenPostings, Any]:
+        """New base segment from a snapshot; returns it and the surviving old positions."""
+        base: FrozenPostings = snapshot["base"]
+        alive = snapshot["alive"]
+        live = np.flatnonzero(alive)
+        remap = np.full(len(alive), -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+
+        tail_ids = sorted(snapshot["tail"])
+        tail_pos = [snapshot["tail"][tid][0] for tid in tail_ids]
+        terms = np.concatenate(
+            [np.repeat(np.arange(base.n_terms, dtype=np.int32), np.diff(base.term_offsets))]
+            + [np.full(len(p), tid, dtype=np.int32) for tid, p in zip(tail_ids, tail_pos)]
+        )
+        positions = np.concatenate([base.positions.astype(np.int64)] + tail_pos)
+        tfs = np.concatenate([base.tfs] + [snapshot["tail"][tid][1] for tid in tail_ids])
+
+        keep = alive[positions]
+        terms, positions, tfs = terms[keep], remap[positions[keep]], tfs[keep]
+        order = np.argsort(terms, kind="stable")  # base before tail keeps positions ascending
+        frozen = FrozenPostings.build(terms[order], positions[order], tfs[order],
+                                      snapshot["doc_len"][live], snapshot["n_terms"])
+        return frozen, live
+
+    def install(self, frozen: FrozenPostings, live: Any, snapshot_size: int) -> Any:
+        """
+        Swap in a segment built from a snapshot of the first `snapshot_size`
+        positions. Chunks added since stay in the tail and chunks removed since
+        stay tombstoned. Returns old position -> new position (-1 if dropped).
+        """
+        added = self.doc_len.size - snapshot_size
+        remap = np.full(self.doc_len.size, -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+        remap[snapshot_size:] = np.arange(len(live), len(live) + added)
+        kept = np.flatnonzero(remap >= 0)
+
+        tail: Dict[int, Tuple[array, array]] = {}
+        postings = 0
+        for tid, (pos, tfs) in self.tail.items():
+            if pos[-1] < snapshot_size:
+                continue
+            start = bisect_left(pos, snapshot_size)
+            shift = len(live) - snapshot_size
+            tail[tid] = (array("I", (p + shift for p in pos[start:])), tfs[start:])
+            postings += len(pos) - start
+
+        self.base = frozen
+        self.tail = tail
+        self.tail_postings = postings
+        self.chunk_terms = [self.chunk_terms[p] for p in kept]
+        self.doc_len = GrowableArray.from_array(self.doc_len.view()[kept])
+        self.alive = GrowableArray.from_array(self.alive.view()[kept])
+        self.tombstones = int(len(kept) - self.alive.view().sum())
+        self.version += 1
+        return remap
+
+    # ------------------------------------------------------------------
+    # Scoring
+    # ------------------------------------------------------------------
+
+    def _average_idf(self) -> float:
+        if self._avg_idf[0] == self.version:
+            return self._avg_idf[1]
+        n = self.live_chunks
+        total = 0.0
+        for df, terms in self.df_hist.items():
+            total += terms * (math.log(n - df + 0.5) - math.log(df + 0.5))
+        avg = total / self.vocab_size if self.vocab_size else 0.0
+        self._avg_idf = (self.version, avg)
+        return avg
+
+    def _idf(self, tid: int) -> float:
+        df = self.df[tid]
+        if not df:
+            return 0.0
+        idf = math.log(self.live_chunks - df + 0.5) - math.log(df + 0.5)
+        if idf < 0:
+            idf = BM25_EPSILON * self._average_idf()
+        return idf
+
+    def _length_norm(self) -> Any:
+        """k1 * (1 - b + b * dl / avgdl) per position, recomputed when the index changes."""
+        if self._norm[0] != self.version:
+            avgdl = self.total_len / self.live_chunks
+            dl = self.doc_len.view()
+            self._norm = (self.version, BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl))
+        return self._norm[1]
+
+    def idf(self, term: str) -> float:
+        tid = self.term_ids.get(term)
+        return 0.0 if tid is None else self._idf(tid)
+
+    def search(self, tokens: List[str], top_n: int = 5) -> List[Tuple[int, float]]:
+        """(position, score) of the top chunks containing at least one query term."""
+        query_ids = [self.term_ids.get(t) for t in tokens]
+        query_ids = [tid for tid in query_ids if tid is not None and self.df[tid]]
+        if not query_ids or not self.live_chunks or top_n <= 0:
+            return []
+        k1 = BM25_K1
+        avgdl = self.total_len / self.live_chunks
+        alive, base, norm = self.alive.view(), self.base, self._length_norm()
+        weights = Counter(query_ids)  # repeated query terms count repeatedly, as in BM25Okapi
+        idfs = {tid: self._idf(tid) for tid in weights}
+
+        def contribution(tid: int, pos: Any, tfs: Any) -> Any:
+            # Same arithmetic as BM25Okapi.get_scores, so sums match it exactly
+            tf = tfs.astype(np.float64)
+            return idfs[tid] * (tf * (k1 + 1) / (tf + norm[pos]))
+
+        # Running top-k pool (boundary ties kept so lower positions can win them)
+        best_pos = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float64)
+
+        def collect(pos: Any, scores: Any) -> Optional[float]:
+            nonlocal best_pos, best_scores
+            keep = alive[pos]  # skip tombstones
+            best_pos = np.concatenate((best_pos, pos[keep]))
+            best_scores = np.concatenate((best_scores, scores[keep]))
+            if len(best_scores) < top_n:
+                return None
+            kth = np.partition(best_scores, -top_n)[-top_n]
+            if len(best_scores) > 4 * top_n:
+                top = best_scores >= kth
+                best_pos, best_scores = best_pos[top], best_scores[top]
+            return float(kth)
+
+        kth: Optional[float] = None
+        # Tail: every posting, accumulated densely over the tail's positions
+        first_tail = base.chunk_count
+        if self.tail_postings:
+            acc = np.zeros(self.doc_len.size - first_tail, dtype=np.float64)
+            hit = np.zeros(len(acc), dtype=bool)
+            for tid in query_ids:
+                if tid in self.tail:
+                    pos_list, tf_list = self.tail[tid]
+                    pos = np.frombuffer(pos_list, dtype=np.uint32).astype(np.int64)
+                    acc[pos - first_tail] += contribution(tid, pos, np.frombuffer(tf_list, dtype=np.uint16))
+                    hit[pos - first_tail] = True
+            local = np.flatnonzero(hit)
+            kth = collect(local + first_tail, acc[local])
+
+        # Base: upper bound per block from the block maxima (short lists use
+        # their exact impacts); blocks are visited best bound first, in growing
+        # batches, until no remaining block can reach the k-th best score
+        n_blocks = (first_tail + BLOCK_SIZE - 1) // BLOCK_SIZE
+        drift = max(1.0, avgdl / base.avgdl)
+        bounds = np.zeros(n_blocks, dtype=np.float64)
+        present = np.zeros(n_blocks, dtype=bool)
+        terms: Dict[int, Tuple[int, int, int, int]] = {}
+        for tid in weights:
+            start, end = base.term_range(tid)
+            if start == end:
+                continue
+            j0, j1 = base.block_range(tid)
+            terms[tid] = (start, end, j0, j1)
+            if j0 == j1:
+                pos = base.positions[start:end]
+                blocks = pos // BLOCK_SIZE
+                present[blocks] = True
+                if idfs[tid] > 0:
+                    block_max = np.zeros(n_blocks, dtype=np.float64)
+                    np.maximum.at(block_max, blocks, contribution(tid, pos, base.tfs[start:end]))
+                    bounds += weights[tid] * block_max
+            else:
+                ids = base.blk_ids[j0:j1]
+                present[ids] = True
+                if idfs[tid] > 0:
+                    bounds[ids] += weights[tid] * idfs[tid] * drift * base.blk_max_impact[j0:j1]
+
+        # Visited blocks are scored densely: slot = block's rank in the batch
+        # * BLOCK_SIZE + offset in the block
+        slot_of = np.zeros(n_blocks, dtype=np.int64)
+        shift = BLOCK_SIZE.bit_length() - 1
+        remaining, batch = np.flatnonzero(present), 64
+        while len(remaining):
+            if kth is not None:
+                remaining = remaining[bounds[remaining] * (1 + 1e-9) >= kth]
+                if not len(remaining):
+                    break
+            if len(remaining) > batch:
+                split = np.argpartition(-bounds[remaining], batch - 1)
+                chosen, remaining = remaining[split[:batch]], remaining[split[batch:]]
+            else:
+                chosen, remaining = remaining, remaining[:0]
+            chosen = np.sort(chosen)
+            batch *= 4
+            slot_of[chosen] = np.arange(len(chosen)) << shift
+            acc = np.zeros(len(chosen) << shift, dtype=np.float64)
+            hit = np.zeros(len(acc), dtype=bool)
+            for tid in query_ids:
+                if tid not in terms:
+                    continue
+                start, end, j0, j1 = terms[tid]
+                if j0 == j1:
+                    idx = start + np.flatnonzero(np.isin(base.positions[start:end] >> shift, chosen))
+                else:
+                    ids = base.blk_ids[j0:j1]
+                    j = np.minimum(np.searchsorted(ids, chosen), len(ids) - 1)
+                    j = j0 + j[ids[j] == chosen]
+                    ends = np.where(j + 1 < j1, base.blk_start[np.minimum(j + 1, len(base.blk_start) - 1)], end)
+                    idx = _gather_ranges(base.blk_start[j].astype(np.int64), ends.astype(np.int64))
+                pos = base.positions[idx].astype(np.int64)
+                slot = slot_of[pos >> shift] | (pos & (BLOCK_SIZE - 1))
+                acc[slot] += contribution(tid, pos, base.tfs[idx])
+                hit[slot] = True
+            local = np.flatnonzero(hit)
+            kth = collect((chosen[local >> shift] << shift) | (local & (BLOCK_SIZE - 1)), acc[local])
+
+        if not len(best_pos):
+            return []
+        ranked = np.lexsort((best_pos, -best_scores))[:top_n]  # ties: lower position first, like sorted()
+        return [(int(best_pos[i]), float(best_scores[i])) for i in ranked]
+
+    def score_positions(self, tokens: List[str], positions: Any) -> Any:
+        """Exact BM25 scores of the given chunk positions (0.0 where no query term occurs)."""
+        positions = np.asarray(positions, dtype=np.int64)
+        scores = np.zeros(len(positions), dtype=np.float64)
+        query_ids = [self.term_ids.get(t) for t in tokens]
+        query_ids = [tid for tid in query_ids if tid is not None and self.df[tid]]
+        if not query_ids or not len(positions) or not self.live_chunks:
+            return scores
+        k1, norm, base = BM25_K1, self._length_norm(), self.base
+        in_base = np.flatnonzero(positions < base.chunk_count)
+        in_tail = np.flatnonzero(positions >= base.chunk_count)
+
+        def lookup(sorted_pos: Any, sorted_tfs: Any, which: Any, tf: Any) -> None:
+            if not len(sorted_pos) or not len(which):
+                return
+            wanted = positions[which]
+            j = np.minimum(np.searchsorted(sorted_pos, wanted), len(sorted_pos) - 1)
+            found = sorted_pos[j] == wanted
+            tf[which[found]] = sorted_tfs[j[found]]
+
+        for tid in query_ids:  # in query order, repeats included, like search()
+            tf = np.zeros(len(positions), dtype=np.float64)
+            start, end = base.term_range(tid)
+            lookup(base.positions[start:end], base.tfs[start:end], in_base, tf)
+            if tid in self.tail:
+                pos_list, tf_list = self.tail[tid]
+                lookup(np.frombuffer(pos_list, dtype=np.uint32), np.frombuffer(tf_list, dtype=np.uint16), in_tail, tf)
+            hit = np.flatnonzero(tf)
+            scores[hit] += self._idf(tid) * (tf[hit] * (k1 + 1) / (tf[hit] + norm[positions[hit]]))
+        return scores
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "terms": self.vocab_size,
+            "base_chunks": self.base.chunk_count,
+            "base_postings": int(len(self.base.positions)),
+            "tail_chunks": self.tail_chunks,
+            "tail_postings": self.tail_postings,
+            "tombstones": self.tombstones,
+        }
@@ -0,0 +1,218 @@
+import os
+import zlib
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# Near-duplicate chunks (e.g. the same brochure in several versions) are
+# indexed once; later copies become source references of the first
+KB_DEDUP = os.getenv("KB_DEDUP", "1").strip().lower() not in ("0", "false", "no", "off")
+# Estimated Jaccard similarity of word shingles at which chunks are collapsed
+KB_DEDUP_THRESHOLD = float(os.getenv("KB_DEDUP_THRESHOLD", "0.85"))
+KB_DEDUP_SHINGLE = int(os.getenv("KB_DEDUP_SHINGLE", "3"))
+
+# 64 MinHash permutations in 8 LSH bands of 8 rows: chunks become candidates
+# with probability 1 - (1 - J^8)^8, i.e. ~0.92 at J = 0.85 and ~0.06 at J = 0.5
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+_rng = np.random.default_rng(0x5EED)
+_PERM_A = _rng.integers(1, 1 << 63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 1 << 63, size=NUM_PERM, dtype=np.uint64)
+_SHIFT_32 = np.uint64(32)
+_SHINGLE_MIX = _rng.integers(1, 1 << 63, size=16, dtype=np.uint64) | np.uint64(1)
+_BAND_MIX = _rng.integers(1, 1 << 63, size=ROWS, dtype=np.uint64) | np.uint64(1)
+# Band keys carry their band number in the top 3 bits, so one sorted array
+# holds all bands and a single searchsorted looks up the 8 keys of a chunk
+_BAND_TAGS = np.arange(BANDS, dtype=np.uint64) << np.uint64(61)
+_SHIFT_3 = np.uint64(3)
+# Chunks added since the last merge are scanned in an append buffer of this
+# many chunks, then kept in sorted runs merged like a binary counter
+BUFFER_CHUNKS = 1024
+
+
+def minhash(tokens: List[str], shingle: int = KB_DEDUP_SHINGLE) -> Optional[Any]:
+    """
+    MinHash signature (uint64[NUM_PERM]) of a token list's word shingles;
+    None if it has fewer tokens than one shingle. Hashes are seeded with
+    fixed constants, so signatures agree across processes.
+    """
+    if len(tokens) < shingle:
+        return None
+    hashes = np.array([zlib.crc32(t.encode("utf-8")) for t in tokens], dtype=np.uint64)
+    count = len(tokens) - shingle + 1
+    mixed = hashes[:count] * _SHINGLE_MIX[0]
+    for i in range(1, shingle):
+        mixed += hashes[i:count + i] * _SHINGLE_MIX[i]  # wraps mod 2**64
+    # One hash per permutation: multiply-add-shift, (a * x + b) mod 2**64 >> 32,
+    # of the shingle hash's high 32 bits. The shift is monotone, so it is taken
+    # after the minimum; repeated shingles leave the minimum unchanged
+    z = np.multiply.outer(mixed >> _SHIFT_32, _PERM_A)
+    z += _PERM_B
+    return z.min(axis=0) >> _SHIFT_32
+
+
+def band_keys(signature: Any) -> Any:
+    """One uint64 key per LSH band, tagged with its band."""
+    keys = (signature.reshape(BANDS, ROWS) * _BAND_MIX).sum(axis=1)  # wraps mod 2**64
+    return (keys >> _SHIFT_3) | _BAND_TAGS
+
+
+def _sorted_run(keys: Any, positions: Any) -> Tuple[Any, Any]:
+    order = np.argsort(keys, kind="stable")
+    return keys[order], positions[order]
+
+
+def _lookup(keys: Any, positions: Any, query: Any, found: List[int]) -> None:
+    lo = np.searchsorted(keys, query)
+    hi = np.searchsorted(keys, query, side="right")
+    for band in np.flatnonzero(hi > lo):
+        found.extend(positions[lo[band]:hi[band]].tolist())
+
+
+def estimate_jaccard(a: Any, b: Any) -> Any:
+    """Jaccard estimate from the low bytes of two signatures (b-bit MinHash, b = 8)."""
+    matches = np.count_nonzero(a == b, axis=-1) / NUM_PERM
+    return (matches - 1.0 / 256) / (1.0 - 1.0 / 256)
+
+
+class ChunkDeduplicator:
+    """
+    MinHash/LSH lookup of near-duplicate chunks by position, parallel to
+    BM25Index.
+
+    Each registered chunk keeps the low byte of its 64 MinHash values (64
+    bytes) and an entry per band (12 bytes). Like the postings, band entries
+    live in a sorted base segment rebuilt at merge time plus a tail for
+    chunks added since: an append buffer and a few sorted runs, all flat
+    arrays. Candidates from any band are confirmed by their estimated
+    Jaccard similarity; tombstoned positions are skipped through the BM25
+    alive mask.
+    """
+
+    def __init__(self, enabled: bool = KB_DEDUP, threshold: float = KB_DEDUP_THRESHOLD,
+                 shingle: int = KB_DEDUP_SHINGLE):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.shingle = shingle
+        self.sigs = np.zeros((0, NUM_PERM), dtype=np.uint8)
+        self.size = 0
+        self.base_keys = np.zeros(0, dtype=np.uint64)
+        self.base_positions = np.zeros(0, dtype=np.uint32)
+        self.runs: List[Tuple[Any, Any]] = []
+        self.buffer_keys = array("Q")  # BANDS keys per buffered chunk
+        self.buffer_positions = array("I")
+        self.lookups = 0
+        self.candidates = 0
+
+    def signature(self, tokens: List[str]) -> Optional[Any]:
+        return minhash(tokens, self.shingle) if self.enabled else None
+
+    def find(self, signature: Optional[Any], alive: Any) -> Optional[int]:
+        """Live registered position most similar to `signature` above the threshold, if any."""
+        if signature is None or not self.size:
+            return None
+        self.lookups += 1
+        keys = band_keys(signature)
+        found: List[int] = []
+        for run_keys, run_positions in [(self.base_keys, self.base_positions)] + self.runs:
+            _lookup(run_keys, run_positions, keys, found)
+        if self.buffer_positions:
+            buffered = np.frombuffer(self.buffer_keys, dtype=np.uint64).reshape(-1, BANDS)
+            hits = np.flatnonzero((buffered == keys).any(axis=1))
+            found.extend(np.frombuffer(self.buffer_positions, dtype=np.uint32)[hits].tolist())
+        if not found:
+            return None
+        candidates = np.unique(np.array(found, dtype=np.int64))
+        candidates = candidates[np.asarray(alive[candidates], dtype=bool)]
+        if not len(candidates):
+            return None
+        self.candidates += len(candidates)
+        similarity = estimate_jaccard(self.sigs[candidates], (signature & np.uint64(0xFF)).astype(np.uint8))
+        best = int(np.argmax(similarity))
+        return int(candidates[best]) if similarity[best] >= self.threshold else None
+
+    def add(self, pos: int, signature: Optional[Any]) -> None:
+        """Record the chunk at position `pos` (the next position); None leaves it unregistered."""
+        if not self.enabled:
+            return
+        if pos >= len(self.sigs):
+            grown = np.zeros((max(1024, 2 * len(self.sigs), pos + 1), NUM_PERM), dtype=np.uint8)
+            grown[:self.size] = self.sigs[:self.size]
+            self.sigs = grown
+        self.size = pos + 1
+        if signature is None:
+            return
+        self.sigs[pos] = (signature & np.uint64(0xFF)).astype(np.uint8)
+        self.buffer_keys.frombytes(band_keys(signature).tobytes())
+        self.buffer_positions.append(pos)
+        if len(self.buffer_positions) >= BUFFER_CHUNKS:
+            self._flush()
+
+    def _flush(self) -> None:
+        """Sort the buffer into a run; merge runs while the newest is at least half the previous."""
+        run = _sorted_run(np.frombuffer(self.buffer_keys, dtype=np.uint64).copy(),
+                          np.repeat(np.frombuffer(self.buffer_positions, dtype=np.uint32), BANDS))
+        self.buffer_keys, self.buffer_positions = array("Q"), array("I")
+        runs = self.runs + [run]
+        while len(runs) > 1 and 2 * len(runs[-1][0]) >= len(runs[-2][0]):
+            (keys_a, pos_a), (keys_b, pos_b) = runs.pop(-2), runs.pop()
+            runs.append(_sorted_run(np.concatenate((keys_a, keys_b)), np.concatenate((pos_a, pos_b))))
+        self.runs = runs
+
+    def _tail_entries(self) -> Tuple[Any, Any]:
+        keys = [k for k, _ in self.runs] + [np.frombuffer(self.buffer_keys, dtype=np.uint64).copy()]
+        positions = [p for _, p in self.runs] + [np.repeat(np.frombuffer(self.buffer_positions, dtype=np.uint32),
+                                                           BANDS)]
+        return np.concatenate(keys), np.concatenate(positions).astype(np.int64)
+
+    # ------------------------------------------------------------------
+    # Merge, mirroring BM25Index: snapshot under the lock, build without it,
+    # install under it
+    # ------------------------------------------------------------------
+
+    def merge_snapshot(self, size: int) -> Dict[str, Any]:
+        return {"keys": self.base_keys, "positions": self.base_positions, "tail": self._tail_entries(), "size": size}
+
+    @staticmethod
+    def build_base(snapshot: Dict[str, Any], live: Any) -> Tuple[Any, Any]:
+        """Sorted band entries of the surviving snapshot positions, renumbered like the new segment."""
+        remap = np.full(snapshot["size"], -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+        tail_keys, tail_pos = snapshot["tail"]
+        inside = tail_pos < snapshot["size"]
+        keys = np.concatenate((snapshot["keys"], tail_keys[inside]))
+        positions = remap[np.concatenate((snapshot["positions"].astype(np.int64), tail_pos[inside]))]
+        keep = positions >= 0
+        return _sorted_run(keys[keep], positions[keep].astype(np.uint32))
+
+    def install(self, built: Tuple[Any, Any], remap: Any, snapshot_size: int) -> None:
+        if not self.enabled:
+            return
+        kept = np.flatnonzero(remap >= 0)
+        self.base_keys, self.base_positions = built
+        keys, positions = self._tail_entries()
+        since = positions >= snapshot_size
+        keys, positions = keys[since], remap[positions[since]]
+        moved = positions >= 0
+        self.runs = [_sorted_run(keys[moved], positions[moved].astype(np.uint32))] if moved.any() else []
+        self.buffer_keys, self.buffer_positions = array("Q"), array("I")
+        self.sigs = self.sigs[kept].copy()
+        self.size = len(kept)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "num_perm": NUM_PERM,
+            "bands": BANDS,
+            "shingle": self.shingle,
+            "lookups": self.lookups,
+            "candidates_checked": self.candidates,
+            "bytes": int(self.sigs[:self.size].nbytes + self.base_keys.nbytes + self.base_positions.nbytes
+                         + sum(k.nbytes + p.nbytes for k, p in self.runs)
+                         + self.buffer_keys.itemsize * len(self.buffer_keys)
+                         + self.buffer_positions.itemsize * len(self.buffer_positions)),
+        }
@@ -0,0 +1,137 @@
+import io
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import joblib
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+
+
+# Explicit backend name; overrides latency-based selection when set
+ML_BACKEND = os.getenv("ML_BACKEND") or None
+# p99 single-message latency budget used to pick a backend
+ML_LATENCY_BUDGET_MS = float(os.getenv("ML_LATENCY_BUDGET_MS", "10"))
+# Comma-separated subset of backends to train (default: all registered)
+ML_BACKENDS = [b.strip() for b in os.getenv("ML_BACKENDS", "").split(",") if b.strip()]
+# Size of the stateless hashed feature space used by incremental backends
+ML_HASH_FEATURES = int(os.getenv("ML_HASH_FEATURES", str(2 ** 15)))
+
+DEFAULT_BACKEND = "random_forest"
+LATENCY_SAMPLES = 200
+
+# name -> factory returning an unfitted sklearn classifier with predict_proba
+CLASSIFIER_BACKENDS: Dict[str, Callable[[], Any]] = {}
+# name -> (step name, vectorizer factory) for backends not using TF-IDF
+BACKEND_VECTORIZERS: Dict[str, Tuple[str, Callable[[], Any]]] = {}
+
+
+def _tfidf_vectorizer() -> TfidfVectorizer:
+    return TfidfVectorizer(max_features=5000, stop_words='english', ngram_range=(1, 2))
+
+
+def _hashing_vectorizer() -> HashingVectorizer:
+    # Stateless: no vocabulary to refit, so new examples can be applied with partial_fit
+    return HashingVectorizer(n_features=ML_HASH_FEATURES, stop_words='english', ngram_range=(1, 2),
+                             alternate_sign=False, norm='l2')
+
+
+def register_backend(name: str, factory: Callable[[], Any],
+                     vectorizer: Optional[Tuple[str, Callable[[], Any]]] = None) -> None:
+    """
+    Register a classifier backend. The factory must return a fresh estimator.
+    `vectorizer` is an optional (step name, factory) pair replacing TF-IDF.
+    """
+    CLASSIFIER_BACKENDS[name] = factory
+    if vectorizer is not None:
+        BACKEND_VECTORIZERS[name] = vectorizer
+
+
+register_backend("random_forest", lambda: RandomForestClassifier(n_estimators=100, random_state=42))
+register_backend("logistic_regression", lambda: LogisticRegression(max_iter=1000))
+register_backend("multinomial_nb", lambda: MultinomialNB(alpha=0.1))
+register_backend("sgd", lambda: SGDClassifier(loss="log_loss", alpha=1e-4, max_iter=1000, random_state=42))
+register_backend("hashed_sgd", lambda: SGDClassifier(loss="log_loss", alpha=1e-4, max_iter=1000, random_state=42),
+                 vectorizer=('hashing', _hashing_vectorizer))
+register_backend("hashed_nb", lambda: MultinomialNB(alpha=0.1),
+                 vectorizer=('hashing', _hashing_vectorizer))
+
+
+def build_pipeline(name: str) -> Pipeline:
+    """Vectorizer (TF-IDF unless overridden) + registered classifier pipeline."""
+    if name not in CLASSIFIER_BACKENDS:
+        raise ValueError(f"Unknown classifier backend: {name}")
+    step, vectorizer_factory = BACKEND_VECTORIZERS.get(name, ('tfidf', _tfidf_vectorizer))
+    return Pipeline([
+        (step, vectorizer_factory()),
+        ('classifier', CLASSIFIER_BACKENDS[name]())
+    ])
+
+
+def supports_partial_fit(pipeline: Any) -> bool:
+    """True if the pipeline has a stateless vectorizer and an incremental classifier."""
+    if not isinstance(pipeline, Pipeline) or len(pipeline.steps) != 2:
+        return False
+    vectorizer, classifier = pipeline.steps[0][1], pipeline.steps[-1][1]
+    return isinstance(vectorizer, HashingVectorizer) and hasattr(classifier, 'partial_fit')
+
+
+def enabled_backends() -> List[str]:
+    """Backends to train, in registration order."""
+    if not ML_BACKENDS:
+        return list(CLASSIFIER_BACKENDS)
+    unknown = [b for b in ML_BACKENDS if b not in CLASSIFIER_BACKENDS]
+    if unknown:
+        print(f"Ignoring unknown ML backends: {', '.join(unknown)}")
+    return [b for b in ML_BACKENDS if b in CLASSIFIER_BACKENDS]
+
+
+def artifact_size(obj: Any) -> int:
+    """Size in bytes of the joblib-serialized object."""
+    buffer = io.BytesIO()
+    joblib.dump(obj, buffer)
+    return buffer.tell()
+
+
+def measure_latency(pipeline: Pipeline, texts: List[str], samples: int = LATENCY_SAMPLES) -> Dict[str, float]:
+    """p50/p99 latency of single-message predict_proba calls, in milliseconds."""
+    if not texts:
+        return {'p50_ms': 0.0, 'p99_ms': 0.0}
+    timings = []
+    for i in range(samples):
+        text = texts[i % len(texts)]
+        start = time.perf_counter()
+        pipeline.predict_proba([text])
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return {
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p99_ms': float(np.percentile(timings, 99)),
+    }
+
+
+def select_backend(backend_metrics: Dict[str, Dict[str, Any]],
+                   budget_ms: Optional[float] = ML_LATENCY_BUDGET_MS,
+                   preferred: Optional[str] = ML_BACKEND) -> Optional[str]:
+    """
+    Pick a backend from measured metrics.
+
+    An explicitly configured backend wins. Otherwise the most accurate backend
+    whose p99 fits the budget is chosen; if none fits, the fastest one.
+    """
+    if not backend_metrics:
+        return None
+    if preferred and preferred in backend_metrics:
+        return preferred
+
+    within_budget = [
+        name for name, m in backend_metrics.items()
+        if budget_ms is None or m.get('p99_ms', float('inf')) <= budget_ms
+    ]
+    if within_budget:
+        return max(within_budget, key=lambda n: (backend_metrics[n].get('accuracy', 0.0),
+                                                 -backend_metrics[n].get('p99_ms', 0.0)))
+    return min(backend_metrics, key=lambda n: backend_metrics[n].get('p99_ms', float('inf')))
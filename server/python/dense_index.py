@@ -0,0 +1,435 @@
+import os
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bm25_index import BM25Index, FrozenPostings
+
+
+# Dense (semantic) retrieval next to BM25. none: BM25 only; flat: every
+# vector is scanned; ivf: k-means inverted lists, KB_DENSE_NPROBE of them scanned
+KB_DENSE_INDEX = os.getenv("KB_DENSE_INDEX", "ivf").strip().lower()
+KB_DENSE_DIM = int(os.getenv("KB_DENSE_DIM", "128"))
+# int8: one byte per dimension plus a float32 scale per chunk; float32: 4 bytes per dimension
+KB_DENSE_QUANT = os.getenv("KB_DENSE_QUANT", "int8").strip().lower()
+# Chunks sampled to fit the LSA projection, and the growth (or shrink) factor that refits it
+KB_DENSE_FIT_SAMPLE = int(os.getenv("KB_DENSE_FIT_SAMPLE", "50000"))
+KB_DENSE_REFIT_RATIO = float(os.getenv("KB_DENSE_REFIT_RATIO", "2.0"))
+# Below this many chunks an IVF index scans everything (exact)
+KB_DENSE_IVF_MIN = int(os.getenv("KB_DENSE_IVF_MIN", "20000"))
+KB_DENSE_NPROBE = int(os.getenv("KB_DENSE_NPROBE", "16"))
+# Dense-only hits (no query term in the chunk) need at least this cosine similarity
+KB_DENSE_MIN_SCORE = float(os.getenv("KB_DENSE_MIN_SCORE", "0.3"))
+
+# How kb_query ranks chunks: bm25, dense or hybrid
+KB_RETRIEVAL = os.getenv("KB_RETRIEVAL", "hybrid").strip().lower()
+# Hybrid score = weight * cosine + (1 - weight) * BM25 / best BM25 among the candidates
+KB_HYBRID_WEIGHT = float(os.getenv("KB_HYBRID_WEIGHT", "0.5"))
+# Each retriever contributes top_n * this many candidates to the fusion
+KB_HYBRID_CANDIDATES = 4
+
+DENSE_KINDS = ("none", "flat", "ivf")
+RETRIEVAL_MODES = ("bm25", "dense", "hybrid")
+EMBED_BATCH = 16384
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+
+
+def _normalize_rows(values: Any) -> Any:
+    norms = np.linalg.norm(values, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return values / norms
+
+
+def quantize(vectors: Any, quant: str) -> Tuple[Any, Any]:
+    """(codes, scales) for float32 rows; int8 codes use a symmetric per-row scale."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if quant == "float32":
+        return vectors, np.ones(len(vectors), dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.zeros(0, dtype=np.float32)
+    safe = np.where(scales > 0, scales, 1.0)
+    codes = np.rint(vectors / safe[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize(codes: Any, scales: Any) -> Any:
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def postings_matrix(frozen: FrozenPostings) -> Any:
+    """Chunk x term tf matrix (scipy CSR) of a base segment; its postings already are the CSC layout."""
+    from scipy.sparse import csc_matrix
+    return csc_matrix((frozen.tfs, frozen.positions.astype(np.int64), frozen.term_offsets),
+                      shape=(frozen.chunk_count, frozen.n_terms)).tocsr()
+
+
+class LSAModel:
+    """
+    Latent semantic analysis over BM25 term ids: sublinear TF-IDF rows,
+    projected onto the top singular vectors of a chunk sample and
+    normalized, so the dot product of two embeddings is their cosine.
+    Terms first seen after the fit do not contribute.
+    """
+
+    def __init__(self, idf: Any, components: Any, fitted_on: int):
+        self.idf = idf  # float32 per term id
+        self.components = components  # (terms, dim) float32
+        self.fitted_on = fitted_on
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.idf)
+
+    @classmethod
+    def fit(cls, tf: Any, dim: int = KB_DENSE_DIM, sample: int = KB_DENSE_FIT_SAMPLE,
+            seed: int = 0) -> Optional["LSAModel"]:
+        """Fit on a CSR tf matrix; None if it is too small to project."""
+        from sklearn.decomposition import TruncatedSVD
+        n_chunks, n_terms = tf.shape
+        df = np.bincount(tf.indices, minlength=n_terms)
+        idf = (np.log((1.0 + n_chunks) / (1.0 + df)) + 1.0).astype(np.float32)
+        if n_chunks > sample:
+            rows = np.sort(np.random.default_rng(seed).choice(n_chunks, sample, replace=False))
+            tf = tf[rows]
+        x = cls._weight(tf, idf)
+        dim = min(dim, x.shape[0] - 1, x.shape[1] - 1)
+        if dim < 1:
+            return None
+        svd = TruncatedSVD(n_components=dim, algorithm="randomized", n_iter=5, random_state=seed)
+        svd.fit(x)
+        return cls(idf, np.ascontiguousarray(svd.components_.T, dtype=np.float32), n_chunks)
+
+    @staticmethod
+    def _weight(tf: Any, idf: Any) -> Any:
+        from sklearn.preprocessing import normalize
+        x = tf.astype(np.float32)
+        x.data = (1.0 + np.log(x.data)) * idf[x.indices]
+        return normalize(x)
+
+    def transform(self, tf: Any) -> Any:
+        """Unit embeddings (float32) of the rows of a CSR tf matrix."""
+        if tf.shape[1] > self.n_terms:
+            tf = tf[:, :self.n_terms]
+        out = np.zeros((tf.shape[0], self.dim), dtype=np.float32)
+        for start in range(0, tf.shape[0], EMBED_BATCH):
+            rows = self._weight(tf[start:start + EMBED_BATCH], self.idf)
+            out[start:start + EMBED_BATCH] = _normalize_rows(np.asarray(rows @ self.components))
+        return out
+
+    def embed(self, tokens: List[str], term_ids: Any) -> Optional[Any]:
+        """Unit embedding of a token list; None if none of its terms were known at fit time."""
+        counts = Counter(term_ids.get(t) for t in tokens)
+        ids = np.array([tid for tid in counts if tid is not None and tid < self.n_terms], dtype=np.int64)
+        if not len(ids):
+            return None
+        weights = (1.0 + np.log(np.array([counts[tid] for tid in ids], dtype=np.float32))) * self.idf[ids]
+        vector = weights @ self.components[ids]
+        norm = float(np.linalg.norm(vector))
+        return (vector / norm).astype(np.float32) if norm > 0 else None
+
+
+class IVFLists:
+    """Inverted file: spherical k-means centroids and the positions assigned to each."""
+
+    def __init__(self, centroids: Any, offsets: Any, positions: Any):
+        self.centroids = centroids  # (lists, dim) float32, unit rows
+        self.offsets = offsets  # list i = positions[offsets[i]:offsets[i + 1]]
+        self.positions = positions
+
+    @property
+    def lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def count(self) -> int:
+        return len(self.positions)
+
+    @staticmethod
+    def train(vectors: Any, lists: int, seed: int = 0) -> Any:
+        """k-means on unit vectors (cosine), from a sample of KMEANS_SAMPLE_PER_LIST rows per list."""
+        rng = np.random.default_rng(seed)
+        if len(vectors) > lists * KMEANS_SAMPLE_PER_LIST:
+            vectors = vectors[rng.choice(len(vectors), lists * KMEANS_SAMPLE_PER_LIST, replace=False)]
+        centroids = vectors[rng.choice(len(vectors), lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            labels = IVFLists.assign(centroids, vectors)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, vectors)
+            empty = np.flatnonzero(np.bincount(labels, minlength=lists) == 0)
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+            centroids = _normalize_rows(sums).astype(np.float32)
+        return centroids
+
+    @staticmethod
+    def assign(centroids: Any, vectors: Any) -> Any:
+        labels = np.zeros(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), EMBED_BATCH):
+            labels[start:start + EMBED_BATCH] = np.argmax(vectors[start:start + EMBED_BATCH] @ centroids.T, axis=1)
+        return labels
+
+    @classmethod
+    def build(cls, centroids: Any, labels: Any) -> "IVFLists":
+        order = np.argsort(labels, kind="stable").astype(np.uint32)  # positions ascending within a list
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=len(centroids)), out=offsets[1:])
+        return cls(centroids, offsets, order)
+
+    def probe(self, query: Any, nprobe: int) -> Any:
+        """Positions in the `nprobe` lists whose centroids are closest to the query."""
+        nprobe = min(nprobe, self.lists)
+        scores = self.centroids @ query
+        chosen = np.argpartition(-scores, nprobe - 1)[:nprobe] if nprobe < self.lists else np.arange(self.lists)
+        return np.concatenate([self.positions[self.offsets[i]:self.offsets[i + 1]] for i in chosen])
+
+
+class DenseIndex:
+    """
+    LSA chunk embeddings stored by chunk position, parallel to BM25Index.
+
+    The projection is fitted, and the IVF lists trained, when the owning
+    index merges: from the new base segment's postings, without tokenizing
+    again. Chunks added between merges are embedded with the current
+    projection as they arrive and scanned exhaustively, like the BM25 tail;
+    tombstones are skipped through the BM25 alive mask. The projection is
+    refitted once the live chunk count has grown or shrunk by
+    KB_DENSE_REFIT_RATIO since the last fit.
+    """
+
+    def __init__(self, kind: str = KB_DENSE_INDEX, dim: int = KB_DENSE_DIM, quant: str = KB_DENSE_QUANT,
+                 nprobe: int = KB_DENSE_NPROBE, fit_sample: int = KB_DENSE_FIT_SAMPLE,
+                 ivf_min: int = KB_DENSE_IVF_MIN, refit_ratio: float = KB_DENSE_REFIT_RATIO):
+        if kind not in DENSE_KINDS:
+            raise ValueError(f"Unknown KB_DENSE_INDEX '{kind}' (expected none, flat or ivf)")
+        if quant not in ("int8", "float32"):
+            raise ValueError(f"Unknown KB_DENSE_QUANT '{quant}' (expected int8 or float32)")
+        self.kind = kind
+        self.dim = dim
+        self.quant = quant
+        self.nprobe = nprobe
+        self.fit_sample = fit_sample
+        self.ivf_min = ivf_min
+        self.refit_ratio = refit_ratio
+        self.model: Optional[LSAModel] = None
+        self.fitted_on = 0  # live chunks at the last fit attempt
+        self.ivf: Optional[IVFLists] = None
+        self.codes = np.zeros((0, 1), dtype=np.int8 if quant == "int8" else np.float32)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.size = 0
+        self.fits = 0
+        self.last_fit: Dict[str, Any] = {}
+
+    @classmethod
+    def read_only(cls, kind: str, model: Optional[LSAModel], codes: Any, scales: Any,
+                  ivf: Optional[IVFLists], nprobe: int = KB_DENSE_NPROBE) -> "DenseIndex":
+        """Searchable index over existing arrays (e.g. mapped from a shared file); no updates."""
+        quant = "int8" if codes.dtype == np.int8 else "float32"
+        index = cls(kind, codes.shape[1] if codes.ndim == 2 else KB_DENSE_DIM, quant, nprobe)
+        index.model = model
+        index.fitted_on = model.fitted_on if model is not None else 0
+        index.codes, index.scales, index.size = codes, scales, len(scales)
+        index.ivf = ivf
+        return index
+
+    @property
+    def enabled(self) -> bool:
+        return self.kind != "none"
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    # ------------------------------------------------------------------
+    # Updates (the owner holds its lock)
+    # ------------------------------------------------------------------
+
+    def _append(self, codes: Any, scales: Any) -> None:
+        needed = self.size + len(scales)
+        if needed > len(self.scales) or self.codes.shape[1] != codes.shape[1]:
+            capacity = max(16, needed, 2 * len(self.scales))
+            grown = np.zeros((capacity, codes.shape[1]), dtype=self.codes.dtype)
+            grown_scales = np.zeros(capacity, dtype=np.float32)
+            if self.codes.shape[1] == codes.shape[1]:
+                grown[:self.size] = self.codes[:self.size]
+                grown_scales[:self.size] = self.scales[:self.size]
+            self.codes, self.scales = grown, grown_scales
+        self.codes[self.size:needed] = codes
+        self.scales[self.size:needed] = scales
+        self.size = needed
+
+    def add(self, tokens: List[str], term_ids: Any) -> None:
+        """Embed the chunk at the next position (a zero vector until a projection is fitted)."""
+        if not self.enabled:
+            return
+        dim = self.model.dim if self.model is not None else self.codes.shape[1]
+        vector = self.model.embed(tokens, term_ids) if self.model is not None else None
+        if vector is None:
+            vector = np.zeros(dim, dtype=np.float32)
+        codes, scales = quantize(vector[None, :], self.quant)
+        self._append(codes, scales)
+
+    def needs_fit(self, live_chunks: int) -> bool:
+        if not self.enabled or live_chunks < 2:
+            return False
+        basis = self.fitted_on
+        return not basis or live_chunks >= basis * self.refit_ratio or live_chunks * self.refit_ratio <= basis
+
+    def merge_snapshot(self) -> Dict[str, Any]:
+        """References to the current vectors; rows below the snapshot size never change."""
+        return {"model": self.model, "codes": self.codes, "scales": self.scales, "ivf": self.ivf}
+
+    def build_base(self, snapshot: Dict[str, Any], frozen: FrozenPostings, live: Any,
+                   live_chunks: int) -> Optional[Dict[str, Any]]:
+        """
+        Vectors and IVF lists for a new base segment (old positions `live`),
+        refitting the projection if needed. Runs without the owner's lock.
+        """
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        model = snapshot["model"]
+        refit = model is None or self.needs_fit(live_chunks)
+        if refit:
+            tf = postings_matrix(frozen)
+            model = LSAModel.fit(tf, self.dim, self.fit_sample) if frozen.chunk_count >= 2 else None
+            if model is None:
+                return {"model": None, "refit": True, "fitted_on": live_chunks,
+                        "codes": np.zeros((frozen.chunk_count, 1), dtype=self.codes.dtype),
+                        "scales": np.zeros(frozen.chunk_count, dtype=np.float32), "ivf": None,
+                        "duration_ms": round((time.perf_counter() - start) * 1000.0, 3)}
+            vectors = model.transform(tf)
+            codes, scales = quantize(vectors, self.quant)
+        else:
+            codes, scales = snapshot["codes"][live], snapshot["scales"][live]
+            vectors = None
+        ivf = None
+        if self.kind == "ivf" and len(scales) >= self.ivf_min:
+            if vectors is None:
+                vectors = dequantize(codes, scales)
+            old = snapshot["ivf"]
+            centroids = old.centroids if old is not None and not refit else None
+            if centroids is None:
+                centroids = IVFLists.train(vectors, max(1, int(np.sqrt(len(vectors)))))
+            ivf = IVFLists.build(centroids, IVFLists.assign(centroids, vectors))
+        return {"model": model, "refit": refit, "fitted_on": live_chunks if refit else self.fitted_on,
+                "codes": codes, "scales": scales, "ivf": ivf,
+                "duration_ms": round((time.perf_counter() - start) * 1000.0, 3)}
+
+    def install(self, built: Optional[Dict[str, Any]], remap: Any, snapshot_size: int,
+                tokens_of: Callable[[int], List[str]], term_ids: Any) -> None:
+        """
+        Swap in vectors from build_base(). Chunks added since the snapshot keep
+        their vectors, or are embedded again if the projection was refitted.
+        """
+        if built is None:
+            return
+        added = np.flatnonzero(remap[snapshot_size:] >= 0) + snapshot_size
+        old_codes, old_scales = self.codes, self.scales
+        self.model, self.fitted_on, self.ivf = built["model"], built["fitted_on"], built["ivf"]
+        self.codes = np.zeros((0, built["codes"].shape[1]), dtype=built["codes"].dtype)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.size = 0
+        self._append(built["codes"], built["scales"])
+        for pos in added:
+            if built["refit"]:
+                self.add(tokens_of(int(pos)), term_ids)
+            else:
+                self._append(old_codes[pos:pos + 1], old_scales[pos:pos + 1])
+        if built["refit"]:
+            self.fits += 1
+            self.last_fit = {"chunks": built["fitted_on"], "dim": self.model.dim if self.model else 0,
+                             "ivf_lists": self.ivf.lists if self.ivf else 0, "duration_ms": built["duration_ms"]}
+
+    # ------------------------------------------------------------------
+    # Query
+    # ------------------------------------------------------------------
+
+    def embed_query(self, tokens: List[str], term_ids: Any) -> Optional[Any]:
+        return self.model.embed(tokens, term_ids) if self.model is not None else None
+
+    def score_positions(self, query: Any, positions: Any) -> Any:
+        """Cosine similarity (through the quantized vectors) of the query and the given positions."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if query is None or not len(positions):
+            return np.zeros(len(positions), dtype=np.float64)
+        return (self.codes[positions].astype(np.float32) @ query * self.scales[positions]).astype(np.float64)
+
+    def search(self, query: Any, top_n: int, alive: Any) -> List[Tuple[int, float]]:
+        """(position, cosine) of the nearest live chunks; approximate for the IVF-indexed part."""
+        if query is None or not self.size or top_n <= 0:
+            return []
+        if self.ivf is not None:
+            positions = np.concatenate((self.ivf.probe(query, self.nprobe).astype(np.int64),
+                                        np.arange(self.ivf.count, self.size, dtype=np.int64)))
+            scores = self.score_positions(query, positions)
+        else:
+            positions = np.arange(self.size, dtype=np.int64)
+            scores = (self.codes[:self.size].astype(np.float32) @ query * self.scales[:self.size]).astype(np.float64)
+        keep = np.asarray(alive[positions], dtype=bool)
+        positions, scores = positions[keep], scores[keep]
+        if len(scores) > top_n:
+            top = np.argpartition(-scores, top_n - 1)[:top_n]
+            positions, scores = positions[top], scores[top]
+        ranked = np.lexsort((positions, -scores))
+        return [(int(positions[i]), float(scores[i])) for i in ranked]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "quant": self.quant,
+            "dim": self.model.dim if self.model is not None else 0,
+            "vectors": self.size,
+            "bytes": int(self.codes[:self.size].nbytes + self.scales[:self.size].nbytes),
+            "ivf_lists": self.ivf.lists if self.ivf is not None else 0,
+            "ivf_chunks": self.ivf.count if self.ivf is not None else 0,
+            "nprobe": self.nprobe,
+            "fitted_on": self.model.fitted_on if self.model is not None else 0,
+            "fits": self.fits,
+            "last_fit": dict(self.last_fit),
+        }
+
+
+def hybrid_search(bm25: BM25Index, dense: DenseIndex, tokens: List[str], top_n: int = 5,
+                  mode: str = "hybrid", weight: float = KB_HYBRID_WEIGHT,
+                  min_dense: float = KB_DENSE_MIN_SCORE) -> List[Tuple[int, float]]:
+    """
+    (position, score) ranked by BM25, by dense cosine, or by both fused.
+
+    Hybrid takes top_n * KB_HYBRID_CANDIDATES candidates from each
+    retriever, scores every candidate exactly under both (BM25 via
+    score_positions, cosine via its vector), and ranks by
+    weight * cosine + (1 - weight) * BM25 / best candidate BM25. Chunks
+    without a query term need a cosine of at least `min_dense`. Without a
+    fitted projection this is plain BM25.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown KB_RETRIEVAL '{mode}' (expected bm25, dense or hybrid)")
+    if mode == "bm25" or not dense.ready:
+        return bm25.search(tokens, top_n)
+    alive = bm25.alive.view()
+    query = dense.embed_query(tokens, bm25.term_ids)
+    if mode == "dense":
+        return [(pos, score) for pos, score in dense.search(query, top_n, alive) if score >= min_dense]
+    k = top_n * KB_HYBRID_CANDIDATES
+    lexical = dict(bm25.search(tokens, k))
+    semantic = dict(dense.search(query, k, alive))
+    positions = np.array(sorted(set(lexical) | set(semantic)), dtype=np.int64)
+    if not len(positions):
+        return []
+    lexical_scores = np.array([lexical.get(int(p), np.nan) for p in positions])
+    missing = np.isnan(lexical_scores)
+    lexical_scores[missing] = bm25.score_positions(tokens, positions[missing])
+    cosines = dense.score_positions(query, positions)
+    keep = (lexical_scores > 0) | (cosines >= min_dense)
+    positions, lexical_scores, cosines = positions[keep], lexical_scores[keep], cosines[keep]
+    if not len(positions):
+        return []
+    best = lexical_scores.max()
+    fused = weight * np.maximum(cosines, 0.0) + (1.0 - weight) * (lexical_scores / best if best > 0 else 0.0)
+    ranked = np.lexsort((positions, -fused))[:top_n]
+    return [(int(positions[i]), float(fused[i])) for i in ranked]
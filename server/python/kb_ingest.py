@@ -0,0 +1,96 @@
+import multiprocessing
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class IngestTimeout(Exception):
+    """A document took longer than the per-file ingestion timeout."""
+
+
+class IngestPool:
+    """
+    Process pool for knowledge base extraction.
+
+    Parsing runs in worker processes, so a slow or malformed file cannot hold
+    the server's GIL or stall request threads. Every call gets its own
+    deadline. When one expires the whole pool is terminated (the only way to
+    stop a stuck parser) and recreated; calls that were running on it are
+    resubmitted. Workers are recycled after `max_tasks_per_child` files to
+    contain memory leaks in PDF parsers.
+    """
+
+    MAX_RESUBMITS = 3
+
+    def __init__(self, workers: int, timeout_s: float, max_tasks_per_child: int = 50):
+        self.workers = max(1, workers)
+        self.timeout_s = timeout_s
+        self.max_tasks_per_child = max_tasks_per_child
+        methods = multiprocessing.get_all_start_methods()
+        # forkserver avoids forking a server process that already runs threads
+        self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._lock = threading.Lock()
+        self._pool: Optional[Any] = None
+        self._epoch = 0
+        self.stats: Dict[str, Any] = {
+            "workers": self.workers,
+            "timeout_s": timeout_s,
+            "tasks": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "restarts": 0,
+        }
+
+    def _current(self) -> Tuple[Any, int]:
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._context.Pool(self.workers, maxtasksperchild=self.max_tasks_per_child)
+            return self._pool, self._epoch
+
+    def _restart(self, epoch: int) -> None:
+        with self._lock:
+            if self._epoch != epoch or self._pool is None:
+                return  # another caller already restarted it
+            self._pool.terminate()
+            self._pool = None
+            self._epoch += 1
+            self.stats["restarts"] += 1
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Call fn(*args) in a worker; re-raises its exception or IngestTimeout."""
+        with self._lock:
+            self.stats["tasks"] += 1
+        for _ in range(self.MAX_RESUBMITS):
+            pool, epoch = self._current()
+            result = pool.apply_async(fn, args)
+            deadline = time.monotonic() + self.timeout_s
+            while not result.ready():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._restart(epoch)
+                    with self._lock:
+                        self.stats["timeouts"] += 1
+                    raise IngestTimeout(f"timed out after {self.timeout_s:g}s")
+                result.wait(min(remaining, 0.25))
+                if not result.ready() and self._epoch != epoch:
+                    break  # pool was restarted for another file: resubmit
+            else:
+                try:
+                    return result.get()
+                except Exception:
+                    with self._lock:
+                        self.stats["failed"] += 1
+                    raise
+        with self._lock:
+            self.stats["failed"] += 1
+        raise IngestTimeout("ingestion pool restarted repeatedly")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
@@ -0,0 +1,526 @@
+import os
+import json
+import mmap
+import time
+import struct
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:  # pragma: no cover
+    import fcntl  # type: ignore
+except Exception:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+from bm25_index import BM25Index, FrozenPostings
+from dense_index import DenseIndex, IVFLists, LSAModel, hybrid_search
+from kb_ingest import IngestPool
+from knowledge_base import (KB_INGEST_TIMEOUT_S, KB_PDF_MAX_PAGES, KnowledgeBaseIndex, kb_doc_key, list_kb_files,
+                            simple_tokenize)
+
+
+# memory: every worker builds its own KnowledgeBaseIndex; mmap: one worker
+# builds a snapshot file that all workers on the host map read-only
+KB_INDEX_BACKEND = os.getenv("KB_INDEX_BACKEND", "memory").strip().lower()
+KB_SHARED_DIR = os.getenv("KB_SHARED_DIR", os.path.join("server", "data", "kb_shared"))
+# How often a worker checks for a newer generation (on the next query or status call)
+KB_SHARED_CHECK_S = float(os.getenv("KB_SHARED_CHECK_S", "1"))
+
+POINTER_FILE = "CURRENT"
+LOCK_FILE = "build.lock"
+# Generations kept on disk: the current one and the one before it
+KEEP_GENERATIONS = 2
+
+# Snapshot files: "<4sQ" (magic, JSON header bytes), a JSON header with the
+# array table, document table and index metadata, then 64-byte aligned arrays.
+SNAPSHOT_MAGIC = b"KBM1"
+SNAPSHOT_PREFIX = struct.Struct("<4sQ")
+ALIGN = 64
+
+
+def snapshot_name(generation: int) -> str:
+    return f"kb-{generation:08d}.idx"
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """Exclusive flock on `path`, held across processes."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def write_snapshot(index: KnowledgeBaseIndex, path: str, generation: int) -> int:
+    """
+    Write a compacted index (see KnowledgeBaseIndex.compact) to `path`,
+    atomically; returns the file size. Terms are stored sorted, so readers
+    look them up by binary search instead of building a dict.
+    """
+    with index._lock:
+        bm25 = index.bm25
+        if bm25.tail_chunks or bm25.tombstones:
+            raise ValueError("index has unmerged chunks; compact() it first")
+        base = bm25.base
+        terms = sorted(bm25.term_ids.items())  # code point order == UTF-8 byte order
+        encoded = [term.encode("utf-8") for term, _ in terms]
+        term_ends = np.cumsum([len(e) for e in encoded], dtype=np.int64)
+        texts = [chunk["text"].encode("utf-8") for chunk in index.chunks]  # type: ignore
+        text_ends = np.cumsum([len(t) for t in texts], dtype=np.int64)
+        doc_keys = sorted(index.docs)
+        chunk_doc = np.zeros(bm25.chunk_count, dtype=np.uint32)
+        chunk_idx = np.zeros(bm25.chunk_count, dtype=np.uint32)
+        for d, key in enumerate(doc_keys):
+            positions = index.docs[key]["chunks"]
+            chunk_doc[positions] = d
+            chunk_idx[positions] = np.arange(len(positions))
+        # Chunks shared by near-duplicate documents: named after their first
+        # reference, with every reference listed as a source
+        doc_number = {key: d for d, key in enumerate(doc_keys)}
+        shared = sorted(index.refs)
+        sources = []
+        for pos in shared:
+            (key, chunk_id), refs = index.refs[pos][0], index.refs[pos]
+            chunk_doc[pos] = doc_number[key]
+            chunk_idx[pos] = int(chunk_id.rsplit(":", 1)[1])
+            sources.append("\n".join(ref[1] for ref in refs).encode("utf-8"))
+        arrays = {
+            "term_offsets": base.term_offsets,
+            "positions": base.positions,
+            "tfs": base.tfs,
+            "blk_offsets": base.blk_offsets,
+            "blk_ids": base.blk_ids,
+            "blk_start": base.blk_start,
+            "blk_max_impact": base.blk_max_impact,
+            "df": np.frombuffer(bm25.df, dtype=np.uint32),
+            "doc_len": bm25.doc_len.view(),
+            "norm": bm25._length_norm() if bm25.live_chunks else np.zeros(0, dtype=np.float64),
+            "term_ends": term_ends,
+            "term_ids": np.array([tid for _, tid in terms], dtype=np.uint32),
+            "term_blob": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "text_ends": text_ends,
+            "text_blob": np.frombuffer(b"".join(texts), dtype=np.uint8),
+            "chunk_doc": chunk_doc,
+            "chunk_idx": chunk_idx,
+            "shared_positions": np.array(shared, dtype=np.uint32),
+            "sources_ends": np.cumsum([len(b) for b in sources], dtype=np.int64),
+            "sources_blob": np.frombuffer(b"".join(sources), dtype=np.uint8),
+        }
+        dense = index.dense
+        dense_header = None
+        if dense.ready and dense.size == bm25.chunk_count:
+            # 2-D arrays are stored flattened; the header keeps the row width
+            arrays.update({
+                "dense_idf": dense.model.idf,
+                "dense_components": dense.model.components.ravel(),
+                "dense_codes": dense.codes[:dense.size].ravel(),
+                "dense_scales": dense.scales[:dense.size],
+            })
+            if dense.ivf is not None:
+                arrays.update({
+                    "ivf_centroids": dense.ivf.centroids.ravel(),
+                    "ivf_offsets": dense.ivf.offsets,
+                    "ivf_positions": dense.ivf.positions,
+                })
+            dense_header = {"kind": dense.kind, "dim": dense.model.dim, "fitted_on": dense.model.fitted_on,
+                            "ivf": dense.ivf is not None}
+        header: Dict[str, Any] = {
+            "generation": generation,
+            "published_at": datetime.utcnow().isoformat(),
+            "avgdl": base.avgdl,
+            "total_len": bm25.total_len,
+            "avg_idf": bm25._average_idf() if bm25.live_chunks else 0.0,
+            "docs": [[key, index.docs[key]["sha256"], index.docs[key]["mtime"], index.docs[key]["size"]]
+                     for key in doc_keys],
+            "failed": index.failed,
+            "dense": dense_header,
+            "meta": index.meta(),
+            "arrays": {},
+        }
+
+    offset = 0
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        arrays[name] = values
+        header["arrays"][name] = [values.dtype.str, len(values), offset]
+        offset += -(-values.nbytes // ALIGN) * ALIGN
+    # Files still on disk are reported by their (mtime, size) so readers can tell the snapshot is current
+    header["files"] = {key: [entry["mtime"], entry["size"]] for key, entry in index.docs.items()}
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = -(-(SNAPSHOT_PREFIX.size + len(header_bytes)) // ALIGN) * ALIGN
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            for name, values in arrays.items():
+                f.seek(data_start + header["arrays"][name][2])
+                f.write(values.data)
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return data_start + offset
+
+
+class MappedVocabulary:
+    """term -> term id over sorted UTF-8 terms in a mapped file (only get() of a dict)."""
+
+    def __init__(self, blob: Any, ends: Any, ids: Any):
+        self.blob = blob
+        self.ends = ends
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _term(self, i: int) -> bytes:
+        start = int(self.ends[i - 1]) if i else 0
+        return self.blob[start:int(self.ends[i])].tobytes()
+
+    def get(self, term: str, default: Optional[int] = None) -> Optional[int]:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self.ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.ids) and self._term(lo) == key:
+            return int(self.ids[lo])
+        return default
+
+    def __contains__(self, term: str) -> bool:
+        return self.get(term) is not None
+
+    def __getitem__(self, term: str) -> int:
+        tid = self.get(term)
+        if tid is None:
+            raise KeyError(term)
+        return tid
+
+
+class KBSnapshot:
+    """One published generation of the index, mapped read-only."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_len = SNAPSHOT_PREFIX.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a KB snapshot: {path}")
+        header = json.loads(self._mm[SNAPSHOT_PREFIX.size:SNAPSHOT_PREFIX.size + header_len])
+        data_start = -(-(SNAPSHOT_PREFIX.size + header_len) // ALIGN) * ALIGN
+        a = {name: np.frombuffer(self._mm, dtype=np.dtype(dtype), count=count, offset=data_start + offset)
+             for name, (dtype, count, offset) in header.pop("arrays").items()}
+        self.header = header
+        self.generation: int = header["generation"]
+        self.bytes = len(self._mm)
+        self.docs: List[str] = [doc[0] for doc in header["docs"]]
+        self.doc_names = [os.path.basename(key) for key in self.docs]
+        self.files: Dict[str, Tuple[float, int]] = {key: tuple(v) for key, v in header["files"].items()}  # type: ignore
+        self.failed: Dict[str, Dict[str, Any]] = header["failed"]
+        base = FrozenPostings(a["term_offsets"], a["positions"], a["tfs"], a["blk_offsets"], a["blk_ids"],
+                              a["blk_start"], a["blk_max_impact"], header["avgdl"], len(a["doc_len"]))
+        vocabulary = MappedVocabulary(a["term_blob"], a["term_ends"], a["term_ids"])
+        self.bm25 = BM25Index.read_only(base, vocabulary, a["df"], a["doc_len"], a["norm"],
+                                        header["total_len"], header["avg_idf"])
+        self._text_blob, self._text_ends = a["text_blob"], a["text_ends"]
+        self._chunk_doc, self._chunk_idx = a["chunk_doc"], a["chunk_idx"]
+        empty = np.zeros(0, dtype=np.int64)
+        self._shared = a.get("shared_positions", empty)
+        self._sources_ends, self._sources_blob = a.get("sources_ends", empty), a.get("sources_blob", empty)
+        dense = header.get("dense")
+        if dense:
+            dim = dense["dim"]
+            model = LSAModel(a["dense_idf"], a["dense_components"].reshape(-1, dim), dense["fitted_on"])
+            ivf = (IVFLists(a["ivf_centroids"].reshape(-1, dim), a["ivf_offsets"], a["ivf_positions"])
+                   if dense["ivf"] else None)
+            codes = a["dense_codes"].reshape(-1, dim)
+            self.dense = DenseIndex.read_only(dense["kind"], model, codes, a["dense_scales"], ivf)
+        else:
+            self.dense = DenseIndex("none")
+
+    def chunk(self, pos: int) -> Dict[str, Any]:
+        start = int(self._text_ends[pos - 1]) if pos else 0
+        name = self.doc_names[int(self._chunk_doc[pos])]
+        entry: Dict[str, Any] = {
+            "id": f"{name}:{int(self._chunk_idx[pos])}",
+            "doc": name,
+            "text": self._text_blob[start:int(self._text_ends[pos])].tobytes().decode("utf-8"),
+        }
+        i = int(np.searchsorted(self._shared, pos))
+        if i < len(self._shared) and self._shared[i] == pos:
+            begin = int(self._sources_ends[i - 1]) if i else 0
+            sources = self._sources_blob[begin:int(self._sources_ends[i])].tobytes().decode("utf-8")
+            entry["sources"] = sources.split("\n")
+        return entry
+
+    def doc_sha256(self) -> Dict[str, Dict[str, Any]]:
+        return {doc[0]: {"sha256": doc[1], "mtime": doc[2], "size": doc[3]} for doc in self.header["docs"]}
+
+
+class SharedKnowledgeBase:
+    """
+    Knowledge base index shared read-only by all workers on a host.
+
+    One worker at a time (under an flock) syncs a private KnowledgeBaseIndex
+    from the extraction cache, compacts it and writes it as a new generation
+    file in `shared_dir`, then swaps the CURRENT pointer. Every worker maps
+    the current file read-only, so postings, vocabulary and chunk texts live
+    once in the page cache instead of once per process. Workers check
+    CURRENT at most every `check_interval_s` and swap in a newer generation
+    with one reference assignment; queries already running finish on the
+    mapping they started with. The builder is dropped after publishing.
+
+    Offers the parts of KnowledgeBaseIndex the app uses. A sync whose files
+    all match the current generation's (mtime, size) only maps it.
+    """
+
+    resolve_key = staticmethod(KnowledgeBaseIndex.resolve_key)
+
+    def __init__(self, knowledge_dir: str, shared_dir: str = KB_SHARED_DIR, cache_dir: Optional[str] = None,
+                 ingest_workers: int = 0, ingest_timeout_s: float = KB_INGEST_TIMEOUT_S,
+                 max_pages: int = KB_PDF_MAX_PAGES, check_interval_s: float = KB_SHARED_CHECK_S):
+        self.knowledge_dir = knowledge_dir
+        self.shared_dir = shared_dir
+        self.cache_dir = cache_dir
+        self.max_pages = max_pages
+        self.check_interval_s = check_interval_s
+        self.ingest = IngestPool(ingest_workers, ingest_timeout_s) if ingest_workers > 0 else None
+        self.pointer_path = os.path.join(shared_dir, POINTER_FILE)
+        self.lock_path = os.path.join(shared_dir, LOCK_FILE)
+        self._lock = threading.Lock()
+        self._snapshot: Optional[KBSnapshot] = None
+        self._checked_at = 0.0
+        self.stats: Dict[str, Any] = {
+            "remaps": 0,
+            "builds": 0,
+            "last_build_ms": None,
+            "mapped_at": None,
+        }
+        os.makedirs(shared_dir, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Generations
+    # ------------------------------------------------------------------
+
+    def _read_pointer(self) -> Optional[str]:
+        try:
+            with open(self.pointer_path, "r") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _write_pointer(self, name: str) -> None:
+        tmp_path = f"{self.pointer_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.pointer_path)
+
+    def refresh(self) -> bool:
+        """Map the generation CURRENT points to if it is not the one in use; True if swapped."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            name = self._read_pointer()
+            current = self._snapshot
+            if name is None or (current is not None and os.path.basename(current.path) == name):
+                return False
+            try:
+                snapshot = KBSnapshot(os.path.join(self.shared_dir, name))
+            except (OSError, ValueError) as e:
+                print(f"KB snapshot {name} could not be mapped: {e}")
+                return False
+            self._snapshot = snapshot
+            self.stats["remaps"] += 1
+            self.stats["mapped_at"] = datetime.utcnow().isoformat()
+            return True
+
+    def _current(self) -> Optional[KBSnapshot]:
+        if time.monotonic() - self._checked_at >= self.check_interval_s:
+            self.refresh()
+        return self._snapshot
+
+    def _is_current(self, snapshot: Optional[KBSnapshot]) -> bool:
+        """True if the files on disk are exactly those the snapshot was built from."""
+        if snapshot is None:
+            return False
+        known = dict(snapshot.files)
+        known.update({key: (f["mtime"], f["size"]) for key, f in snapshot.failed.items() if "mtime" in f})
+        paths = list_kb_files(self.knowledge_dir)
+        if len(paths) != len(known):
+            return False
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if known.get(kb_doc_key(self.knowledge_dir, path)) != (st.st_mtime, st.st_size):
+                return False
+        return True
+
+    def _build(self) -> KnowledgeBaseIndex:
+        """Sync a fresh index from the extraction cache and publish it as the next generation (lock held)."""
+        start = time.perf_counter()
+        previous = self._snapshot
+        builder = KnowledgeBaseIndex(self.knowledge_dir, cache_dir=self.cache_dir, max_pages=self.max_pages,
+                                     ingest=self.ingest)
+        if previous is not None:
+            # Files that failed to extract are not retried until their content changes
+            builder.failed = {key: {k: f[k] for k in ("sha256", "status", "error")}
+                              for key, f in previous.failed.items()}
+        builder.sync()
+        builder.compact()
+        for key, failure in builder.failed.items():
+            try:
+                st = os.stat(os.path.join(self.knowledge_dir, key))
+                failure["mtime"], failure["size"] = st.st_mtime, st.st_size
+            except OSError:
+                pass
+        generation = (previous.generation if previous is not None else 0) + 1
+        name = snapshot_name(generation)
+        write_snapshot(builder, os.path.join(self.shared_dir, name), generation)
+        self._write_pointer(name)
+        self._prune(generation)
+        with self._lock:
+            self.stats["builds"] += 1
+            self.stats["last_build_ms"] = round((time.perf_counter() - start) * 1000.0, 3)
+        self.refresh()
+        return builder
+
+    def _prune(self, generation: int) -> None:
+        """Delete old generations; workers still mapping one keep reading it until they swap."""
+        keep = {snapshot_name(g) for g in range(generation - KEEP_GENERATIONS + 1, generation + 1)}
+        for name in os.listdir(self.shared_dir):
+            if name.startswith("kb-") and name.endswith(".idx") and name not in keep:
+                try:
+                    os.remove(os.path.join(self.shared_dir, name))
+                except OSError:
+                    pass
+
+    def _sync_locked(self) -> Optional[KnowledgeBaseIndex]:
+        """Under the build lock: map the latest generation and rebuild it if files changed."""
+        self.refresh()
+        if self._is_current(self._snapshot):
+            return None
+        return self._build()
+
+    # ------------------------------------------------------------------
+    # KnowledgeBaseIndex API used by the app
+    # ------------------------------------------------------------------
+
+    def sync(self) -> Dict[str, Any]:
+        """Map the current generation, building a new one first if the files changed."""
+        os.makedirs(self.knowledge_dir, exist_ok=True)
+        with _file_lock(self.lock_path):
+            self._sync_locked()
+        return self.meta()
+
+    def index_file(self, path: str) -> Dict[str, Any]:
+        """Publish a generation that includes `path`; returns its per-file report."""
+        key = kb_doc_key(self.knowledge_dir, path)
+        with _file_lock(self.lock_path):
+            builder = self._sync_locked()
+        if builder is not None:
+            for report in builder.last_sync.get("files", []):
+                if report["doc"] == key:
+                    return report
+        failure = self._snapshot.failed.get(key) if self._snapshot is not None else None
+        if failure:
+            return {"doc": key, "changed": False, "status": failure["status"], "error": failure["error"]}
+        return {"doc": key, "changed": False, "status": "unchanged"}
+
+    def delete_document(self, key: str) -> bool:
+        """Delete a document's file (if present) and publish a generation without it."""
+        path = os.path.join(self.knowledge_dir, key)
+        existed = os.path.isfile(path)
+        with _file_lock(self.lock_path):
+            self.refresh()
+            indexed = self._snapshot is not None and key in self._snapshot.files
+            if existed:
+                os.remove(path)
+            self._sync_locked()
+        return existed or indexed
+
+    def search(self, query: str, top_n: int = 5, mode: str = "bm25") -> List[Dict[str, Any]]:
+        """Top chunks for a query, ranked as KnowledgeBaseIndex.search ranks them."""
+        tokens = simple_tokenize(query)
+        snapshot = self._current()
+        if snapshot is None or not tokens or top_n <= 0:
+            return []
+        hits = hybrid_search(snapshot.bm25, snapshot.dense, tokens, top_n, mode)
+        return [{"score": score, **snapshot.chunk(pos)} for pos, score in hits]
+
+    def idf(self, term: str) -> float:
+        snapshot = self._current()
+        return 0.0 if snapshot is None else float(snapshot.bm25.idf(term))
+
+    @property
+    def generation(self) -> int:
+        snapshot = self._current()
+        return 0 if snapshot is None else snapshot.generation
+
+    @property
+    def chunk_count(self) -> int:
+        snapshot = self._current()
+        return 0 if snapshot is None else snapshot.bm25.live_chunks
+
+    def close(self) -> None:
+        """Stop ingestion workers."""
+        if self.ingest is not None:
+            self.ingest.close()
+
+    def meta(self) -> Dict[str, Any]:
+        snapshot = self._current()
+        with self._lock:
+            shared = {"backend": "mmap", "dir": self.shared_dir, **self.stats}
+        if snapshot is None:
+            return {"doc_count": 0, "chunk_count": 0, "last_indexed_at": None, "generation": 0, "shared": shared}
+        shared.update(file=os.path.basename(snapshot.path), bytes=snapshot.bytes,
+                      published_at=snapshot.header["published_at"])
+        meta = dict(snapshot.header["meta"])
+        meta["generation"] = snapshot.generation
+        meta["ingest"] = self.ingest.get_stats() if self.ingest is not None else None
+        meta["shared"] = shared
+        return meta
+
+
+def create_kb_index(knowledge_dir: str, backend: str = KB_INDEX_BACKEND, **kwargs: Any) -> Any:
+    """KnowledgeBaseIndex for backend "memory", SharedKnowledgeBase for "mmap"; same keyword arguments."""
+    if backend == "memory":
+        return KnowledgeBaseIndex(knowledge_dir, **kwargs)
+    if backend == "mmap":
+        return SharedKnowledgeBase(knowledge_dir, **kwargs)
+    raise ValueError(f"Unknown KB_INDEX_BACKEND '{backend}' (expected memory or mmap)")
+
+
+if __name__ == "__main__":
+    # Build the shared generation before starting the workers: python kb_shared.py
+    from knowledge_base import KB_CACHE_DIR, KB_INGEST_WORKERS
+
+    kb = SharedKnowledgeBase(os.path.join("server", "data", "knowledge"), cache_dir=KB_CACHE_DIR,
+                             ingest_workers=KB_INGEST_WORKERS)
+    try:
+        meta = kb.sync()
+        print(json.dumps({k: meta.get(k) for k in ("generation", "doc_count", "chunk_count", "shared")}, indent=2))
+    finally:
+        kb.close()
@@ -0,0 +1,855 @@
+import os
+import re
+import json
+import glob
+import zlib
+import struct
+import hashlib
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from bm25_index import BM25Index
+from dense_index import KB_DENSE_INDEX, DenseIndex, hybrid_search
+from chunk_dedup import KB_DEDUP, ChunkDeduplicator
+from kb_ingest import IngestPool, IngestTimeout
+
+
+KB_EXTENSIONS = (".txt", ".md", ".pdf")
+
+# Bump whenever extraction, chunking, tokenization or the chunk file format
+# changes so cached chunks are rebuilt
+KB_EXTRACTOR_VERSION = 2
+KB_CACHE_DIR = os.getenv("KB_CACHE_DIR", os.path.join("server", "data", "kb_cache"))
+
+# Compact tombstoned chunks in the background once they exceed this share of the index
+KB_MERGE_TOMBSTONE_RATIO = float(os.getenv("KB_MERGE_TOMBSTONE_RATIO", "0.2"))
+KB_MERGE_MIN_TOMBSTONES = int(os.getenv("KB_MERGE_MIN_TOMBSTONES", "1000"))
+# Fold recently added chunks into the base segment once the tail reaches this size
+KB_MERGE_TAIL_RATIO = float(os.getenv("KB_MERGE_TAIL_RATIO", "0.1"))
+KB_MERGE_MIN_TAIL = int(os.getenv("KB_MERGE_MIN_TAIL", "2000"))
+# Chunks read (and signed) outside the index lock per splice while a document is ingested
+KB_UPSERT_BATCH_CHUNKS = int(os.getenv("KB_UPSERT_BATCH_CHUNKS", "256"))
+
+# Extraction runs in a process pool (0 = in the calling thread, no timeout)
+KB_INGEST_WORKERS = int(os.getenv("KB_INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+KB_INGEST_TIMEOUT_S = float(os.getenv("KB_INGEST_TIMEOUT_S", "60"))
+KB_PDF_MAX_PAGES = int(os.getenv("KB_PDF_MAX_PAGES", "500"))
+# Characters read per block when streaming text files
+TEXT_READ_CHARS = 1024 * 1024
+# Per-file entries kept in the last sync report (failures first, then slowest)
+KB_SYNC_REPORT_FILES = 100
+
+
+def simple_tokenize(text: str) -> List[str]:
+    return re.findall(r"[\w']+", (text or "").lower())
+
+
+def chunk_text(text: str, max_chars: int = 800, overlap: int = 150) -> List[str]:
+    text = (text or "").strip()
+    if not text:
+        return []
+    chunks: List[str] = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + max_chars)
+        chunks.append(text[start:end])
+        if end == len(text):
+            break
+        start = max(0, end - overlap)
+    return chunks
+
+
+def iter_chunks(pieces: Iterable[str], max_chars: int = 800, overlap: int = 150) -> Iterator[str]:
+    """chunk_text() over the concatenation of `pieces`, without joining them in memory."""
+    buf = ""
+    start = 0  # start of the next chunk in buf
+    last = -1  # index of the last non-whitespace character in buf
+    for piece in pieces:
+        if last < 0:
+            piece = piece.lstrip()  # chunk_text() strips the whole text
+            if not piece:
+                continue
+        content = len(piece.rstrip())
+        if start:
+            buf, last = buf[start:], last - start
+            start = 0
+        if content:
+            last = len(buf) + content - 1
+        buf += piece
+        # A full window is final once non-whitespace text follows it
+        while start + max_chars <= last:
+            yield buf[start:start + max_chars]
+            start += max_chars - overlap
+    end_of_text = last + 1
+    while start < end_of_text:
+        end = min(end_of_text, start + max_chars)
+        yield buf[start:end]
+        if end == end_of_text:
+            break
+        start = max(0, end - overlap)
+
+
+def iter_document_text(path: str, max_pages: int, info: Dict[str, Any]) -> Iterator[str]:
+    """
+    A file's text piece by piece: one PDF page or one block of a text file at
+    a time. Sets info["pages"] and info["truncated"] for PDFs. Raises on
+    unreadable files.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".txt", ".md"):
+        with open(path, "r", encoding="utf-8") as f:
+            for block in iter(lambda: f.read(TEXT_READ_CHARS), ""):
+                yield block
+    elif ext == ".pdf":
+        from pypdf import PdfReader  # type: ignore
+
+        reader = PdfReader(path)
+        info["pages"] = len(reader.pages)
+        info["truncated"] = info["pages"] > max_pages
+        for index in range(min(info["pages"], max_pages)):
+            if index:
+                yield "\n"
+            yield reader.pages[index].extract_text() or ""
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+
+def extract_document(path: str, out_path: str, max_pages: int = KB_PDF_MAX_PAGES) -> Dict[str, Any]:
+    """
+    Extract, chunk and tokenize one file into a chunk file at `out_path`.
+
+    Runs in ingestion workers. Pages are extracted, chunked and written one
+    at a time, so memory stays flat however large the document is. PDFs stop
+    after `max_pages` pages.
+    """
+    start = time.perf_counter()
+    info: Dict[str, Any] = {}
+    writer = ChunkWriter(out_path)
+    try:
+        for chunk in iter_chunks(iter_document_text(path, max_pages, info)):
+            text = chunk.strip()
+            writer.add(text, simple_tokenize(text))
+        extract_ms = round((time.perf_counter() - start) * 1000.0, 3)
+        writer.commit(os.path.getsize(path), extract_ms)
+    except BaseException:
+        writer.abort()
+        raise
+    return {"chunks": writer.n_chunks, "extract_ms": extract_ms, **info}
+
+
+def list_kb_files(knowledge_dir: str) -> List[str]:
+    files: List[str] = []
+    for ext in KB_EXTENSIONS:
+        files.extend(glob.glob(os.path.join(knowledge_dir, "**", f"*{ext}"), recursive=True))
+    return files
+
+
+def kb_doc_key(knowledge_dir: str, path: str) -> str:
+    return os.path.relpath(path, knowledge_dir).replace(os.sep, "/")
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# Chunk files: a small header, then a zlib stream of one record per chunk:
+# "<IIII" (text bytes, new vocabulary bytes, new terms, token ids), the text,
+# the terms first used by this chunk joined by "\n", and uint32 token ids into
+# the vocabulary built up so far. Records can be written and read one at a
+# time, so neither side holds a whole document.
+CHUNK_MAGIC = b"KBX2"
+CHUNK_HEADER = struct.Struct("<4sHIQd")  # magic, extractor version, chunks, source bytes, extract ms
+CHUNK_RECORD = struct.Struct("<IIII")
+
+
+class ChunkWriter:
+    """Streams (text, tokens) chunks into a chunk file, published atomically on commit."""
+
+    def __init__(self, path: str, extractor_version: int = KB_EXTRACTOR_VERSION):
+        self.path = path
+        self.extractor_version = extractor_version
+        self.n_chunks = 0
+        self._vocab: Dict[str, int] = {}
+        self._tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(b"\0" * CHUNK_HEADER.size)
+        self._compressor = zlib.compressobj(1)  # fast: chunk files are written once per extraction
+
+    def add(self, text: str, tokens: List[str]) -> None:
+        vocab = self._vocab
+        new_terms: List[str] = []
+        for token in tokens:
+            if token not in vocab:
+                vocab[token] = len(vocab)
+                new_terms.append(token)
+        ids = array("I", map(vocab.__getitem__, tokens))
+        encoded = text.encode("utf-8")
+        new_vocab = "\n".join(new_terms).encode("utf-8")
+        record = CHUNK_RECORD.pack(len(encoded), len(new_vocab), len(new_terms), len(ids))
+        self._file.write(self._compressor.compress(record + encoded + new_vocab + ids.tobytes()))
+        self.n_chunks += 1
+
+    def commit(self, source_bytes: int = 0, extract_ms: float = 0.0) -> None:
+        self._file.write(self._compressor.flush())
+        self._file.seek(0)
+        self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self.extractor_version, self.n_chunks,
+                                           source_bytes, extract_ms))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+def read_chunk_header(f: BinaryIO, extractor_version: int = KB_EXTRACTOR_VERSION) -> Tuple[int, int, float]:
+    """(chunks, source bytes, extract ms) of an open chunk file; ValueError if stale or foreign."""
+    magic, version, n_chunks, source_bytes, extract_ms = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+    if magic != CHUNK_MAGIC or version != extractor_version:
+        raise ValueError("stale chunk file")
+    return n_chunks, source_bytes, extract_ms
+
+
+def iter_chunk_file(f: BinaryIO, n_chunks: int, remove_path: Optional[str] = None) -> Iterator[Tuple[str, List[str]]]:
+    """(text, tokens) records of an open chunk file positioned after its header; closes it when done."""
+    decompressor = zlib.decompressobj()
+    buf = bytearray()
+
+    def read_exact(size: int) -> bytes:
+        while len(buf) < size:
+            block = f.read(256 * 1024)
+            if not block:
+                raise ValueError("truncated chunk file")
+            buf.extend(decompressor.decompress(block))
+        data = bytes(buf[:size])
+        del buf[:size]
+        return data
+
+    vocab: List[str] = []
+    try:
+        for _ in range(n_chunks):
+            text_len, vocab_len, n_new, n_ids = CHUNK_RECORD.unpack(read_exact(CHUNK_RECORD.size))
+            text = read_exact(text_len).decode("utf-8")
+            if n_new:
+                vocab.extend(read_exact(vocab_len).decode("utf-8").split("\n"))
+            ids = array("I")
+            ids.frombytes(read_exact(4 * n_ids))
+            yield text, [vocab[i] for i in ids]
+    finally:
+        f.close()
+        if remove_path is not None:
+            try:
+                os.remove(remove_path)
+            except OSError:
+                pass
+
+
+def open_chunk_file(path: str, remove: bool = False) -> Iterator[Tuple[str, List[str]]]:
+    """Validate a chunk file's header and stream its records; `remove` deletes it once read."""
+    f = open(path, "rb")
+    try:
+        n_chunks, _, _ = read_chunk_header(f)
+    except BaseException:
+        f.close()
+        raise
+    return iter_chunk_file(f, n_chunks, path if remove else None)
+
+
+class ExtractionCache:
+    """
+    On-disk cache of extracted, chunked and tokenized documents.
+
+    Entries are chunk files keyed by file sha256 and KB_EXTRACTOR_VERSION,
+    written by the ingestion workers and streamed back into the index. A
+    manifest of (mtime, size) -> sha256 per file lets a restart skip
+    re-hashing unchanged files, so an unchanged corpus is indexed without
+    parsing any document.
+    """
+
+    def __init__(self, cache_dir: str, extractor_version: int = KB_EXTRACTOR_VERSION):
+        self.cache_dir = cache_dir
+        self.extractor_version = extractor_version
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.stats: Dict[str, Any] = {
+            "hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "errors": 0,
+            "bytes_saved": 0,
+            "extract_ms_saved": 0.0,
+        }
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest: Dict[str, Dict[str, Any]] = self._load_manifest()
+
+    def entry_path(self, sha256: str) -> str:
+        path = os.path.join(self.cache_dir, sha256[:2], f"{sha256}.v{self.extractor_version}.kbx")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                loaded = json.load(f)
+            return loaded if isinstance(loaded, dict) else {}
+        except Exception:
+            return {}
+
+    def known_sha256(self, key: str, mtime: float, size: int) -> Optional[str]:
+        """sha256 recorded for a file whose mtime and size are unchanged."""
+        entry = self.manifest.get(key)
+        if entry and entry.get("mtime") == mtime and entry.get("size") == size:
+            return entry.get("sha256")
+        return None
+
+    def save_manifest(self, docs: Dict[str, Dict[str, Any]]) -> None:
+        manifest = {key: {"sha256": d["sha256"], "mtime": d["mtime"], "size": d["size"]}
+                    for key, d in docs.items() if d.get("sha256")}
+        try:
+            _atomic_write(self.manifest_path, json.dumps(manifest).encode("utf-8"))
+            self.manifest = manifest
+        except Exception as e:
+            print(f"KB cache manifest write error: {e}")
+
+    def get(self, sha256: str) -> Optional[Iterator[Tuple[str, List[str]]]]:
+        """Stream of cached (chunk text, chunk tokens) for a content hash, or None."""
+        f = None
+        try:
+            f = open(self.entry_path(sha256), "rb")
+            n_chunks, source_bytes, extract_ms = read_chunk_header(f, self.extractor_version)
+        except FileNotFoundError:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        except Exception as e:
+            if f is not None:
+                f.close()
+            print(f"KB cache read error for {sha256}: {e}")
+            with self._lock:
+                self.stats["misses"] += 1
+                self.stats["errors"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += source_bytes
+            self.stats["extract_ms_saved"] = round(self.stats["extract_ms_saved"] + extract_ms, 3)
+        return iter_chunk_file(f, n_chunks)
+
+    def record_write(self) -> None:
+        with self._lock:
+            self.stats["writes"] += 1
+
+    def prune(self, keep: set) -> int:
+        """Delete entries whose content hash is not in `keep`."""
+        removed = 0
+        suffix = f".v{self.extractor_version}.kbx"
+        for path in glob.glob(os.path.join(self.cache_dir, "*", "*.kbx")):
+            name = os.path.basename(path)
+            if name.endswith(suffix) and name[:-len(suffix)] in keep:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+
+class KnowledgeBaseIndex:
+    """
+    Incrementally maintained BM25 index over knowledge base chunks.
+
+    Scoring and postings live in bm25_index.BM25Index, and LSA embeddings for
+    dense and hybrid retrieval in dense_index.DenseIndex at the same
+    positions; this class maps files to chunks. Each document's sha256,
+    mtime and size are tracked, so a sync only re-extracts files that
+    changed. Removed documents leave tombstoned chunks that are skipped at
+    query time. A background merge folds recently added chunks into the
+    immutable base segment and drops tombstones.
+
+    A chunk that is a near duplicate of an indexed one (chunk_dedup) is not
+    indexed again: its (document, chunk id) is added to the indexed chunk's
+    references, reported as "sources". The chunk lives until its last
+    reference is removed; when the first one goes, the next takes its id.
+    """
+
+    def __init__(self, knowledge_dir: str, cache_dir: Optional[str] = None, ingest_workers: int = 0,
+                 ingest_timeout_s: float = KB_INGEST_TIMEOUT_S, max_pages: int = KB_PDF_MAX_PAGES,
+                 ingest: Optional[IngestPool] = None, dense: str = KB_DENSE_INDEX, dedup: bool = KB_DEDUP):
+        self.knowledge_dir = knowledge_dir
+        self.cache = ExtractionCache(cache_dir) if cache_dir else None
+        if ingest is None and ingest_workers > 0:
+            ingest = IngestPool(ingest_workers, ingest_timeout_s)
+        self.ingest = ingest
+        self.max_pages = max_pages
+        self.failed: Dict[str, Dict[str, str]] = {}  # key -> {sha256, error} of files that failed to extract
+        self._lock = threading.RLock()
+        self._merge_thread: Optional[threading.Thread] = None
+        self._defer_merge = 0
+        self.docs: Dict[str, Dict[str, Any]] = {}  # key -> {sha256, mtime, size, chunks}
+        self.chunks: List[Optional[Dict[str, Any]]] = []  # None = tombstone
+        self.chunk_keys: List[Optional[str]] = []  # document key of each chunk's first reference
+        self.refs: Dict[int, List[Tuple[str, str]]] = {}  # position -> (key, chunk id), for shared chunks only
+        self._ingesting: Dict[int, List[int]] = {}  # positions of documents being spliced in, remapped by merges
+        self.bm25 = BM25Index()
+        self.dense = DenseIndex(dense)
+        self.dedup = ChunkDeduplicator(dedup)
+        self.query_stats = {"queries": 0, "deduplicated_hits": 0, "slots_saved": 0}
+        self.generation = 0
+        self.last_indexed_at: Optional[str] = None
+        self.last_sync: Dict[str, Any] = {}
+        self.merges = 0
+        self.last_merge: Dict[str, Any] = {}
+
+    # ------------------------------------------------------------------
+    # Document keys and files
+    # ------------------------------------------------------------------
+
+    def doc_key(self, path: str) -> str:
+        return kb_doc_key(self.knowledge_dir, path)
+
+    @staticmethod
+    def resolve_key(name: str) -> str:
+        """Normalize a user supplied document name, rejecting paths outside the KB."""
+        key = os.path.normpath((name or "").replace("\\", "/")).replace(os.sep, "/")
+        if not key or key in (".", "..") or key.startswith("../") or os.path.isabs(key):
+            raise ValueError(f"Invalid document name: {name}")
+        return key
+
+    def list_files(self) -> List[str]:
+        return list_kb_files(self.knowledge_dir)
+
+    # ------------------------------------------------------------------
+    # Index maintenance (callers hold the lock)
+    # ------------------------------------------------------------------
+
+    def _add_chunks(self, key: str, chunks: Iterable[Tuple[str, List[str], Any]], positions: List[int]) -> None:
+        """
+        Index (text, tokens, dedup signature) chunks, or reference a near duplicate,
+        appending their positions to `positions` (chunk ids continue from its length).
+        """
+        doc_name = os.path.basename(key)
+        for text, tokens, signature in chunks:
+            chunk_id = f"{doc_name}:{len(positions)}"
+            duplicate = self.dedup.find(signature, self.bm25.alive.view())
+            if duplicate is not None:
+                refs = self.refs.setdefault(duplicate, [(self.chunk_keys[duplicate], self.chunks[duplicate]["id"])])
+                refs.append((key, chunk_id))
+                self.chunks[duplicate] = self._chunk_entry(self.chunks[duplicate]["text"], refs)
+                positions.append(duplicate)
+                continue
+            pos = self.bm25.add_chunk(tokens)
+            self.dense.add(tokens, self.bm25.term_ids)
+            self.dedup.add(pos, signature)
+            self.chunks.append({"id": chunk_id, "doc": doc_name, "text": text})
+            self.chunk_keys.append(key)
+            positions.append(pos)
+
+    @staticmethod
+    def _chunk_entry(text: str, refs: List[Tuple[str, str]]) -> Dict[str, Any]:
+        chunk_id = refs[0][1]
+        entry: Dict[str, Any] = {"id": chunk_id, "doc": chunk_id.rsplit(":", 1)[0], "text": text}
+        if len(refs) > 1:
+            entry["sources"] = [ref[1] for ref in refs]
+        return entry
+
+    def _release(self, key: str, positions: List[int]) -> None:
+        """Drop a document's references to its chunks; chunks nobody else references are tombstoned."""
+        doc_name = os.path.basename(key)
+        for idx, pos in enumerate(positions):
+            refs = self.refs.get(pos)
+            if refs is None:
+                self.bm25.remove_chunk(pos)
+                self.chunks[pos] = None
+                continue
+            refs.remove((key, f"{doc_name}:{idx}"))
+            self.chunk_keys[pos] = refs[0][0]
+            self.chunks[pos] = self._chunk_entry(self.chunks[pos]["text"], refs)  # type: ignore
+            if len(refs) == 1:
+                del self.refs[pos]
+
+    def _remove_doc(self, key: str) -> bool:
+        entry = self.docs.pop(key, None)
+        if entry is None:
+            return False
+        self._release(key, entry["chunks"])
+        return True
+
+    def _touch(self) -> None:
+        self.generation += 1
+        self.last_indexed_at = datetime.utcnow().isoformat()
+
+    # ------------------------------------------------------------------
+    # Public mutation API
+    # ------------------------------------------------------------------
+
+    def upsert_document(self, key: str, text: str, sha256: str = "",
+                        mtime: float = 0.0, size: int = 0) -> int:
+        """Replace a document's chunks; returns the number of chunks indexed."""
+        chunks = ((chunk.strip(), simple_tokenize(chunk.strip())) for chunk in iter_chunks([text]))
+        return self._upsert_chunks(key, chunks, sha256, mtime, size)
+
+    def _upsert_chunks(self, key: str, chunks: Iterable[Tuple[str, List[str]]],
+                       sha256: str, mtime: float, size: int) -> int:
+        """
+        Replace a document with a stream of (text, tokens) chunks.
+
+        The stream is read and signed outside the lock, KB_UPSERT_BATCH_CHUNKS
+        at a time, and each batch is spliced in under it, so queries are not
+        held up while a large file is read. New chunks are indexed before the
+        old ones are removed, which happens in one step at the end; if the
+        stream fails part way, the new chunks are tombstoned and the
+        document's previous version stays searchable.
+        """
+        positions: List[int] = []
+        with self._lock:
+            self._ingesting[id(positions)] = positions
+        committed = False
+        try:
+            batch: List[Tuple[str, List[str], Any]] = []
+            for text, tokens in chunks:
+                batch.append((text, tokens, self.dedup.signature(tokens)))
+                if len(batch) >= KB_UPSERT_BATCH_CHUNKS:
+                    with self._lock:
+                        self._add_chunks(key, batch, positions)
+                    batch = []
+            with self._lock:
+                self._add_chunks(key, batch, positions)
+                self._remove_doc(key)
+                self.docs[key] = {"sha256": sha256, "mtime": mtime, "size": size, "chunks": positions}
+                committed = True
+                self._touch()
+        finally:
+            with self._lock:
+                if not committed:
+                    self._release(key, positions)
+                del self._ingesting[id(positions)]
+            self._maybe_schedule_merge()
+        return len(positions)
+
+    def _load_chunks(self, path: str, sha256: str) -> Dict[str, Any]:
+        """Stream of chunk texts and tokens from the extraction cache, extracting on a miss."""
+        if self.cache is not None:
+            cached = self.cache.get(sha256)
+            if cached is not None:
+                return {"stream": cached, "cached": True}
+            out_path = self.cache.entry_path(sha256)
+        else:
+            fd, out_path = tempfile.mkstemp(prefix="kb-chunks-", suffix=".kbx")
+            os.close(fd)
+        try:
+            if self.ingest is not None:
+                extracted = self.ingest.run(extract_document, path, out_path, self.max_pages)
+            else:
+                extracted = extract_document(path, out_path, self.max_pages)
+        except BaseException:
+            if self.cache is None:
+                os.remove(out_path)
+            raise
+        if self.cache is not None:
+            self.cache.record_write()
+        stream = open_chunk_file(out_path, remove=self.cache is None)
+        return {**extracted, "stream": stream, "cached": False}
+
+    def remove_document(self, key: str) -> bool:
+        with self._lock:
+            removed = self._remove_doc(key)
+            if removed:
+                self._touch()
+        if removed:
+            self._maybe_schedule_merge()
+        return removed
+
+    def index_file(self, path: str) -> Dict[str, Any]:
+        """
+        Index (or refresh) a single file if its content changed.
+
+        Returns a per-file report with timings; extraction failures and
+        timeouts are reported with a reason instead of raising, and the
+        document's previous chunks (if any) stay searchable.
+        """
+        start = time.perf_counter()
+        key = self.doc_key(path)
+        st = os.stat(path)
+        existing = self.docs.get(key)
+        if existing and existing["mtime"] == st.st_mtime and existing["size"] == st.st_size:
+            return {"doc": key, "changed": False, "status": "unchanged"}
+        sha256 = None
+        if existing is None and self.cache is not None:
+            sha256 = self.cache.known_sha256(key, st.st_mtime, st.st_size)
+        sha256 = sha256 or file_sha256(path)
+        if existing and existing["sha256"] == sha256:
+            existing["mtime"], existing["size"] = st.st_mtime, st.st_size
+            return {"doc": key, "changed": False, "status": "unchanged"}
+        failure = self.failed.get(key)
+        if failure and failure["sha256"] == sha256:
+            return {"doc": key, "changed": False, "status": failure["status"], "error": failure["error"]}
+        try:
+            loaded = self._load_chunks(path, sha256)
+            chunks = self._upsert_chunks(key, loaded["stream"], sha256, st.st_mtime, st.st_size)
+        except Exception as e:
+            status = "timeout" if isinstance(e, IngestTimeout) else "failed"
+            error = str(e) if isinstance(e, IngestTimeout) else f"{type(e).__name__}: {e}"
+            print(f"KB ingestion {status} for {key}: {error}")
+            self.failed[key] = {"sha256": sha256, "status": status, "error": error}
+            return {"doc": key, "changed": False, "status": status, "error": error,
+                    "total_ms": round((time.perf_counter() - start) * 1000.0, 3)}
+        self.failed.pop(key, None)
+        report = {
+            "doc": key,
+            "changed": True,
+            "status": "updated" if existing else "added",
+            "chunks": chunks,
+            "cached": loaded["cached"],
+            "total_ms": round((time.perf_counter() - start) * 1000.0, 3),
+        }
+        for field in ("extract_ms", "pages", "truncated"):
+            if loaded.get(field) is not None:
+                report[field] = loaded[field]
+        return report
+
+    def delete_document(self, key: str) -> bool:
+        """Delete a document's file (if present) and tombstone its chunks."""
+        path = os.path.join(self.knowledge_dir, key)
+        existed = os.path.isfile(path)
+        if existed:
+            os.remove(path)
+        return self.remove_document(key) or existed
+
+    @contextmanager
+    def bulk_load(self):
+        """Hold off background merges while many documents are indexed, then merge once."""
+        with self._lock:
+            self._defer_merge += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._defer_merge -= 1
+            self._maybe_schedule_merge()
+
+    def _index_files(self, paths: List[str]) -> List[Dict[str, Any]]:
+        """index_file() over many paths; with a process pool, files are extracted in parallel."""
+        def index_one(path: str) -> Optional[Dict[str, Any]]:
+            try:
+                return self.index_file(path)
+            except OSError:
+                return None  # vanished or unreadable while syncing
+
+        if self.ingest is None:
+            reports = [index_one(path) for path in paths]
+        else:
+            # Threads only hash files and wait on workers; parsing happens in the pool
+            with ThreadPoolExecutor(max_workers=self.ingest.workers, thread_name_prefix="kb-ingest") as executor:
+                reports = list(executor.map(index_one, paths))
+        return [r for r in reports if r is not None]
+
+    def sync(self) -> Dict[str, Any]:
+        """Bring the index in line with the files on disk, re-extracting only changed files."""
+        start = time.perf_counter()
+        os.makedirs(self.knowledge_dir, exist_ok=True)
+        paths = self.list_files()
+        seen = {self.doc_key(path) for path in paths}
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        with self.bulk_load():
+            reports = self._index_files(paths)
+            for report in reports:
+                status = report["status"]
+                counts["failed" if status == "timeout" else status] += 1
+            for key in [k for k in list(self.docs) if k not in seen]:
+                if self.remove_document(key):
+                    counts["removed"] += 1
+        for key in [k for k in list(self.failed) if k not in seen]:
+            self.failed.pop(key, None)
+        # Failures first, then the slowest files
+        files = sorted((r for r in reports if r["status"] != "unchanged"),
+                       key=lambda r: ("error" not in r, -r.get("total_ms", 0.0)))
+        counts["files"] = files[:KB_SYNC_REPORT_FILES]
+        counts["files_omitted"] = max(0, len(files) - KB_SYNC_REPORT_FILES)
+        if self.cache is not None:
+            with self._lock:
+                docs = {key: dict(entry) for key, entry in self.docs.items()}
+            self.cache.save_manifest(docs)
+            counts["cache_pruned"] = self.cache.prune({entry["sha256"] for entry in docs.values()})
+        self.last_sync = {**counts, "duration_ms": round((time.perf_counter() - start) * 1000.0, 3)}
+        return self.meta()
+
+    # ------------------------------------------------------------------
+    # Merge
+    # ------------------------------------------------------------------
+
+    def _needs_merge(self) -> bool:
+        bm25 = self.bm25
+        if self.dense.needs_fit(bm25.live_chunks):
+            return True
+        if bm25.tombstones >= max(KB_MERGE_MIN_TOMBSTONES, KB_MERGE_TOMBSTONE_RATIO * bm25.chunk_count):
+            return True
+        return bm25.tail_chunks >= max(KB_MERGE_MIN_TAIL, KB_MERGE_TAIL_RATIO * bm25.base.chunk_count)
+
+    def _maybe_schedule_merge(self) -> None:
+        with self._lock:
+            if self._defer_merge or not self._needs_merge():
+                return
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            self._merge_thread = threading.Thread(target=self.merge, name="kb-merge", daemon=True)
+            self._merge_thread.start()
+
+    def merge(self) -> Dict[str, Any]:
+        """Fold the tail into a new base segment, drop tombstoned chunks and (re)build dense vectors."""
+        start = time.perf_counter()
+        with self._lock:
+            snapshot = self.bm25.merge_snapshot()
+            dense_snapshot = self.dense.merge_snapshot()
+            dedup_snapshot = self.dedup.merge_snapshot(snapshot["size"])
+            live_chunks = self.bm25.live_chunks
+        # The expensive part runs without the lock; updates made meanwhile are
+        # replayed onto the new segment by install()
+        frozen, live = BM25Index.build_base(snapshot)
+        dense = self.dense.build_base(dense_snapshot, frozen, live, live_chunks)
+        dedup = ChunkDeduplicator.build_base(dedup_snapshot, live) if self.dedup.enabled else None
+        with self._lock:
+            before = len(self.chunks)
+            remap = self.bm25.install(frozen, live, snapshot["size"])
+            old_chunks = self.chunks
+            self.dense.install(dense, remap, snapshot["size"],
+                               lambda pos: simple_tokenize(old_chunks[pos]["text"]) if old_chunks[pos] else [],
+                               self.bm25.term_ids)
+            if dedup is not None:
+                self.dedup.install(dedup, remap, snapshot["size"])
+            kept = np.flatnonzero(remap >= 0)
+            self.chunks = [self.chunks[p] for p in kept]
+            self.chunk_keys = [self.chunk_keys[p] for p in kept]
+            self.refs = {int(remap[p]): refs for p, refs in self.refs.items() if remap[p] >= 0}
+            for entry in self.docs.values():
+                entry["chunks"] = [int(remap[p]) for p in entry["chunks"]]
+            for positions in self._ingesting.values():
+                positions[:] = [int(remap[p]) for p in positions]
+            self.merges += 1
+            self.generation += 1
+            self.last_merge = {
+                "chunks_before": before,
+                "chunks_after": len(self.chunks),
+                "duration_ms": round((time.perf_counter() - start) * 1000.0, 3),
+            }
+            return dict(self.last_merge)
+
+    def compact(self) -> None:
+        """Wait for a background merge, then merge what is left into a single base segment."""
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            pending = self.bm25.tail_chunks or self.bm25.tombstones or self.dense.needs_fit(self.bm25.live_chunks)
+        if pending:
+            self.merge()
+
+    # ------------------------------------------------------------------
+    # Query
+    # ------------------------------------------------------------------
+
+    def idf(self, term: str) -> float:
+        with self._lock:
+            return self.bm25.idf(term)
+
+    def search(self, query: str, top_n: int = 5, mode: str = "bm25") -> List[Dict[str, Any]]:
+        """
+        Top chunks for a query. mode "bm25": chunks containing a query term,
+        scored like BM25Okapi; "dense" and "hybrid": see dense_index.hybrid_search.
+        """
+        tokens = simple_tokenize(query)
+        if not tokens or top_n <= 0:
+            return []
+        with self._lock:
+            hits = hybrid_search(self.bm25, self.dense, tokens, top_n, mode)
+            results = [{"score": score, **self.chunks[pos]} for pos, score in hits]  # type: ignore
+            # Every extra source is a result slot a copy would otherwise have taken
+            saved = [len(r["sources"]) - 1 for r in results if "sources" in r]
+            self.query_stats["queries"] += 1
+            self.query_stats["deduplicated_hits"] += len(saved)
+            self.query_stats["slots_saved"] += sum(saved)
+            return results
+
+    @property
+    def chunk_count(self) -> int:
+        return self.bm25.live_chunks
+
+    def close(self) -> None:
+        """Stop ingestion workers."""
+        if self.ingest is not None:
+            self.ingest.close()
+
+    def _dedup_stats(self) -> Dict[str, Any]:
+        """Index size and query work saved by collapsing near-duplicate chunks (lock held)."""
+        duplicates = postings_saved = bytes_saved = 0
+        for pos, refs in self.refs.items():
+            copies = len(refs) - 1
+            duplicates += copies
+            postings_saved += copies * len(self.bm25.chunk_terms[pos] or ())
+            bytes_saved += copies * len(self.chunks[pos]["text"].encode("utf-8"))  # type: ignore
+        postings = len(self.bm25.base.positions) + self.bm25.tail_postings
+        source_chunks = self.bm25.live_chunks + duplicates
+        queries = self.query_stats["queries"]
+        return {
+            **self.dedup.get_stats(),
+            "source_chunks": source_chunks,
+            "duplicate_chunks": duplicates,
+            "shared_chunks": len(self.refs),
+            "chunk_reduction": round(duplicates / source_chunks, 4) if source_chunks else 0.0,
+            "postings_saved": postings_saved,
+            # Query cost grows with the postings of the query terms, so this is
+            # also the expected share of BM25 scoring work avoided per query
+            "postings_reduction": round(postings_saved / (postings + postings_saved), 4) if postings_saved else 0.0,
+            "text_bytes_saved": bytes_saved,
+            "queries": queries,
+            "deduplicated_hits": self.query_stats["deduplicated_hits"],
+            "result_slots_saved_per_query": round(self.query_stats["slots_saved"] / queries, 4) if queries else 0.0,
+        }
+
+    def meta(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "doc_count": sum(1 for entry in self.docs.values() if entry["chunks"]),
+                "chunk_count": self.bm25.live_chunks,
+                "last_indexed_at": self.last_indexed_at,
+                "generation": self.generation,
+                "tombstones": self.bm25.tombstones,
+                "merges": self.merges,
+                "last_merge": dict(self.last_merge),
+                "index": self.bm25.get_stats(),
+                "dense": self.dense.get_stats(),
+                "dedup": self._dedup_stats(),
+                "last_sync": dict(self.last_sync),
+                "cache": self.cache.get_stats() if self.cache is not None else None,
+                "ingest": self.ingest.get_stats() if self.ingest is not None else None,
+            }
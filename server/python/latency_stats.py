@@ -0,0 +1,47 @@
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+
+class LatencyTracker:
+    """
+    Rolling time-to-first-byte and total latency per response source.
+
+    Keeps the last `window` samples of each source and reports count and
+    p50/p95/max, so a slow model shows up as a TTFB regression even when total
+    latency is dominated by generation length.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, source: str, ttfb_ms: float, total_ms: float) -> None:
+        with self._lock:
+            self._samples.setdefault(source, deque(maxlen=self.window)).append((ttfb_ms, total_ms))
+            self._counts[source] = self._counts.get(source, 0) + 1
+
+    @staticmethod
+    def _summary(values: List[float]) -> Dict[str, float]:
+        values = sorted(values)
+        last = len(values) - 1
+        return {
+            'p50': round(values[last // 2], 3),
+            'p95': round(values[int(last * 0.95)], 3),
+            'max': round(values[last], 3),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = {source: list(values) for source, values in self._samples.items()}
+            counts = dict(self._counts)
+        return {
+            source: {
+                'count': counts[source],
+                'ttfb_ms': self._summary([ttfb for ttfb, _ in values]),
+                'total_ms': self._summary([total for _, total in values]),
+            }
+            for source, values in samples.items()
+        }
@@ -0,0 +1,166 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+LEADS_DB_PATH = os.getenv("LEADS_DB_PATH", os.path.join(os.getcwd(), "server", "data", "leads.db"))
+LEADS_JSON_PATH = os.path.join(os.getcwd(), "server", "data", "leads.json")
+
+LEAD_FIELDS = ("name", "email", "company", "phone", "details", "language", "created_at")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    company TEXT,
+    phone TEXT,
+    details TEXT,
+    language TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_leads_email ON leads (email);
+CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads (created_at);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+class LeadStore:
+    """
+    Lead storage in an embedded SQLite database (WAL mode).
+
+    Inserts are O(1) appends, reads never block writers, and `email` /
+    `created_at` are indexed. Listing uses keyset pagination on the row id so
+    export cost does not grow with the page number.
+    """
+
+    def __init__(self, db_path: str, legacy_json_path: Optional[str] = None):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        if legacy_json_path:
+            self._migrate_legacy(legacy_json_path)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _migrate_legacy(self, legacy_json_path: str) -> None:
+        """One-time import of the old leads.json list."""
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM migrations WHERE name = 'leads_json'").fetchone():
+            return
+        rows: List[Dict[str, Any]] = []
+        if os.path.exists(legacy_json_path):
+            try:
+                with open(legacy_json_path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                rows = [r for r in loaded if isinstance(r, dict)] if isinstance(loaded, list) else []
+            except Exception as e:
+                print(f"Error reading legacy leads file: {e}")
+                return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock in case another worker migrated first
+            if conn.execute("SELECT 1 FROM migrations WHERE name = 'leads_json'").fetchone():
+                conn.execute("ROLLBACK")
+                return
+            conn.executemany(
+                "INSERT INTO leads (name, email, company, phone, details, language, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._row(r) for r in rows]
+            )
+            conn.execute("INSERT INTO migrations (name) VALUES ('leads_json')")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if rows:
+            os.replace(legacy_json_path, legacy_json_path + ".migrated")
+            print(f"Migrated {len(rows)} leads from {legacy_json_path}")
+
+    @staticmethod
+    def _row(lead: Dict[str, Any]) -> Tuple[Any, ...]:
+        """Column values for a lead dict; emails are stored lower-cased for indexed lookup."""
+        values = {f: lead.get(f) for f in LEAD_FIELDS}
+        values["name"] = values["name"] or ""
+        values["email"] = (values["email"] or "").strip().lower()
+        values["created_at"] = values["created_at"] or ""
+        return tuple(values[f] for f in LEAD_FIELDS)
+
+    def add(self, lead: Dict[str, Any]) -> int:
+        """Insert a lead and return its id."""
+        cur = self._conn().execute(
+            "INSERT INTO leads (name, email, company, phone, details, language, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._row(lead)
+        )
+        return int(cur.lastrowid)
+
+    def _where(self, after_id: int, email: Optional[str], since: Optional[str],
+               until: Optional[str]) -> Tuple[str, List[Any]]:
+        clauses, params = ["id > ?"], [after_id]
+        if email:
+            clauses.append("email = ?")
+            params.append(email.strip().lower())
+        if since:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("created_at < ?")
+            params.append(until)
+        return " AND ".join(clauses), params
+
+    def page(self, limit: int = 100, cursor: int = 0, email: Optional[str] = None,
+             since: Optional[str] = None, until: Optional[str] = None) -> Dict[str, Any]:
+        """One page of leads after `cursor` (a lead id), oldest first."""
+        where, params = self._where(cursor, email, since, until)
+        rows = self._conn().execute(
+            f"SELECT * FROM leads WHERE {where} ORDER BY id LIMIT ?", params + [limit + 1]
+        ).fetchall()
+        leads = [dict(r) for r in rows[:limit]]
+        next_cursor = leads[-1]["id"] if len(rows) > limit and leads else None
+        return {"leads": leads, "next_cursor": next_cursor}
+
+    def iter_leads(self, email: Optional[str] = None, since: Optional[str] = None,
+                   until: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Stream every matching lead in id order, one batch in memory at a time."""
+        cursor = 0
+        while True:
+            result = self.page(batch_size, cursor, email, since, until)
+            yield from result["leads"]
+            if result["next_cursor"] is None:
+                return
+            cursor = result["next_cursor"]
+
+    def count(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM leads").fetchone()[0])
+
+
+_lead_store: Optional[LeadStore] = None
+_lead_store_lock = threading.Lock()
+
+
+def get_lead_store() -> LeadStore:
+    """Get or create the process-wide lead store (migrating leads.json on first use)."""
+    global _lead_store
+    if _lead_store is None:
+        with _lead_store_lock:
+            if _lead_store is None:
+                _lead_store = LeadStore(LEADS_DB_PATH, legacy_json_path=LEADS_JSON_PATH)
+    return _lead_store
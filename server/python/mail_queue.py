@@ -0,0 +1,262 @@
+import os
+import time
+import queue
+import random
+import smtplib
+import threading
+from email.message import EmailMessage
+from typing import Any, Dict, List, Optional
+
+from latency_stats import LatencyTracker
+
+
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASS = os.getenv("SMTP_PASS")
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER or "no-reply@matex.local")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").strip().lower() in ("1", "true", "yes", "on")
+SMTP_TIMEOUT_S = float(os.getenv("SMTP_TIMEOUT_S", "10"))
+# Messages waiting to be sent; submit() refuses new mail beyond this
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "1000"))
+# Sender threads, each with its own persistent SMTP connection
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "2"))
+# Messages sent back to back on one connection before going back to the queue
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", "3"))
+MAIL_RETRY_BASE_S = float(os.getenv("MAIL_RETRY_BASE_S", "1"))
+MAIL_RETRY_MAX_S = float(os.getenv("MAIL_RETRY_MAX_S", "30"))
+# Connections idle this long are closed (relays drop idle clients after a few minutes)
+MAIL_IDLE_CLOSE_S = float(os.getenv("MAIL_IDLE_CLOSE_S", "60"))
+# Connections idle this long are checked with NOOP before the next batch
+MAIL_NOOP_AFTER_S = float(os.getenv("MAIL_NOOP_AFTER_S", "10"))
+
+
+class MailQueueFull(Exception):
+    """The outbound queue is at MAIL_QUEUE_SIZE."""
+
+
+def smtp_configured() -> bool:
+    return bool(SMTP_HOST and SMTP_USER and SMTP_PASS)
+
+
+def _is_transient(error: Exception) -> bool:
+    """Connection problems and 4xx replies are worth retrying; 5xx replies are not."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+
+class _Sender:
+    """One worker's SMTP connection: opened on demand, kept authenticated between sends."""
+
+    def __init__(self, dispatcher: "MailDispatcher"):
+        self.dispatcher = dispatcher
+        self.smtp: Optional[smtplib.SMTP] = None
+        self.last_used = 0.0
+
+    def connection(self) -> smtplib.SMTP:
+        d = self.dispatcher
+        if self.smtp is not None and time.monotonic() - self.last_used > d.noop_after_s:
+            try:
+                if self.smtp.noop()[0] != 250:
+                    self.close()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+        if self.smtp is None:
+            smtp = smtplib.SMTP(d.host, d.port, timeout=d.timeout_s)
+            try:
+                if d.starttls:
+                    smtp.starttls()
+                if d.user and d.password:
+                    smtp.login(d.user, d.password)
+            except Exception:
+                smtp.close()
+                raise
+            self.smtp = smtp
+            d._count('connections_opened')
+        return self.smtp
+
+    def send(self, message: EmailMessage) -> None:
+        self.connection().send_message(message)
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.smtp.close()
+            self.smtp = None
+
+
+class MailDispatcher:
+    """
+    Background outbound mail over a small pool of persistent SMTP connections.
+
+    submit() only enqueues, so request handlers never wait on the relay. Each
+    of `workers` threads owns one connection: STARTTLS and login happen once,
+    and the worker then sends up to `batch_size` queued messages back to back
+    on it. Connections idle for `noop_after_s` are checked with NOOP before
+    reuse and closed after `idle_close_s`. Transient failures (disconnects,
+    timeouts, 4xx) reconnect and retry with capped exponential backoff and
+    full jitter; permanent ones (5xx) are dropped and counted.
+    """
+
+    def __init__(self, host: Optional[str] = SMTP_HOST, port: int = SMTP_PORT, user: Optional[str] = SMTP_USER,
+                 password: Optional[str] = SMTP_PASS, starttls: bool = SMTP_STARTTLS,
+                 timeout_s: float = SMTP_TIMEOUT_S, queue_size: int = MAIL_QUEUE_SIZE,
+                 workers: int = MAIL_WORKERS, batch_size: int = MAIL_BATCH_SIZE,
+                 max_retries: int = MAIL_MAX_RETRIES, retry_base_s: float = MAIL_RETRY_BASE_S,
+                 retry_max_s: float = MAIL_RETRY_MAX_S, idle_close_s: float = MAIL_IDLE_CLOSE_S,
+                 noop_after_s: float = MAIL_NOOP_AFTER_S):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout_s = timeout_s
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max(0, max_retries)
+        self.retry_base_s = retry_base_s
+        self.retry_max_s = retry_max_s
+        self.idle_close_s = idle_close_s
+        self.noop_after_s = noop_after_s
+        # (enqueued_at, message), or None to stop a worker
+        self.queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max(1, queue_size))
+        self.latency = LatencyTracker()
+        self._threads: List[threading.Thread] = []
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            'submitted': 0,
+            'sent': 0,
+            'failed': 0,
+            'retries': 0,
+            'rejected': 0,
+            'batches': 0,
+            'connections_opened': 0,
+            'max_depth': 0,
+            'last_error': None,
+        }
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += n
+
+    def start(self) -> None:
+        """Start the worker threads (again after a fork: threads do not survive it)."""
+        with self._lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            threads = self._threads = [threading.Thread(target=self._run, name=f"mail-{i}", daemon=True)
+                                       for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+    def submit(self, message: EmailMessage) -> None:
+        """Queue a message for delivery; raises MailQueueFull instead of blocking."""
+        self.start()
+        try:
+            self.queue.put_nowait((time.monotonic(), message))
+        except queue.Full:
+            self._count('rejected')
+            raise MailQueueFull(f"Mail queue is full ({self.queue.maxsize} messages)")
+        depth = self.queue.qsize()
+        with self._lock:
+            self.stats['submitted'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], depth)
+
+    def _retry_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.retry_max_s, self.retry_base_s * (2 ** attempt)))
+
+    def _deliver(self, sender: _Sender, enqueued_at: float, message: EmailMessage) -> None:
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                sender.send(message)
+                break
+            except Exception as e:
+                sender.close()
+                if attempt >= self.max_retries or not _is_transient(e):
+                    with self._lock:
+                        self.stats['failed'] += 1
+                        self.stats['last_error'] = f"{type(e).__name__}: {e}"
+                    print(f"[MAIL] Giving up on message to {message['To']}: {type(e).__name__}: {e}")
+                    return
+                delay = self._retry_delay(attempt)
+                attempt += 1
+                self._count('retries')
+                print(f"[MAIL] Send failed ({type(e).__name__}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+        self._count('sent')
+        # Recorded as (time waiting in the queue, time from submit to accepted by the relay)
+        self.latency.record("smtp", (started - enqueued_at) * 1000.0, (time.monotonic() - enqueued_at) * 1000.0)
+
+    def _run(self) -> None:
+        sender = _Sender(self)
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.idle_close_s if sender.smtp is not None else None)
+                except queue.Empty:
+                    sender.close()  # idle: let the relay's connection go
+                    continue
+                batch = [item]
+                while item is not None and len(batch) < self.batch_size:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+                self._count('batches')
+                for entry in batch:
+                    if entry is None:
+                        return
+                    self._deliver(sender, *entry)
+        finally:
+            sender.close()
+
+    def stop(self, timeout_s: float = 10.0) -> None:
+        """Send what is queued, then stop the workers and close their connections."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if self._pid != os.getpid():
+            return
+        for _ in threads:
+            self.queue.put(None)
+        deadline = time.monotonic() + timeout_s
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        latency = self.latency.snapshot().get('smtp')
+        return {
+            **stats,
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'workers': self.workers,
+            'latency': latency and {'count': latency['count'], 'queue_wait_ms': latency['ttfb_ms'],
+                                    'total_ms': latency['total_ms']},
+        }
+
+
+_mail_dispatcher: Optional[MailDispatcher] = None
+_mail_dispatcher_lock = threading.Lock()
+
+
+def get_mail_dispatcher() -> MailDispatcher:
+    """Get or create the process-wide dispatcher (workers start on the first submit)."""
+    global _mail_dispatcher
+    if _mail_dispatcher is None:
+        with _mail_dispatcher_lock:
+            if _mail_dispatcher is None:
+                _mail_dispatcher = MailDispatcher()
+    return _mail_dispatcher
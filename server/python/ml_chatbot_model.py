@@ -1,17 +1,15 @@
 import os
 import json
+import time
 import pickle
 import numpy as np
-import pandas as pd
-from typing import Dict, List, Tuple, Optional, Any
+import threading
+from typing import Dict, List, Tuple, Optional, Any, Callable, NamedTuple
 from datetime import datetime
 import re
 
 # ML Libraries
 from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.linear_model import LogisticRegression
-from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split, cross_val_score
 from sklearn.metrics import classification_report, accuracy_score, confusion_matrix
 from sklearn.preprocessing import LabelEncoder
@@ -23,16 +21,60 @@ import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
-from textblob import TextBlob
 
-# Download required NLTK data
-try:
-    nltk.download('punkt', quiet=True)
-    nltk.download('stopwords', quiet=True)
-    nltk.download('wordnet', quiet=True)
-    nltk.download('vader_lexicon', quiet=True)
-except:
-    pass
+from text_normalizer import TextNormalizer
+from classifier_backends import (
+    CLASSIFIER_BACKENDS, DEFAULT_BACKEND, ML_BACKEND, ML_LATENCY_BUDGET_MS,
+    build_pipeline, enabled_backends, measure_latency, artifact_size,
+    select_backend
+)
+from online_learner import OnlineLearner
+from model_registry import ModelRegistry
+from training_log import TrainingExampleLog
+from result_cache import ResultCache
+import text_features
+from text_features import LazyFeatures
+
+# Memory-map numpy arrays of loaded classifiers (faster load, pages shared between workers)
+ML_MMAP_LOAD = os.getenv("ML_MMAP_LOAD", "true").lower() == "true"
+ML_VERIFY_CHECKSUMS = os.getenv("ML_VERIFY_CHECKSUMS", "true").lower() == "true"
+# How often running workers check the CURRENT pointer for a new version
+ML_MODEL_RELOAD_SECONDS = float(os.getenv("ML_MODEL_RELOAD_SECONDS", "5"))
+# Batch learning mode: feedback examples since the last rebuild that trigger a retrain
+ML_RETRAIN_AFTER_FEEDBACK = int(os.getenv("ML_RETRAIN_AFTER_FEEDBACK", "10"))
+
+# Fetch missing NLTK data in ensure_nltk_data() (never at import time)
+ML_NLTK_DOWNLOAD = os.getenv("ML_NLTK_DOWNLOAD", "true").lower() == "true"
+NLTK_RESOURCES = {
+    'punkt': 'tokenizers/punkt',
+    'stopwords': 'corpora/stopwords',
+    'wordnet': 'corpora/wordnet',
+    'vader_lexicon': 'sentiment/vader_lexicon'
+}
+
+
+def ensure_nltk_data() -> Dict[str, bool]:
+    """Download required NLTK data that is not installed yet."""
+    status = {}
+    for package, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+            status[package] = True
+            continue
+        except LookupError:
+            pass
+        try:
+            status[package] = bool(ML_NLTK_DOWNLOAD and nltk.download(package, quiet=True))
+        except Exception:
+            status[package] = False
+    return status
+
+class ServingModel(NamedTuple):
+    """Everything predictions read, published together with one reference swap."""
+    classifier: Any
+    label_encoder: LabelEncoder
+    backend: str
+
 
 class ChatbotMLModel:
     """
@@ -44,6 +86,12 @@ class ChatbotMLModel:
         self.model_dir = model_dir
         os.makedirs(model_dir, exist_ok=True)
         
+        # Versioned artifacts (versions/<id>/ + CURRENT pointer)
+        self.registry = ModelRegistry(model_dir)
+        self.loaded_version: Optional[str] = None
+        self._version_lock = threading.RLock()
+        self._reload_thread: Optional[threading.Thread] = None
+        
         # Initialize components
         self.vectorizer = TfidfVectorizer(
             max_features=5000,
@@ -53,17 +101,27 @@ class ChatbotMLModel:
             max_df=0.95
         )
         
-        self.classifier = Pipeline([
-            ('tfidf', TfidfVectorizer(max_features=5000, stop_words='english', ngram_range=(1, 2))),
-            ('classifier', RandomForestClassifier(n_estimators=100, random_state=42))
-        ])
+        # Classifier backend (see classifier_backends.py); the trained backend is
+        # picked from measured p99 latency against ML_LATENCY_BUDGET_MS
+        backend = ML_BACKEND if ML_BACKEND in CLASSIFIER_BACKENDS else DEFAULT_BACKEND
+        self.serving = ServingModel(build_pipeline(backend), LabelEncoder(), backend)
+        self._publish_lock = threading.Lock()
+        # Bumped on every publish/swap; stamps cached predictions (see model_stamp)
+        self.serving_generation = 0
+        self.prediction_cache = ResultCache('predict_category')
+        self.feature_cache = ResultCache('extract_features')
+        self.backend_pipelines: Dict[str, Pipeline] = {}
         
-        self.label_encoder = LabelEncoder()
         self.stemmer = PorterStemmer()
         self.lemmatizer = WordNetLemmatizer()
+        self.normalizer = TextNormalizer(stemmer=self.stemmer, lemmatizer=self.lemmatizer)
         
-        # Training data storage
-        self.training_data = []
+        # Training data storage: append-only JSONL log (training_data.json is
+        # migrated on first start)
+        self.training_data = TrainingExampleLog(
+            os.path.join(model_dir, 'training_data.jsonl'),
+            legacy_json_path=os.path.join(model_dir, 'training_data.json')
+        )
         self.response_templates = {}
         self.category_keywords = {}
         
@@ -75,79 +133,65 @@ class ChatbotMLModel:
             'version': '1.0'
         }
         
+        # Applies feedback with partial_fit between full rebuilds
+        self.online_learner = OnlineLearner(self)
+        # Labelled feedback recorded since the last rebuild (batch learning mode)
+        self.feedback_since_train = 0
+        
         # Load existing models if available
         self.load_models()
         
+    # Predictions read `self.serving` once; these accessors keep the old
+    # attribute names working on top of the published snapshot.
+    @property
+    def classifier(self) -> Any:
+        return self.serving.classifier
+    
+    @property
+    def label_encoder(self) -> LabelEncoder:
+        return self.serving.label_encoder
+    
+    @property
+    def backend(self) -> str:
+        return self.serving.backend
+    
+    def publish(self, serving: ServingModel):
+        """Atomically replace the model used for predictions."""
+        with self._publish_lock:
+            self.serving = serving
+            self.serving_generation += 1
+    
+    def swap_classifier(self, expected: Any, classifier: Any) -> bool:
+        """Replace the classifier only if it is still `expected` (compare-and-swap)."""
+        with self._publish_lock:
+            if self.serving.classifier is not expected:
+                return False
+            self.serving = self.serving._replace(classifier=classifier)
+            self.serving_generation += 1
+            return True
+    
+    def model_stamp(self) -> Tuple[Optional[str], int]:
+        """Identifies the served model; changes on load, retrain, rollback and online updates."""
+        with self._publish_lock:
+            return self.loaded_version, self.serving_generation
+    
     def preprocess_text(self, text: str) -> str:
         """Preprocess text for ML model training."""
-        if not text:
-            return ""
-            
-        # Convert to lowercase
-        text = text.lower()
-        
-        # Remove special characters and digits
-        text = re.sub(r'[^a-zA-Z\s]', '', text)
-        
-        # Tokenize and remove stop words
-        try:
-            tokens = word_tokenize(text)
-            stop_words = set(stopwords.words('english'))
-            tokens = [token for token in tokens if token not in stop_words]
-            
-            # Stemming and lemmatization
-            tokens = [self.stemmer.stem(self.lemmatizer.lemmatize(token)) for token in tokens]
-            
-            return ' '.join(tokens)
-        except:
-            return text
+        # Lowercase, strip non-letters, drop stop words, lemmatize and stem
+        # (memoized per token, see TextNormalizer)
+        return self.normalizer.normalize(text)
     
     def extract_features(self, text: str) -> Dict[str, Any]:
-        """Extract features from text for ML model."""
-        features = {}
-        
-        # Basic text features
-        features['length'] = len(text)
-        features['word_count'] = len(text.split())
-        features['char_count'] = len(text)
-        
-        # Sentiment analysis
-        try:
-            blob = TextBlob(text)
-            features['sentiment_polarity'] = blob.sentiment.polarity
-            features['sentiment_subjectivity'] = blob.sentiment.subjectivity
-        except:
-            features['sentiment_polarity'] = 0.0
-            features['sentiment_subjectivity'] = 0.0
-        
-        # Question indicators
-        features['is_question'] = 1 if '?' in text else 0
-        features['has_what'] = 1 if 'what' in text.lower() else 0
-        features['has_how'] = 1 if 'how' in text.lower() else 0
-        features['has_why'] = 1 if 'why' in text.lower() else 0
-        features['has_when'] = 1 if 'when' in text.lower() else 0
-        features['has_where'] = 1 if 'where' in text.lower() else 0
-        
-        # Technology keywords
-        tech_keywords = [
-            'ai', 'machine learning', 'software', 'development', 'mobile', 'web',
-            'cloud', 'cybersecurity', 'programming', 'coding', 'react', 'python',
-            'javascript', 'java', 'database', 'api', 'frontend', 'backend'
-        ]
-        
-        for keyword in tech_keywords:
-            features[f'has_{keyword.replace(" ", "_")}'] = 1 if keyword in text.lower() else 0
-        
-        # Business keywords
-        business_keywords = [
-            'price', 'cost', 'service', 'company', 'contact', 'project', 'consultation',
-            'team', 'solution', 'help', 'support', 'meeting', 'schedule'
-        ]
-        
-        for keyword in business_keywords:
-            features[f'has_{keyword}'] = 1 if keyword in text.lower() else 0
-        
-        return features
+        """Extract features from text for ML model (cached per exact text)."""
+        return self.feature_cache.get_or_compute(text, None, lambda: self._extract_features(text))
+    
+    def _extract_features(self, text: str) -> Dict[str, Any]:
+        # One automaton pass for all keyword/question flags, lexicon sentiment
+        return text_features.extract_features(text)
+
+    def extract_features_batch(self, texts: List[str]) -> np.ndarray:
+        """Feature matrix for many texts, columns in text_features.FEATURE_NAMES order."""
+        return text_features.extract_feature_matrix(texts)
     
     def create_training_data_from_responses(self, response_categories: Dict) -> List[Tuple[str, str]]:
         """Create training data from response categories."""
@@ -217,9 +261,19 @@ class ChatbotMLModel:
         
         return key_phrases
     
-    def train_model(self, response_categories: Dict, additional_data: List[Tuple[str, str]] = None) -> Dict[str, Any]:
-        """Train the ML model on response categories and additional data."""
+    def train_model(self, response_categories: Dict, additional_data: List[Tuple[str, str]] = None,
+                    progress: Optional[Callable[[str, float], None]] = None) -> Dict[str, Any]:
+        """
+        Train the ML model on response categories and additional data.
+        
+        The new model is built off to the side and published with a single
+        swap at the end, so concurrent predictions never see a partial model.
+        `progress(stage, fraction)` is called as training advances.
+        """
+        report_progress = progress or (lambda stage, fraction: None)
         print("Starting ML model training...")
+        feedback_included = self.feedback_since_train
+        report_progress('preparing_data', 0.0)
         
         # Create training data
         training_data = self.create_training_data_from_responses(response_categories)
@@ -244,47 +298,100 @@ class ChatbotMLModel:
         texts, labels = zip(*valid_data)
         
         # Encode labels
-        encoded_labels = self.label_encoder.fit_transform(labels)
+        label_encoder = LabelEncoder()
+        encoded_labels = label_encoder.fit_transform(labels)
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
             texts, encoded_labels, test_size=0.2, random_state=42, stratify=encoded_labels
         )
         
-        # Train model
-        self.classifier.fit(X_train, y_train)
+        # Train and benchmark every enabled backend on the same split
+        backend_metrics: Dict[str, Dict[str, Any]] = {}
+        trained: Dict[str, Pipeline] = {}
+        backend_names = enabled_backends() or [DEFAULT_BACKEND]
+        for i, name in enumerate(backend_names):
+            report_progress(f'training_{name}', 0.1 + 0.8 * i / len(backend_names))
+            try:
+                pipeline = build_pipeline(name)
+                start = time.perf_counter()
+                pipeline.fit(X_train, y_train)
+                train_seconds = time.perf_counter() - start
+                
+                backend_metrics[name] = {
+                    'accuracy': float(accuracy_score(y_test, pipeline.predict(X_test))),
+                    **measure_latency(pipeline, list(X_test)),
+                    'artifact_bytes': artifact_size(pipeline),
+                    'train_seconds': round(train_seconds, 3)
+                }
+                trained[name] = pipeline
+                print(f"  {name}: accuracy={backend_metrics[name]['accuracy']:.3f} "
+                      f"p50={backend_metrics[name]['p50_ms']:.2f}ms p99={backend_metrics[name]['p99_ms']:.2f}ms "
+                      f"size={backend_metrics[name]['artifact_bytes']}B")
+            except Exception as e:
+                print(f"Backend {name} failed to train: {e}")
+        
+        if not trained:
+            return {'error': 'No classifier backend could be trained'}
+        
+        # Pick the backend for the configured latency budget; online learning
+        # applies feedback with partial_fit only if that backend supports it
+        backend = select_backend(backend_metrics)
+        classifier = trained[backend]
         
         # Evaluate model
-        y_pred = self.classifier.predict(X_test)
-        accuracy = accuracy_score(y_test, y_pred)
+        y_pred = classifier.predict(X_test)
+        accuracy = backend_metrics[backend]['accuracy']
+        
+        # Generate classification report
+        report = classification_report(y_test, y_pred, target_names=label_encoder.classes_, output_dict=True)
         
-        # Update metrics
-        self.model_metrics.update({
+        # Publish: metrics first, then the serving snapshot in one swap
+        self.model_metrics = {
+            **self.model_metrics,
             'accuracy': float(accuracy),
             'last_trained': datetime.now().isoformat(),
             'training_samples': len(training_data),
-            'version': '1.0'
-        })
-        
-        # Generate classification report
-        report = classification_report(y_test, y_pred, target_names=self.label_encoder.classes_, output_dict=True)
+            'version': '1.0',
+            'backend': backend,
+            'latency_budget_ms': ML_LATENCY_BUDGET_MS,
+            'backends': backend_metrics
+        }
+        self.backend_pipelines = trained
+        self.publish(ServingModel(classifier, label_encoder, backend))
+        self.online_learner.mark_rebuilt()
+        self.feedback_since_train = max(0, self.feedback_since_train - feedback_included)
         
-        print(f"Model trained successfully! Accuracy: {accuracy:.3f}")
+        print(f"Model trained successfully! Backend: {backend}, accuracy: {accuracy:.3f}")
         print(f"Training samples: {len(training_data)}")
         
         # Save models
+        report_progress('saving', 0.9)
         self.save_models()
+        report_progress('done', 1.0)
         
         return {
             'accuracy': float(accuracy),
+            'backend': backend,
+            'backends': backend_metrics,
             'training_samples': len(training_data),
             'classification_report': report,
-            'categories': list(self.label_encoder.classes_)
+            'categories': list(label_encoder.classes_)
         }
     
-    def predict_category(self, text: str) -> Tuple[str, float]:
+    def predict_category(self, text: str, use_cache: bool = True) -> Tuple[str, float]:
         """Predict the category for given text."""
-        if not hasattr(self.classifier, 'predict_proba'):
+        if not use_cache:
+            return self._predict_category(text)
+        # preprocess_text() only sees lowercase letters and word boundaries, so
+        # texts that agree on those always get the same prediction
+        key = ' '.join(re.sub(r'[^a-z\s]', '', (text or '').lower()).split())
+        return self.prediction_cache.get_or_compute(key, self.model_stamp(),
+                                                    lambda: self._predict_category(text))
+    
+    def _predict_category(self, text: str) -> Tuple[str, float]:
+        serving = self.serving
+        if not hasattr(serving.classifier, 'predict_proba'):
             return 'unknown', 0.0
         
         try:
@@ -293,18 +400,52 @@ class ChatbotMLModel:
                 return 'unknown', 0.0
             
             # Get prediction probabilities
-            probabilities = self.classifier.predict_proba([processed_text])[0]
+            probabilities = serving.classifier.predict_proba([processed_text])[0]
             max_prob_idx = np.argmax(probabilities)
             max_prob = probabilities[max_prob_idx]
             
             # Get category name
-            category = self.label_encoder.inverse_transform([max_prob_idx])[0]
+            category = serving.label_encoder.inverse_transform([max_prob_idx])[0]
             
             return category, float(max_prob)
         except Exception as e:
             print(f"Prediction error: {e}")
             return 'unknown', 0.0
-    
+
+    def predict_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Predict categories for many texts with one vectorizer/classifier pass."""
+        results = [
+            {'predicted_category': 'unknown', 'confidence': 0.0, 'confidence_level': 'very_low'}
+            for _ in texts
+        ]
+        serving = self.serving
+        if not texts or not hasattr(serving.classifier, 'predict_proba'):
+            return results
+
+        try:
+            processed = [self.preprocess_text(text) for text in texts]
+            rows = [i for i, text in enumerate(processed) if text.strip()]
+            if not rows:
+                return results
+
+            # Single TF-IDF transform and predict_proba call for the whole batch
+            probabilities = serving.classifier.predict_proba([processed[i] for i in rows])
+            best_idx = np.argmax(probabilities, axis=1)
+            best_prob = probabilities[np.arange(len(rows)), best_idx]
+            categories = serving.label_encoder.inverse_transform(best_idx)
+
+            for i, category, prob in zip(rows, categories, best_prob):
+                confidence = float(prob)
+                results[i] = {
+                    'predicted_category': category,
+                    'confidence': confidence,
+                    'confidence_level': self.get_confidence_level(confidence)
+                }
+        except Exception as e:
+            print(f"Batch prediction error: {e}")
+
+        return results
+
     def get_confidence_level(self, confidence: float) -> str:
         """Convert confidence score to human-readable level."""
         if confidence >= 0.8:
@@ -344,56 +485,181 @@ class ChatbotMLModel:
             'predicted_category': predicted_category,
             'confidence': confidence,
             'confidence_level': confidence_level,
-            'features': self.extract_features(text)
+            'features': LazyFeatures(lambda: self.extract_features(text))
         }
     
+    def save_classifier(self):
+        """Snapshot the served classifier and metrics as a new version (after online updates)."""
+        with self._version_lock:
+            try:
+                self.model_metrics['online_learning'] = self.online_learner.get_stats()
+                version = self.registry.commit(
+                    {'classifier.pkl': self.classifier, 'metrics.json': self.model_metrics},
+                    info={'source': 'online', 'backend': self.backend,
+                          'accuracy': self.model_metrics.get('accuracy')},
+                    link_from=self.loaded_version
+                )
+                self.loaded_version = version
+            except Exception as e:
+                print(f"Error saving classifier: {e}")
+    
     def save_models(self):
-        """Save trained models to disk."""
-        try:
-            # Save classifier
-            joblib.dump(self.classifier, os.path.join(self.model_dir, 'classifier.pkl'))
-            
-            # Save label encoder
-            joblib.dump(self.label_encoder, os.path.join(self.model_dir, 'label_encoder.pkl'))
-            
-            # Save metrics
-            with open(os.path.join(self.model_dir, 'metrics.json'), 'w') as f:
-                json.dump(self.model_metrics, f, indent=2)
-            
-            # Save training data
-            with open(os.path.join(self.model_dir, 'training_data.json'), 'w') as f:
-                json.dump(self.training_data, f, indent=2)
-            
-            print(f"Models saved to {self.model_dir}")
-        except Exception as e:
-            print(f"Error saving models: {e}")
+        """Save trained models to disk as a new immutable version."""
+        serving = self.serving
+        with self._version_lock:
+            try:
+                files: Dict[str, Any] = {
+                    'classifier.pkl': serving.classifier,
+                    'label_encoder.pkl': serving.label_encoder,
+                    # Stop words + token cache so predictions skip NLTK warm-up
+                    'normalizer.pkl': self.normalizer,
+                    'metrics.json': self.model_metrics
+                }
+                # Every trained backend, so the server can switch on its latency budget
+                for name, pipeline in self.backend_pipelines.items():
+                    files[f'backends/{name}.pkl'] = pipeline
+                
+                version = self.registry.commit(files, info={
+                    'source': 'train',
+                    'backend': serving.backend,
+                    'accuracy': self.model_metrics.get('accuracy'),
+                    'training_samples': self.model_metrics.get('training_samples')
+                })
+                self.loaded_version = version
+                
+                print(f"Models saved to {self.model_dir} (version {version})")
+            except Exception as e:
+                print(f"Error saving models: {e}")
+    
+    def _load_version(self, version: str, verify: bool = ML_VERIFY_CHECKSUMS):
+        """Load a registry version and publish it; records the load time."""
+        start = time.perf_counter()
+        if verify and not self.registry.verify(version):
+            raise ValueError(f"Model version {version} failed checksum verification")
+        
+        mmap_mode = 'r' if ML_MMAP_LOAD else None
+        with open(self.registry.path(version, 'metrics.json'), 'r') as f:
+            metrics = json.load(f)
+        label_encoder = joblib.load(self.registry.path(version, 'label_encoder.pkl'))
+        normalizer_path = self.registry.path(version, 'normalizer.pkl')
+        normalizer = joblib.load(normalizer_path) if os.path.exists(normalizer_path) else self.normalizer
+        
+        # classifier.pkl holds the backend selected at training time; only the
+        # backend actually served is unpickled
+        backend = metrics.get('backend', DEFAULT_BACKEND)
+        classifier_path = self.registry.path(version, 'classifier.pkl')
+        selected = select_backend(metrics.get('backends', {}))
+        if selected and selected != backend:
+            backend_path = self.registry.path(version, f'backends/{selected}.pkl')
+            if os.path.exists(backend_path):
+                classifier_path, backend = backend_path, selected
+                print(f"Using ML backend {selected} for latency budget {ML_LATENCY_BUDGET_MS}ms")
+        classifier = joblib.load(classifier_path, mmap_mode=mmap_mode)
+        
+        self.normalizer = normalizer
+        self.stemmer = normalizer.stemmer
+        self.lemmatizer = normalizer.lemmatizer
+        self.model_metrics = metrics
+        self.backend_pipelines = {}
+        self.publish(ServingModel(classifier, label_encoder, backend))
+        self.loaded_version = version
+        
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self.registry.record_load(version, elapsed_ms)
+        print(f"Loaded ML model version {version} in {elapsed_ms:.1f}ms")
+    
+    def _load_legacy_models(self):
+        """Load the pre-registry flat layout (classifier.pkl etc. in model_dir)."""
+        classifier_path = os.path.join(self.model_dir, 'classifier.pkl')
+        encoder_path = os.path.join(self.model_dir, 'label_encoder.pkl')
+        normalizer_path = os.path.join(self.model_dir, 'normalizer.pkl')
+        metrics_path = os.path.join(self.model_dir, 'metrics.json')
+        
+        classifier, label_encoder = self.serving.classifier, self.serving.label_encoder
+        if os.path.exists(classifier_path) and os.path.exists(encoder_path):
+            classifier = joblib.load(classifier_path)
+            label_encoder = joblib.load(encoder_path)
+            print("Loaded existing ML models")
+        
+        if os.path.exists(normalizer_path):
+            self.normalizer = joblib.load(normalizer_path)
+            self.stemmer = self.normalizer.stemmer
+            self.lemmatizer = self.normalizer.lemmatizer
+        
+        if os.path.exists(metrics_path):
+            with open(metrics_path, 'r') as f:
+                self.model_metrics = json.load(f)
+        
+        backend = self.model_metrics.get('backend', DEFAULT_BACKEND)
+        self.publish(ServingModel(classifier, label_encoder, backend))
     
     def load_models(self):
         """Load trained models from disk."""
         try:
-            classifier_path = os.path.join(self.model_dir, 'classifier.pkl')
-            encoder_path = os.path.join(self.model_dir, 'label_encoder.pkl')
-            metrics_path = os.path.join(self.model_dir, 'metrics.json')
-            training_data_path = os.path.join(self.model_dir, 'training_data.json')
-            
-            if os.path.exists(classifier_path) and os.path.exists(encoder_path):
-                self.classifier = joblib.load(classifier_path)
-                self.label_encoder = joblib.load(encoder_path)
-                print("Loaded existing ML models")
-            
-            if os.path.exists(metrics_path):
-                with open(metrics_path, 'r') as f:
-                    self.model_metrics = json.load(f)
-            
-            if os.path.exists(training_data_path):
-                with open(training_data_path, 'r') as f:
-                    self.training_data = json.load(f)
-            
+            with self._version_lock:
+                version = self.registry.current_version()
+                if version:
+                    self._load_version(version)
+                else:
+                    self._load_legacy_models()
         except Exception as e:
             print(f"Error loading models: {e}")
     
+    def rollback(self, version: Optional[str] = None) -> Dict[str, Any]:
+        """Activate an earlier version (default: the one before the current)."""
+        with self._version_lock:
+            target = version or self.registry.previous_version()
+            if not target:
+                raise ValueError("No earlier model version to roll back to")
+            if not self.registry.verify(target):
+                raise ValueError(f"Model version {target} failed checksum verification")
+            previous = self.loaded_version
+            self._load_version(target, verify=False)
+            self.registry.set_current(target)
+            return {
+                'version': target,
+                'previous_version': previous,
+                'load_ms': self.registry.load_times_ms.get(target)
+            }
+    
+    def reload_if_changed(self) -> bool:
+        """Load the version CURRENT points at if it differs from the loaded one."""
+        version = self.registry.current_version()
+        if not version or version == self.loaded_version:
+            return False
+        with self._version_lock:
+            if self.registry.current_version() != version or version == self.loaded_version:
+                return False
+            self._load_version(version)
+            return True
+    
+    def start_reload_watcher(self, interval: float = ML_MODEL_RELOAD_SECONDS):
+        """Poll the CURRENT pointer and hot-swap new versions in the background."""
+        if interval <= 0 or (self._reload_thread and self._reload_thread.is_alive()):
+            return
+        
+        def _watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    print(f"Model reload error: {e}")
+        
+        self._reload_thread = threading.Thread(target=_watch, name="ml-model-reload", daemon=True)
+        self._reload_thread.start()
+    
+    def list_versions(self) -> Dict[str, Any]:
+        """Registry versions plus what this process has loaded."""
+        return {
+            'current': self.registry.current_version(),
+            'loaded': self.loaded_version,
+            'versions': self.registry.list_versions()
+        }
+    
     def add_training_example(self, text: str, category: str, response: str = None):
-        """Add a new training example for continuous learning."""
+        """Add a new training example for continuous learning; raises if it could not be stored."""
+        # Durable append (group-committed fsync), no full-file rewrite
         self.training_data.append({
             'text': text,
             'category': category,
@@ -401,43 +667,76 @@ class ChatbotMLModel:
             'timestamp': datetime.now().isoformat()
         })
         
-        # Save updated training data
-        try:
-            with open(os.path.join(self.model_dir, 'training_data.json'), 'w') as f:
-                json.dump(self.training_data, f, indent=2)
-        except Exception as e:
-            print(f"Error saving training data: {e}")
+        # Reach the live model within seconds via partial_fit (online mode)
+        if category and category != 'unknown':
+            self.feedback_since_train += 1
+            self.online_learner.submit(text, category)
+    
+    def get_feedback_examples(self) -> List[Tuple[str, str]]:
+        """Labelled feedback examples for a full rebuild."""
+        return [
+            (item['text'], item['category']) for item in self.training_data
+            if isinstance(item, dict) and item.get('text') and item.get('category')
+            and item['category'] != 'unknown'
+        ]
     
     def retrain_with_feedback(self, text: str, correct_category: str, user_satisfaction: float):
-        """Retrain model with user feedback."""
+        """
+        Record feedback and report whether a full rebuild is due. The rebuild
+        itself is a training job queued by the caller, never run in the request.
+        """
         # Add the feedback as training data
         self.add_training_example(text, correct_category)
         
-        # If we have enough new data, retrain the model
-        if len([item for item in self.training_data if isinstance(item, dict) and 'timestamp' in item]) > 10:
-            print("Retraining model with new feedback data...")
-            # Convert to training format
-            new_training_data = [(item['text'], item['category']) for item in self.training_data if isinstance(item, dict)]
-            return self.train_model({}, new_training_data)
-        
-        return {'message': 'Feedback recorded, will retrain when enough data is available'}
+        # Online mode: the example is applied incrementally, a full rebuild
+        # only happens on demand (POST /api/ml/train)
+        if self.online_learner.is_enabled():
+            return {
+                'message': 'Feedback queued for incremental update',
+                'online_learning': self.online_learner.get_stats()
+            }
+        
+        # Enough new examples since the last rebuild: retrain in the background
+        if self.feedback_since_train >= ML_RETRAIN_AFTER_FEEDBACK:
+            return {'message': 'Feedback recorded, retraining', 'retrain_due': True,
+                    'feedback_since_train': self.feedback_since_train}
+        
+        return {'message': 'Feedback recorded, will retrain when enough data is available', 'retrain_due': False,
+                'feedback_since_train': self.feedback_since_train}
     
     def get_model_status(self) -> Dict[str, Any]:
         """Get current model status and metrics."""
+        serving = self.serving
         return {
             'metrics': self.model_metrics,
-            'is_trained': hasattr(self.classifier, 'predict_proba'),
-            'categories': list(self.label_encoder.classes_) if hasattr(self.label_encoder, 'classes_') else [],
-            'training_data_count': len(self.training_data)
+            'backend': serving.backend,
+            'model_version': self.loaded_version,
+            'is_trained': hasattr(serving.classifier, 'predict_proba'),
+            'categories': list(serving.label_encoder.classes_) if hasattr(serving.label_encoder, 'classes_') else [],
+            'training_data_count': len(self.training_data),
+            'training_log': self.training_data.get_stats(),
+            'online_learning': self.online_learner.get_stats(),
+            'normalizer': self.normalizer.get_stats(),
+            'result_cache': self.get_cache_stats()
+        }
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Hit rates and memory use of the prediction and feature caches."""
+        return {
+            'predict_category': self.prediction_cache.get_stats(),
+            'extract_features': self.feature_cache.get_stats()
         }
 
 
 # Initialize global ML model instance
 ml_model = None
+_ml_model_lock = threading.Lock()
 
 def get_ml_model() -> ChatbotMLModel:
     """Get or create the global ML model instance."""
     global ml_model
     if ml_model is None:
-        ml_model = ChatbotMLModel()
+        with _ml_model_lock:
+            if ml_model is None:
+                ml_model = ChatbotMLModel()
     return ml_model
@@ -0,0 +1,226 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import joblib
+
+
+# Retention per class: training runs and online-learning snapshots are pruned
+# separately, so frequent snapshots never push trained versions out
+ML_MODEL_KEEP_VERSIONS = int(os.getenv("ML_MODEL_KEEP_VERSIONS", "20"))
+ML_MODEL_KEEP_ONLINE_VERSIONS = int(os.getenv("ML_MODEL_KEEP_ONLINE_VERSIONS", "20"))
+
+POINTER_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+def _fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Versioned, immutable model artifacts.
+
+    Layout under `root`:
+        versions/<id>/manifest.json   files with sha256 + size, source, parent
+        versions/<id>/...             classifier.pkl, label_encoder.pkl, ...
+        CURRENT                       id of the active version
+
+    A version is written into a staging directory and renamed into place, and
+    CURRENT is replaced atomically, so a crash never leaves a half-written model
+    active.
+    """
+
+    def __init__(self, root: str, keep_versions: int = ML_MODEL_KEEP_VERSIONS,
+                 keep_online_versions: int = ML_MODEL_KEEP_ONLINE_VERSIONS):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        self.pointer_path = os.path.join(root, POINTER_FILE)
+        self.keep_versions = max(1, keep_versions)
+        self.keep_online_versions = max(1, keep_online_versions)
+        self.load_times_ms: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    def version_dir(self, version: str) -> str:
+        return os.path.join(self.versions_dir, version)
+
+    def path(self, version: str, name: str) -> str:
+        return os.path.join(self.version_dir(version), name)
+
+    def current_version(self) -> Optional[str]:
+        """Version the pointer marks as active, or None."""
+        try:
+            with open(self.pointer_path, 'r') as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+        return version if version and os.path.isdir(self.version_dir(version)) else None
+
+    def set_current(self, version: str) -> None:
+        """Atomically point CURRENT at an existing version."""
+        if not os.path.isdir(self.version_dir(version)):
+            raise ValueError(f"Unknown model version: {version}")
+        tmp_path = f"{self.pointer_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.pointer_path)
+        _fsync_dir(self.root)
+
+    def commit(self, files: Dict[str, Any], info: Optional[Dict[str, Any]] = None,
+               link_from: Optional[str] = None, activate: bool = True) -> str:
+        """
+        Write a new immutable version.
+
+        `files` maps relative names to objects: `.json` names are written as
+        JSON, everything else with joblib. Files of `link_from` that are not
+        replaced are hard-linked (copied if linking fails) into the new version.
+        """
+        with self._lock:
+            version = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{os.urandom(3).hex()}"
+            staging = os.path.join(self.versions_dir, f".staging-{version}")
+            os.makedirs(staging)
+            try:
+                for name, obj in files.items():
+                    target = os.path.join(staging, name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    if name.endswith('.json'):
+                        with open(target, 'w') as f:
+                            json.dump(obj, f, indent=2)
+                    else:
+                        joblib.dump(obj, target)
+
+                if link_from:
+                    parent_manifest = self.manifest(link_from)
+                    for name in parent_manifest.get('files', {}):
+                        if name in files:
+                            continue
+                        source = self.path(link_from, name)
+                        target = os.path.join(staging, name)
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        try:
+                            os.link(source, target)
+                        except OSError:
+                            shutil.copy2(source, target)
+
+                manifest_files: Dict[str, Dict[str, Any]] = {}
+                for dirpath, _, filenames in os.walk(staging):
+                    for filename in filenames:
+                        full = os.path.join(dirpath, filename)
+                        with open(full, 'rb') as f:
+                            os.fsync(f.fileno())
+                        rel = os.path.relpath(full, staging).replace(os.sep, '/')
+                        manifest_files[rel] = {'sha256': _sha256(full), 'bytes': os.path.getsize(full)}
+
+                manifest = {
+                    'version': version,
+                    'created_at': datetime.now().isoformat(),
+                    'parent': link_from or self.current_version(),
+                    'files': manifest_files,
+                    **(info or {})
+                }
+                with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+                    json.dump(manifest, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                os.rename(staging, self.version_dir(version))
+                _fsync_dir(self.versions_dir)
+            except Exception:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+
+            if activate:
+                self.set_current(version)
+            self._prune()
+            return version
+
+    def manifest(self, version: str) -> Dict[str, Any]:
+        with open(self.path(version, MANIFEST_FILE), 'r') as f:
+            return json.load(f)
+
+    def verify(self, version: str) -> bool:
+        """Check every file of a version against its manifest hash."""
+        try:
+            manifest = self.manifest(version)
+            for name, meta in manifest.get('files', {}).items():
+                if _sha256(self.path(version, name)) != meta.get('sha256'):
+                    print(f"Model version {version}: checksum mismatch for {name}")
+                    return False
+            return True
+        except Exception as e:
+            print(f"Model version {version} failed verification: {e}")
+            return False
+
+    def list_versions(self) -> List[Dict[str, Any]]:
+        """Versions, newest first, with manifest summary and load time if known."""
+        current = self.current_version()
+        versions = []
+        for version in sorted(os.listdir(self.versions_dir), reverse=True):
+            if version.startswith('.'):
+                continue
+            try:
+                manifest = self.manifest(version)
+            except Exception:
+                continue
+            files = manifest.get('files', {})
+            versions.append({
+                **{k: v for k, v in manifest.items() if k != 'files'},
+                'file_count': len(files),
+                'total_bytes': sum(meta.get('bytes', 0) for meta in files.values()),
+                'is_current': version == current,
+                'load_ms': self.load_times_ms.get(version)
+            })
+        return versions
+
+    def previous_version(self) -> Optional[str]:
+        """The version created just before the current one."""
+        current = self.current_version()
+        versions = [v['version'] for v in self.list_versions()]
+        if current not in versions:
+            return versions[0] if versions else None
+        index = versions.index(current)
+        return versions[index + 1] if index + 1 < len(versions) else None
+
+    def record_load(self, version: str, elapsed_ms: float) -> None:
+        self.load_times_ms[version] = round(elapsed_ms, 3)
+
+    def _prune(self) -> None:
+        """Keep the newest versions of each retention class, and CURRENT."""
+        current = self.current_version()
+        versions = sorted((v for v in os.listdir(self.versions_dir) if not v.startswith('.')), reverse=True)
+        seen = {'train': 0, 'online': 0}
+        for version in versions:
+            try:
+                online = self.manifest(version).get('source') == 'online'
+            except Exception:
+                online = False
+            retention = 'online' if online else 'train'
+            seen[retention] += 1
+            limit = self.keep_online_versions if online else self.keep_versions
+            if seen[retention] > limit and version != current:
+                shutil.rmtree(self.version_dir(version), ignore_errors=True)
@@ -0,0 +1,164 @@
+import os
+import copy
+import time
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from classifier_backends import supports_partial_fit
+
+
+# "online": feedback is applied with partial_fit when the served backend (chosen
+# by the latency budget) supports it, else as in batch mode; "batch": full retrains
+ML_LEARNING_MODE = os.getenv("ML_LEARNING_MODE", "online").lower()
+ML_ONLINE_BATCH_SIZE = int(os.getenv("ML_ONLINE_BATCH_SIZE", "32"))
+ML_ONLINE_FLUSH_SECONDS = float(os.getenv("ML_ONLINE_FLUSH_SECONDS", "2"))
+# Minimum interval between persisted snapshots (registry versions) of online updates
+ML_ONLINE_SNAPSHOT_SECONDS = float(os.getenv("ML_ONLINE_SNAPSHOT_SECONDS", "30"))
+
+
+class OnlineLearner:
+    """
+    Applies labelled feedback to the live model in mini-batches.
+
+    Examples are queued by submit() and a background thread flushes them every
+    few seconds (or as soon as a mini-batch is full) and periodically saves a
+    snapshot to the model registry. Each flush updates a copy
+    of the served pipeline with partial_fit and swaps it in with a single
+    compare-and-swap, so predictions never see a half-updated model.
+    Only pipelines with a stateless hashed vectorizer qualify; labels the
+    classifier has never seen need a full rebuild (/api/ml/train).
+    """
+
+    def __init__(self, model, batch_size: int = ML_ONLINE_BATCH_SIZE,
+                 flush_seconds: float = ML_ONLINE_FLUSH_SECONDS):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self._pending: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._dirty = False
+        self._last_snapshot = 0.0
+        self.stats: Dict[str, Any] = {
+            'applied_examples': 0,
+            'batches': 0,
+            'skipped_unknown_labels': 0,
+            'needs_rebuild': False,
+            'last_update': None,
+            'last_flush_ms': 0.0
+        }
+
+    def is_enabled(self) -> bool:
+        """Online mode is configured and the served pipeline supports partial_fit."""
+        return ML_LEARNING_MODE == 'online' and supports_partial_fit(self.model.classifier)
+
+    def mark_rebuilt(self) -> None:
+        """A full rebuild has been published; it covers any labels skipped so far."""
+        self.stats['needs_rebuild'] = False
+
+    def submit(self, text: str, category: str) -> bool:
+        """Queue a labelled example. Returns False if online learning is unavailable."""
+        if not text or not category or not self.is_enabled():
+            return False
+        with self._lock:
+            self._pending.append((text, category))
+            pending = len(self._pending)
+        self._ensure_thread()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ml-online-learner", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                self.snapshot()
+            except Exception as e:
+                print(f"Online learning error: {e}")
+
+    def flush(self) -> Dict[str, Any]:
+        """Apply all queued examples to the live model now."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return {'applied': 0}
+
+            start = time.perf_counter()
+            serving = self.model.serving
+            base = serving.classifier
+            if not supports_partial_fit(base):
+                return {'applied': 0, 'dropped': len(batch)}
+
+            classifier = base.steps[-1][1]
+            known = set(serving.label_encoder.inverse_transform(classifier.classes_))
+            texts: List[str] = []
+            labels: List[str] = []
+            skipped = 0
+            for text, category in batch:
+                processed = self.model.preprocess_text(text)
+                if category not in known:
+                    skipped += 1
+                elif processed.strip():
+                    texts.append(processed)
+                    labels.append(category)
+
+            if skipped:
+                self.stats['skipped_unknown_labels'] += skipped
+                self.stats['needs_rebuild'] = True
+            if not texts:
+                return {'applied': 0, 'skipped': skipped}
+
+            # Update a copy, then publish it with one reference swap
+            updated = copy.deepcopy(base)
+            vectorizer, classifier = updated[:-1], updated.steps[-1][1]
+            encoded = serving.label_encoder.transform(labels)
+            for i in range(0, len(texts), self.batch_size):
+                X = vectorizer.transform(texts[i:i + self.batch_size])
+                classifier.partial_fit(X, encoded[i:i + self.batch_size], classes=classifier.classes_)
+
+            if not self.model.swap_classifier(base, updated):
+                # A full rebuild replaced the model meanwhile; it already includes these examples
+                return {'applied': 0, 'superseded': len(texts)}
+
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            self.stats['applied_examples'] += len(texts)
+            self.stats['batches'] += 1
+            self.stats['last_update'] = datetime.now().isoformat()
+            self.stats['last_flush_ms'] = round(elapsed_ms, 3)
+
+            self._dirty = True
+
+        return {'applied': len(texts), 'skipped': skipped, 'flush_ms': round(elapsed_ms, 3)}
+
+    def snapshot(self, force: bool = False) -> bool:
+        """Persist online updates, at most every ML_ONLINE_SNAPSHOT_SECONDS unless forced."""
+        if not self._dirty:
+            return False
+        if not force and time.monotonic() - self._last_snapshot < ML_ONLINE_SNAPSHOT_SECONDS:
+            return False
+        self._dirty = False
+        self._last_snapshot = time.monotonic()
+        self.model.save_classifier()
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth and update counters."""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'mode': ML_LEARNING_MODE,
+            'enabled': self.is_enabled(),
+            'pending': pending,
+            **self.stats
+        }
@@ -0,0 +1,338 @@
+import os
+import asyncio
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Any OpenAI-compatible endpoint (e.g. a local fake server in tests)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_CONNECT_TIMEOUT_S = float(os.getenv("OPENAI_CONNECT_TIMEOUT_S", "5"))
+OPENAI_READ_TIMEOUT_S = float(os.getenv("OPENAI_READ_TIMEOUT_S", "30"))
+# How long a request may wait for a free pooled connection
+OPENAI_POOL_TIMEOUT_S = float(os.getenv("OPENAI_POOL_TIMEOUT_S", "10"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+# Connections per async pool shard (see AsyncInstrumentedTransport)
+OPENAI_POOL_SHARD_SIZE = int(os.getenv("OPENAI_POOL_SHARD_SIZE", "64"))
+OPENAI_KEEPALIVE_EXPIRY_S = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_S", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_RETRY_BASE_S = float(os.getenv("OPENAI_RETRY_BASE_S", "0.5"))
+OPENAI_RETRY_MAX_S = float(os.getenv("OPENAI_RETRY_MAX_S", "8"))
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class PoolStats:
+    """New vs reused connections, TLS handshakes and pool pressure of one transport."""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            'requests': 0,
+            'new_connections': 0,
+            'reused_connections': 0,
+            'tls_handshakes': 0,
+            'in_flight': 0,
+            'peak_in_flight': 0,
+            'saturated_requests': 0,
+            'pool_wait_ms_total': 0.0,
+            'pool_wait_ms_max': 0.0,
+        }
+
+    def begin(self) -> None:
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.stats['in_flight'] >= self.max_connections:
+                self.stats['saturated_requests'] += 1
+            self.stats['in_flight'] += 1
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+
+    def connected(self, trace: "RequestTrace", start: float) -> None:
+        # Time until the first trace event is time spent waiting for a pooled connection
+        wait_ms = ((trace.first_event or time.perf_counter()) - start) * 1000.0
+        with self._lock:
+            self.stats['new_connections' if trace.connected else 'reused_connections'] += 1
+            self.stats['tls_handshakes'] += trace.tls_handshakes
+            self.stats['pool_wait_ms_total'] = round(self.stats['pool_wait_ms_total'] + wait_ms, 3)
+            self.stats['pool_wait_ms_max'] = round(max(self.stats['pool_wait_ms_max'], wait_ms), 3)
+
+    def end(self) -> None:
+        with self._lock:
+            self.stats['in_flight'] -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['max_connections'] = self.max_connections
+        return stats
+
+
+class RequestTrace:
+    """Collects httpcore trace events of one request."""
+
+    def __init__(self):
+        self.first_event: Optional[float] = None
+        self.connected = False
+        self.tls_handshakes = 0
+
+    def event(self, name: str) -> None:
+        if self.first_event is None:
+            self.first_event = time.perf_counter()
+        if name == 'connection.connect_tcp.complete':
+            self.connected = True
+        elif name == 'connection.start_tls.complete':
+            self.tls_handshakes += 1
+
+
+class _AsyncTrackedStream(httpx.AsyncByteStream):
+    """Async response body that reports when its connection goes back to the pool."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    async def __aiter__(self):
+        async for part in self._stream:
+            yield part
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class AsyncInstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that counts new vs reused connections and pool pressure,
+    split into connection pool shards.
+
+    New connections and TLS handshakes are seen through httpcore's trace
+    extension; a request that sends its headers without connecting first
+    reused a kept-alive connection. A request is in flight until its response
+    body is closed, which is when its connection returns to the pool.
+
+    httpcore scans every pooled connection on each request and release, which
+    costs milliseconds per request once a pool holds hundreds of connections.
+    Large pools are therefore split into shards of at most `shard_size`
+    connections; each request goes to the shard with the fewest requests in
+    flight, so the shards together behave like one pool of `max_connections`.
+    """
+
+    def __init__(self, max_connections: int, limits: httpx.Limits, shard_size: int = OPENAI_POOL_SHARD_SIZE):
+        self.pool_stats = PoolStats(max_connections)
+        count = max(1, -(-max_connections // max(1, shard_size)))
+        shard_limits = httpx.Limits(
+            max_connections=-(-max_connections // count),
+            max_keepalive_connections=-(-(limits.max_keepalive_connections or max_connections) // count),
+            keepalive_expiry=limits.keepalive_expiry)
+        ssl_context = httpx.create_ssl_context()  # loading CA certificates once, not per shard
+        self.shards = [httpx.AsyncHTTPTransport(verify=ssl_context, limits=shard_limits) for _ in range(count)]
+        self._in_flight = [0] * count
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        trace = RequestTrace()
+        outer_trace = request.extensions.get('trace')
+
+        async def on_event(name: str, info: Dict[str, Any]) -> None:
+            trace.event(name)
+            if outer_trace is not None:
+                await outer_trace(name, info)
+
+        # Only touched from the event loop thread: no lock needed
+        shard = min(range(len(self.shards)), key=self._in_flight.__getitem__)
+        self._in_flight[shard] += 1
+
+        def end() -> None:
+            self._in_flight[shard] -= 1
+            self.pool_stats.end()
+
+        request.extensions = {**request.extensions, 'trace': on_event}
+        self.pool_stats.begin()
+        try:
+            response = await self.shards[shard].handle_async_request(request)
+        except BaseException:
+            end()
+            raise
+        self.pool_stats.connected(trace, start)
+        return httpx.Response(status_code=response.status_code, headers=response.headers,
+                              stream=_AsyncTrackedStream(response.stream, end),
+                              extensions=response.extensions)
+
+    async def aclose(self) -> None:
+        for shard in self.shards:
+            await shard.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.pool_stats.get_stats(), 'shards': len(self.shards)}
+
+
+class AsyncPooledOpenAIClient:
+    """
+    One OpenAI client per worker event loop (AsyncOpenAI over a shared
+    httpx.AsyncClient connection pool).
+
+    Connections are kept alive between calls, so only the first request (and
+    any after an idle expiry) pays for TCP and TLS setup. Connect, read and
+    pool-wait timeouts are explicit. Transient failures (connection errors,
+    timeouts, 408/409/429/5xx) are retried up to `max_retries` times with
+    capped exponential backoff and full jitter, honouring Retry-After. The
+    SDK's own retries are disabled so the budget is not applied twice.
+
+    Waiting on the API holds no thread, so the number of chats in flight is
+    bounded by `max_connections` rather than by a threadpool. Bound to the
+    event loop it was created in.
+    """
+
+    def __init__(self, api_key: Optional[str] = OPENAI_API_KEY, base_url: Optional[str] = OPENAI_BASE_URL,
+                 max_connections: int = OPENAI_MAX_CONNECTIONS, max_keepalive: int = OPENAI_MAX_KEEPALIVE,
+                 connect_timeout_s: float = OPENAI_CONNECT_TIMEOUT_S,
+                 read_timeout_s: float = OPENAI_READ_TIMEOUT_S,
+                 pool_timeout_s: float = OPENAI_POOL_TIMEOUT_S,
+                 max_retries: int = OPENAI_MAX_RETRIES, retry_base_s: float = OPENAI_RETRY_BASE_S,
+                 retry_max_s: float = OPENAI_RETRY_MAX_S, shard_size: int = OPENAI_POOL_SHARD_SIZE):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_retries = max(0, max_retries)
+        self.retry_base_s = retry_base_s
+        self.retry_max_s = retry_max_s
+        self.timeout = httpx.Timeout(connect=connect_timeout_s, read=read_timeout_s,
+                                     write=read_timeout_s, pool=pool_timeout_s)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_S)
+        self.transport = AsyncInstrumentedTransport(max_connections=max_connections, limits=self.limits,
+                                                    shard_size=shard_size)
+        self.http_client = httpx.AsyncClient(transport=self.transport, timeout=self.timeout)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            'calls': 0,
+            'retries': 0,
+            'failures': 0,
+            'last_error': None,
+        }
+        from openai import AsyncOpenAI  # heavy; imported on first use
+
+        self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=self.http_client,
+                                  timeout=self.timeout, max_retries=0)
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.retry_max_s, self.retry_base_s * (2 ** attempt)))
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            delay = max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            pass
+        return min(delay, self.retry_max_s)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        import openai
+
+        if isinstance(error, openai.APIConnectionError):  # includes APITimeoutError
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+    def _start_call(self) -> None:
+        with self._lock:
+            self.stats['calls'] += 1
+
+    def _next_delay(self, attempt: int, error: Exception) -> Optional[float]:
+        """Seconds to wait before retrying after `error`, or None to give up."""
+        if attempt >= self.max_retries or not self._is_retryable(error):
+            with self._lock:
+                self.stats['failures'] += 1
+                self.stats['last_error'] = f"{type(error).__name__}: {error}"
+            return None
+        delay = self._retry_delay(attempt, error)
+        with self._lock:
+            self.stats['retries'] += 1
+        print(f"OpenAI call failed ({type(error).__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        return delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        return {
+            **stats,
+            'max_retries': self.max_retries,
+            'timeouts_s': {'connect': self.timeout.connect, 'read': self.timeout.read,
+                           'pool': self.timeout.pool},
+            'pool': self.transport.get_stats(),
+        }
+
+    async def call(self, fn: Callable[[Any], Awaitable[Any]]) -> Any:
+        """Await fn(client) with the retry policy; re-raises the last error."""
+        self._start_call()
+        attempt = 0
+        while True:
+            try:
+                return await fn(self.client)
+            except Exception as e:
+                delay = self._next_delay(attempt, e)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def chat_completion(self, messages: List[Dict[str, str]], model: str = OPENAI_MODEL,
+                              **kwargs: Any) -> str:
+        """Text of a chat completion."""
+        response = await self.call(lambda client: client.chat.completions.create(
+            model=model, messages=messages, **kwargs))
+        return response.choices[0].message.content or ""
+
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], model: str = OPENAI_MODEL,
+                                     **kwargs: Any) -> AsyncIterator[str]:
+        """Text deltas of a streamed chat completion; only opening the stream is retried."""
+        stream = await self.call(lambda client: client.chat.completions.create(
+            model=model, messages=messages, stream=True, **kwargs))
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+    async def aclose(self) -> None:
+        await self.http_client.aclose()
+
+
+_async_openai_client: Optional[AsyncPooledOpenAIClient] = None
+_async_openai_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_async_openai_client() -> AsyncPooledOpenAIClient:
+    """Get or create the async client of the running event loop (one loop per worker process)."""
+    global _async_openai_client, _async_openai_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_openai_client is None or _async_openai_client_loop is not loop:
+        _async_openai_client = AsyncPooledOpenAIClient()
+        _async_openai_client_loop = loop
+    return _async_openai_client
+
+
+def get_client_stats() -> Optional[Dict[str, Any]]:
+    """Stats of the worker's client, or None if it has not been created."""
+    client = _async_openai_client
+    return client.get_stats() if client is not None else None
+
+
+async def aclose_async_openai_client() -> None:
+    global _async_openai_client
+    client = _async_openai_client
+    if client is not None and _async_openai_client_loop is asyncio.get_running_loop():
+        await client.aclose()
+    _async_openai_client = None
@@ -0,0 +1,457 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+# memory (per worker) | sqlite (shared by the workers on one host)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", os.path.join(os.getcwd(), "server", "data", "rate_limits.db"))
+# Take the client IP from X-Forwarded-For (only behind a trusted proxy). Proxies
+# append to the header the client sent, so the address is read from the right:
+# the entry added by the outermost of RATE_LIMIT_TRUSTED_HOPS trusted proxies
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").strip().lower() in ("1", "true", "yes", "on")
+RATE_LIMIT_TRUSTED_HOPS = int(os.getenv("RATE_LIMIT_TRUSTED_HOPS", "1"))
+# Timing wheel resolution and size: expiries within tick_s * slots need no extra laps
+WHEEL_TICK_S = float(os.getenv("WHEEL_TICK_S", "1"))
+WHEEL_SLOTS = int(os.getenv("WHEEL_SLOTS", "4096"))
+
+# Per-route quotas: scope -> "<requests>/<seconds>". Scopes are ip, email and
+# session (the last two read from the JSON body). RATE_LIMITS (JSON, same
+# shape) overrides individual routes.
+DEFAULT_RATE_LIMITS: Dict[str, Dict[str, str]] = {
+    "POST /api/chat": {"ip": "60/60", "session": "20/60"},
+    "POST /api/chat/stream": {"ip": "60/60", "session": "20/60"},
+    "POST /api/ml/train": {"ip": "3/3600"},
+    "POST /api/ml/predict": {"ip": "120/60"},
+    "POST /api/ml/predict/batch": {"ip": "30/60"},
+    "POST /api/ml/feedback": {"ip": "60/60"},
+    "POST /api/otp/request": {"ip": "10/3600", "email": "1/45"},
+    "POST /api/otp/verify": {"ip": "30/600", "email": "10/600"},
+    "POST /api/2fa/setup": {"ip": "10/3600"},
+    "POST /api/2fa/verify": {"ip": "30/600", "email": "10/600"},
+    "POST /api/leads": {"ip": "10/600"},
+    "POST /api/kb/upload": {"ip": "30/3600"},
+    "POST /api/kb/text": {"ip": "30/3600"},
+    "POST /api/kb/reload": {"ip": "6/3600"},
+}
+
+
+class Rate(NamedTuple):
+    """`limit` requests per `period_s` seconds; a full bucket allows a burst of `limit`."""
+    limit: int
+    period_s: float
+
+    @property
+    def per_second(self) -> float:
+        return self.limit / self.period_s
+
+    @classmethod
+    def parse(cls, spec: str) -> "Rate":
+        limit, _, period = spec.partition("/")
+        rate = cls(int(limit), float(period or 1))
+        if rate.limit < 1 or rate.period_s <= 0:
+            raise ValueError(f"Invalid rate '{spec}'")
+        return rate
+
+
+def load_route_quotas(overrides: Optional[str] = None) -> Dict[str, Dict[str, Rate]]:
+    """DEFAULT_RATE_LIMITS merged with the RATE_LIMITS JSON, parsed to Rate values."""
+    rules: Dict[str, Dict[str, str]] = dict(DEFAULT_RATE_LIMITS)
+    overrides = os.getenv("RATE_LIMITS") if overrides is None else overrides
+    if overrides:
+        try:
+            rules.update(json.loads(overrides))
+        except Exception as e:
+            print(f"Ignoring invalid RATE_LIMITS: {e}")
+    return {route: {scope: Rate.parse(spec) for scope, spec in scopes.items()}
+            for route, scopes in rules.items() if scopes}
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel of keys to expire.
+
+    A key scheduled for `deadline` goes into the slot of the tick after it. Advancing
+    the clock visits only the slots of the ticks that have passed, so the work
+    is proportional to the entries that come due (plus, for deadlines more than
+    one revolution ahead, an extra visit per lap) instead of to everything
+    stored. Entries may fire up to one tick late; callers re-check deadlines.
+    """
+
+    def __init__(self, tick_s: float = WHEEL_TICK_S, slots: int = WHEEL_SLOTS, now: Optional[float] = None):
+        self.tick_s = tick_s
+        self.slots: List[List[Tuple[float, Hashable]]] = [[] for _ in range(max(1, slots))]
+        self._tick = int((time.monotonic() if now is None else now) / tick_s)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        # First tick boundary at or after the deadline: every entry in a visited slot is due,
+        # except those a whole revolution (or more) ahead
+        tick = max(int(deadline / self.tick_s) + 1, self._tick + 1)
+        self.slots[tick % len(self.slots)].append((deadline, key))
+        self.size += 1
+
+    def advance(self, now: float) -> List[Tuple[float, Hashable]]:
+        """(deadline, key) of the entries that have come due, in no particular order."""
+        target = int(now / self.tick_s)
+        if target <= self._tick:
+            return []
+        due: List[Tuple[float, Hashable]] = []
+        # After a full revolution every slot has been visited once
+        for tick in range(self._tick + 1, min(target, self._tick + len(self.slots)) + 1):
+            index = tick % len(self.slots)
+            slot = self.slots[index]
+            if not slot:
+                continue
+            later = [entry for entry in slot if entry[0] > now]
+            due.extend(entry for entry in slot if entry[0] <= now)
+            self.slots[index] = later
+        self._tick = target
+        self.size -= len(due)
+        return due
+
+
+class ExpiringDict:
+    """
+    Dict whose entries disappear after a per-entry TTL.
+
+    Expired entries are never returned; a timing wheel removes them on later
+    calls in O(expired) time, so the dict does not grow with stale state.
+    Entries set with ttl_s=None never expire. Thread-safe.
+    """
+
+    def __init__(self, name: str, tick_s: float = WHEEL_TICK_S, slots: int = WHEEL_SLOTS):
+        self.name = name
+        # key -> [expires_at or None, value, deadline of its wheel entry or None]
+        self._data: Dict[Hashable, List[Any]] = {}
+        self._wheel = TimingWheel(tick_s, slots)
+        self._lock = threading.Lock()
+        self.expired = 0
+
+    def _sweep(self, now: float) -> None:
+        for deadline, key in self._wheel.advance(now):
+            entry = self._data.get(key)
+            if entry is None or entry[2] != deadline:
+                continue  # removed, or superseded by an earlier wheel entry
+            if entry[0] is not None and entry[0] <= now:
+                del self._data[key]
+                self.expired += 1
+            elif entry[0] is not None:
+                entry[2] = entry[0]  # extended since it was scheduled
+                self._wheel.schedule(key, entry[0])
+            else:
+                entry[2] = None
+
+    def set(self, key: Hashable, value: Any, ttl_s: Optional[float]) -> None:
+        now = time.monotonic()
+        expires_at = None if ttl_s is None else now + ttl_s
+        with self._lock:
+            self._sweep(now)
+            entry = self._data.get(key)
+            scheduled = entry[2] if entry is not None else None
+            # Keep at most one live wheel entry per key; a later expiry is picked up when it fires
+            if expires_at is not None and (scheduled is None or scheduled > expires_at):
+                self._wheel.schedule(key, expires_at)
+                scheduled = expires_at
+            self._data[key] = [expires_at, value, scheduled]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= now):
+                return default
+            return entry[1]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sweep(time.monotonic())
+            return len(self._data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sweep(time.monotonic())
+            return {'entries': len(self._data), 'expired': self.expired, 'scheduled': len(self._wheel)}
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    retry_after_s: float
+    # "<scope>" of the first bucket that refused the request
+    limited_by: Optional[str] = None
+
+
+def _refill(tokens: float, updated_at: float, rate: Rate, now: float) -> float:
+    return min(float(rate.limit), tokens + max(0.0, now - updated_at) * rate.per_second)
+
+
+class RateLimiter:
+    """Decision counters shared by the limiter backends."""
+
+    backend = "base"
+    # True if acquire() does disk I/O and belongs off the event loop
+    blocking = False
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, Any] = {'allowed': 0, 'limited': 0, 'evicted': 0, 'routes': {}}
+
+    def record(self, route: str, decision: Decision) -> None:
+        with self._stats_lock:
+            counts = self.stats['routes'].setdefault(route, {'allowed': 0, 'limited': 0, 'limited_by': {}})
+            if decision.allowed:
+                self.stats['allowed'] += 1
+                counts['allowed'] += 1
+            else:
+                self.stats['limited'] += 1
+                counts['limited'] += 1
+                counts['limited_by'][decision.limited_by] = counts['limited_by'].get(decision.limited_by, 0) + 1
+
+    def acquire(self, buckets: List[Tuple[str, str, Rate]], cost: float = 1.0) -> Decision:
+        """Take `cost` tokens from every (scope, key, rate) bucket, or from none if any is short."""
+        raise NotImplementedError
+
+    def _stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return json.loads(json.dumps({'backend': self.backend, **self.stats}))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self._stats()
+
+    def close(self) -> None:
+        pass
+
+
+class TokenBucketLimiter(RateLimiter):
+    """
+    In-process token buckets.
+
+    A bucket that has refilled completely is indistinguishable from a new one,
+    so each bucket is scheduled on a timing wheel for the moment it will be
+    full again and dropped then unless it was used in the meantime. Idle
+    clients therefore cost nothing, and eviction work is O(expired).
+    """
+
+    backend = "memory"
+
+    def __init__(self, tick_s: float = WHEEL_TICK_S, slots: int = WHEEL_SLOTS):
+        super().__init__()
+        # key -> [tokens, updated_at, full_at]
+        self._buckets: Dict[str, List[float]] = {}
+        self._wheel = TimingWheel(tick_s, slots)
+        self._lock = threading.Lock()
+
+    def _sweep(self, now: float) -> None:
+        evicted = 0
+        for _, key in self._wheel.advance(now):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            if bucket[2] <= now:
+                del self._buckets[key]
+                evicted += 1
+            else:
+                self._wheel.schedule(key, bucket[2])
+        if evicted:
+            with self._stats_lock:
+                self.stats['evicted'] += evicted
+
+    def acquire(self, buckets: List[Tuple[str, str, Rate]], cost: float = 1.0) -> Decision:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            levels = []
+            for scope, key, rate in buckets:
+                bucket = self._buckets.get(key)
+                tokens = float(rate.limit) if bucket is None else _refill(bucket[0], bucket[1], rate, now)
+                if tokens < cost:
+                    return Decision(False, (cost - tokens) / rate.per_second, scope)
+                levels.append(tokens)
+            for (_, key, rate), tokens in zip(buckets, levels):
+                tokens -= cost
+                full_at = now + (rate.limit - tokens) / rate.per_second
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    self._buckets[key] = [tokens, now, full_at]
+                    self._wheel.schedule(key, full_at)
+                else:
+                    bucket[0], bucket[1], bucket[2] = tokens, now, full_at
+        return Decision(True, 0.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sweep(time.monotonic())
+            buckets, scheduled = len(self._buckets), len(self._wheel)
+        return {**self._stats(), 'buckets': buckets, 'scheduled': scheduled}
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    full_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_buckets_full_at ON buckets (full_at);
+"""
+
+
+class SQLiteTokenBucketLimiter(RateLimiter):
+    """
+    Token buckets in a SQLite database (WAL mode) shared by every worker on a host.
+
+    Each decision is one IMMEDIATE transaction, so concurrent workers never
+    both spend the same token. Full buckets are deleted through the `full_at`
+    index at most every `sweep_interval_s`, again in O(expired). Times are
+    wall-clock so all workers agree on them.
+    """
+
+    backend = "sqlite"
+    blocking = True
+
+    def __init__(self, db_path: str = RATE_LIMIT_DB_PATH, sweep_interval_s: float = 10.0):
+        super().__init__()
+        self.db_path = db_path
+        self.sweep_interval_s = sweep_interval_s
+        self._local = threading.local()
+        self._next_sweep = 0.0
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn().executescript(_SQLITE_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, buckets: List[Tuple[str, str, Rate]], cost: float = 1.0) -> Decision:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for scope, key, rate in buckets:
+                row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = float(rate.limit) if row is None else _refill(row[0], row[1], rate, now)
+                if tokens < cost:
+                    conn.execute("ROLLBACK")
+                    return Decision(False, (cost - tokens) / rate.per_second, scope)
+                levels.append(tokens)
+            conn.executemany(
+                "INSERT INTO buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at, "
+                "full_at = excluded.full_at",
+                [(key, tokens - cost, now, now + (rate.limit - tokens + cost) / rate.per_second)
+                 for (_, key, rate), tokens in zip(buckets, levels)]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + self.sweep_interval_s
+            evicted = conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,)).rowcount
+            if evicted > 0:
+                with self._stats_lock:
+                    self.stats['evicted'] += evicted
+        return Decision(True, 0.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        buckets = self._conn().execute("SELECT COUNT(*) FROM buckets WHERE full_at > ?", (time.time(),)).fetchone()[0]
+        return {**self._stats(), 'buckets': buckets}
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_untrusted_proxy_warned = False
+
+
+def client_ip(headers: Dict[str, str], peer: Optional[str], trust_proxy: bool = RATE_LIMIT_TRUST_PROXY,
+              trusted_hops: int = RATE_LIMIT_TRUSTED_HOPS) -> str:
+    """
+    Client address for per-IP quotas. With trust_proxy it is the
+    X-Forwarded-For entry `trusted_hops` from the right, the one our proxies
+    added; entries to its left come from the client and may be forged.
+    Without trust_proxy, X-Forwarded-For is ignored and a warning is logged
+    once: behind a proxy every client would share the proxy's buckets.
+    """
+    global _untrusted_proxy_warned
+    forwarded = headers.get("x-forwarded-for", "")
+    if forwarded and trust_proxy:
+        addresses = [address.strip() for address in forwarded.split(",") if address.strip()]
+        if addresses:
+            return addresses[-min(max(1, trusted_hops), len(addresses))]
+    if forwarded and not _untrusted_proxy_warned:
+        _untrusted_proxy_warned = True
+        print(f"[RateLimit] Warning: request from {peer} has X-Forwarded-For but RATE_LIMIT_TRUST_PROXY is off; "
+              f"per-IP quotas are keyed on the proxy address, so all clients share them. "
+              f"Set RATE_LIMIT_TRUST_PROXY=true behind a trusted reverse proxy.")
+    return peer or "unknown"
+
+
+def quota_buckets(route: str, quotas: Dict[str, Rate], ip: str,
+                  body: Optional[Dict[str, Any]]) -> List[Tuple[str, str, Rate]]:
+    """(scope, bucket key, rate) for each scope of a route's quota that applies to this request."""
+    buckets = []
+    for scope, rate in quotas.items():
+        if scope == "ip":
+            value: Any = ip
+        elif scope == "email":
+            value = (body or {}).get("email")
+            value = value.strip().lower() if isinstance(value, str) else None
+        elif scope == "session":
+            value = (body or {}).get("session_id")
+        else:
+            value = None
+        if value:
+            buckets.append((scope, f"{route}|{scope}|{value}", rate))
+    return buckets
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+def create_rate_limiter(backend: str = RATE_LIMIT_BACKEND) -> RateLimiter:
+    if backend == "memory":
+        return TokenBucketLimiter()
+    if backend == "sqlite":
+        return SQLiteTokenBucketLimiter()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{backend}' (expected memory or sqlite)")
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Get or create the process-wide limiter selected by RATE_LIMIT_BACKEND."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = create_rate_limiter()
+    return _rate_limiter
@@ -0,0 +1,64 @@
+import time
+import importlib
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ReadinessTracker:
+    """
+    Per-component startup state for the /api/ready probe.
+
+    Components move from pending -> loading -> ready (or failed) with their
+    warm-up duration; lazily imported modules record their import time.
+    """
+
+    def __init__(self, components: List[str]):
+        self.started_at = time.perf_counter()
+        self.components: Dict[str, Dict[str, Any]] = {
+            name: {'status': 'pending', 'duration_ms': None, 'error': None} for name in components
+        }
+        self.import_timings_ms: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def timed_import(self, module_name: str):
+        """Import a module, recording how long the first import took."""
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self.import_timings_ms.setdefault(module_name, round(elapsed_ms, 3))
+        return module
+
+    def run(self, name: str, fn: Callable[[], Any]) -> Optional[Any]:
+        """Run one warm-up step, recording status and duration."""
+        with self._lock:
+            self.components.setdefault(name, {})
+            self.components[name].update({'status': 'loading', 'started_at': datetime.now().isoformat()})
+        start = time.perf_counter()
+        try:
+            result = fn()
+            status, error = 'ready', None
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+            result, status, error = None, 'failed', str(e)
+        with self._lock:
+            self.components[name].update({
+                'status': status,
+                'error': error,
+                'duration_ms': round((time.perf_counter() - start) * 1000.0, 3)
+            })
+        return result
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return all(c['status'] == 'ready' for c in self.components.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'ready': all(c['status'] == 'ready' for c in self.components.values()),
+                'uptime_seconds': round(time.perf_counter() - self.started_at, 3),
+                'components': {name: dict(c) for name, c in self.components.items()},
+                'import_timings_ms': dict(self.import_timings_ms)
+            }
@@ -0,0 +1,119 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2048"))
+RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", "600"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+_MISSING = object()
+
+
+def approx_size(value: Any) -> int:
+    """Rough deep size in bytes of strings, numbers and nested lists/tuples/dicts."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(approx_size(v) for v in value)
+    return size
+
+
+class ResultCache:
+    """
+    Bounded LRU + TTL cache for expensive, deterministic results.
+
+    Every entry is stored with a stamp (a model version, an index generation)
+    taken when it was computed. A lookup with a different current stamp is a
+    miss and drops the entry, so retraining or reindexing invalidates cached
+    results without any explicit flush. Bounded by entry count and by the
+    approximate size of keys and values. Cached values are shared between
+    callers and must not be mutated.
+    """
+
+    def __init__(self, name: str, max_entries: int = RESULT_CACHE_SIZE,
+                 ttl_s: float = RESULT_CACHE_TTL_S, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.name = name
+        self.max_entries = max(0, max_entries)
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        # key -> (stamp, expires_at, size, value)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float, int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, stamp: Any = None) -> Any:
+        """Cached value for `key` computed under `stamp`, or _MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] != stamp:
+                    self.stale += 1
+                    self._drop(key)
+                elif entry[1] < time.monotonic():
+                    self.expired += 1
+                    self._drop(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[3]
+            self.misses += 1
+            return _MISSING
+
+    def put(self, key: Hashable, stamp: Any, value: Any) -> None:
+        if not self.max_entries:
+            return
+        size = approx_size(key) + approx_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (stamp, time.monotonic() + self.ttl_s, size, value)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, stamp: Any, compute: Callable[[], Any]) -> Any:
+        """Cached value, or compute() stored under `stamp` (concurrent misses may both compute)."""
+        value = self.get(key, stamp)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, stamp, value)
+        return value
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self.bytes -= entry[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_s': self.ttl_s,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0
+            }
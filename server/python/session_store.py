@@ -0,0 +1,479 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+
+# memory | sqlite | redis
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").strip().lower()
+# Sessions expire after this long without being read or written
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", str(24 * 3600)))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "20"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(32 * 1024)))
+# Memory and SQLite backends; Redis is bounded by its own maxmemory policy
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_TOTAL_BYTES = int(os.getenv("SESSION_MAX_TOTAL_BYTES", str(64 * 1024 * 1024)))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(os.getcwd(), "server", "data", "sessions.db"))
+SESSION_SWEEP_INTERVAL_S = float(os.getenv("SESSION_SWEEP_INTERVAL_S", "10"))
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://127.0.0.1:6379/0")
+SESSION_REDIS_TIMEOUT_S = float(os.getenv("SESSION_REDIS_TIMEOUT_S", "2"))
+
+History = List[Dict[str, str]]
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class SessionStore:
+    """
+    Conversation history per session id, bounded in time and size.
+
+    Histories are kept as compact JSON. On every write the history is cut to
+    the last `max_messages` messages, then the oldest messages are dropped
+    until it fits in `max_session_bytes` (a single oversized message is
+    truncated). Sessions expire `ttl_s` after they were last read or written.
+    Backends add LRU eviction and a global memory cap where the storage does
+    not provide one itself. Reads return a fresh list the caller may mutate.
+    """
+
+    backend = "base"
+    # True if calls do network or disk I/O and belong off the event loop
+    blocking = False
+
+    def __init__(self, ttl_s: float = SESSION_TTL_S, max_messages: int = SESSION_MAX_MESSAGES,
+                 max_session_bytes: int = SESSION_MAX_BYTES):
+        self.ttl_s = ttl_s
+        self.max_messages = max(1, max_messages)
+        self.max_session_bytes = max_session_bytes
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            'hits': 0,
+            'misses': 0,
+            'writes': 0,
+            'trimmed': 0,
+            'expired': 0,
+            'evictions': 0,
+        }
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def encode(self, history: History) -> bytes:
+        """Compact JSON of the newest messages of `history` that fit the per-session caps."""
+        parts = [_dumps(m) for m in history[-self.max_messages:]]
+        size = sum(len(p) + 1 for p in parts) + 1  # brackets and commas
+        if size > self.max_session_bytes:
+            self._count('trimmed')
+            while len(parts) > 1 and size > self.max_session_bytes:
+                size -= len(parts.pop(0)) + 1
+            if size > self.max_session_bytes:
+                message = json.loads(parts[0])
+                content = str(message.get("content", ""))
+                while content and size > self.max_session_bytes:
+                    # JSON escaping only adds bytes: cutting the excess from the raw text fits
+                    raw = content.encode("utf-8")
+                    content = raw[:max(0, len(raw) - (size - self.max_session_bytes))].decode("utf-8", "ignore")
+                    message["content"] = content
+                    parts[0] = _dumps(message)
+                    size = len(parts[0]) + 2
+        return b"[" + b",".join(parts) + b"]"
+
+    @staticmethod
+    def decode(data: bytes) -> History:
+        return json.loads(data)
+
+    def get(self, session_id: str) -> Optional[History]:
+        """History of a live session (refreshing its expiry), or None."""
+        raise NotImplementedError
+
+    def put(self, session_id: str, history: History) -> None:
+        """Store `history` (trimmed to the caps) and refresh the session's expiry."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def _settings(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        return {
+            'backend': self.backend,
+            **stats,
+            'hit_rate': (stats['hits'] / lookups) if lookups else 0.0,
+            'ttl_s': self.ttl_s,
+            'max_messages': self.max_messages,
+            'max_session_bytes': self.max_session_bytes,
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self._settings()
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Per-process LRU of sessions with a global byte cap.
+
+    Every read or write moves a session to the end and pushes its expiry
+    forward by the same TTL, so LRU order is also expiry order: expired
+    sessions are always at the front and are dropped there on each write,
+    together with the least recently used sessions while the store holds
+    more than `max_sessions` sessions or `max_total_bytes` bytes.
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS,
+                 max_total_bytes: int = SESSION_MAX_TOTAL_BYTES, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.max_sessions = max(1, max_sessions)
+        self.max_total_bytes = max_total_bytes
+        # session id -> (expires_at, size, encoded history)
+        self._entries: "OrderedDict[str, Tuple[float, int, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+
+    def get(self, session_id: str) -> Optional[History]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry[0] < now:
+                self._drop(session_id)
+                self._count('expired')
+                entry = None
+            if entry is None:
+                self._count('misses')
+                return None
+            self._entries[session_id] = (now + self.ttl_s, entry[1], entry[2])
+            self._entries.move_to_end(session_id)
+        self._count('hits')
+        return self.decode(entry[2])
+
+    def put(self, session_id: str, history: History) -> None:
+        data = self.encode(history)
+        size = sys.getsizeof(data) + sys.getsizeof(session_id)
+        now = time.monotonic()
+        expired = evicted = 0
+        with self._lock:
+            if session_id in self._entries:
+                self._drop(session_id)
+            self._entries[session_id] = (now + self.ttl_s, size, data)
+            self.bytes += size
+            while len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                if self._entries[oldest][0] < now:
+                    expired += 1
+                elif len(self._entries) > self.max_sessions or self.bytes > self.max_total_bytes:
+                    evicted += 1
+                else:
+                    break
+                self._drop(oldest)
+        self._count('writes')
+        if expired:
+            self._count('expired', expired)
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _drop(self, session_id: str) -> None:
+        self.bytes -= self._entries.pop(session_id)[1]
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._entries:
+                self._drop(session_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions, total = len(self._entries), self.bytes
+        return {**self._settings(), 'sessions': sessions, 'max_sessions': self.max_sessions,
+                'bytes': total, 'max_total_bytes': self.max_total_bytes}
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at);
+"""
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in a SQLite database (WAL mode) shared by every worker on a host.
+
+    Reads refresh the expiry in the same statement. Since all sessions share
+    one sliding TTL, `expires_at` order is LRU order: a sweep at most every
+    `sweep_interval_s` per process deletes expired rows, then the oldest rows
+    while the table is over `max_sessions` rows or `max_total_bytes` of
+    history. Expiry is wall-clock time so all workers agree on it.
+    """
+
+    backend = "sqlite"
+    blocking = True
+
+    def __init__(self, db_path: str = SESSION_DB_PATH, max_sessions: int = SESSION_MAX_SESSIONS,
+                 max_total_bytes: int = SESSION_MAX_TOTAL_BYTES,
+                 sweep_interval_s: float = SESSION_SWEEP_INTERVAL_S, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self.max_sessions = max(1, max_sessions)
+        self.max_total_bytes = max_total_bytes
+        self.sweep_interval_s = sweep_interval_s
+        self._local = threading.local()
+        self._sweep_lock = threading.Lock()
+        self._next_sweep = 0.0
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn().executescript(_SQLITE_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[History]:
+        now = time.time()
+        row = self._conn().execute(
+            "UPDATE sessions SET expires_at = ? WHERE id = ? AND expires_at > ? RETURNING data",
+            (now + self.ttl_s, session_id, now)
+        ).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return self.decode(row[0])
+
+    def put(self, session_id: str, history: History) -> None:
+        data = self.encode(history)
+        self._conn().execute(
+            "INSERT INTO sessions (id, data, size, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data, size = excluded.size, "
+            "expires_at = excluded.expires_at",
+            (session_id, data, len(data) + len(session_id), time.time() + self.ttl_s)
+        )
+        self._count('writes')
+        if time.monotonic() >= self._next_sweep:
+            self.sweep()
+
+    def sweep(self) -> None:
+        """Delete expired sessions, then the least recently used ones over the caps."""
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = time.monotonic() + self.sweep_interval_s
+            conn = self._conn()
+            expired = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+            if expired > 0:
+                self._count('expired', expired)
+            sessions, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+            victims: List[str] = []
+            rows = conn.execute("SELECT id, size FROM sessions ORDER BY expires_at")
+            while sessions > self.max_sessions or total > self.max_total_bytes:
+                row = rows.fetchone()
+                if row is None:
+                    break
+                victims.append(row[0])
+                sessions -= 1
+                total -= row[1]
+            rows.close()
+            if victims:
+                conn.executemany("DELETE FROM sessions WHERE id = ?", [(v,) for v in victims])
+                self._count('evictions', len(victims))
+        finally:
+            self._sweep_lock.release()
+
+    def delete(self, session_id: str) -> None:
+        self._conn().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        sessions, total = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions WHERE expires_at > ?", (time.time(),)
+        ).fetchone()
+        return {**self._settings(), 'sessions': sessions, 'max_sessions': self.max_sessions,
+                'bytes': total, 'max_total_bytes': self.max_total_bytes}
+
+
+class RedisError(Exception):
+    """Error reply from a Redis server."""
+
+
+class RedisConnection:
+    """Minimal blocking client for the Redis protocol (RESP2) over one socket."""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None,
+                 username: Optional[str] = None, timeout_s: float = SESSION_REDIS_TIMEOUT_S):
+        self.sock = socket.create_connection((host, port), timeout=timeout_s)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if password:
+            self.command(*(["AUTH", username, password] if username else ["AUTH", password]))
+        if db:
+            self.command("SELECT", db)
+
+    def command(self, *args: Any) -> Any:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            value = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(value), value))
+        self.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self) -> Any:
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def close(self) -> None:
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in Redis (or any server speaking its protocol), shared by every worker.
+
+    Each session is one key with a millisecond TTL; reads use GETEX to refresh
+    it. The per-session caps are applied before writing. The global memory cap
+    and LRU eviction are the server's: run it with `maxmemory` and
+    `maxmemory-policy volatile-lru`. One connection per thread; a failed
+    command is retried once on a fresh connection.
+    """
+
+    backend = "redis"
+    blocking = True
+
+    def __init__(self, url: str = SESSION_REDIS_URL, prefix: str = "session:",
+                 timeout_s: float = SESSION_REDIS_TIMEOUT_S, **kwargs: Any):
+        super().__init__(**kwargs)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.username = parsed.username or None
+        self.password = parsed.password or None
+        self.prefix = prefix
+        self.timeout_s = timeout_s
+        self._local = threading.local()
+
+    def _command(self, *args: Any) -> Any:
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = RedisConnection(self.host, self.port, self.db, self.password, self.username,
+                                       self.timeout_s)
+                self._local.conn = conn
+            try:
+                return conn.command(*args)
+            except (ConnectionError, OSError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def _key(self, session_id: str) -> str:
+        return self.prefix + session_id
+
+    def _ttl_ms(self) -> int:
+        return max(1, int(self.ttl_s * 1000))
+
+    def get(self, session_id: str) -> Optional[History]:
+        data = self._command("GETEX", self._key(session_id), "PX", self._ttl_ms())
+        if data is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return self.decode(data)
+
+    def put(self, session_id: str, history: History) -> None:
+        self._command("SET", self._key(session_id), self.encode(history), "PX", self._ttl_ms())
+        self._count('writes')
+
+    def delete(self, session_id: str) -> None:
+        self._command("DEL", self._key(session_id))
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {**self._settings(), 'server': f"{self.host}:{self.port}/{self.db}"}
+        try:
+            info = self._command("INFO", "memory").decode("utf-8")
+            fields = dict(line.split(":", 1) for line in info.splitlines() if ":" in line)
+            stats['used_memory'] = int(fields.get('used_memory', 0))
+            stats['maxmemory'] = int(fields.get('maxmemory', 0))
+            stats['maxmemory_policy'] = fields.get('maxmemory_policy')
+        except Exception as e:
+            stats['error'] = f"{type(e).__name__}: {e}"
+        return stats
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "redis":
+        return RedisSessionStore()
+    raise ValueError(f"Unknown SESSION_BACKEND '{backend}' (expected memory, sqlite or redis)")
+
+
+_session_store: Optional[SessionStore] = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Get or create the process-wide session store selected by SESSION_BACKEND."""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = create_session_store()
+    return _session_store
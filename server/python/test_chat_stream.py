@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test script for the async chat endpoints.
+Starts the app with uvicorn against the fake OpenAI-compatible server from
+test_openai_client.py, compares time to first token with total latency on
+/api/chat/stream and measures how many /api/chat calls one worker keeps in
+flight: python test_chat_stream.py [concurrent_chats]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import threading
+
+import httpx
+
+
+def read_events(response):
+    """(event, data, seconds since request) for each SSE event of a streamed response."""
+    start = time.perf_counter()
+    event, data = None, []
+    for line in response.iter_lines():
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data.append(line[len("data: "):])
+        elif not line and event:
+            yield event, json.loads("\n".join(data)), time.perf_counter() - start
+            event, data = None, []
+
+
+def start_app():
+    import uvicorn
+    import app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{port}"
+    with httpx.Client() as client:
+        while client.get(f"{base_url}/api/ready").status_code != 200:  # warm-up competes for CPU
+            time.sleep(0.1)
+    return app, server, base_url
+
+
+def check_token_stream(app, base_url, fake):
+    """LLM tokens arrive well before the stream ends; history is written after `done`."""
+    fake.token_delay_s = 0.1
+    message = "tell me about your cloud services please"
+    with httpx.Client(timeout=10) as client:
+        with client.stream("POST", f"{base_url}/api/chat/stream",
+                           json={"message": message, "use_ml": False}) as response:
+            events = list(read_events(response))
+    fake.token_delay_s = 0.0
+    tokens = [(data["text"], at) for event, data, at in events if event == "token"]
+    done = next(data for event, data, _ in events if event == "done")
+    first_token, total = tokens[0][1], events[-1][2]
+    history = app.SESSION_STORE.get(done["session_id"]) or []
+    answer = "".join(text for text, _ in tokens)
+    print(f"\n📡 Token stream: {len(tokens)} tokens, first after {first_token * 1000:.0f} ms, "
+          f"complete after {total * 1000:.0f} ms")
+    print(f"   Server timings: ttfb {done['ttfb_ms']:.0f} ms, total {done['total_ms']:.0f} ms, "
+          f"history turns {len(history)}")
+    return (answer == f"echo: {message}" and first_token < total / 3 and done["source"] == "openai"
+            and history[-1] == {"role": "assistant", "content": answer})
+
+
+def check_disconnect(app, base_url, fake):
+    """A client that leaves mid-stream does not get a half answer saved to its session."""
+    fake.token_delay_s = 0.1
+    session_id = "stream-disconnect-test"
+    with httpx.Client(timeout=10) as client:
+        with client.stream("POST", f"{base_url}/api/chat/stream",
+                           json={"message": "one two three four five six", "use_ml": False,
+                                 "session_id": session_id}) as response:
+            for event, _, _ in read_events(response):
+                if event == "token":
+                    break
+    time.sleep(1.0)  # let the server notice
+    fake.token_delay_s = 0.0
+    saved = app.SESSION_STORE.get(session_id) or []
+    print(f"\n✂️  Client disconnected after the first token: {len(saved)} history turns saved")
+    return not saved
+
+
+def check_concurrent_chats(app, base_url, fake, chats, llm_delay_s=1.0):
+    """Chats waiting on a slow LLM overlap instead of queueing for threadpool slots."""
+    fake.delay_s = llm_delay_s
+
+    async def one(client, i):
+        response = await client.post(f"{base_url}/api/chat",
+                                     json={"message": f"question {i}", "use_ml": False})
+        return response.status_code == 200 and response.json()["response"] == f"echo: question {i}"
+
+    async def run():
+        # httpx scans its whole pool per request: shard the load generator so it is not the bottleneck
+        clients = [httpx.AsyncClient(limits=httpx.Limits(max_connections=50), timeout=60)
+                   for _ in range((chats + 49) // 50)]
+        try:
+            return await asyncio.gather(*(one(clients[i % len(clients)], i) for i in range(chats)))
+        finally:
+            for client in clients:
+                await client.aclose()
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    fake.delay_s = 0.0
+    with httpx.Client() as client:
+        pool = client.get(f"{base_url}/api/health").json()["openai"]["pool"]
+    print(f"\n🚀 {chats} concurrent /api/chat calls, LLM latency {llm_delay_s:.1f}s: "
+          f"{sum(results)} ok in {elapsed:.2f}s")
+    print(f"   LLM calls in flight at once: {pool['peak_in_flight']} "
+          f"({pool['shards']} pool shards, {pool['new_connections']} connections opened)")
+    # Sync handlers on the default threadpool would cap this at 40 calls in flight
+    return all(results) and pool['peak_in_flight'] >= chats * 0.9
+
+
+def main():
+    print("🧪 Testing Chat Streaming Endpoint")
+    print("=" * 40)
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    # Pool limits are read when openai_client is first imported
+    os.environ["OPENAI_MAX_CONNECTIONS"] = str(chats)
+    # Every request comes from 127.0.0.1: per-IP quotas would cut the load test short
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    from test_openai_client import start_fake_server
+
+    fake, fake_url = start_fake_server()
+    os.environ["OPENAI_API_KEY"] = "test-key"
+    os.environ["OPENAI_BASE_URL"] = fake_url
+    app, server, base_url = start_app()
+    ok = check_token_stream(app, base_url, fake)
+    ok = check_disconnect(app, base_url, fake) and ok
+    ok = check_concurrent_chats(app, base_url, fake, chats) and ok
+    with httpx.Client() as client:
+        print(f"\n📊 /api/health chat_stream: {client.get(f'{base_url}/api/health').json()['chat_stream']}")
+    server.should_exit = True
+    fake.shutdown()
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
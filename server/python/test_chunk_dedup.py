@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Test and benchmark script for near-duplicate chunk elimination: MinHash
+estimates, source references through removals and merges, shared-snapshot
+parity, and index size / query time on versioned brochures:
+python test_chunk_dedup.py [brochures] [versions]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+import numpy as np
+
+from chunk_dedup import KB_DEDUP_THRESHOLD, estimate_jaccard, minhash
+from kb_shared import KBSnapshot, write_snapshot
+from knowledge_base import KnowledgeBaseIndex, iter_chunks, simple_tokenize
+
+WORDS = [f"w{i}" for i in range(5000)]
+
+
+def brochure(rng, words=1200):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def revise(rng, text, edit_rate=0.01):
+    """Another version of a document: a few words replaced, inserted or dropped."""
+    out = []
+    for word in text.split():
+        r = rng.random()
+        if r < edit_rate / 3:
+            continue
+        out.append(rng.choice(WORDS) if r < 2 * edit_rate / 3 else word)
+        if r > 1 - edit_rate / 3:
+            out.append(rng.choice(WORDS))
+    return " ".join(out)
+
+
+def shingles(tokens, n=3):
+    return {tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+
+
+def check_minhash_estimates(pairs=300):
+    """8-bit MinHash estimates track the exact shingle Jaccard similarity."""
+    rng = random.Random(1)
+    errors = []
+    for _ in range(pairs):
+        a = simple_tokenize(brochure(rng, 130))
+        b = simple_tokenize(revise(rng, " ".join(a), rng.choice([0.01, 0.05, 0.2, 0.5])))
+        exact = len(shingles(a) & shingles(b)) / len(shingles(a) | shingles(b))
+        low = lambda s: (s & np.uint64(0xFF)).astype(np.uint8)  # noqa: E731
+        errors.append(abs(float(estimate_jaccard(low(minhash(a)), low(minhash(b)))) - exact))
+    mean, worst = float(np.mean(errors)), float(np.max(errors))
+    print(f"🔢 MinHash Jaccard estimate vs exact on {pairs} pairs: mean error {mean:.3f}, max {worst:.3f}")
+    return mean < 0.05
+
+
+def check_references():
+    """Copies become sources; removing the first promotes the next; the last removal tombstones."""
+    rng = random.Random(2)
+    kb = KnowledgeBaseIndex(tempfile.mkdtemp(prefix="kb-dedup-"), dense="none")
+    text = brochure(rng)
+    copy = revise(rng, text, 0.005)
+    n = kb.upsert_document("v1.txt", text)
+    kb.upsert_document("v2.txt", copy)
+    kb.upsert_document("v1_again.txt", text)
+    query = " ".join(text.split()[20:24])
+    top = kb.search(query, 1)[0]
+    ok = kb.bm25.live_chunks < 2 * n and top["id"] == "v1.txt:0"
+    ok = ok and top["sources"] == ["v1.txt:0", "v2.txt:0", "v1_again.txt:0"]
+    kb.remove_document("v1.txt")
+    top = kb.search(query, 1)[0]
+    ok = ok and top["id"] == "v2.txt:0" and top["sources"] == ["v2.txt:0", "v1_again.txt:0"]
+    live = kb.bm25.live_chunks
+    kb.upsert_document("v2.txt", copy)  # unchanged content reuses its own chunks
+    ok = ok and kb.bm25.live_chunks == live
+
+    def failing():
+        yield from ((c, simple_tokenize(c)) for c in iter_chunks([text]))
+        raise OSError("stream broke")
+
+    try:
+        kb._upsert_chunks("broken.txt", failing(), "", 0.0, 0)
+    except OSError:
+        pass
+    ok = ok and kb.bm25.live_chunks == live and "broken.txt:0" not in (kb.search(query, 1)[0].get("sources") or [])
+    kb.remove_document("v2.txt")
+    kb.remove_document("v1_again.txt")
+    ok = ok and kb.bm25.live_chunks == 0 and not kb.refs
+    print(f"🔗 Source references through copies, removals and rollback: {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def check_merge_and_snapshot(brochures=60):
+    """After a merge the base still finds duplicates, and a mapped snapshot reports the same sources."""
+    rng = random.Random(3)
+    kb = KnowledgeBaseIndex(tempfile.mkdtemp(prefix="kb-dedup-"), dense="none")
+    texts = [brochure(rng) for _ in range(brochures)]
+    for b, text in enumerate(texts):
+        kb.upsert_document(f"b{b}_v1.txt", text)
+        kb.upsert_document(f"b{b}_v2.txt", revise(rng, text, 0.005))
+    kb.remove_document("b0_v1.txt")
+    kb.compact()
+    live = kb.bm25.live_chunks
+    kb.upsert_document("b1_v3.txt", revise(rng, texts[1], 0.005))
+    ok = kb.bm25.live_chunks - live <= 2  # collapsed against the merged base segment
+    kb.compact()
+    path = os.path.join(tempfile.mkdtemp(prefix="kb-snap-"), "kb.idx")
+    write_snapshot(kb, path, generation=1)
+    snapshot = KBSnapshot(path)
+    ok = ok and all(snapshot.chunk(pos) == chunk for pos, chunk in enumerate(kb.chunks))
+    print(f"💾 Duplicates found after a merge; snapshot sources match: {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def _index(texts, dedup):
+    kb = KnowledgeBaseIndex(tempfile.mkdtemp(prefix="kb-dedup-"), dense="none", dedup=dedup)
+    start = time.perf_counter()
+    with kb.bulk_load():
+        for key, text in texts:
+            kb.upsert_document(key, text)
+    kb.compact()
+    return kb, time.perf_counter() - start
+
+
+def benchmark_brochures(brochures=200, versions=5, query_count=500):
+    """Index size, query latency and copies in the top 4, with and without dedup."""
+    rng = random.Random(4)
+    texts = []
+    for b in range(brochures):
+        text = brochure(rng)
+        for v in range(versions):
+            texts.append((f"b{b}_v{v}.txt", text))
+            text = revise(rng, text)
+    queries = [" ".join(rng.sample(text.split(), 4)) for _, text in rng.sample(texts, query_count)]
+    results = {}
+    for dedup in (False, True):
+        kb, build_s = _index(texts, dedup)
+        samples, copies = [], 0
+        for query in queries:
+            start = time.perf_counter()
+            hits = kb.search(query, 4)
+            samples.append(time.perf_counter() - start)
+            brochures_seen = [hit["doc"].split("_")[0] for hit in hits]
+            copies += len(brochures_seen) - len(set(brochures_seen))
+        results[dedup] = {
+            "chunks": kb.bm25.live_chunks,
+            "postings": len(kb.bm25.base.positions),
+            "p50": float(np.percentile(samples, 50)) * 1000.0,
+            "copies": copies / len(queries),
+            "build_s": build_s,
+            "meta": kb.meta()["dedup"],
+        }
+    off, on = results[False], results[True]
+    meta = on["meta"]
+    print(f"\n📚 {brochures} brochures x {versions} versions (1% of words edited per version), "
+          f"threshold {KB_DEDUP_THRESHOLD}:")
+    for name, r in (("no dedup", off), ("dedup", on)):
+        print(f"   {name:8}: {r['chunks']} chunks, {r['postings']} postings, build {r['build_s']:.1f} s, "
+              f"query p50 {r['p50']:.3f} ms, {r['copies']:.2f} same-brochure copies in the top 4")
+    print(f"   KB_META dedup: chunk_reduction {meta['chunk_reduction']}, postings_reduction "
+          f"{meta['postings_reduction']}, text_bytes_saved {meta['text_bytes_saved']}, "
+          f"result_slots_saved_per_query {meta['result_slots_saved_per_query']}")
+    return on["chunks"] < 0.5 * off["chunks"] and on["copies"] < off["copies"]
+
+
+def main():
+    print("🧪 Testing Chunk Deduplication")
+    print("=" * 40)
+    brochures = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    versions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    ok = check_minhash_estimates()
+    ok = check_references() and ok
+    ok = check_merge_and_snapshot() and ok
+    ok = benchmark_brochures(brochures, versions) and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
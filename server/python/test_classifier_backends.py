@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test script for classifier backend selection: measured p50/p99 latency and
+the latency budget excluding the most accurate backend, the fallback to the
+fastest backend, and an explicitly configured backend.
+"""
+
+import sys
+import time
+
+from classifier_backends import build_pipeline, measure_latency, select_backend, supports_partial_fit
+
+TEXTS = ["what are your prices", "how much does it cost", "i need help with my account",
+         "my login does not work", "tell me about machine learning", "what is a neural network"]
+LABELS = [0, 0, 1, 1, 2, 2]
+
+
+class SlowPipeline:
+    """A fitted pipeline that takes at least `delay_ms` per prediction, like a large ensemble."""
+
+    def __init__(self, pipeline, delay_ms):
+        self.pipeline = pipeline
+        self.delay_ms = delay_ms
+
+    def predict_proba(self, texts):
+        time.sleep(self.delay_ms / 1000.0)
+        return self.pipeline.predict_proba(texts)
+
+
+def check_measure_latency(samples=30):
+    """p50 <= p99, both reflect the real per-call cost; no texts measures nothing."""
+    fast = build_pipeline("multinomial_nb").fit(TEXTS, LABELS)
+    slow = SlowPipeline(fast, delay_ms=15)
+    fast_latency = measure_latency(fast, TEXTS, samples)
+    slow_latency = measure_latency(slow, TEXTS, samples)
+    empty = measure_latency(fast, [], samples)
+    print(f"⏱️  Latency over {samples} calls: multinomial_nb p50 {fast_latency['p50_ms']:.2f}ms "
+          f"p99 {fast_latency['p99_ms']:.2f}ms, 15ms pipeline p50 {slow_latency['p50_ms']:.2f}ms "
+          f"p99 {slow_latency['p99_ms']:.2f}ms; no texts {empty}")
+    return (0 < fast_latency['p50_ms'] <= fast_latency['p99_ms'] < slow_latency['p50_ms']
+            and 15 <= slow_latency['p50_ms'] <= slow_latency['p99_ms']
+            and empty == {'p50_ms': 0.0, 'p99_ms': 0.0})
+
+
+def check_budget_excludes_most_accurate(samples=30, budget_ms=10.0):
+    """The most accurate backend is skipped when its measured p99 is over budget."""
+    fast = build_pipeline("multinomial_nb").fit(TEXTS, LABELS)
+    metrics = {
+        "random_forest": {"accuracy": 0.95, **measure_latency(SlowPipeline(fast, 15), TEXTS, samples)},
+        "multinomial_nb": {"accuracy": 0.85, **measure_latency(fast, TEXTS, samples)},
+        "hashed_sgd": {"accuracy": 0.90, "p50_ms": 1.0, "p99_ms": budget_ms},  # exactly on budget fits
+    }
+    within = select_backend(metrics, budget_ms=budget_ms, preferred=None)
+    unbounded = select_backend(metrics, budget_ms=None, preferred=None)
+    over = select_backend(metrics, budget_ms=0.001, preferred=None)
+    pinned = select_backend(metrics, budget_ms=budget_ms, preferred="random_forest")
+    missing = select_backend(metrics, budget_ms=budget_ms, preferred="logistic_regression")
+    tie = select_backend({"a": {"accuracy": 0.9, "p99_ms": 3.0}, "b": {"accuracy": 0.9, "p99_ms": 2.0}},
+                         budget_ms=budget_ms, preferred=None)
+    print(f"🎚️  Budget {budget_ms}ms: {within} (random_forest p99 {metrics['random_forest']['p99_ms']:.1f}ms "
+          f"excluded); no budget {unbounded}; nothing fits {over}; ML_BACKEND=random_forest {pinned}, "
+          f"unknown ML_BACKEND {missing}; accuracy tie {tie}; no metrics {select_backend({})}")
+    return (within == "hashed_sgd" and unbounded == "random_forest" and over == "multinomial_nb"
+            and pinned == "random_forest" and missing == "hashed_sgd" and tie == "b"
+            and select_backend({}) is None)
+
+
+def check_partial_fit_support():
+    """Only hashed pipelines with an incremental classifier can learn online."""
+    supported = {name: supports_partial_fit(build_pipeline(name))
+                 for name in ("hashed_sgd", "hashed_nb", "sgd", "multinomial_nb", "random_forest")}
+    print(f"🔁 partial_fit support: {supported}")
+    return supported == {"hashed_sgd": True, "hashed_nb": True, "sgd": False, "multinomial_nb": False,
+                         "random_forest": False}
+
+
+def main():
+    print("🧪 Testing Classifier Backends")
+    print("=" * 40)
+    ok = check_measure_latency()
+    ok = check_budget_excludes_most_accurate() and ok
+    ok = check_partial_fit_support() and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
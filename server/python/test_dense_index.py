@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Test and benchmark script for dense (LSA) and hybrid KB retrieval: paraphrase
+recall against BM25, incremental updates, shared-snapshot parity, and IVF
+recall@k and latency against exact search:
+python test_dense_index.py [chunk_count ...]   (default 100000; e.g. 100000 1000000)
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+from dense_index import DenseIndex, postings_matrix
+from kb_shared import KBSnapshot, write_snapshot
+from knowledge_base import simple_tokenize
+from test_knowledge_base import build_index
+
+
+def topic_corpus(chunk_count, topics=200, words_per_dialect=20, background=20000, bridge_rate=0.02,
+                 tokens_per_chunk=(30, 60), seed=7, batch_size=10000):
+    """
+    (token lists, topic labels) batches. Each topic has two word sets for the
+    same meaning, "dialects" a and b: chunks use dialect a plus Zipf
+    background words, and only `bridge_rate` of them use both, so a
+    dialect-b query paraphrases what most of its topic's chunks say.
+    """
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"bg{i}" for i in range(background)]
+                     + [f"{d}{t}x{w}" for t in range(topics) for d in "ab" for w in range(words_per_dialect)])
+    for start in range(0, chunk_count, batch_size):
+        rows = min(batch_size, chunk_count - start)
+        labels = rng.integers(0, topics, size=rows)
+        lengths = rng.integers(tokens_per_chunk[0], tokens_per_chunk[1] + 1, size=rows)
+        bridge = rng.random(rows) < bridge_rate
+        total = int(lengths.sum())
+        owner = np.repeat(np.arange(rows), lengths)
+        ranks = rng.zipf(1.2, size=total) - 1
+        ranks[ranks >= background] = rng.integers(0, background, size=int((ranks >= background).sum()))
+        topical = rng.random(total) < 0.5
+        dialect = np.where(bridge[owner] & (rng.random(total) < 0.5), 1, 0)
+        topic_words = (background + (labels[owner] * 2 + dialect) * words_per_dialect
+                       + rng.integers(0, words_per_dialect, size=total))
+        ids = np.where(topical, topic_words, ranks)
+        ends = np.cumsum(lengths)
+        yield [list(vocab[ids[end - n:end]]) for n, end in zip(lengths, ends)], labels
+
+
+def build_topic_index(chunk_count, dense="ivf"):
+    labels = []
+
+    def batches():
+        for tokens, batch_labels in topic_corpus(chunk_count):
+            labels.extend(batch_labels.tolist())
+            yield tokens
+
+    start = time.perf_counter()
+    kb = build_index(batches(), dense=dense)
+    kb.compact()
+    return kb, np.array(labels), time.perf_counter() - start
+
+
+def _topic_of(kb, labels, hit):
+    doc, idx = hit["id"].split(":")
+    return labels[int(doc[3:-4]) * 100 + int(idx)]  # build_index puts 100 chunks in each doc
+
+
+def check_paraphrase(chunk_count=20000, query_count=200, k=10):
+    """Dialect-b queries: share of the top k that is on the query's topic, per retrieval mode."""
+    kb, labels, _ = build_topic_index(chunk_count)
+    rng = np.random.default_rng(3)
+    precision = {}
+    for mode in ("bm25", "dense", "hybrid"):
+        hits = 0
+        for q in range(query_count):
+            topic = q % 200
+            query = " ".join(f"b{topic}x{w}" for w in rng.choice(20, 3, replace=False))
+            hits += sum(_topic_of(kb, labels, r) == topic for r in kb.search(query, k, mode))
+        precision[mode] = hits / (query_count * k)
+    print(f"🗣️  Paraphrased queries, on-topic share of the top {k}: "
+          + ", ".join(f"{mode} {p:.0%}" for mode, p in precision.items()))
+    return precision["dense"] > 2 * precision["bm25"] and precision["hybrid"] > 2 * precision["bm25"]
+
+
+def check_updates():
+    """Chunks added after the fit are found; deleted ones are not; growth refits the projection."""
+    kb, labels, _ = build_topic_index(4000, dense="flat")
+    fits = kb.dense.fits
+    text = " ".join(f"a7x{w}" for w in range(20)) + " brandnewterm"
+    kb.upsert_document("added.txt", text)
+    ok = kb.dense.size == kb.bm25.chunk_count
+    ok = ok and kb.search(text, 1, "dense")[0]["doc"] == "added.txt"
+    kb.remove_document("added.txt")
+    ok = ok and all(r["doc"] != "added.txt" for r in kb.search(text, 5, "hybrid"))
+    for tokens, _ in topic_corpus(4000, seed=9):
+        for start in range(0, len(tokens), 100):
+            kb._upsert_chunks(f"more{start}.txt", ((" ".join(t), t) for t in tokens[start:start + 100]), "", 0.0, 0)
+    kb.compact()
+    ok = ok and kb.dense.fits == fits + 1 and kb.dense.size == kb.bm25.chunk_count
+    print(f"🔁 Incremental updates and refit: {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def check_snapshot_parity(query_count=200):
+    """A mapped snapshot ranks dense and hybrid queries exactly like the in-memory index."""
+    kb, _, _ = build_topic_index(30000)
+    path = os.path.join(tempfile.mkdtemp(prefix="kb-snap-"), "kb.idx")
+    write_snapshot(kb, path, generation=1)
+    snapshot = KBSnapshot(path)
+    from dense_index import hybrid_search
+    rng = np.random.default_rng(5)
+    mismatches = 0
+    for q in range(query_count):
+        tokens = [f"{'ab'[q % 2]}{rng.integers(200)}x{rng.integers(20)}", f"bg{rng.integers(50)}"]
+        for mode in ("dense", "hybrid"):
+            expected = [(r["id"], r["score"]) for r in kb.search(" ".join(tokens), 5, mode)]
+            got = [(snapshot.chunk(p)["id"], s) for p, s in hybrid_search(snapshot.bm25, snapshot.dense, tokens, 5, mode)]
+            mismatches += got != expected
+    print(f"🎯 Mapped snapshot vs in-memory dense/hybrid: {mismatches} of {2 * query_count} queries differ "
+          f"(ivf lists {snapshot.dense.ivf.lists if snapshot.dense.ivf else 0})")
+    return mismatches == 0
+
+
+def _percentiles(samples):
+    return np.percentile(np.array(samples) * 1000.0, 50), np.percentile(np.array(samples) * 1000.0, 95)
+
+
+def benchmark(chunk_count, query_count=300, k=10):
+    """Recall@k of int8 and IVF search against exact float32 search; latency per retrieval mode."""
+    kb, labels, build_s = build_topic_index(chunk_count)
+    dense = kb.dense
+    exact = dense.model.transform(postings_matrix(kb.bm25.base))  # float32 vectors, exact reference
+    print(f"\n📊 {chunk_count} chunks: built in {build_s:.0f} s (last dense fit {dense.last_fit['duration_ms'] / 1000:.1f} s), "
+          f"{dense.ivf.lists if dense.ivf else 0} IVF lists, vectors {dense.get_stats()['bytes'] / 1e6:.0f} MB int8 "
+          f"vs {exact.nbytes / 1e6:.0f} MB float32")
+    rng = np.random.default_rng(11)
+    queries = []
+    for q in range(query_count):
+        topic = int(rng.integers(200))
+        words = [f"{'ab'[q % 2]}{topic}x{w}" for w in rng.choice(20, 2, replace=False)]
+        queries.append(simple_tokenize(" ".join(words + [f"bg{rng.integers(1000)}"])))
+    vectors = [dense.embed_query(tokens, kb.bm25.term_ids) for tokens in queries]
+    exact_scores = [exact @ v for v in vectors]
+    truth = [set(np.argpartition(-scores, k)[:k].tolist()) for scores in exact_scores]
+    alive = kb.bm25.alive.view()
+
+    # Strict recall@k counts exact top-k ids; on near-tied neighbours int8
+    # rounding alone reorders them, so the ANN loss is also measured against
+    # the int8 flat scan, and quality as the cosine shortfall of the k-th hit
+    flat = DenseIndex.read_only("flat", dense.model, dense.codes[:dense.size], dense.scales[:dense.size], None)
+    flat_hits = [{pos for pos, _ in flat.search(v, k, alive)} for v in vectors]
+    ok = True
+    for name, index in [("int8 flat", flat)] + [(f"ivf nprobe={n}", DenseIndex.read_only(
+            "ivf", dense.model, dense.codes[:dense.size], dense.scales[:dense.size], dense.ivf, n))
+            for n in (4, 16, 64)]:
+        found, overlap, shortfall, samples = 0, 0, [], []
+        for scores, expected, reference, v in zip(exact_scores, truth, flat_hits, vectors):
+            start = time.perf_counter()
+            hits = {pos for pos, _ in index.search(v, k, alive)}
+            samples.append(time.perf_counter() - start)
+            found += len(expected & hits)
+            overlap += len(reference & hits)
+            shortfall.append(np.sort(scores[list(expected)])[0] - np.sort(scores[list(hits)])[0])
+        recall, vs_flat = found / (k * len(vectors)), overlap / (k * len(vectors))
+        p50, p95 = _percentiles(samples)
+        print(f"   {name:15} recall@{k} {recall:.3f} (vs int8 flat {vs_flat:.3f}, k-th cosine -{np.mean(shortfall):.4f})"
+              f"   p50 {p50:.2f} ms  p95 {p95:.2f} ms")
+        if name == f"ivf nprobe={dense.nprobe}":
+            ok = ok and vs_flat >= 0.8 and np.mean(shortfall) < 0.01
+    for mode in ("bm25", "dense", "hybrid"):
+        samples = []
+        for tokens in queries:
+            start = time.perf_counter()
+            kb.search(" ".join(tokens), 5, mode)
+            samples.append(time.perf_counter() - start)
+        p50, p95 = _percentiles(samples)
+        print(f"   search {mode:8} top 5   p50 {p50:.2f} ms  p95 {p95:.2f} ms")
+    return ok
+
+
+def main():
+    print("🧪 Testing Dense Retrieval")
+    print("=" * 40)
+    chunk_counts = [int(arg) for arg in sys.argv[1:]] or [100000]
+    ok = check_paraphrase()
+    ok = check_updates() and ok
+    ok = check_snapshot_parity() and ok
+    for chunk_count in chunk_counts:
+        ok = benchmark(chunk_count) and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
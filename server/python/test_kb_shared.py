@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared memory-mapped knowledge base index: results
+identical to the in-memory index, new generations picked up by other
+workers, a single build when workers start together, and per-worker memory
+as workers are added: python test_kb_shared.py [chunk_count]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import multiprocessing
+
+from knowledge_base import simple_tokenize
+from kb_shared import KBSnapshot, SharedKnowledgeBase, write_snapshot
+from test_knowledge_base import build_index, synthetic_corpus
+
+
+def _queries(count, chunk_count, seed=5):
+    random.seed(seed)
+    sample = next(synthetic_corpus(chunk_count, batch_size=min(chunk_count, 10000)))[:1000]
+    return [" ".join(random.choice(random.choice(sample)) for _ in range(random.randint(1, 5)))
+            for _ in range(count)]
+
+
+def check_parity(chunk_count=20000, query_count=300):
+    """Mapped snapshot returns exactly the in-memory index's ids and scores."""
+    kb = build_index(synthetic_corpus(chunk_count, batch_size=chunk_count // 4))
+    for d in range(0, len(kb.docs), 5):
+        kb.remove_document(f"doc{d}.txt")
+    kb.compact()
+    path = os.path.join(tempfile.mkdtemp(prefix="kb-snap-"), "kb.idx")
+    size = write_snapshot(kb, path, generation=1)
+    snapshot = KBSnapshot(path)
+    mismatches = 0
+    start = time.perf_counter()
+    for query in _queries(query_count, chunk_count):
+        expected = kb.search(query, 5)
+        hits = snapshot.bm25.search(simple_tokenize(query), 5)
+        got = [{"score": score, **snapshot.chunk(pos)} for pos, score in hits]
+        if got != expected:
+            mismatches += 1
+    per_query_ms = (time.perf_counter() - start) / query_count * 1000.0
+    print(f"🎯 Mapped vs in-memory index ({kb.chunk_count} chunks, {size / 1e6:.1f} MB file): "
+          f"{mismatches} of {query_count} queries differ ({per_query_ms:.2f} ms per query pair)")
+    return mismatches == 0 and snapshot.bm25.live_chunks == kb.chunk_count
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def check_generations():
+    """A worker sees another worker's update as a new generation; old mappings stay readable."""
+    root = tempfile.mkdtemp(prefix="kb-shared-")
+    knowledge_dir, shared_dir = os.path.join(root, "knowledge"), os.path.join(root, "shared")
+    os.makedirs(knowledge_dir)
+    for i in range(20):
+        _write(os.path.join(knowledge_dir, f"doc{i}.txt"), f"Document {i} about copper scrap grade {i}.")
+    options = dict(shared_dir=shared_dir, cache_dir=os.path.join(root, "cache"))
+    # The reader only picks up new generations when refreshed explicitly below
+    writer = SharedKnowledgeBase(knowledge_dir, **options)
+    reader = SharedKnowledgeBase(knowledge_dir, check_interval_s=3600, **options)
+    writer.sync()
+    reader.sync()
+    before = reader.generation
+    old = reader._snapshot
+    _write(os.path.join(knowledge_dir, "new.txt"), "Brass turnings collection schedule.")
+    report = writer.index_file(os.path.join(knowledge_dir, "new.txt"))
+    stale = reader.search("brass")
+    swapped = reader.refresh()
+    fresh = reader.search("brass")
+    writer.delete_document("doc0.txt")
+    writer.delete_document("doc1.txt")  # generation 4: the one `old` maps is deleted from disk
+    old_still_readable = bool(old.bm25.search(["copper"], 3)) and not os.path.exists(old.path)
+    restarted = SharedKnowledgeBase(knowledge_dir, **options)
+    meta = restarted.sync()
+    print(f"🔄 Generations: reader on {before}, writer added a file ({report['status']}); before the check "
+          f"{len(stale)} hits, after refresh (swapped {swapped}) {len(fresh)} (generation {reader.generation}); "
+          f"deleted generation still readable by its mapping: {old_still_readable}")
+    print(f"   Restarted worker: mapped generation {meta['generation']} "
+          f"({meta['chunk_count']} chunks) with {meta['shared']['builds']} builds")
+    return (report["status"] == "added" and not stale and swapped and fresh and fresh[0]["doc"] == "new.txt"
+            and old_still_readable and meta["shared"]["builds"] == 0 and meta["chunk_count"] == 19)
+
+
+def _sync_worker(knowledge_dir, shared_dir, cache_dir, queue):
+    kb = SharedKnowledgeBase(knowledge_dir, shared_dir=shared_dir, cache_dir=cache_dir)
+    meta = kb.sync()
+    queue.put((meta["shared"]["builds"], meta["generation"]))
+
+
+def check_single_build(workers=4):
+    """Workers starting together build the index once; the others map it."""
+    root = tempfile.mkdtemp(prefix="kb-start-")
+    knowledge_dir = os.path.join(root, "knowledge")
+    os.makedirs(knowledge_dir)
+    for i in range(200):
+        _write(os.path.join(knowledge_dir, f"doc{i}.txt"), f"Document {i} " * 200)
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    processes = [context.Process(target=_sync_worker, args=(knowledge_dir, os.path.join(root, "shared"),
+                                                            os.path.join(root, "cache"), queue))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    builds = sum(b for b, _ in results)
+    print(f"🚀 {workers} workers started at once: {builds} build(s), generations {sorted(g for _, g in results)}")
+    return builds == 1 and all(g == 1 for _, g in results)
+
+
+def _memory_kb(kind):
+    """/proc/self/smaps_rollup totals in MB (Linux)."""
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024.0
+    return {
+        "kind": kind,
+        "rss": values.get("Rss", 0.0),
+        "pss": values.get("Pss", 0.0),
+        "private": values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0),
+    }
+
+
+def _memory_worker(mode, chunk_count, path, queries, barrier, queue):
+    baseline = _memory_kb("baseline")
+    if mode == "memory":
+        kb = build_index(synthetic_corpus(chunk_count))
+        search = kb.search
+    else:
+        snapshot = KBSnapshot(path)
+        snapshot._text_blob.sum()  # fault in the chunk texts too, as a long-running worker would
+
+        def search(query, top_n):
+            hits = snapshot.bm25.search(simple_tokenize(query), top_n)
+            return [{"score": score, **snapshot.chunk(pos)} for pos, score in hits]
+    for query in queries:
+        search(query, 5)
+    barrier.wait()  # every worker is mapped and warm: shared pages are counted once
+    queue.put((baseline, _memory_kb(mode)))
+    barrier.wait()
+
+
+def benchmark_worker_memory(chunk_count=100000, worker_counts=(1, 2, 4)):
+    """Per-worker memory with its own index vs the shared mapping."""
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("   /proc/self/smaps_rollup not available, skipping memory benchmark")
+        return True
+    print(f"\n🏗️  Building {chunk_count} synthetic chunks and publishing them...")
+    kb = build_index(synthetic_corpus(chunk_count))
+    kb.compact()
+    path = os.path.join(tempfile.mkdtemp(prefix="kb-mem-"), "kb.idx")
+    size_mb = write_snapshot(kb, path, generation=1) / 1e6
+    del kb
+    queries = _queries(200, chunk_count)
+    context = multiprocessing.get_context("spawn")
+    print(f"\n🧠 Memory per worker above its baseline (snapshot file {size_mb:.0f} MB):")
+    runs = [("memory", 1)] + [("mmap", n) for n in worker_counts]
+    growth = {}
+    for mode, workers in runs:
+        queue, barrier = context.Queue(), context.Barrier(workers)
+        processes = [context.Process(target=_memory_worker,
+                                     args=(mode, chunk_count, path, queries, barrier, queue))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        results = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        rss = sum(r["rss"] - b["rss"] for b, r in results) / workers
+        pss = sum(r["pss"] - b["pss"] for b, r in results) / workers
+        private = sum(r["private"] - b["private"] for b, r in results) / workers
+        growth[(mode, workers)] = (pss, private)
+        print(f"   {mode:6} x{workers}: RSS +{rss:.0f} MB, PSS +{pss:.0f} MB, private +{private:.0f} MB"
+              + (" (each worker holds its own copy)" if mode == "memory" else ""))
+    largest = max(worker_counts)
+    # Shared pages are charged 1/n to each worker, and nothing of the index is private
+    return (growth[("mmap", largest)][1] < 0.1 * growth[("memory", 1)][1]
+            and growth[("mmap", largest)][0] < growth[("mmap", 1)][0] / largest * 1.5)
+
+
+def main():
+    print("🧪 Testing Shared KB Index")
+    print("=" * 40)
+    chunk_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    ok = check_parity()
+    ok = check_generations() and ok
+    ok = check_single_build() and ok
+    ok = benchmark_worker_memory(chunk_count) and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
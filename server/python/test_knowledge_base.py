@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Test and benchmark script for the knowledge base BM25 index.
+Checks scores against rank_bm25.BM25Okapi and measures query latency on a
+synthetic corpus: python test_knowledge_base.py [chunk_count]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+import numpy as np
+
+import knowledge_base
+from knowledge_base import KnowledgeBaseIndex, simple_tokenize
+
+
+def synthetic_corpus(chunk_count, vocab_size=50000, tokens_per_chunk=(20, 60), seed=7, batch_size=10000):
+    """Zipf-distributed token lists of varying length, roughly like natural text, yielded in batches."""
+    rng = np.random.default_rng(seed)
+    vocab = [f"t{i}" for i in range(vocab_size)]
+    for start in range(0, chunk_count, batch_size):
+        rows = min(batch_size, chunk_count - start)
+        lengths = rng.integers(tokens_per_chunk[0], tokens_per_chunk[1] + 1, size=rows)
+        ranks = rng.zipf(1.2, size=int(lengths.sum())) - 1
+        tail = ranks >= vocab_size  # resample the unbounded Zipf tail uniformly
+        ranks[tail] = rng.integers(0, vocab_size, size=int(tail.sum()))
+        ends = np.cumsum(lengths)
+        yield [[vocab[r] for r in ranks[end - n:end]] for n, end in zip(lengths, ends)]
+
+
+def build_index(batches, chunks_per_doc=100, **kwargs):
+    kb = KnowledgeBaseIndex(tempfile.mkdtemp(prefix="kb-test-"), **kwargs)
+    doc = 0
+    with kb.bulk_load():
+        for batch in batches:
+            for start in range(0, len(batch), chunks_per_doc):
+                part = batch[start:start + chunks_per_doc]
+                kb._upsert_chunks(f"doc{doc}.txt", ((" ".join(t), t) for t in part), "", 0.0, 0)
+                doc += 1
+    if kb._merge_thread is not None:
+        kb._merge_thread.join()
+    return kb
+
+
+def compare_with_bm25okapi(kb, token_lists, query_count, seed):
+    """Scores must agree with BM25Okapi to float rounding; ids may only differ among near-ties."""
+    from rank_bm25 import BM25Okapi
+    live = [(chunk["id"], tokens) for chunk, tokens in zip(kb.chunks, token_lists) if chunk is not None]
+    reference = BM25Okapi([tokens for _, tokens in live])
+    position = {chunk_id: i for i, (chunk_id, _) in enumerate(live)}
+    random.seed(seed)
+    mismatches = 0
+    for _ in range(query_count):
+        query = " ".join(random.choice(random.choice(live)[1]) for _ in range(random.randint(1, 5)))
+        terms = set(simple_tokenize(query))
+        scores = reference.get_scores(simple_tokenize(query))
+        expected = [
+            s for i, s in sorted(enumerate(scores), key=lambda x: x[1], reverse=True)
+            if terms & set(live[i][1])
+        ][:5]
+        results = kb.search(query, 5)
+        close = len(expected) == len(results) and all(
+            abs(s - r["score"]) <= 1e-9 * max(1.0, abs(s)) and
+            abs(scores[position[r["id"]]] - r["score"]) <= 1e-9 * max(1.0, abs(s))
+            for s, r in zip(expected, results)
+        )
+        if not close:
+            mismatches += 1
+    return mismatches
+
+
+def check_bm25_parity(chunk_count=6000, query_count=200):
+    """Parity on a fresh index, then after deletes, a merge and more additions."""
+    try:
+        import rank_bm25  # noqa: F401
+    except ImportError:
+        print("   rank_bm25 not installed (requirements-dev.txt), skipping parity check")
+        return True
+    min_tail = knowledge_base.KB_MERGE_MIN_TAIL
+    batches = list(synthetic_corpus(chunk_count, vocab_size=5000, batch_size=chunk_count // 2))
+    knowledge_base.KB_MERGE_MIN_TAIL = chunk_count  # keep the second half in the tail until merged below
+    kb = build_index(batches[:1])
+    kb.merge()  # first half in the base segment, second half in the tail
+    first_docs = len(kb.docs)
+    with kb.bulk_load():
+        for start in range(0, len(batches[1]), 100):
+            part = batches[1][start:start + 100]
+            kb._upsert_chunks(f"doc{first_docs + start // 100}.txt", ((" ".join(t), t) for t in part), "", 0.0, 0)
+    token_lists = [t for batch in batches for t in batch]
+
+    def current_tokens():
+        # Chunk ids are "doc<d>.txt:<i>" with 100 chunks per document
+        return [None if c is None else token_lists[int(c["doc"][3:-4]) * 100 + int(c["id"].rsplit(":", 1)[1])]
+                for c in kb.chunks]
+
+    ok = True
+    steps = [("base + tail", None)]
+    steps.append(("after deletes", lambda: [kb.remove_document(f"doc{d}.txt") for d in range(0, first_docs * 2, 7)]))
+    steps.append(("after merge", kb.merge))
+    for label, action in steps:
+        if action is not None:
+            action()
+        mismatches = compare_with_bm25okapi(kb, current_tokens(), query_count, seed=len(label))
+        print(f"\n🎯 BM25Okapi parity {label} ({query_count} queries, {kb.chunk_count} chunks): {mismatches} mismatches")
+        ok = ok and mismatches == 0
+    knowledge_base.KB_MERGE_MIN_TAIL = min_tail
+    return ok
+
+
+def check_ingestion():
+    """Per-file timeout, pool restart and failure reasons of process-pool ingestion."""
+    import threading
+    from kb_ingest import IngestPool, IngestTimeout
+
+    pool = IngestPool(workers=2, timeout_s=1.0)
+    results = {}
+
+    def quick():
+        time.sleep(0.3)  # lands on the pool that the slow call gets terminated
+        results["quick"] = pool.run(sum, [1, 2, 3])
+
+    worker = threading.Thread(target=quick)
+    worker.start()
+    try:
+        pool.run(time.sleep, 5)
+        timed_out = False
+    except IngestTimeout:
+        timed_out = True
+    worker.join()
+    pool.close()
+    print(f"\n⏱️  Slow task timed out: {timed_out}, concurrent task resubmitted: {results.get('quick') == 6}")
+
+    knowledge_dir = tempfile.mkdtemp(prefix="kb-ingest-")
+    with open(os.path.join(knowledge_dir, "good.txt"), "w", encoding="utf-8") as f:
+        f.write("Steel pipes and copper wire price list. " * 50)
+    with open(os.path.join(knowledge_dir, "broken.pdf"), "wb") as f:
+        f.write(b"%PDF-1.4 not really a pdf")
+    kb = KnowledgeBaseIndex(knowledge_dir, ingest_workers=2)
+    meta = kb.sync()
+    kb.close()
+    files = {r["doc"]: r for r in meta["last_sync"]["files"]}
+    print(f"📄 Sync: {meta['last_sync']['added']} added, {meta['last_sync']['failed']} failed")
+    for doc, report in files.items():
+        print(f"   {doc}: {report['status']} {report.get('error', '')}")
+    return (timed_out and results.get("quick") == 6 and files["good.txt"]["status"] == "added"
+            and files["broken.pdf"]["status"] == "failed" and files["broken.pdf"]["error"])
+
+
+def write_synthetic_text(path, megabytes, seed=3):
+    """A large plain-text document of random words, written in blocks."""
+    rng = random.Random(seed)
+    words = [f"{w}{i}" for w in ("steel", "copper", "pipe", "wire", "price", "order", "valve") for i in range(300)]
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(megabytes * 16):
+            f.write(" ".join(rng.choice(words) for _ in range(9000)) + "\n")
+
+
+def write_synthetic_pdf(path, pages, lines_per_page=45, seed=3):
+    """A multi-page text PDF built by hand (one Helvetica content stream per page)."""
+    rng = random.Random(seed)
+    words = [f"{w}{i}" for w in ("steel", "copper", "pipe", "wire", "price", "order", "valve") for i in range(300)]
+    offsets = []
+    with open(path, "wb") as f:
+        def obj(num, body):
+            offsets.append((num, f.tell()))
+            f.write(f"{num} 0 obj\n".encode() + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(pages))
+        obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+        obj(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        for i in range(pages):
+            lines = [" ".join(rng.choice(words) for _ in range(12)) for _ in range(lines_per_page)]
+            stream = ("BT /F1 9 Tf 40 800 Td 16 TL " + " ".join(f"({line}) ' " for line in lines) + "ET").encode()
+            obj(4 + 2 * i, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                           f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode())
+            obj(5 + 2 * i, f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+        xref = f.tell()
+        f.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+        for _, offset in sorted(offsets):
+            f.write(f"{offset:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+def _extract_whole_document(path):
+    """Pre-streaming extraction: the whole text, every chunk and every token list at once."""
+    if path.endswith(".pdf"):
+        from pypdf import PdfReader
+        text = "\n".join(p.extract_text() or "" for p in PdfReader(path).pages)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+    texts = [chunk.strip() for chunk in knowledge_base.chunk_text(text)]
+    return texts, [simple_tokenize(t) for t in texts]
+
+
+def _peak_memory_child(mode, path, queue):
+    import resource
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == "whole":
+        chunks = len(_extract_whole_document(path)[0])
+    else:
+        chunks = knowledge_base.extract_document(path, path + ".kbx", max_pages=10 ** 6)["chunks"]
+        os.remove(path + ".kbx")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((chunks, before / 1024.0, peak / 1024.0, time.perf_counter() - start))
+
+
+def benchmark_peak_memory(text_mb=64, pdf_pages=2000):
+    """Peak RSS growth while extracting a large file, whole-document vs streaming, each in a fresh process."""
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    workdir = tempfile.mkdtemp(prefix="kb-mem-")
+    text_path = os.path.join(workdir, "large.txt")
+    pdf_path = os.path.join(workdir, "large.pdf")
+    write_synthetic_text(text_path, text_mb)
+    write_synthetic_pdf(pdf_path, pdf_pages)
+    print("\n🧠 Peak RSS while extracting (growth over the worker's baseline):")
+    results = {}
+    for path in (text_path, pdf_path):
+        size_mb = os.path.getsize(path) / 1e6
+        for mode in ("whole", "streaming"):
+            queue = context.Queue()
+            child = context.Process(target=_peak_memory_child, args=(mode, path, queue))
+            child.start()
+            chunks, base_mb, peak_mb, seconds = queue.get()
+            child.join()
+            results[(path, mode)] = (chunks, peak_mb)
+            print(f"   {os.path.basename(path)} ({size_mb:.0f} MB) {mode}: {chunks} chunks, "
+                  f"peak {peak_mb:.0f} MB (+{peak_mb - base_mb:.0f} MB), {seconds:.1f}s")
+    return all(results[(p, "whole")][0] == results[(p, "streaming")][0] for p in (text_path, pdf_path))
+
+
+def check_streaming_chunks(trials=2000):
+    """iter_chunks() over arbitrary pieces must match chunk_text() over the joined text."""
+    rng = random.Random(11)
+    mismatches = 0
+    for _ in range(trials):
+        text = "".join(rng.choice("ab c\n  d\t") for _ in range(rng.randint(0, 3000)))
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 20))))
+        pieces = [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+        max_chars = rng.choice([5, 50, 800])
+        overlap = rng.choice([0, 2, min(150, max_chars - 1)])
+        if list(knowledge_base.iter_chunks(pieces, max_chars, overlap)) != knowledge_base.chunk_text(text, max_chars, overlap):
+            mismatches += 1
+    print(f"\n🧩 Streaming chunker vs chunk_text ({trials} random splits): {mismatches} mismatches")
+    return mismatches == 0
+
+
+def check_queries_during_ingest(chunk_count=3000, delay_s=0.001):
+    """A slowly read document must not hold up queries, and survives a merge part way through."""
+    import threading
+
+    kb = build_index(synthetic_corpus(20000, vocab_size=5000))
+    token_lists = next(synthetic_corpus(chunk_count, vocab_size=5000, seed=9, batch_size=chunk_count))
+
+    def slow_stream():
+        for i, tokens in enumerate(token_lists):
+            time.sleep(delay_s)  # a large file read from disk
+            if i == chunk_count // 2:
+                kb.merge()  # positions of the chunks spliced so far move
+            yield " ".join(tokens), tokens
+
+    writer = threading.Thread(target=kb._upsert_chunks, args=("slow.txt", slow_stream(), "", 0.0, 0))
+    writer.start()
+    timings = []
+    while writer.is_alive():
+        start = time.perf_counter()
+        kb.search("t1 t20 t300", 5)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    writer.join()
+    positions = kb.docs["slow.txt"]["chunks"]
+    ids_ok = [kb.chunks[p]["id"] for p in positions] == [f"slow.txt:{i}" for i in range(chunk_count)]
+    worst = max(timings)
+    print(f"\n🚰 Queries while a {chunk_count}-chunk document streams in ({chunk_count * delay_s:.0f}s+): "
+          f"{len(timings)} queries, max {worst:.1f} ms, chunk ids {'ok' if ids_ok else 'FAILED'}")
+    return ids_ok and worst < 0.5 * chunk_count * delay_s * 1000.0
+
+
+def benchmark_query_latency(chunk_count=1_000_000, query_count=500):
+    """p50/p99 query latency on a synthetic corpus."""
+    print(f"\n🏗️  Building {chunk_count} synthetic chunks...")
+    start = time.perf_counter()
+    kb = build_index(synthetic_corpus(chunk_count))
+    print(f"   Indexed in {time.perf_counter() - start:.1f}s")
+
+    random.seed(5)
+    sample = next(synthetic_corpus(chunk_count))[:1000]  # indexed chunks
+    queries = [
+        " ".join(random.choice(random.choice(sample)) for _ in range(random.randint(2, 5)))
+        for _ in range(query_count)
+    ]
+    for query in queries[:50]:  # warm up
+        kb.search(query, 5)
+    # Queries with at least one term in under 1% of chunks behave like natural
+    # questions; head-only queries ("the and of") are the worst case
+    selective, head_only = [], []
+    for query in queries:
+        min_df = min(kb.bm25.df[kb.bm25.term_ids[t]] for t in simple_tokenize(query))
+        start = time.perf_counter()
+        kb.search(query, 5)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        (selective if min_df < 0.01 * chunk_count else head_only).append(elapsed)
+    print(f"\n⚡ Query latency ({query_count} queries, top 5):")
+    for label, timings in (("selective", selective), ("head-only", head_only)):
+        if timings:
+            p50, p99 = np.percentile(timings, [50, 99])
+            print(f"   {label} ({len(timings)}): p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+    return selective, head_only
+
+
+def main():
+    print("🧪 Testing Matex Knowledge Base Index")
+    print("=" * 40)
+    chunk_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    ok = check_bm25_parity()
+    ok = check_ingestion() and ok
+    ok = check_streaming_chunks() and ok
+    ok = check_queries_during_ingest() and ok
+    ok = benchmark_peak_memory() and ok
+    benchmark_query_latency(chunk_count)
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test script for the SQLite lead store: the one-time leads.json migration
+(including workers racing to run it), keyset pagination with filters, and
+the admin-only NDJSON export.
+"""
+
+import os
+import sys
+import json
+import tempfile
+import multiprocessing
+
+from lead_store import LeadStore
+
+
+def lead(i, email=None):
+    return {"name": f"Lead {i}", "email": email or f"lead{i}@example.com", "company": "Acme",
+            "details": "Wants a quote", "language": "en",
+            "created_at": f"2026-01-{1 + i // 100:02d}T00:00:{i % 60:02d}"}
+
+
+def _open_store(db_path, legacy_path):
+    LeadStore(db_path, legacy_json_path=legacy_path)
+
+
+def check_migration(workers=4):
+    """leads.json is imported exactly once, even when several workers start at the same time."""
+    data_dir = tempfile.mkdtemp(prefix="leads-")
+    db_path, legacy_path = os.path.join(data_dir, "leads.db"), os.path.join(data_dir, "leads.json")
+    legacy = [lead(i) for i in range(50)] + ["not a lead"]
+    with open(legacy_path, "w", encoding="utf-8") as f:
+        json.dump(legacy, f)
+    processes = [multiprocessing.Process(target=_open_store, args=(db_path, legacy_path)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    store = LeadStore(db_path, legacy_json_path=legacy_path)
+    imported = store.count()
+    renamed = not os.path.exists(legacy_path) and os.path.exists(legacy_path + ".migrated")
+
+    # A leads.json that reappears later is not imported again: the migrations row guards it
+    with open(legacy_path, "w", encoding="utf-8") as f:
+        json.dump([lead(100)], f)
+    store = LeadStore(db_path, legacy_json_path=legacy_path)
+    first = store.page(limit=1)["leads"][0]
+    print(f"📥 Migration with {workers} workers racing: {imported} of 50 leads imported, file renamed {renamed}; "
+          f"reappearing leads.json imported again: {store.count() != imported}")
+    return (imported == 50 and renamed and store.count() == 50 and os.path.exists(legacy_path)
+            and first["email"] == "lead0@example.com" and first["created_at"] == legacy[0]["created_at"])
+
+
+def check_pagination(total=250, limit=100):
+    """Cursors visit every lead once, are not shifted by new inserts, and combine with filters."""
+    store = LeadStore(os.path.join(tempfile.mkdtemp(prefix="leads-"), "leads.db"))
+    ids = [store.add(lead(i)) for i in range(total)]
+    seen, pages, cursor = [], 0, 0
+    while True:
+        result = store.page(limit=limit, cursor=cursor)
+        seen.extend(r["id"] for r in result["leads"])
+        pages += 1
+        if pages == 1:
+            store.add(lead(total))  # arrives while paging; shows up at the end
+        if result["next_cursor"] is None:
+            break
+        cursor = result["next_cursor"]
+    in_order = seen == ids + [ids[-1] + 1]
+
+    store.add(lead(total + 1, email="  Repeat@Example.com"))
+    store.add(lead(total + 2, email="repeat@example.com"))
+    by_email = store.page(email="REPEAT@example.com ")["leads"]
+    window = store.page(limit=1000, since="2026-01-02", until="2026-01-03")["leads"]
+    streamed = [r["id"] for r in store.iter_leads(batch_size=7)]
+    exact = store.page(limit=len(streamed))
+    print(f"📄 {total + 1} leads in pages of {limit}: {len(seen)} seen in {pages} pages, once each in id order "
+          f"{in_order}; email filter {len(by_email)} (case-insensitive), created_at window {len(window)}, "
+          f"iter_leads {len(streamed)}")
+    return (in_order and pages == 3 and [r["name"] for r in by_email] == [f"Lead {total + 1}", f"Lead {total + 2}"]
+            and len(window) == 100 and all(r["created_at"].startswith("2026-01-02") for r in window)
+            and streamed == sorted(streamed) and len(streamed) == store.count()
+            and exact["next_cursor"] is None)
+
+
+def check_export():
+    """format=ndjson streams every match, one JSON object per line, and requires the admin token."""
+    from fastapi.testclient import TestClient
+    import app
+    import lead_store
+
+    store = LeadStore(os.path.join(tempfile.mkdtemp(prefix="leads-"), "leads.db"))
+    lead_store._lead_store = store
+    app.LEADS_ADMIN_TOKEN = "test-admin-token"
+    client = TestClient(app.app)
+    created = [client.post("/api/leads", json={"name": f"Lead {i}", "email": f"LEAD{i}@example.com",
+                                               "language": "de" if i % 3 else "en"}).json() for i in range(1200)]
+    headers = {"X-Admin-Token": "test-admin-token"}
+    response = client.get("/api/leads?format=ndjson", headers=headers)
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    filtered = client.get("/api/leads?format=ndjson&email=lead5@example.com", headers=headers).text.splitlines()
+    page = client.get("/api/leads?limit=5", headers=headers).json()
+    denied = client.get("/api/leads?format=ndjson", headers={"X-Admin-Token": "wrong"}).status_code
+    bad_format = client.get("/api/leads?format=csv", headers=headers).status_code
+    print(f"📤 NDJSON export of {len(created)} leads: {len(rows)} lines ({response.headers['content-type']}), "
+          f"email filter {len(filtered)} line(s), page of {len(page['leads'])} with next_cursor "
+          f"{page['next_cursor']}; wrong token {denied}, bad format {bad_format}")
+    return (all(c["ok"] for c in created) and response.status_code == 200
+            and response.headers["content-type"].startswith("application/x-ndjson")
+            and [r["id"] for r in rows] == [c["id"] for c in created]
+            and rows[7]["email"] == "lead7@example.com" and rows[7]["language"] == "de"
+            and len(filtered) == 1 and len(page["leads"]) == 5 and page["next_cursor"] == page["leads"][-1]["id"]
+            and denied == 401 and bad_format == 400)
+
+
+def main():
+    print("🧪 Testing Lead Store")
+    print("=" * 40)
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    ok = check_migration()
+    ok = check_pagination() and ok
+    ok = check_export() and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
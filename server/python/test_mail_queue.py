@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Test script for the background mail dispatcher against a local SMTP sink
+(aiosmtpd, with STARTTLS and AUTH when openssl is available): connection
+reuse, batching, retries, a full queue, idle reconnects and OTP latency of
+the app compared with one SMTP connection per message.
+Requires: pip install aiosmtpd
+"""
+
+import os
+import sys
+import ssl
+import time
+import socket
+import asyncio
+import smtplib
+import logging
+import tempfile
+import threading
+import subprocess
+from email.message import EmailMessage
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+# aiosmtpd logs a deprecation warning from its own AUTH handling on every login
+logging.getLogger("mail.log").setLevel(logging.ERROR)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _tls_context():
+    """Self-signed certificate for STARTTLS, or None without openssl."""
+    tmp = tempfile.mkdtemp(prefix="smtp-tls-")
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    try:
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key,
+                        "-out", cert, "-days", "1", "-subj", "/CN=localhost"],
+                       check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+TLS_CONTEXT = _tls_context()
+SMTP_PORT = _free_port()
+# mail_queue reads its configuration at import time
+os.environ.update({"SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(SMTP_PORT), "SMTP_USER": "mailer",
+                   "SMTP_PASS": "secret", "SMTP_STARTTLS": "true" if TLS_CONTEXT else "false",
+                   "RATE_LIMIT_ENABLED": "false"})
+
+from mail_queue import MailDispatcher, MailQueueFull  # noqa: E402
+
+
+class SinkHandler:
+    """Collects messages; `delay_s` slows every DATA and `fail_next` scripts SMTP replies."""
+
+    def __init__(self):
+        self.messages = []
+        self.logins = 0
+        self.delay_s = 0.0
+        self.fail_next = []
+        self.lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.delay_s:
+            await asyncio.sleep(self.delay_s)
+        with self.lock:
+            if self.fail_next:
+                return self.fail_next.pop(0)
+            self.messages.append(envelope.content.decode("utf-8", "replace"))
+        return "250 OK"
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        ok = auth_data.login == b"mailer" and auth_data.password == b"secret"
+        if ok:
+            with self.lock:
+                self.logins += 1
+        return AuthResult(success=ok)
+
+
+def start_sink():
+    handler = SinkHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=SMTP_PORT, tls_context=TLS_CONTEXT,
+                            require_starttls=TLS_CONTEXT is not None, authenticator=handler.authenticate,
+                            auth_require_tls=TLS_CONTEXT is not None)
+    controller.start()
+    return controller, handler
+
+
+def message(i, to="user@example.com"):
+    msg = EmailMessage()
+    msg["Subject"] = f"Test {i}"
+    msg["From"] = "no-reply@matex.local"
+    msg["To"] = to
+    msg.set_content(f"Message {i}")
+    return msg
+
+
+def dispatcher(**kwargs):
+    options = dict(host="127.0.0.1", port=SMTP_PORT, user="mailer", password="secret",
+                   starttls=TLS_CONTEXT is not None, retry_base_s=0.05, retry_max_s=0.2)
+    options.update(kwargs)
+    return MailDispatcher(**options)
+
+
+def wait_for(predicate, timeout_s=30.0):
+    deadline = time.monotonic() + timeout_s
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def send_per_connection(msg):
+    """The old send path: connect, STARTTLS and login for every message."""
+    with smtplib.SMTP("127.0.0.1", SMTP_PORT, timeout=10) as server:
+        if TLS_CONTEXT is not None:
+            server.starttls()
+        server.login("mailer", "secret")
+        server.send_message(msg)
+
+
+def check_reuse(handler, count=200):
+    handler.messages.clear()
+    start = time.perf_counter()
+    for i in range(20):
+        send_per_connection(message(i))
+    per_connection_ms = (time.perf_counter() - start) / 20 * 1000.0
+
+    handler.messages.clear()
+    logins = handler.logins
+    mailer = dispatcher()
+    start = time.perf_counter()
+    for i in range(count):
+        mailer.submit(message(i))
+    submit_us = (time.perf_counter() - start) / count * 1e6
+    delivered = wait_for(lambda: mailer.get_stats()['sent'] == count)
+    elapsed = time.perf_counter() - start
+    stats = mailer.get_stats()
+    mailer.stop()
+    print(f"📮 One connection per message: {per_connection_ms:.1f} ms each "
+          f"({'STARTTLS + ' if TLS_CONTEXT else ''}login every time)")
+    print(f"🔁 Dispatcher: submit {submit_us:.0f} µs, {count} messages delivered in {elapsed:.2f}s "
+          f"({elapsed / count * 1000:.2f} ms each) over {stats['connections_opened']} connections, "
+          f"{handler.logins - logins} logins, {stats['batches']} batches, max depth {stats['max_depth']}")
+    print(f"   latency: {stats['latency']}")
+    return (delivered and len(handler.messages) == count and stats['connections_opened'] == mailer.workers
+            and handler.logins - logins == mailer.workers)
+
+
+def check_retries(handler):
+    mailer = dispatcher(workers=1)
+    handler.fail_next = ["451 Try again later", "421 Service not available"]
+    mailer.submit(message("transient"))
+    transient_ok = wait_for(lambda: mailer.get_stats()['sent'] == 1)
+    handler.fail_next = ["550 Mailbox unavailable"]
+    mailer.submit(message("permanent"))
+    wait_for(lambda: mailer.get_stats()['failed'] == 1)
+    stats = mailer.get_stats()
+    mailer.stop()
+    print(f"🔄 Retries: 451 + 421 then accepted: sent {stats['sent']} after {stats['retries']} retries; "
+          f"550 dropped without retry: failed {stats['failed']} ({stats['last_error']})")
+    return transient_ok and stats['retries'] == 2 and stats['failed'] == 1
+
+
+def check_queue_full(handler):
+    handler.delay_s = 0.2
+    mailer = dispatcher(workers=1, queue_size=5, batch_size=1)
+    accepted = rejected = 0
+    for i in range(20):
+        try:
+            mailer.submit(message(i))
+            accepted += 1
+        except MailQueueFull:
+            rejected += 1
+    stats = mailer.get_stats()
+    handler.delay_s = 0.0
+    mailer.stop(timeout_s=30)
+    print(f"🚧 Queue of 5, slow relay: {accepted} accepted, {rejected} refused at once, "
+          f"depth {stats['queue_depth']}, rejected counter {stats['rejected']}")
+    return rejected > 0 and stats['rejected'] == rejected and stats['queue_depth'] <= 5
+
+
+def check_idle_reconnect(handler):
+    mailer = dispatcher(workers=1, idle_close_s=0.3, noop_after_s=0.1)
+    mailer.submit(message("first"))
+    wait_for(lambda: mailer.get_stats()['sent'] == 1)
+    time.sleep(0.15)
+    mailer.submit(message("after noop"))  # idle > noop_after_s: checked with NOOP, still reused
+    wait_for(lambda: mailer.get_stats()['sent'] == 2)
+    reused = mailer.get_stats()['connections_opened'] == 1
+    time.sleep(0.6)
+    mailer.submit(message("after idle close"))  # closed after idle_close_s: reconnects
+    wait_for(lambda: mailer.get_stats()['sent'] == 3)
+    stats = mailer.get_stats()
+    mailer.stop()
+    print(f"💤 Idle connections: reused after a NOOP check: {reused}, "
+          f"reopened after idle close: {stats['connections_opened'] == 2}")
+    return reused and stats['connections_opened'] == 2
+
+
+def check_app_otp(handler):
+    """POST /api/otp/request no longer waits for the SMTP handshake."""
+    from fastapi.testclient import TestClient
+    import app
+
+    client = TestClient(app.app)
+    handler.messages.clear()
+    handler.delay_s = 0.05  # a slow relay no longer shows up in request latency
+    timings = []
+    for i in range(20):
+        start = time.perf_counter()
+        response = client.post("/api/otp/request", json={"email": f"otp{i}@example.com"})
+        timings.append((time.perf_counter() - start) * 1000.0)
+        if response.status_code != 200:
+            return False
+    delivered = wait_for(lambda: len(handler.messages) == 20)
+    handler.delay_s = 0.0
+    mail = client.get("/api/health").json()["mail"]
+    timings.sort()
+    print(f"\n🔐 /api/otp/request: p50 {timings[10]:.1f} ms, max {timings[-1]:.1f} ms; "
+          f"{len(handler.messages)} OTP emails delivered over {mail['connections_opened']} connection(s)")
+    print(f"   /api/health mail: sent {mail['sent']}, queue depth {mail['queue_depth']}, "
+          f"latency {mail['latency']}")
+    app.MAIL_DISPATCHER.stop()
+    return delivered and all("verification code" in m for m in handler.messages)
+
+
+def main():
+    print("🧪 Testing Mail Queue")
+    print("=" * 40)
+    controller, handler = start_sink()
+    ok = check_reuse(handler)
+    ok = check_retries(handler) and ok
+    ok = check_queue_full(handler) and ok
+    ok = check_idle_reconnect(handler) and ok
+    ok = check_app_otp(handler) and ok
+    controller.stop()
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,7 +6,8 @@ Run this to test the trained model with sample questions.
 
 import os
 import sys
-from ml_chatbot_model import ChatbotMLModel
+import time
+from ml_chatbot_model import ChatbotMLModel, ensure_nltk_data
 
 def load_response_categories():
     """Load response categories for testing."""
@@ -103,6 +104,65 @@ def test_questions():
         ("Tell me about pricing", "pricing"),
     ]
 
+def benchmark_batch_throughput(ml_model, questions, repeat=20):
+    """Compare single-item predict_category throughput with predict_batch."""
+    texts = [q for q, _ in questions] * repeat
+
+    start = time.perf_counter()
+    single = [ml_model.predict_category(t, use_cache=False) for t in texts]
+    single_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = ml_model.predict_batch(texts)
+    batch_elapsed = time.perf_counter() - start
+
+    mismatches = sum(
+        1 for (cat, conf), item in zip(single, batch)
+        if cat != item['predicted_category'] or abs(conf - item['confidence']) > 1e-9
+    )
+
+    single_rate = len(texts) / single_elapsed if single_elapsed > 0 else 0
+    batch_rate = len(texts) / batch_elapsed if batch_elapsed > 0 else 0
+    speedup = batch_rate / single_rate if single_rate > 0 else 0
+
+    print(f"\n⚡ Batch Throughput ({len(texts)} messages):")
+    print(f"   Single-item: {single_rate:.1f} msg/s ({single_elapsed:.3f}s)")
+    print(f"   Batch: {batch_rate:.1f} msg/s ({batch_elapsed:.3f}s)")
+    print(f"   Speedup: {speedup:.1f}x, mismatches: {mismatches}")
+    return mismatches == 0
+
+
+def check_result_cache(ml_model, questions, repeat=20):
+    """Repeated questions hit the prediction cache; publishing a model invalidates it."""
+    texts = [q for q, _ in questions]
+    variants = [t.upper() + "  " for t in texts]  # same letters and word boundaries
+    ml_model.prediction_cache.clear()
+    before = ml_model.prediction_cache.get_stats()
+
+    start = time.perf_counter()
+    uncached = [ml_model.predict_category(t, use_cache=False) for t in texts * repeat]
+    uncached_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    cached = [ml_model.predict_category(t) for t in (texts + variants) * (repeat // 2)]
+    cached_elapsed = time.perf_counter() - start
+
+    stats = ml_model.prediction_cache.get_stats()
+    hits = stats['hits'] - before['hits']
+    expected_hits = len(cached) - len(texts)
+    same = cached == (uncached[:len(texts)] * 2) * (repeat // 2)
+
+    ml_model.publish(ml_model.serving)  # any publish changes the model stamp
+    ml_model.predict_category(texts[0])
+    invalidated = ml_model.prediction_cache.get_stats()['stale'] > stats['stale']
+
+    print(f"\n🗃️  Prediction cache ({len(cached)} lookups):")
+    print(f"   Uncached: {uncached_elapsed * 1000 / len(uncached):.3f} ms/msg, "
+          f"cached: {cached_elapsed * 1000 / len(cached):.3f} ms/msg")
+    print(f"   Hits: {hits}/{expected_hits}, results identical: {same}, "
+          f"invalidated on publish: {invalidated}, {stats['bytes']} bytes")
+    return hits == expected_hits and same and invalidated
+
+
 def main():
     """Main test function."""
     print("🧪 Testing Matex Chatbot ML Model")
@@ -110,6 +170,7 @@ def main():
     
     # Load model
     print("📚 Loading ML model...")
+    ensure_nltk_data()
     ml_model = ChatbotMLModel()
     
     # Load categories
@@ -176,6 +237,9 @@ def main():
     print(f"   High (≥80%): {high_conf} ({high_conf/total_predictions*100:.1f}%)")
     print(f"   Medium (60-79%): {med_conf} ({med_conf/total_predictions*100:.1f}%)")
     print(f"   Low (<60%): {low_conf} ({low_conf/total_predictions*100:.1f}%)")
+
+    benchmark_batch_throughput(ml_model, test_data)
+    check_result_cache(ml_model, test_data)
     
     print("\n✅ Testing completed!")
 
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script for the versioned model registry: immutable commits with
+manifest checksums, the CURRENT pointer, corrupt artifacts rejected on
+load and rollback, rollback itself and retention pruning of trained
+versions and online snapshots as separate classes.
+"""
+
+import os
+import sys
+import tempfile
+
+from model_registry import ModelRegistry
+
+
+def corrupt(path):
+    """Flip one byte in the middle of a file, in place."""
+    with open(path, "r+b") as f:
+        f.seek(os.path.getsize(path) // 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+def check_commit_and_verify():
+    """Manifest hashes match on commit, linked files are shared, and a flipped byte fails verification."""
+    registry = ModelRegistry(tempfile.mkdtemp(prefix="registry-"))
+    first = registry.commit({"classifier.pkl": {"weights": list(range(1000))}, "metrics.json": {"accuracy": 0.5}},
+                            info={"source": "train"})
+    second = registry.commit({"metrics.json": {"accuracy": 0.6}}, info={"source": "online"}, link_from=first)
+    manifest = registry.manifest(second)
+    linked = os.path.samefile(registry.path(first, "classifier.pkl"), registry.path(second, "classifier.pkl"))
+    ok = (registry.current_version() == second and manifest["parent"] == first
+          and set(manifest["files"]) == {"classifier.pkl", "metrics.json"}
+          and registry.verify(first) and registry.verify(second) and linked)
+    corrupt(registry.path(second, "metrics.json"))
+    rejected = not registry.verify(second) and registry.verify(first)
+    staging = not any(v.startswith(".staging") for v in os.listdir(registry.versions_dir))
+    print(f"📦 Commit: CURRENT {registry.current_version() == second}, classifier hard-linked {linked}, "
+          f"corrupt metrics rejected {rejected}, no staging left {staging}")
+    return ok and rejected and staging
+
+
+def check_prune(train=5, online=8, keep=2, keep_online=3):
+    """Frequent online snapshots never push trained versions out, and CURRENT is always kept."""
+    registry = ModelRegistry(tempfile.mkdtemp(prefix="registry-"), keep_versions=keep,
+                             keep_online_versions=keep_online)
+    # The first run stays CURRENT (e.g. later runs were not activated, or were rolled back)
+    trained = [registry.commit({"metrics.json": {"run": i}}, info={"source": "train"}, activate=i == 0)
+               for i in range(train)]
+    snapshots = [registry.commit({"metrics.json": {"snapshot": i}}, info={"source": "online"},
+                                 link_from=trained[0], activate=False) for i in range(online)]
+    kept = {v["version"] for v in registry.list_versions()}
+    expected = {trained[0]} | set(trained[-keep:]) | set(snapshots[-keep_online:])
+    print(f"✂️  Prune after {train} trained versions and {online} online snapshots (keep {keep} + {keep_online}): "
+          f"{len(kept)} kept, trained {sorted(trained.index(v) for v in kept if v in trained)}, "
+          f"snapshots {sorted(snapshots.index(v) for v in kept if v in snapshots)}")
+    return kept == expected and registry.current_version() == trained[0]
+
+
+def check_model_rollback():
+    """Rollback loads the previous version; a corrupt version is refused and the served model is kept."""
+    from app import load_response_categories
+    from ml_chatbot_model import ChatbotMLModel
+
+    model_dir = tempfile.mkdtemp(prefix="registry-model-")
+    categories = load_response_categories()
+    model = ChatbotMLModel(model_dir)
+    model.train_model(categories)
+    first = model.loaded_version
+    model.train_model(categories)
+    second = model.loaded_version
+
+    result = model.rollback()
+    rolled_back = (result["version"] == first and result["previous_version"] == second
+                   and model.loaded_version == first and model.registry.current_version() == first)
+    serves = model.predict_category("What are your prices?")[0] is not None
+
+    corrupt(model.registry.path(second, "classifier.pkl"))
+    try:
+        model.rollback(second)
+        refused = False
+    except ValueError:
+        refused = model.loaded_version == first and model.registry.current_version() == first
+
+    # A worker starting on a CURRENT that points at a corrupt version does not serve it
+    model.registry.set_current(second)
+    fresh = ChatbotMLModel(model_dir)  # loads CURRENT
+    not_loaded = fresh.loaded_version is None
+    print(f"⏪ Rollback to the previous version: {rolled_back} (serving: {serves}); corrupt version refused "
+          f"on rollback: {refused}, on load: {not_loaded}")
+    return rolled_back and serves and refused and not_loaded
+
+
+def main():
+    print("🧪 Testing Model Registry")
+    print("=" * 40)
+    # Two quick backends keep the training runs below to about a second each
+    os.environ.setdefault("ML_BACKENDS", "multinomial_nb,sgd")
+    ok = check_commit_and_verify()
+    ok = check_prune() and ok
+    ok = check_model_rollback() and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for online learning: feedback applied to a hashed backend with
+partial_fit changes predictions without a full retrain, unknown labels
+flag a rebuild, and a flush that lost the race against a rebuild is
+dropped by the compare-and-swap publish.
+"""
+
+import os
+import sys
+import copy
+import tempfile
+
+TEXT = "does the zorblax gizmo come in teal"
+
+
+def train_model():
+    from app import load_response_categories
+    from ml_chatbot_model import ChatbotMLModel
+
+    categories = load_response_categories()
+    model = ChatbotMLModel(tempfile.mkdtemp(prefix="online-learning-"))
+    model.train_model(categories)
+    return model, categories
+
+
+def check_feedback_updates_prediction(model, categories, repeats=40):
+    """Feedback reaches the served hashed_sgd pipeline via partial_fit; no retrain, one swap per flush."""
+    before, _ = model.predict_category(TEXT)
+    target = next(c for c in sorted(categories) if c != before)
+    version, generation = model.loaded_version, model.serving_generation
+    last_trained = model.model_metrics['last_trained']
+    replies = [model.retrain_with_feedback(TEXT, target, 0.1) for _ in range(repeats)]
+    result = model.online_learner.flush()
+    after, confidence = model.predict_category(TEXT)
+    no_retrain = model.loaded_version == version and model.model_metrics['last_trained'] == last_trained
+    swaps = model.serving_generation - generation
+    snapshot = model.online_learner.snapshot(force=True)
+    snapshot_source = model.registry.manifest(model.loaded_version)['source'] if snapshot else None
+    print(f"🎯 {repeats} feedback '{target}' for '{TEXT}': {before} -> {after} ({confidence:.2f}) after one flush "
+          f"{result}; no retrain {no_retrain}, {swaps} swap(s), snapshot {snapshot_source}")
+    return (model.backend == "hashed_sgd" and model.online_learner.is_enabled()
+            and all('online_learning' in r and not r.get('retrain_due') for r in replies)
+            and result['applied'] == repeats and after == target != before and no_retrain and swaps == 1
+            and snapshot and snapshot_source == 'online')
+
+
+def check_unknown_label(model, categories):
+    """A label the classifier has never seen is skipped and flags a rebuild; the rebuild clears it."""
+    for text in ("please book a zorblax demo", "can i see a zorblax demo", "zorblax demo next week"):
+        model.add_training_example(text, "brand_new_category")
+    result = model.online_learner.flush()
+    flagged = model.online_learner.get_stats()['needs_rebuild']
+    model.train_model(categories, model.get_feedback_examples())
+    cleared = not model.online_learner.get_stats()['needs_rebuild']
+    print(f"🆕 Unknown label: flush {result}, needs_rebuild {flagged}; cleared by the rebuild {cleared}")
+    return result == {'applied': 0, 'skipped': 3} and flagged and cleared
+
+
+def check_superseded_flush(model, categories):
+    """A flush whose base was replaced before its swap is dropped, leaving the newer model served."""
+    target = next(c for c in sorted(categories) if c != model.predict_category(TEXT)[0])
+    swap_classifier = model.swap_classifier
+    rebuilt = []
+
+    def rebuild_then_swap(expected, classifier):
+        # A rebuild publishes between the flush taking its base and swapping the update in
+        rebuilt.append(copy.deepcopy(expected))
+        model.publish(model.serving._replace(classifier=rebuilt[0]))
+        return swap_classifier(expected, classifier)
+
+    model.swap_classifier = rebuild_then_swap
+    for _ in range(5):
+        model.add_training_example(TEXT, target)
+    result = model.online_learner.flush()
+    model.swap_classifier = swap_classifier
+    kept = model.serving.classifier is rebuilt[0]
+    stale = not model.swap_classifier(object(), copy.deepcopy(model.serving.classifier))
+    print(f"🔀 Flush racing a rebuild: {result}, rebuilt model kept {kept}; stale compare-and-swap refused {stale}")
+    return result == {'applied': 0, 'superseded': 5} and kept and stale
+
+
+def main():
+    print("🧪 Testing Online Learning")
+    print("=" * 40)
+    # Serve the hashed backend, the one that can learn with partial_fit
+    os.environ["ML_LEARNING_MODE"] = "online"
+    os.environ.setdefault("ML_BACKENDS", "hashed_sgd")
+    # No background flushes: each check flushes explicitly
+    os.environ.setdefault("ML_ONLINE_FLUSH_SECONDS", "3600")
+    os.environ.setdefault("ML_ONLINE_BATCH_SIZE", "1000")
+    model, categories = train_model()
+    ok = check_feedback_updates_prediction(model, categories)
+    ok = check_unknown_label(model, categories) and ok
+    ok = check_superseded_flush(model, categories) and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Test script for the pooled OpenAI client against a local fake
+OpenAI-compatible server: connection reuse, retries, timeouts and pool
+saturation. No API key or network access needed.
+"""
+
+import sys
+import json
+import asyncio
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai_client import AsyncPooledOpenAIClient
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers /v1/chat/completions; `fail_next` and `delay_s` on the server script failures."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body are separate writes
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            failure = server.fail_next.pop(0) if server.fail_next else None
+        time.sleep(server.delay_s)
+        if failure is not None:
+            payload = json.dumps({"error": {"message": "scripted failure", "type": "server_error"}}).encode()
+            self.send_response(failure)
+            if failure == 429:
+                self.send_header("Retry-After", "0.05")
+        elif body.get("stream"):
+            self._stream_answer(body)
+            return
+        else:
+            last = body.get("messages", [{}])[-1].get("content", "")
+            payload = json.dumps({
+                "id": "chatcmpl-test", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": f"echo: {last}"}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }).encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        try:
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out first
+
+    def _stream_answer(self, body):
+        """Streams "echo: <last message>" word by word as chat.completion.chunk events."""
+        last = body.get("messages", [{}])[-1].get("content", "")
+        words = f"echo: {last}".split(" ")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, word in enumerate(words + [None]):
+                delta = {"content": word if i == 0 else f" {word}"} if word is not None else {}
+                chunk = {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body.get("model", "fake"),
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None if word else "stop"}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                time.sleep(self.server.token_delay_s)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 4096  # concurrency tests open thousands of connections at once
+
+
+def start_fake_server():
+    server = FakeOpenAIServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.fail_next = []
+    server.delay_s = 0.0
+    server.token_delay_s = 0.0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def make_client(base_url, **kwargs):
+    kwargs.setdefault("retry_base_s", 0.05)
+    return AsyncPooledOpenAIClient(api_key="test-key", base_url=base_url, **kwargs)
+
+
+async def check_connection_reuse(base_url, calls=50):
+    """Sequential calls share one kept-alive connection; compare with a client per call."""
+    client = make_client(base_url)
+    start = time.perf_counter()
+    answers = [await client.chat_completion([{"role": "user", "content": f"hi {i}"}]) for i in range(calls)]
+    pooled_ms = (time.perf_counter() - start) * 1000.0 / calls
+    pool = client.get_stats()["pool"]
+    await client.aclose()
+
+    start = time.perf_counter()
+    for i in range(calls):
+        fresh = make_client(base_url)  # what call_openai used to do per request
+        await fresh.chat_completion([{"role": "user", "content": f"hi {i}"}])
+        await fresh.aclose()
+    fresh_ms = (time.perf_counter() - start) * 1000.0 / calls
+
+    print(f"\n🔁 Connection reuse ({calls} calls): {pool['new_connections']} new, "
+          f"{pool['reused_connections']} reused")
+    print(f"   Shared client: {pooled_ms:.2f} ms/call, client per call: {fresh_ms:.2f} ms/call (plain HTTP, no TLS)")
+    return answers[-1] == f"echo: hi {calls - 1}" and pool["new_connections"] == 1
+
+
+async def check_retries(server, base_url):
+    """Transient 503/429 responses are retried; 400s and exhausted budgets raise."""
+    import openai
+
+    client = make_client(base_url, max_retries=2)
+    server.fail_next = [503, 429]
+    answer = await client.chat_completion([{"role": "user", "content": "retry me"}])
+    recovered = answer == "echo: retry me" and client.get_stats()["retries"] == 2
+
+    server.fail_next = [503, 503, 503]
+    try:
+        await client.chat_completion([{"role": "user", "content": "give up"}])
+        exhausted = False
+    except openai.InternalServerError:
+        exhausted = client.get_stats()["retries"] == 4
+
+    server.fail_next = [400]
+    try:
+        await client.chat_completion([{"role": "user", "content": "bad request"}])
+        not_retried = False
+    except openai.BadRequestError:
+        not_retried = client.get_stats()["retries"] == 4
+    stats = client.get_stats()
+    await client.aclose()
+    print(f"\n🔄 Retries: recovered after 503+429: {recovered}, gave up after budget: {exhausted}, "
+          f"400 not retried: {not_retried} ({stats['retries']} retries, {stats['failures']} failures)")
+    return recovered and exhausted and not_retried
+
+
+async def check_read_timeout(server, base_url):
+    """A slow server hits the read timeout on every attempt, bounded by the retry budget."""
+    import openai
+
+    client = make_client(base_url, read_timeout_s=0.2, max_retries=1)
+    server.delay_s = 1.0
+    start = time.perf_counter()
+    try:
+        await client.chat_completion([{"role": "user", "content": "slow"}])
+        timed_out = False
+    except openai.APITimeoutError:
+        timed_out = True
+    elapsed = time.perf_counter() - start
+    server.delay_s = 0.0
+    await client.aclose()
+    print(f"\n⏱️  Read timeout 0.2s x 2 attempts: raised {timed_out}, after {elapsed:.2f}s")
+    return timed_out and elapsed < 1.0
+
+
+async def check_pool_saturation(server, base_url, calls=8, max_connections=2):
+    """More concurrent calls than connections queue for the pool, and the stats show it."""
+    client = make_client(base_url, max_connections=max_connections, max_keepalive=max_connections)
+    server.delay_s = 0.2
+    start = time.perf_counter()
+    await asyncio.gather(*(client.chat_completion([{"role": "user", "content": "x"}]) for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+    server.delay_s = 0.0
+    pool = client.get_stats()["pool"]
+    await client.aclose()
+    print(f"\n🚦 Pool saturation ({calls} concurrent calls, {max_connections} connections, 0.2s each): "
+          f"{elapsed:.2f}s total")
+    print(f"   peak in flight {pool['peak_in_flight']}, saturated requests {pool['saturated_requests']}, "
+          f"new connections {pool['new_connections']}, max pool wait {pool['pool_wait_ms_max']:.0f} ms")
+    return (pool["new_connections"] <= max_connections and pool["saturated_requests"] > 0
+            and pool["pool_wait_ms_max"] > 300 and pool["in_flight"] == 0)
+
+
+async def check_pool_shards(server, base_url, calls=40, shard_size=8):
+    """A large pool is split into shards that together keep every call in flight."""
+    client = make_client(base_url, max_connections=calls, max_keepalive=calls, shard_size=shard_size)
+    server.delay_s = 0.2
+    await asyncio.gather(*(client.chat_completion([{"role": "user", "content": "x"}]) for _ in range(calls)))
+    server.delay_s = 0.0
+    pool = client.get_stats()["pool"]
+    await client.aclose()
+    print(f"\n🧩 Pool shards ({calls} concurrent calls, shards of {shard_size}): {pool['shards']} shards, "
+          f"peak in flight {pool['peak_in_flight']}, saturated requests {pool['saturated_requests']}")
+    return pool["shards"] == calls // shard_size and pool["peak_in_flight"] == calls and pool["saturated_requests"] == 0
+
+
+async def check_streaming(server, base_url):
+    """Streamed deltas arrive one by one and join up to the full answer."""
+    client = make_client(base_url)
+    server.token_delay_s = 0.05
+    start = time.perf_counter()
+    arrivals, pieces = [], []
+    async for piece in client.stream_chat_completion([{"role": "user", "content": "one two three four"}]):
+        arrivals.append(time.perf_counter() - start)
+        pieces.append(piece)
+    server.token_delay_s = 0.0
+    in_flight = client.get_stats()["pool"]["in_flight"]
+    await client.aclose()
+    print(f"\n📡 Streaming: {len(pieces)} deltas, first after {arrivals[0] * 1000:.0f} ms, "
+          f"last after {arrivals[-1] * 1000:.0f} ms")
+    return "".join(pieces) == "echo: one two three four" and arrivals[0] < arrivals[-1] - 0.1 and in_flight == 0
+
+
+async def run_checks(server, base_url):
+    ok = await check_connection_reuse(base_url)
+    ok = await check_retries(server, base_url) and ok
+    ok = await check_read_timeout(server, base_url) and ok
+    ok = await check_pool_saturation(server, base_url) and ok
+    ok = await check_pool_shards(server, base_url) and ok
+    ok = await check_streaming(server, base_url) and ok
+    return ok
+
+
+def main():
+    print("🧪 Testing Pooled OpenAI Client")
+    print("=" * 40)
+    server, base_url = start_fake_server()
+    ok = asyncio.run(run_checks(server, base_url))
+    server.shutdown()
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
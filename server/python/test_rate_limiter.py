@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Test script for the rate limiter: token bucket refill, all-or-nothing
+decisions across scopes, timing-wheel eviction of idle buckets and expired
+OTP state, a budget shared between workers through SQLite, and the 429
+middleware on the app itself.
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from rate_limiter import ExpiringDict, Rate, SQLiteTokenBucketLimiter, TimingWheel, TokenBucketLimiter, client_ip
+
+
+def check_token_bucket():
+    limiter = TokenBucketLimiter(tick_s=0.05)
+    bucket = [("ip", "ip|1.2.3.4", Rate(5, 1.0))]
+    burst = [limiter.acquire(bucket).allowed for _ in range(6)]
+    refused = limiter.acquire(bucket)
+    time.sleep(refused.retry_after_s + 0.01)
+    refilled = limiter.acquire(bucket).allowed
+    print(f"🪣 Token bucket 5/s: burst {burst}, retry after {refused.retry_after_s:.2f}s, "
+          f"allowed again after waiting: {refilled}")
+    return burst == [True] * 5 + [False] and refused.limited_by == "ip" and refilled
+
+
+def check_all_or_nothing():
+    limiter = TokenBucketLimiter()
+    ip = ("ip", "ip|1.2.3.4", Rate(3, 60))
+    first = [limiter.acquire([ip, ("session", "session|abc", Rate(2, 60))]) for _ in range(4)]
+    second = [limiter.acquire([ip, ("session", "session|def", Rate(2, 60))]) for _ in range(2)]
+    print(f"🔗 IP 3/min + session 2/min: first session {[d.allowed for d in first]} "
+          f"(refused by '{first[2].limited_by}'), second session on the same IP "
+          f"{[d.allowed for d in second]} (refused by '{second[1].limited_by}')")
+    # Requests refused by the session bucket took no IP tokens, so one is left for the second session
+    return ([d.allowed for d in first] == [True, True, False, False] and first[2].limited_by == "session"
+            and [d.allowed for d in second] == [True, False] and second[1].limited_by == "ip")
+
+
+def check_wheel():
+    wheel = TimingWheel(tick_s=1.0, slots=8, now=0.0)
+    for deadline in (0.5, 3.2, 7.9, 12.5, 30.0):
+        wheel.schedule(deadline, deadline)
+    fired = [sorted(k for _, k in wheel.advance(t)) for t in (1.0, 8.0, 13.0, 100.0)]
+    print(f"🎡 Timing wheel (8 slots of 1s): fired {fired}")
+    return fired == [[0.5], [3.2, 7.9], [12.5], [30.0]] and len(wheel) == 0
+
+
+def check_bucket_eviction(clients=100000):
+    limiter = TokenBucketLimiter(tick_s=0.1)
+    rate = Rate(5, 0.5)  # a used bucket is full again within 0.1s
+    start = time.perf_counter()
+    for i in range(clients):
+        limiter.acquire([("ip", f"ip|{i}", rate)])
+    fill_s = time.perf_counter() - start
+    idle_sweep = min(_timed(lambda: limiter.acquire([("ip", "ip|hot", rate)])) for _ in range(50))
+    time.sleep(0.3)
+    sweep_s = _timed(lambda: limiter.acquire([("ip", "ip|hot", rate)]))
+    stats = limiter.get_stats()
+    print(f"🧹 {clients} client buckets ({fill_s / clients * 1e6:.1f} µs per decision): "
+          f"decision with nothing expired {idle_sweep * 1e6:.1f} µs, "
+          f"sweep evicting {stats['evicted']} idle buckets {sweep_s * 1000:.1f} ms, {stats['buckets']} left")
+    return stats['evicted'] == clients and stats['buckets'] <= 1 and idle_sweep < 0.001
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def check_expiring_dict(entries=50000):
+    store = ExpiringDict("otp", tick_s=0.05)
+    store.set("renewed@example.com", {"code": "123456"}, ttl_s=0.2)
+    store.set("renewed@example.com", {"code": "654321"}, ttl_s=5)  # re-requested code lives on
+    for i in range(entries):
+        store.set(f"user{i}@example.com", {"code": "123456"}, ttl_s=0.2)
+        store.set(f"admin{i}@example.com", {"secret": "s"}, ttl_s=None)
+    time.sleep(0.3)
+    stats = store.get_stats()
+    print(f"⏳ Expiring OTP state: {entries} codes with a 0.2s TTL and {entries} without: "
+          f"{stats['expired']} expired, {stats['entries']} left, renewed code kept: "
+          f"{store.get('renewed@example.com') == {'code': '654321'}}")
+    return (stats['expired'] == entries and stats['entries'] == entries + 1
+            and store.get("renewed@example.com") == {"code": "654321"}
+            and store.get("user1@example.com") is None and store.get("admin1@example.com") is not None)
+
+
+def check_shared_budget(db_path):
+    workers = [SQLiteTokenBucketLimiter(db_path), SQLiteTokenBucketLimiter(db_path)]
+    bucket = [("email", "otp|email|a@example.com", Rate(5, 60))]
+    allowed = [workers[i % 2].acquire(bucket).allowed for i in range(8)]
+    start = time.perf_counter()
+    for i in range(500):
+        workers[0].acquire([("ip", f"bench|{i % 50}", Rate(1000, 1))])
+    per_decision_us = (time.perf_counter() - start) / 500 * 1e6
+    print(f"🤝 SQLite budget shared by two workers: {sum(allowed)} of 8 allowed (limit 5), "
+          f"{per_decision_us:.0f} µs per decision")
+    return allowed == [True] * 5 + [False] * 3
+
+
+def check_middleware():
+    """429 with Retry-After from the real app, and decisions counted in /api/health."""
+    os.environ["RATE_LIMITS"] = '{"POST /api/chat": {"ip": "3/60"}}'
+    from fastapi.testclient import TestClient
+    import app
+
+    client = TestClient(app.app)
+    chats = [client.post("/api/chat", json={"message": ""}) for _ in range(4)]
+    otps = [client.post("/api/otp/request", json={"email": "flood@example.com"}) for _ in range(2)]
+    other = client.post("/api/otp/request", json={"email": "other@example.com"})
+    stats = client.get("/api/health").json()["rate_limit"]
+    print(f"\n🚦 App: /api/chat statuses {[r.status_code for r in chats]} "
+          f"(Retry-After {chats[-1].headers.get('retry-after')}s), OTP resend "
+          f"{[r.status_code for r in otps]}, other email {other.status_code}")
+    print(f"   /api/health rate_limit: allowed {stats['allowed']}, limited {stats['limited']}, "
+          f"routes {stats['routes']}, OTP state {stats['state']['otp']}")
+    return ([r.status_code for r in chats] == [400, 400, 400, 429] and chats[-1].headers.get("retry-after")
+            and [r.status_code for r in otps] == [200, 429] and other.status_code == 200
+            and stats['routes']['POST /api/otp/request']['limited_by'] == {'email': 1}
+            and stats['state']['otp']['entries'] == 2)
+
+
+def check_otp_resend_without_limiter():
+    """With the rate limiter off, request_otp still refuses a resend within 45 s."""
+    from fastapi.testclient import TestClient
+    import app
+
+    app.RATE_LIMIT_ENABLED = False
+    try:
+        client = TestClient(app.app)
+        otps = [client.post("/api/otp/request", json={"email": "unlimited@example.com"}) for _ in range(2)]
+    finally:
+        app.RATE_LIMIT_ENABLED = True
+    print(f"📨 OTP resend with RATE_LIMIT_ENABLED=false: {[r.status_code for r in otps]}")
+    return [r.status_code for r in otps] == [200, 429]
+
+
+def check_untrusted_proxy_warning():
+    """
+    X-Forwarded-For without RATE_LIMIT_TRUST_PROXY keys on the peer and warns
+    once; with it, addresses a client forges in the header are ignored.
+    """
+    import io
+    import contextlib
+    import rate_limiter
+
+    rate_limiter._untrusted_proxy_warned = False
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        ips = [client_ip({"x-forwarded-for": f"203.0.113.{i}"}, "10.0.0.1", trust_proxy=False) for i in range(3)]
+    trusted = client_ip({"x-forwarded-for": "203.0.113.7"}, "10.0.0.1", trust_proxy=True)
+    # The client sends its own X-Forwarded-For and the proxy appends the real address
+    forged = {client_ip({"x-forwarded-for": f"198.51.100.{i}, 203.0.113.7"}, "10.0.0.1", trust_proxy=True)
+              for i in range(20)}
+    two_hops = client_ip({"x-forwarded-for": "198.51.100.9, 203.0.113.7, 10.0.0.2"}, "10.0.0.1",
+                         trust_proxy=True, trusted_hops=2)
+    warnings = out.getvalue().count("[RateLimit] Warning")
+    print(f"🛡️  X-Forwarded-For untrusted: keyed on {set(ips)}, {warnings} warning(s); trusted: {trusted}, "
+          f"20 forged addresses keyed on {forged}, behind two proxies: {two_hops}")
+    return (ips == ["10.0.0.1"] * 3 and warnings == 1 and trusted == "203.0.113.7"
+            and forged == {"203.0.113.7"} and two_hops == "203.0.113.7")
+
+
+def main():
+    print("🧪 Testing Rate Limiter")
+    print("=" * 40)
+    tmp = tempfile.mkdtemp(prefix="rate-limits-")
+    ok = check_token_bucket()
+    ok = check_all_or_nothing() and ok
+    ok = check_wheel() and ok
+    ok = check_bucket_eviction() and ok
+    ok = check_expiring_dict() and ok
+    ok = check_shared_budget(os.path.join(tmp, "limits.db")) and ok
+    ok = check_middleware() and ok
+    ok = check_otp_resend_without_limiter() and ok
+    ok = check_untrusted_proxy_warning() and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Test script for the session store backends: per-session caps, TTL expiry,
+LRU eviction under the global caps, state shared between workers and
+per-operation latency. The Redis backend runs against a local stand-in
+speaking the Redis protocol, so no Redis server is needed.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+import tracemalloc
+import socketserver
+
+from session_store import (MemorySessionStore, RedisSessionStore, SQLiteSessionStore,
+                           create_session_store)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """The handful of Redis commands RedisSessionStore uses, with millisecond key expiry."""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            self.wfile.write(self.server.execute(args[0].upper().decode(), args[1:]))
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.lock = threading.Lock()
+        self.data = {}  # key -> (value, expires_at or None)
+
+    @staticmethod
+    def bulk(value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            entry = None
+        return entry
+
+    @staticmethod
+    def _expiry(options):
+        options = [o.upper() for o in options]
+        if b"PX" in options:
+            return time.monotonic() + int(options[options.index(b"PX") + 1]) / 1000.0
+        return None
+
+    def execute(self, name, args):
+        with self.lock:
+            if name in ("PING", "AUTH", "SELECT"):
+                return b"+PONG\r\n" if name == "PING" else b"+OK\r\n"
+            if name == "GET":
+                entry = self._live(args[0])
+                return self.bulk(entry[0] if entry else None)
+            if name == "GETEX":
+                entry = self._live(args[0])
+                if entry and args[1:]:
+                    self.data[args[0]] = (entry[0], self._expiry(args[1:]))
+                return self.bulk(entry[0] if entry else None)
+            if name == "SET":
+                self.data[args[0]] = (args[1], self._expiry(args[2:]))
+                return b"+OK\r\n"
+            if name == "DEL":
+                return b":%d\r\n" % sum(self.data.pop(k, None) is not None for k in args)
+            if name == "DBSIZE":
+                return b":%d\r\n" % sum(self._live(k) is not None for k in list(self.data))
+            if name == "INFO":
+                used = sum(len(k) + len(v[0]) for k, v in self.data.items())
+                return self.bulk(f"# Memory\r\nused_memory:{used}\r\nmaxmemory:0\r\n"
+                                 f"maxmemory_policy:volatile-lru\r\n".encode())
+            return f"-ERR unknown command '{name}'\r\n".encode()
+
+
+def start_fake_redis():
+    server = FakeRedisServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"redis://{host}:{port}/0"
+
+
+def conversation(turns, size=40):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"question {i} " + "q" * size})
+        history.append({"role": "assistant", "content": f"answer {i} " + "a" * size})
+    return history
+
+
+def check_session_caps():
+    store = MemorySessionStore(max_messages=6, max_session_bytes=400)
+    store.put("long", conversation(10, size=10))
+    kept = store.get("long")
+    store.put("big", conversation(10, size=100))
+    big = store.get("big")
+    store.put("huge", [{"role": "user", "content": "é" * 5000}])
+    huge = store.get("huge")
+    print(f"✂️  Per-session caps: {len(kept)} of 20 messages kept by count, "
+          f"{len(big)} by size, oversized message cut to {len(huge[0]['content'])} chars "
+          f"({len(store.encode(huge))} bytes)")
+    return (len(kept) == 6 and kept[-1]["content"].startswith("answer 9")
+            and 0 < len(big) < 6 and big[-1]["content"].startswith("answer 9")
+            and len(store.encode(huge)) <= 400 and huge[0]["content"])
+
+
+def check_ttl(name, store):
+    store.put("a", conversation(1))
+    store.put("b", conversation(1))
+    time.sleep(0.2)
+    refreshed = store.get("a") is not None  # sliding expiry: a lives on, b does not
+    time.sleep(0.2)
+    a, b = store.get("a"), store.get("b")
+    print(f"⏳ {name}: TTL 0.3s, read at 0.2s keeps a session alive: {a is not None}, "
+          f"untouched session expired: {b is None}")
+    return refreshed and a is not None and b is None
+
+
+def check_lru_bounds():
+    store = MemorySessionStore(max_sessions=100)
+    for i in range(1000):
+        store.put(f"s{i}", conversation(1))
+        if i >= 50:
+            store.get("s0")  # keeps the first session recently used
+    by_count = store.get_stats()
+    hot_kept = store.get("s0") is not None
+    store = MemorySessionStore(max_total_bytes=64 * 1024)
+    for i in range(1000):
+        store.put(f"s{i}", conversation(2))
+    by_bytes = store.get_stats()
+    print(f"🧹 LRU: 1000 sessions into a 100-session store keeps {by_count['sessions']} "
+          f"({by_count['evictions']} evicted, hot session kept: {hot_kept}); "
+          f"64 KB cap keeps {by_bytes['sessions']} sessions in {by_bytes['bytes']} bytes")
+    return (by_count['sessions'] == 100 and by_count['evictions'] == 900 and hot_kept
+            and by_bytes['bytes'] <= 64 * 1024 and by_bytes['evictions'] > 0)
+
+
+def measure_growth(sessions=50000):
+    """Heap growth of `sessions` new chats: the old unbounded dict vs the bounded store."""
+    history = conversation(2)
+    results = {}
+    for name in ("dict", "store"):
+        tracemalloc.start()
+        if name == "dict":
+            unbounded = {}
+            for i in range(sessions):
+                unbounded[os.urandom(8).hex()] = [dict(m) for m in history]
+        else:
+            store = MemorySessionStore(max_sessions=5000, max_total_bytes=4 * 1024 * 1024)
+            for i in range(sessions):
+                store.put(os.urandom(8).hex(), history)
+        results[name] = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        unbounded = store = None
+    print(f"\n📈 Heap after {sessions} new sessions: unbounded dict {results['dict']:.1f} MB, "
+          f"bounded store {results['store']:.1f} MB")
+    return results['store'] < results['dict'] / 4
+
+
+def check_shared(name, first, second):
+    """Two store instances over the same storage stand in for two workers."""
+    history = conversation(2)
+    first.put("shared", history)
+    seen = second.get("shared")
+    second.put("shared", seen + conversation(1))
+    updated = first.get("shared")
+    print(f"🤝 {name}: worker 2 sees worker 1's session: {seen == history}, "
+          f"worker 1 sees the reply: {updated is not None and len(updated) == 6}")
+    return seen == history and updated is not None and len(updated) == 6
+
+
+def check_sqlite_sweep(db_path):
+    store = SQLiteSessionStore(db_path, max_sessions=50, max_total_bytes=1024 * 1024, sweep_interval_s=0)
+    for i in range(200):
+        store.put(f"s{i}", conversation(1))
+    stats = store.get_stats()
+    oldest, newest = store.get("s0"), store.get("s199")
+    print(f"🧹 SQLite sweep: 200 sessions into a 50-session table keeps {stats['sessions']} "
+          f"({stats['evictions']} evicted), oldest gone: {oldest is None}")
+    store.close()
+    return stats['sessions'] == 50 and oldest is None and newest is not None
+
+
+def benchmark(name, store, ops=2000):
+    history = conversation(5)
+    for i in range(100):
+        store.put(f"bench{i}", history)
+    start = time.perf_counter()
+    for i in range(ops):
+        sid = f"bench{i % 100}"
+        store.put(sid, store.get(sid))
+    per_op_us = (time.perf_counter() - start) / (2 * ops) * 1e6
+    print(f"⚡ {name}: {per_op_us:.1f} µs per get/put of a 10-message history")
+
+
+def main():
+    print("🧪 Testing Session Store")
+    print("=" * 40)
+    redis_server, redis_url = start_fake_redis()
+    tmp = tempfile.mkdtemp(prefix="sessions-")
+    db_path = os.path.join(tmp, "sessions.db")
+
+    ok = check_session_caps()
+    ok = check_lru_bounds() and ok
+    ok = check_ttl("memory", MemorySessionStore(ttl_s=0.3)) and ok
+    ok = check_ttl("sqlite", SQLiteSessionStore(os.path.join(tmp, "ttl.db"), ttl_s=0.3)) and ok
+    ok = check_ttl("redis", RedisSessionStore(redis_url, prefix="ttl:", ttl_s=0.3)) and ok
+    ok = check_shared("sqlite", SQLiteSessionStore(db_path), SQLiteSessionStore(db_path)) and ok
+    ok = check_shared("redis", RedisSessionStore(redis_url), RedisSessionStore(redis_url)) and ok
+    ok = check_sqlite_sweep(os.path.join(tmp, "sweep.db")) and ok
+    try:
+        create_session_store("memcached")
+        ok = False
+    except ValueError as e:
+        print(f"🚫 Unknown backend rejected: {e}")
+    ok = measure_growth() and ok
+
+    print()
+    benchmark("memory", MemorySessionStore())
+    benchmark("sqlite", SQLiteSessionStore(db_path))
+    redis_store = RedisSessionStore(redis_url)
+    benchmark("redis (local stand-in)", redis_store)
+    print(f"\n📊 Redis stats: {redis_store.get_stats()}")
+    redis_server.shutdown()
+
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
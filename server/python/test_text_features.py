@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Test script for chat feature extraction: keyword automaton vs plain substring
+checks, lexicon sentiment vs TextBlob, lazy features in generate_response,
+the batch feature matrix, and timings: python test_text_features.py [count]
+"""
+
+import sys
+import time
+import random
+import tempfile
+
+import numpy as np
+
+import text_features
+from text_features import (FEATURE_NAMES, SUBSTRING_FEATURES, KeywordAutomaton, LazyFeatures,
+                           extract_feature_matrix, extract_features, get_sentiment_lexicon)
+
+WORDS = [
+    "what", "how", "why", "when", "where", "is", "the", "a", "it", "you", "we", "price", "team",
+    "email", "javascript", "java", "api", "rapid", "webinar", "cloudy", "good", "bad", "great",
+    "terrible", "not", "no", "never", "very", "really", "extremely", "happy", "awful", "helpful",
+    "isn't", "don't", "I'm", "slow", "fast", "nice", "machine learning", "support", "scheduled",
+    "Héllo", "café", "naïve", "straße",
+]
+SUFFIXES = ["", "", "", "!", "?", ".", ",", "...", "!!", " :)", " :(", " (!)", " ;)", '"', "'"]
+
+
+def random_messages(count, seed=11):
+    random.seed(seed)
+    return [" ".join(random.choice(WORDS) + random.choice(SUFFIXES)
+                     for _ in range(random.randint(1, 14))).capitalize()
+            for _ in range(count)]
+
+
+def legacy_features(text):
+    """The original per-keyword extract_features, with TextBlob sentiment."""
+    from textblob import TextBlob
+    blob = TextBlob(text)
+    features = {
+        'length': len(text), 'word_count': len(text.split()), 'char_count': len(text),
+        'sentiment_polarity': blob.sentiment.polarity,
+        'sentiment_subjectivity': blob.sentiment.subjectivity,
+    }
+    for name, pattern in SUBSTRING_FEATURES:
+        features[name] = 1 if pattern in (text if pattern == '?' else text.lower()) else 0
+    return features
+
+
+def check_automaton(messages):
+    """Automaton bitmasks equal `pattern in text` for every pattern, single and batch."""
+    patterns = [pattern for _, pattern in SUBSTRING_FEATURES] + ["é", "ße", "aaa", "aa"]
+    automaton = KeywordAutomaton(patterns)
+    texts = [m.lower() for m in messages] + ["", "aaaa", "javascriptjava", "emailapi", "é" * 3]
+    expected = [sum(1 << i for i, p in enumerate(patterns) if p in t) for t in texts]
+    single = [automaton.match(t) for t in texts]
+    batch = [int(v) for v in automaton.match_batch(texts)]
+    ok = single == expected and batch == expected
+    print(f"🔎 Keyword automaton ({len(patterns)} patterns, {automaton.states} states) on {len(texts)} texts: "
+          f"{'identical to substring checks' if ok else 'MISMATCH'}")
+    return ok
+
+
+def check_sentiment(messages):
+    """Lexicon scores agree with TextBlob's analyzer."""
+    try:
+        from textblob import TextBlob
+    except ImportError:
+        print("⚠️  textblob not installed, skipping sentiment comparison")
+        return True
+    lexicon = get_sentiment_lexicon()
+    differ, worst = 0, 0.0
+    for message in messages:
+        expected = tuple(TextBlob(message).sentiment)
+        got = lexicon.score(message)
+        diff = max(abs(a - b) for a, b in zip(got, expected))
+        worst = max(worst, diff)
+        if diff > 1e-9:
+            differ += 1
+            if differ <= 3:
+                print(f"   differs: {message!r}: {got} vs {expected}")
+    print(f"💬 Lexicon sentiment vs TextBlob on {len(messages)} messages: {differ} differ, max diff {worst:.4f}")
+    return differ == 0
+
+
+def check_features(messages):
+    """Per-text dicts keep the old keys and order; the batch matrix matches them."""
+    ok = True
+    for message in messages[:200]:
+        features = extract_features(message)
+        ok = ok and list(features) == FEATURE_NAMES
+        try:
+            ok = ok and features == legacy_features(message)
+        except ImportError:
+            pass
+    matrix = extract_feature_matrix(messages)
+    rows = np.array([[extract_features(m)[name] for name in FEATURE_NAMES] for m in messages], dtype=np.float64)
+    ok = ok and matrix.shape == (len(messages), len(FEATURE_NAMES)) and np.array_equal(matrix, rows)
+    ok = ok and extract_feature_matrix([]).shape == (0, len(FEATURE_NAMES))
+    print(f"📐 Feature dicts and {matrix.shape} batch matrix: {'consistent' if ok else 'MISMATCH'}")
+    return ok
+
+
+def check_lazy():
+    """generate_response leaves features uncomputed until they are read."""
+    from ml_chatbot_model import ChatbotMLModel
+    calls = []
+    lazy = LazyFeatures(lambda: calls.append(1) or {"length": 3})
+    ok = not lazy.computed and not calls
+    ok = ok and lazy["length"] == 3 and dict(lazy) == {"length": 3} and len(calls) == 1
+
+    model = ChatbotMLModel(model_dir=tempfile.mkdtemp(prefix="ml-lazy-"))
+    before = model.feature_cache.get_stats()
+    result = model.generate_response("What does a web project cost?", {})
+    untouched = model.feature_cache.get_stats() == before and not result['features'].computed
+    ok = ok and untouched and result['features']['has_cost'] == 1 and result['features'].computed
+    print(f"💤 Lazy features: {'not computed until read' if untouched else 'computed eagerly'}")
+    return ok
+
+
+def benchmark(messages):
+    """Per-message cost of the old TextBlob path vs the new one, and the batch matrix."""
+    sample = messages[:500]
+    try:
+        start = time.perf_counter()
+        legacy_features(sample[0])  # imports textblob and loads its lexicon
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        for message in sample:
+            legacy_features(message)
+        old_us = (time.perf_counter() - start) / len(sample) * 1e6
+        print(f"⏱️  Old (TextBlob): first call {first * 1000:.0f} ms, then {old_us:.0f} µs per message")
+    except ImportError:
+        old_us = None
+    start = time.perf_counter()
+    for message in sample:
+        extract_features(message)
+    new_us = (time.perf_counter() - start) / len(sample) * 1e6
+    start = time.perf_counter()
+    for message in messages:
+        extract_features(message)
+    loop_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    extract_feature_matrix(messages)
+    batch_ms = (time.perf_counter() - start) * 1000
+    print(f"⏱️  New: {new_us:.0f} µs per message"
+          + (f" ({old_us / new_us:.1f}x faster)" if old_us else ""))
+    print(f"⏱️  {len(messages)} messages: per-text loop {loop_ms:.0f} ms, batch matrix {batch_ms:.0f} ms")
+    return old_us is None or new_us < old_us
+
+
+def main():
+    print("🧪 Testing Text Features")
+    print("=" * 40)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    messages = random_messages(count)
+    print(f"Sentiment lexicon: {text_features._default_lexicon_path()}")
+    ok = check_automaton(messages)
+    ok = check_sentiment(messages[:2000]) and ok
+    ok = check_features(messages) and ok
+    ok = check_lazy() and ok
+    ok = benchmark(messages) and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test script for background training jobs: deduplication of concurrent
+train requests, force_retrain queued behind a running job, failure
+reporting, and full retrains queued by feedback in batch learning mode.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+from training_jobs import TrainingJobQueue
+
+
+def wait_for(job, timeout_s=60.0):
+    deadline = time.monotonic() + timeout_s
+    while job.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return not job.active
+
+
+def check_dedup_and_force():
+    """Submissions while a job is active return it; force queues one new job behind a running one."""
+    queue = TrainingJobQueue()
+    release = threading.Event()
+    order = []
+
+    def slow(progress):
+        order.append("first")
+        progress("training", 0.5)
+        release.wait(10)
+        return {"accuracy": 0.9}
+
+    def forced_run(progress):
+        order.append("forced")
+        return {"accuracy": 0.95}
+
+    first, deduplicated_first = queue.submit(slow)
+    again, deduplicated_again = queue.submit(lambda progress: {})
+    while first.status != "running":
+        time.sleep(0.01)
+    forced, deduplicated_forced = queue.submit(forced_run, force=True)
+    forced_twice, deduplicated_forced_twice = queue.submit(lambda progress: {}, force=True)  # forced job is queued
+    mid_stage, mid_progress, forced_status = first.stage, first.progress, forced.status
+    release.set()
+    finished = wait_for(first) and wait_for(forced)
+    after, deduplicated_after = queue.submit(lambda progress: {"accuracy": 1.0})
+    wait_for(after)
+    print(f"🧵 Dedup: second submit same job {again is first and deduplicated_again}; force while running: "
+          f"new job {forced is not first and not deduplicated_forced}, {forced_status} until the first finished, "
+          f"ran {order}; second force deduplicated {forced_twice is forced and deduplicated_forced_twice}")
+    print(f"   First job mid-run: {mid_stage} {mid_progress}; after both finished a submit starts a new job: "
+          f"{after not in (first, forced) and not deduplicated_after}; history {len(queue.list_jobs())} jobs")
+    return (not deduplicated_first and again is first and deduplicated_again
+            and forced is not first and not deduplicated_forced and forced_status == "queued"
+            and forced_twice is forced and deduplicated_forced_twice
+            and (mid_stage, mid_progress) == ("training", 0.5) and finished and order == ["first", "forced"]
+            and first.status == forced.status == "succeeded" and forced.accuracy == 0.95
+            and after not in (first, forced) and not deduplicated_after and len(queue.list_jobs()) == 3)
+
+
+def check_failures(history=3):
+    """Errors and error results mark a job failed; the history is bounded."""
+    queue = TrainingJobQueue(max_history=history)
+
+    def raises(progress):
+        raise RuntimeError("boom")
+
+    crashed, _ = queue.submit(raises)
+    wait_for(crashed)
+    reported, _ = queue.submit(lambda progress: {"error": "No training data available"})
+    wait_for(reported)
+    for _ in range(history):
+        job, _ = queue.submit(lambda progress: {"accuracy": 0.5})
+        wait_for(job)
+    print(f"💥 Failures: exception -> {crashed.status} ({crashed.error}), error result -> {reported.status} "
+          f"({reported.error}); history kept {len(queue.list_jobs())} of {history + 2}")
+    return (crashed.status == reported.status == "failed" and crashed.error == "boom"
+            and reported.error == "No training data available" and len(queue.list_jobs()) == history
+            and queue.get(crashed.id) is None)
+
+
+def check_feedback_retrain():
+    """In batch mode, the feedback that reaches ML_RETRAIN_AFTER_FEEDBACK queues one full retrain job."""
+    from fastapi.testclient import TestClient
+    import app
+    import ml_chatbot_model
+
+    model = ml_chatbot_model.ChatbotMLModel(tempfile.mkdtemp(prefix="training-jobs-"))
+    model.train_model(app.load_response_categories())
+    ml_chatbot_model.ml_model = model
+    client = TestClient(app.app)
+    threshold = ml_chatbot_model.ML_RETRAIN_AFTER_FEEDBACK
+    version, samples = model.loaded_version, model.model_metrics["training_samples"]
+    responses = [client.post("/api/ml/feedback", json={
+        "message": f"how much does plan {i} cost", "correct_category": "pricing", "user_satisfaction": 0.2,
+    }).json() for i in range(threshold)]
+    results = [r["retraining_result"] for r in responses]
+    queued = [r for r in results if r.get("job")]
+    job = app.get_training_queue().get(queued[-1]["job"]["id"]) if queued else None
+    finished = job is not None and wait_for(job)
+    print(f"🔁 {threshold} low-satisfaction feedback: retrain due only on the last {[r['retrain_due'] for r in results]}, "
+          f"job {job.status if job else None} (trigger {job.params.get('trigger') if job else None}), "
+          f"new version {model.loaded_version != version}, feedback since train {model.feedback_since_train}, "
+          f"samples {samples} -> {job.result['training_samples'] if finished else None}")
+    return (not model.online_learner.is_enabled() and len(queued) == 1 and results[-1] is queued[0]
+            and finished and job.status == "succeeded" and job.params == {"include_feedback": True,
+                                                                          "trigger": "feedback"}
+            and model.loaded_version != version and model.feedback_since_train == 0
+            and job.result["training_samples"] > samples)
+
+
+def main():
+    print("🧪 Testing Training Jobs")
+    print("=" * 40)
+    # Batch learning mode, so feedback counts towards a full retrain, and quick training runs
+    os.environ.setdefault("ML_LEARNING_MODE", "batch")
+    os.environ.setdefault("ML_BACKENDS", "multinomial_nb,sgd")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    ok = check_dedup_and_force()
+    ok = check_failures() and ok
+    ok = check_feedback_retrain() and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test script for the append-only training example log: group commits under
+concurrent appends from threads and processes, failed commits raised to
+every appender in the batch, and compaction that drops only malformed,
+torn and exactly duplicated rows.
+"""
+
+import os
+import sys
+import json
+import tempfile
+import threading
+import multiprocessing
+
+from training_log import TrainingExampleLog
+
+
+def new_log_path():
+    return os.path.join(tempfile.mkdtemp(prefix="training-log-"), "training_data.jsonl")
+
+
+def row(text, i):
+    return {"text": text, "category": "help", "response": None,
+            "timestamp": f"2026-01-01T00:{i // 60:02d}:{i % 60:02d}"}
+
+
+def check_group_commit(threads=8, per_thread=50):
+    """Concurrent appends all land, in order per thread, in far fewer fsyncs than rows."""
+    log = TrainingExampleLog(new_log_path(), commit_ms=5, compact_every=0)
+
+    def writer(t):
+        for i in range(per_thread):
+            log.append({"text": f"thread {t} row {i}", "category": "help", "thread": t, "i": i})
+
+    workers = [threading.Thread(target=writer, args=(t,)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    rows = list(log)
+    in_order = all([r["i"] for r in rows if r["thread"] == t] == list(range(per_thread)) for t in range(threads))
+    stats = log.get_stats()
+    print(f"📝 {threads} threads x {per_thread} appends: {len(rows)} rows in {stats['group_commits']} group commits, "
+          f"per-thread order kept: {in_order}, pending {stats['pending']}")
+    return (len(rows) == len(log) == threads * per_thread and in_order
+            and stats['appends'] == threads * per_thread and stats['group_commits'] < threads * per_thread)
+
+
+def _append_from_process(path, worker, count):
+    log = TrainingExampleLog(path, commit_ms=1, compact_every=0)
+    for i in range(count):
+        log.append({"text": f"process {worker} row {i}", "category": "help"})
+
+
+def check_processes(processes=4, per_process=100):
+    """Several processes append to one file under flock without interleaving rows."""
+    path = new_log_path()
+    workers = [multiprocessing.Process(target=_append_from_process, args=(path, p, per_process))
+               for p in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    with open(path, "rb") as f:
+        lines = f.read().splitlines()
+    parsed = [json.loads(line) for line in lines]
+    distinct = len({r["text"] for r in parsed})
+    print(f"👥 {processes} processes x {per_process} appends: {len(lines)} lines, {distinct} distinct rows")
+    return len(lines) == distinct == processes * per_process
+
+
+def check_failed_commit(appenders=4):
+    """A failing write raises to every appender of that commit and leaves no partial row."""
+    log = TrainingExampleLog(new_log_path(), commit_ms=20, compact_every=0)
+    log.append({"text": "before", "category": "help"})
+    write_batch = log._write_batch
+    barrier = threading.Barrier(appenders + 1)
+
+    def failing_write(data):
+        raise OSError("disk full")
+
+    errors = []
+
+    def appender(i):
+        barrier.wait()
+        try:
+            log.append({"text": f"lost {i}", "category": "help"})
+        except OSError as e:
+            errors.append(e)
+
+    log._write_batch = failing_write
+    workers = [threading.Thread(target=appender, args=(i,)) for i in range(appenders)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    for worker in workers:
+        worker.join()
+    log._write_batch = write_batch
+    log.append({"text": "after", "category": "help"})
+    texts = [r["text"] for r in log]
+    stats = log.get_stats()
+    print(f"💥 Failed commit: {len(errors)}/{appenders} appenders raised, failed_appends "
+          f"{stats['failed_appends']}, log afterwards {texts}")
+    return len(errors) == appenders and stats['failed_appends'] == appenders and texts == ["before", "after"]
+
+
+def check_compaction_keeps_events(texts=40, repeats=10, compact_every=50):
+    """Periodic compaction keeps repeated feedback on the same text: each row is its own event."""
+    log = TrainingExampleLog(new_log_path(), commit_ms=0, compact_every=compact_every)
+    for r in range(repeats):
+        for t in range(texts):
+            log.append(row(f"question {t}", r * texts + t))
+    log.flush()
+    stats = log.get_stats()
+    print(f"🗜️  {texts * repeats} rows ({texts} texts x {repeats}) with compaction every {compact_every}: "
+          f"{len(log)} rows after {stats['compactions']} compactions")
+    return len(log) == texts * repeats and stats['compactions'] > 0
+
+
+def check_compaction_drops_bad_rows():
+    """Malformed rows, a torn last line and exact duplicates go; everything else stays in order."""
+    path = new_log_path()
+    rows = [row("a", 1), row("b", 2), row("a", 3), row("b", 2), row("c", 4)]
+    with open(path, "w", encoding="utf-8") as f:
+        for i, r in enumerate(rows):
+            f.write(json.dumps(r) + "\n")
+            if i == 1:
+                f.write("{not json\n[1, 2]\n")
+        f.write('{"text": "torn"')
+    log = TrainingExampleLog(path, compact_every=0)
+    result = log.compact()
+    kept = [(r["text"], r["timestamp"][-2:]) for r in log]
+    print(f"🧹 Compaction of 5 rows (1 exact duplicate), 2 malformed and 1 torn line: {result}, kept {kept}")
+    return result == {"rows_before": 5, "rows_after": 4} and kept == [("a", "01"), ("a", "03"), ("b", "02"),
+                                                                       ("c", "04")]
+
+
+def main():
+    print("🧪 Testing Training Example Log")
+    print("=" * 40)
+    ok = check_group_commit()
+    ok = check_processes() and ok
+    ok = check_failed_commit() and ok
+    ok = check_compaction_keeps_events() and ok
+    ok = check_compaction_drops_bad_rows() and ok
+    print("\n✅ Testing completed!" if ok else "\n❌ Some checks failed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+import os
+import re
+import threading
+import importlib.util
+from collections import deque
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple
+from xml.etree import ElementTree
+
+import numpy as np
+
+
+# Pattern's subjectivity lexicon of English adjectives (TextBlob's default
+# sentiment analyzer). Read from the installed textblob package unless this
+# points at a copy of en-sentiment.xml; without either, sentiment is 0.0.
+ML_SENTIMENT_LEXICON = os.getenv("ML_SENTIMENT_LEXICON")
+
+QUESTION_WORDS = ['what', 'how', 'why', 'when', 'where']
+TECH_KEYWORDS = [
+    'ai', 'machine learning', 'software', 'development', 'mobile', 'web',
+    'cloud', 'cybersecurity', 'programming', 'coding', 'react', 'python',
+    'javascript', 'java', 'database', 'api', 'frontend', 'backend'
+]
+BUSINESS_KEYWORDS = [
+    'price', 'cost', 'service', 'company', 'contact', 'project', 'consultation',
+    'team', 'solution', 'help', 'support', 'meeting', 'schedule'
+]
+# (feature name, substring of the lowercased text)
+SUBSTRING_FEATURES: List[Tuple[str, str]] = [('is_question', '?')] + [
+    (f'has_{keyword.replace(" ", "_")}', keyword) for keyword in QUESTION_WORDS + TECH_KEYWORDS + BUSINESS_KEYWORDS
+]
+FEATURE_NAMES: List[str] = (['length', 'word_count', 'char_count', 'sentiment_polarity', 'sentiment_subjectivity']
+                            + [name for name, _ in SUBSTRING_FEATURES])
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over UTF-8 bytes that reports which of up to 64
+    patterns occur in a text, overlapping and nested ones included (the same
+    answer as `pattern in text` for each), in a single pass.
+
+    The automaton is compiled into a dense (states x 256) transition table:
+    match() walks it one byte at a time, match_batch() advances every text
+    of a batch together with NumPy, one byte column per step.
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        if not 0 < len(patterns) <= 64 or not all(patterns):
+            raise ValueError("KeywordAutomaton takes 1 to 64 non-empty patterns")
+        goto: List[Dict[int, int]] = [{}]
+        out = [0]
+        for bit, pattern in enumerate(patterns):
+            state = 0
+            for byte in pattern.encode("utf-8"):
+                nxt = goto[state].get(byte)
+                if nxt is None:
+                    nxt = goto[state][byte] = len(goto)
+                    goto.append({})
+                    out.append(0)
+                state = nxt
+            out[state] |= 1 << bit
+        # Breadth-first: a state's failure link is shallower, so its row is complete
+        table = np.zeros((len(goto), 256), dtype=np.int32)
+        fail = [0] * len(goto)
+        for byte, child in goto[0].items():
+            table[0, byte] = child
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            out[state] |= out[fail[state]]
+            table[state] = table[fail[state]]
+            for byte, child in goto[state].items():
+                fail[child] = int(table[fail[state], byte])
+                table[state, byte] = child
+                queue.append(child)
+        self.patterns = list(patterns)
+        self.table = table
+        self.out = np.array(out, dtype=np.uint64)
+        self._rows = table.tolist()
+        self._out = out
+
+    @property
+    def states(self) -> int:
+        return len(self._out)
+
+    def match(self, text: str) -> int:
+        """Bitmask of the patterns found in `text` (bit i = patterns[i])."""
+        rows, out = self._rows, self._out
+        state = found = 0
+        for byte in text.encode("utf-8"):
+            state = rows[state][byte]
+            found |= out[state]
+        return found
+
+    def match_batch(self, texts: Sequence[str]) -> Any:
+        """match() for many texts at once; returns a uint64 array of bitmasks."""
+        encoded = [text.encode("utf-8") for text in texts]
+        lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+        found = np.zeros(len(encoded), dtype=np.uint64)
+        if not len(encoded) or not lengths.max():
+            return found
+        # Longest first, so the texts still being read at column c are a prefix
+        order = np.argsort(-lengths, kind="stable")
+        sorted_lengths = lengths[order]
+        width = int(sorted_lengths[0])
+        data = np.zeros((len(encoded), width), dtype=np.uint8)
+        for row, i in enumerate(order):
+            data[row, :lengths[i]] = np.frombuffer(encoded[i], dtype=np.uint8)
+        active = np.searchsorted(-sorted_lengths, -np.arange(width), side="left")
+        state = np.zeros(len(encoded), dtype=np.int32)
+        hits = np.zeros(len(encoded), dtype=np.uint64)
+        for column in range(width):
+            k = active[column]
+            state[:k] = self.table[state[:k], data[:k, column]]
+            hits[:k] |= self.out[state[:k]]
+        found[order] = hits
+        return found
+
+
+# Pattern's tokenizer and scoring rules, for the string input TextBlob passes it
+CONTRACTIONS = ("'d", "'m", "'s", "'ll", "'re", "'ve", "n't")
+PUNCTUATION = ".,;:!?()[]{}`''\"@#$^&*+-|=~_"
+_LEADING = tuple(PUNCTUATION.replace(".", ""))
+_TRAILING = _LEADING + (".",)
+_ABBREVIATION = re.compile(r"^([A-Za-z]\.)+$")  # "U.S.", "e.g."
+_SARCASM = re.compile(r"\( ?\! ?\)")
+NEGATIONS = ("no", "not", "n't", "never")
+EMOTICONS = {  # polarity -> emoticons
+    +1.00: ("<3", "♥", ">:D", ":-D", ":D", "=-D", "=D", "X-D", "x-D", "XD", "xD", "8-D"),
+    +0.75: (">:P", ":-P", ":P", ":-p", ":p", ":-b", ":b", ":c)", ":o)", ":^)"),
+    +0.50: (">:)", ":-)", ":)", "=)", "=]", ":]", ":}", ":>", ":3", "8)", "8-)"),
+    +0.25: (">;]", ";-)", ";)", ";-]", ";]", ";D", ";^)", "*-)", "*)"),
+    +0.05: (">:o", ":-O", ":O", ":o", ":-o", "o_O", "o.O", "°O°", "°o°"),
+    -0.25: (">:/", ":-/", ":/", ":\\", ">:\\", ":-.", ":-s", ":s", ":S", ":-S", ">.>"),
+    -0.75: (">:[", ":-(", ":(", "=(", ":-[", ":[", ":{", ":-<", ":c", ":-c", "=/"),
+    -1.00: (":'(", ":'''(", ";'("),
+}
+EMOTICON_POLARITY = {e.lower(): p for p, emoticons in EMOTICONS.items() for e in emoticons}
+# The tokenizer splits emoticons apart; this joins them again
+_EMOTICON = re.compile(r"(%s)($|\s)" % "|".join(
+    r" ?".join(re.escape(c) for c in e) for emoticons in EMOTICONS.values() for e in emoticons))
+
+
+def _clamp(value: float) -> float:
+    return max(-1.0, min(value, 1.0))
+
+
+def _average(values: List[Tuple[float, ...]]) -> List[float]:
+    return [sum(v) / float(len(v) or 1) for v in zip(*values)]
+
+
+def sentiment_tokens(text: str) -> List[str]:
+    """Lowercased tokens as pattern's find_tokens() splits them (contractions, punctuation, emoticons)."""
+    for contraction in CONTRACTIONS:
+        text = text.replace(contraction, " " + contraction)
+    for quote in ("“", "”", "‘", "’", "'", '"'):
+        text = text.replace(quote, f" {quote} ")
+    tokens: List[str] = []
+    for token in text.split():
+        tail: List[str] = []
+        while token.startswith(_LEADING) and token not in CONTRACTIONS:
+            tokens.append(token[0])
+            token = token[1:]
+        while token.endswith(_TRAILING) and token not in CONTRACTIONS:
+            if token.endswith(_LEADING):
+                tail.append(token[-1])
+                token = token[:-1]
+            if token.endswith("..."):
+                tail.append("...")
+                token = token[:-3].rstrip(".")
+            if token.endswith("."):
+                if _ABBREVIATION.match(token):
+                    break
+                tail.append(token[-1])
+                token = token[:-1]
+        if token:
+            tokens.append(token)
+        tokens.extend(reversed(tail))
+    joined = _SARCASM.sub("(!)", " ".join(tokens))
+    joined = _EMOTICON.sub(lambda m: m.group(1).replace(" ", "") + m.group(2), joined)
+    return joined.lower().split()
+
+
+class SentimentLexicon:
+    """
+    Polarity and subjectivity from pattern's adjective lexicon with the
+    scoring rules of TextBlob's default analyzer (modifiers such as "very",
+    negations, "!" and emoticons), without importing TextBlob or NLTK.
+
+    The XML lexicon is parsed once per process on first use into a flat
+    word -> (polarity, subjectivity, intensity) dict; scoring a message is a
+    tokenize plus one dict lookup per token.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.words: Dict[str, Tuple[float, float, float]] = {}
+        self.modifiers: FrozenSet[str] = frozenset()  # words with an adverb sense ("very", "terribly")
+        self.loaded = False
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        if self.loaded:
+            return
+        with self._lock:
+            if self.loaded:
+                return
+            try:
+                if not self.path:
+                    raise FileNotFoundError("no sentiment lexicon (install textblob or set ML_SENTIMENT_LEXICON)")
+                senses: Dict[str, Dict[Optional[str], List[Tuple[float, ...]]]] = {}
+                for w in ElementTree.parse(self.path).getroot().findall("word"):
+                    form = w.attrib.get("form")
+                    if form:
+                        senses.setdefault(form, {}).setdefault(w.attrib.get("pos"), []).append((
+                            float(w.attrib.get("polarity", 0.0)),
+                            float(w.attrib.get("subjectivity", 0.0)),
+                            float(w.attrib.get("intensity", 1.0)),
+                        ))
+                # Average the senses of each part of speech, then the parts of speech
+                by_pos = {form: {pos: tuple(_average(v)) for pos, v in parts.items()} for form, parts in senses.items()}
+                words = {form: tuple(_average(list(parts.values()))) for form, parts in by_pos.items()}
+                modifiers = {form for form, parts in by_pos.items() if "RB" in parts}
+                # "terrible" also scores its adverb "terribly"
+                for form, parts in list(by_pos.items()):
+                    if "JJ" in parts:
+                        adverb = form[:-1] + "i" if form.endswith("y") else form
+                        adverb = adverb[:-2] if adverb.endswith("le") else adverb
+                        words[adverb + "ly"] = parts["JJ"]
+                        modifiers.add(adverb + "ly")
+                self.words = words  # type: ignore
+                self.modifiers = frozenset(modifiers)
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                print(f"Sentiment lexicon unavailable ({self.error}); sentiment features are 0.0")
+            self.loaded = True
+
+    def score(self, text: str) -> Tuple[float, float]:
+        """(polarity in [-1, 1], subjectivity in [0, 1]) of a text."""
+        self.load()
+        words, modifiers = self.words, self.modifiers
+        if not words:
+            return 0.0, 0.0
+        assessments: List[List[Any]] = []  # [polarity, subjectivity, intensity, negated]
+        modifier: Optional[str] = None
+        negation: Optional[str] = None
+        for w in sentiment_tokens(text):
+            entry = words.get(w)
+            if entry is not None:
+                p, s, i = entry
+                if modifier is None:
+                    assessments.append([p, s, i, False])
+                else:  # "very good": the modifier's intensity scales this word
+                    last = assessments[-1]
+                    last[0], last[1], last[2] = _clamp(p * last[2]), _clamp(s * last[2]), i
+                if negation is not None:  # "not good"
+                    assessments[-1][2] = 1.0 / assessments[-1][2]
+                    assessments[-1][3] = True
+                modifier = w if w in modifiers else None
+                negation = w if w in NEGATIONS else None
+                continue
+            if w in NEGATIONS:
+                negation = w
+            elif negation and len(w.strip("'")) > 1:
+                negation = None  # negation carries over small words only ("not a good")
+            if negation is not None and modifier is not None and modifier.endswith("ly"):
+                assessments[-1][3] = True  # "really not good"
+                negation = None
+            elif modifier and len(w) > 2:
+                modifier = None
+            if w == "!" and assessments:
+                assessments[-1][0] = _clamp(assessments[-1][0] * 1.25)
+            if w == "(!)":
+                assessments.append([0.0, 1.0, 1.0, False])
+            if not w.isalpha() and len(w) <= 5 and w not in PUNCTUATION and w in EMOTICON_POLARITY:
+                assessments.append([EMOTICON_POLARITY[w], 1.0, 1.0, False])
+        if not assessments:
+            return 0.0, 0.0
+        # "not good" is slightly bad, "not bad" slightly good
+        polarity = sum(p * -0.5 if negated else p for p, _, _, negated in assessments) / len(assessments)
+        subjectivity = sum(s for _, s, _, _ in assessments) / len(assessments)
+        return polarity, subjectivity
+
+
+def _default_lexicon_path() -> Optional[str]:
+    if ML_SENTIMENT_LEXICON:
+        return ML_SENTIMENT_LEXICON
+    spec = importlib.util.find_spec("textblob")  # locates the package without importing it
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    return os.path.join(list(spec.submodule_search_locations)[0], "en", "en-sentiment.xml")
+
+
+_lexicon: Optional[SentimentLexicon] = None
+_automaton: Optional[KeywordAutomaton] = None
+_init_lock = threading.Lock()
+
+
+def get_sentiment_lexicon() -> SentimentLexicon:
+    """Process-wide lexicon (parsed on the first score)."""
+    global _lexicon
+    if _lexicon is None:
+        with _init_lock:
+            if _lexicon is None:
+                _lexicon = SentimentLexicon(_default_lexicon_path())
+    return _lexicon
+
+
+def get_keyword_automaton() -> KeywordAutomaton:
+    """Process-wide automaton over SUBSTRING_FEATURES."""
+    global _automaton
+    if _automaton is None:
+        with _init_lock:
+            if _automaton is None:
+                _automaton = KeywordAutomaton([pattern for _, pattern in SUBSTRING_FEATURES])
+    return _automaton
+
+
+def extract_features(text: str) -> Dict[str, Any]:
+    """Length, sentiment and keyword features of one text, keyed by FEATURE_NAMES."""
+    polarity, subjectivity = get_sentiment_lexicon().score(text)
+    features: Dict[str, Any] = {
+        'length': len(text),
+        'word_count': len(text.split()),
+        'char_count': len(text),
+        'sentiment_polarity': polarity,
+        'sentiment_subjectivity': subjectivity,
+    }
+    found = get_keyword_automaton().match(text.lower())
+    for bit, (name, _) in enumerate(SUBSTRING_FEATURES):
+        features[name] = (found >> bit) & 1
+    return features
+
+
+def extract_feature_matrix(texts: Sequence[str]) -> Any:
+    """float64 matrix of shape (len(texts), len(FEATURE_NAMES)), columns in FEATURE_NAMES order."""
+    lexicon = get_sentiment_lexicon()
+    matrix = np.zeros((len(texts), len(FEATURE_NAMES)), dtype=np.float64)
+    if not len(texts):
+        return matrix
+    matrix[:, 0] = matrix[:, 2] = [len(text) for text in texts]
+    matrix[:, 1] = [len(text.split()) for text in texts]
+    matrix[:, 3:5] = [lexicon.score(text) for text in texts]
+    found = get_keyword_automaton().match_batch([text.lower() for text in texts])
+    bits = np.arange(len(SUBSTRING_FEATURES), dtype=np.uint64)
+    matrix[:, 5:] = (found[:, None] >> bits) & np.uint64(1)
+    return matrix
+
+
+class LazyFeatures(Mapping):
+    """Read-only feature mapping that calls `compute` on first access."""
+
+    __slots__ = ("_compute", "_features")
+
+    def __init__(self, compute: Callable[[], Dict[str, Any]]):
+        self._compute: Optional[Callable[[], Dict[str, Any]]] = compute
+        self._features: Optional[Dict[str, Any]] = None
+
+    @property
+    def computed(self) -> bool:
+        return self._features is not None
+
+    def _get(self) -> Dict[str, Any]:
+        if self._features is None:
+            self._features = self._compute()  # type: ignore
+            self._compute = None
+        return self._features
+
+    def __getitem__(self, key: str) -> Any:
+        return self._get()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._get())
+
+    def __len__(self) -> int:
+        return len(self._get())
+
+    def __repr__(self) -> str:
+        return f"LazyFeatures({self._features!r})" if self.computed else "LazyFeatures(<not computed>)"
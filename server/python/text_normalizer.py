@@ -0,0 +1,107 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, FrozenSet
+
+from nltk.corpus import stopwords
+from nltk.tokenize import word_tokenize
+from nltk.stem import PorterStemmer, WordNetLemmatizer
+
+
+NORMALIZER_CACHE_SIZE = int(os.getenv("ML_NORMALIZER_CACHE_SIZE", "50000"))
+
+_MISSING = object()
+
+
+class TextNormalizer:
+    """
+    Memoized text normalization used by ChatbotMLModel.preprocess_text.
+
+    Stop words are loaded once and every token's stem(lemmatize(token)) form is
+    kept in a bounded LRU cache, so repeated vocabulary never touches NLTK again.
+    Output is identical to the original uncached implementation.
+    """
+
+    def __init__(self, max_size: int = NORMALIZER_CACHE_SIZE,
+                 stemmer: Optional[PorterStemmer] = None,
+                 lemmatizer: Optional[WordNetLemmatizer] = None):
+        self.max_size = max(1, max_size)
+        self.stemmer = stemmer or PorterStemmer()
+        self.lemmatizer = lemmatizer or WordNetLemmatizer()
+        self.stop_words: Optional[FrozenSet[str]] = None
+        # token -> normalized form, or None for stop words
+        self._cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load_stop_words(self) -> FrozenSet[str]:
+        # Retried on every call until the corpus is available, like the
+        # original per-call stopwords.words() lookup
+        if self.stop_words is None:
+            self.stop_words = frozenset(stopwords.words('english'))
+        return self.stop_words
+
+    def normalize_token(self, token: str) -> Optional[str]:
+        """Return the normalized form of a token, or None if it is a stop word."""
+        with self._lock:
+            cached = self._cache.get(token, _MISSING)
+            if cached is not _MISSING:
+                self._cache.move_to_end(token)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        if token in self._load_stop_words():
+            normalized = None
+        else:
+            normalized = self.stemmer.stem(self.lemmatizer.lemmatize(token))
+
+        with self._lock:
+            self._cache[token] = normalized
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return normalized
+
+    def normalize(self, text: str) -> str:
+        """Lowercase, strip non-letters, drop stop words, lemmatize and stem."""
+        if not text:
+            return ""
+
+        text = text.lower()
+        text = re.sub(r'[^a-zA-Z\s]', '', text)
+
+        try:
+            self._load_stop_words()
+            tokens = word_tokenize(text)
+            normalized = [self.normalize_token(token) for token in tokens]
+            return ' '.join(token for token in normalized if token is not None)
+        except Exception:
+            return text
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache size and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._cache),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+                'stop_words_loaded': self.stop_words is not None
+            }
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.pop('_lock', None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
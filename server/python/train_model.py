@@ -7,7 +7,7 @@ Run this script to train the model with your response categories.
 import os
 import sys
 import json
-from ml_chatbot_model import ChatbotMLModel
+from ml_chatbot_model import ChatbotMLModel, ensure_nltk_data
 
 def load_response_categories():
     """Load response categories from the JavaScript file."""
@@ -67,6 +67,7 @@ def main():
     
     # Initialize ML model
     print("🧠 Initializing ML model...")
+    ensure_nltk_data()
     ml_model = ChatbotMLModel()
     
     # Train the model
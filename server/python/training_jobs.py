@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+ML_TRAINING_JOB_HISTORY = int(os.getenv("ML_TRAINING_JOB_HISTORY", "50"))
+
+ProgressCallback = Callable[[str, float], None]
+
+
+class TrainingJob:
+    """State of one background training run, as reported by /api/ml/jobs/{id}."""
+
+    def __init__(self, job_id: str, params: Optional[Dict[str, Any]] = None):
+        self.id = job_id
+        self.params = params or {}
+        self.status = 'queued'
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.accuracy: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.duration_seconds: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ('queued', 'running')
+
+    def set_progress(self, stage: str, fraction: float) -> None:
+        self.stage = stage
+        self.progress = round(max(0.0, min(1.0, fraction)), 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'accuracy': self.accuracy,
+            'duration_seconds': self.duration_seconds,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'params': self.params,
+            'error': self.error,
+            'result': self.result,
+        }
+
+
+class TrainingJobQueue:
+    """
+    Runs model training off the request path, one job at a time.
+
+    While a job is queued or running, further submissions return that job
+    instead of starting another one, unless forced: a forced job is queued
+    behind it. Finished jobs are kept in a bounded history.
+    """
+
+    def __init__(self, max_history: int = ML_TRAINING_JOB_HISTORY):
+        self.max_history = max(1, max_history)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ml-training")
+        self._jobs: "OrderedDict[str, TrainingJob]" = OrderedDict()
+        self._active: Optional[TrainingJob] = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[[ProgressCallback], Dict[str, Any]],
+               params: Optional[Dict[str, Any]] = None, force: bool = False) -> Tuple[TrainingJob, bool]:
+        """Queue `fn(progress)`; returns (job, deduplicated)."""
+        with self._lock:
+            if self._active is not None and self._active.active and not (force and self._active.status == 'running'):
+                return self._active, True
+            job = TrainingJob(os.urandom(8).hex(), params)
+            self._jobs[job.id] = job
+            self._active = job
+            while len(self._jobs) > self.max_history:
+                oldest_id = next(iter(self._jobs))
+                if self._jobs[oldest_id].active:
+                    break
+                self._jobs.pop(oldest_id)
+        self._executor.submit(self._run, job, fn)
+        return job, False
+
+    def _run(self, job: TrainingJob, fn: Callable[[ProgressCallback], Dict[str, Any]]) -> None:
+        job.status = 'running'
+        job.started_at = datetime.now().isoformat()
+        start = time.perf_counter()
+        try:
+            result = fn(job.set_progress) or {}
+            if result.get('error'):
+                job.status = 'failed'
+                job.error = str(result['error'])
+            else:
+                job.status = 'succeeded'
+                job.accuracy = result.get('accuracy')
+                job.set_progress('done', 1.0)
+            job.result = result
+        except Exception as e:
+            print(f"Training job {job.id} failed: {e}")
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.duration_seconds = round(time.perf_counter() - start, 3)
+            job.finished_at = datetime.now().isoformat()
+
+    def get(self, job_id: str) -> Optional[TrainingJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Most recent jobs first, without full results."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [{k: v for k, v in job.to_dict().items() if k != 'result'} for job in reversed(jobs)]
+
+
+_training_queue: Optional[TrainingJobQueue] = None
+_training_queue_lock = threading.Lock()
+
+
+def get_training_queue() -> TrainingJobQueue:
+    """Get or create the process-wide training job queue."""
+    global _training_queue
+    if _training_queue is None:
+        with _training_queue_lock:
+            if _training_queue is None:
+                _training_queue = TrainingJobQueue()
+    return _training_queue
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:  # pragma: no cover
+    import fcntl  # type: ignore
+except Exception:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+
+# Extra time the committer waits to gather more appends into one fsync
+ML_TRAINING_LOG_COMMIT_MS = float(os.getenv("ML_TRAINING_LOG_COMMIT_MS", "2"))
+# Compact (drop duplicate and malformed rows) after this many appends
+ML_TRAINING_LOG_COMPACT_EVERY = int(os.getenv("ML_TRAINING_LOG_COMPACT_EVERY", "10000"))
+
+
+def _lock_file(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def _unlock_file(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class _CommitBatch:
+    """Rows gathered for one group commit; appenders wait on it and see its error."""
+
+    def __init__(self):
+        self.lines: List[bytes] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+
+class TrainingExampleLog:
+    """
+    Append-only JSONL log of training examples.
+
+    Appends are handed to a committer thread that writes every queued row
+    with one write() and one fsync() (group commit); callers block until
+    their row is durable, and get the write error if that commit failed.
+    Writers take an exclusive flock, so several worker processes can append
+    to the same file safely. In memory only the byte offset of each row is
+    kept; rows are read from disk when iterated.
+    """
+
+    def __init__(self, path: str, legacy_json_path: Optional[str] = None,
+                 commit_ms: float = ML_TRAINING_LOG_COMMIT_MS,
+                 compact_every: int = ML_TRAINING_LOG_COMPACT_EVERY):
+        self.path = path
+        self.commit_ms = commit_ms
+        self.compact_every = compact_every
+        self._offsets = array('q')
+        self._indexed_bytes = 0
+        self._indexed_inode: Optional[int] = None
+        self._index_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._batch = _CommitBatch()  # rows queued for the next commit
+        self._last_batch: Optional[_CommitBatch] = None  # being (or last) committed
+        self._appends_since_compaction = 0
+        self._fd: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, Any] = {
+            'appends': 0,
+            'failed_appends': 0,
+            'group_commits': 0,
+            'compactions': 0,
+            'last_commit_rows': 0,
+            'last_commit_ms': 0.0
+        }
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if legacy_json_path:
+            self._migrate_legacy(legacy_json_path)
+        self.refresh()
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def _migrate_legacy(self, legacy_json_path: str) -> None:
+        """One-time conversion of the old training_data.json list."""
+        if os.path.exists(self.path) or not os.path.exists(legacy_json_path):
+            return
+        try:
+            with open(legacy_json_path, 'r') as f:
+                rows = json.load(f)
+        except Exception as e:
+            print(f"Error reading legacy training data: {e}")
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for row in rows if isinstance(rows, list) else []:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        print(f"Migrated {len(rows)} training examples to {self.path}")
+
+    def refresh(self) -> None:
+        """Index rows appended since the last call (by any process)."""
+        with self._index_lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                self._offsets = array('q')
+                self._indexed_bytes, self._indexed_inode = 0, None
+                return
+            if stat.st_ino != self._indexed_inode or stat.st_size < self._indexed_bytes:
+                # File was compacted or replaced: reindex from the start
+                self._offsets = array('q')
+                self._indexed_bytes, self._indexed_inode = 0, stat.st_ino
+            if stat.st_size == self._indexed_bytes:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._indexed_bytes)
+                offset = self._indexed_bytes
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # partially written row, picked up next time
+                    if line.strip():
+                        self._offsets.append(offset)
+                    offset += len(line)
+                self._indexed_bytes = offset
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._offsets)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        self.refresh()
+        offset = self._offsets[index]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Stream rows from disk, skipping malformed ones."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(row, dict):
+                    yield row
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def append(self, record: Dict[str, Any], wait: bool = True) -> None:
+        """
+        Queue a row for the next group commit; by default wait until it is
+        fsynced. Raises the write error if the commit holding the row failed.
+        """
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._cond:
+            batch = self._batch
+            batch.lines.append(line)
+            self._ensure_thread()
+            self._cond.notify_all()
+            if wait:
+                self._wait(batch)
+
+    def flush(self) -> None:
+        """Block until every queued row is committed; raises if the last commit failed."""
+        with self._cond:
+            batch = self._batch if self._batch.lines else self._last_batch
+            if batch is not None:
+                self._wait(batch)
+
+    def _wait(self, batch: _CommitBatch) -> None:
+        while not batch.done:
+            self._cond.wait()
+        if batch.error is not None:
+            raise OSError(f"Training log write failed: {batch.error}") from batch.error
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._commit_loop, name="training-log-commit", daemon=True)
+            self._thread.start()
+
+    def _commit_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._batch.lines:
+                    self._cond.wait()
+            if self.commit_ms > 0:
+                time.sleep(self.commit_ms / 1000.0)
+            with self._cond:
+                batch, self._batch = self._batch, _CommitBatch()
+                self._last_batch = batch
+            start = time.perf_counter()
+            try:
+                self._write_batch(b''.join(batch.lines))
+            except Exception as e:
+                print(f"Training log write error: {e}")
+                batch.error = e
+            with self._cond:
+                batch.done = True
+                self._cond.notify_all()
+            rows = len(batch.lines)
+            if batch.error is not None:
+                self.stats['failed_appends'] += rows
+                continue
+            self.stats['appends'] += rows
+            self.stats['group_commits'] += 1
+            self.stats['last_commit_rows'] = rows
+            self.stats['last_commit_ms'] = round((time.perf_counter() - start) * 1000.0, 3)
+
+            self._appends_since_compaction += rows
+            if self.compact_every > 0 and self._appends_since_compaction >= self.compact_every:
+                self._appends_since_compaction = 0
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"Training log compaction error: {e}")
+
+    def _locked_fd(self) -> int:
+        """Append fd holding the exclusive lock on the file currently at `path`."""
+        while True:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _lock_file(self._fd)
+            try:
+                if os.fstat(self._fd).st_ino == os.stat(self.path).st_ino:
+                    return self._fd
+            except OSError:
+                pass
+            # Another process compacted (replaced) the file: reopen
+            _unlock_file(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def _write_batch(self, data: bytes) -> None:
+        fd = self._locked_fd()
+        try:
+            size = os.fstat(fd).st_size
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                os.fsync(fd)
+            except Exception:
+                # Drop a partially written batch so the next rows start on a clean line
+                try:
+                    os.ftruncate(fd, size)
+                except OSError:
+                    pass
+                raise
+        finally:
+            _unlock_file(fd)
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Rewrite the log without malformed rows and exact duplicates: rows equal
+        in every field, timestamp included, so separate feedback events with
+        the same text are all kept. Two streaming passes: the first records
+        the offset of the last copy of each row in a temporary on-disk SQLite
+        table, the second copies the rows at those offsets, so memory stays
+        flat however large the log is.
+        """
+        fd = self._locked_fd()
+        keys_path = f"{self.path}.{os.getpid()}.keys"
+        tmp_path = f"{self.path}.{os.getpid()}.compact"
+        total = kept = 0
+        try:
+            conn = sqlite3.connect(keys_path, isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=OFF")
+                conn.execute("PRAGMA synchronous=OFF")
+                conn.execute("CREATE TABLE latest (key BLOB PRIMARY KEY, offset INTEGER NOT NULL)")
+
+                def keyed_rows():
+                    nonlocal total
+                    for offset, line in self._lines():
+                        try:
+                            row = json.loads(line)
+                        except ValueError:
+                            continue
+                        if not isinstance(row, dict):
+                            continue
+                        total += 1
+                        key = json.dumps(row, sort_keys=True, ensure_ascii=False)
+                        yield hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest(), offset
+
+                conn.execute("BEGIN")
+                conn.executemany("INSERT OR REPLACE INTO latest (key, offset) VALUES (?, ?)", keyed_rows())
+                conn.execute("COMMIT")
+
+                wanted = (offset for (offset,) in conn.execute("SELECT offset FROM latest ORDER BY offset"))
+                next_offset = next(wanted, None)
+                with open(tmp_path, 'wb') as f:
+                    for offset, line in self._lines():
+                        if offset != next_offset:
+                            continue
+                        f.write(line)
+                        kept += 1
+                        next_offset = next(wanted, None)
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                conn.close()
+            os.replace(tmp_path, self.path)
+        finally:
+            _unlock_file(fd)
+            for path in (keys_path, tmp_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self.stats['compactions'] += 1
+        self.refresh()
+        return {'rows_before': total, 'rows_after': kept}
+
+    def _lines(self) -> Iterator[Tuple[int, bytes]]:
+        """(byte offset, line) of every complete row."""
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                yield offset, line
+                offset += len(line)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._batch.lines)
+        return {
+            'rows': len(self),
+            'bytes': self._indexed_bytes,
+            'pending': pending,
+            **self.stats
+        }